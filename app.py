@@ -2,15 +2,28 @@ import os
 import json
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, send_from_directory, jsonify, abort, render_template
+from flask import Flask, jsonify, abort, render_template
 import threading
 import queue
 import sys
+
+# `python app.py`で起動した場合も、ルート内の`from app import ...`がこのモジュールを参照するようにする
+# （別モジュールとして読み直されると、起動時の処理・ワーカースレッド・処理キューが二重になる）
+if __name__ == '__main__':
+    sys.modules.setdefault('app', sys.modules[__name__])
+
 from app_utils.file_cleanup import cleanup_temp_files, schedule_cleanup
+from app_utils.http_cache import send_cached_file
 from config import *  # 設定は全てconfig.pyから取得
 from routes.yolo import yolo_bp
 from routes.training import training_bp
 from routes.annotation_editor import annotation_editor_bp
+from core.dataset_index import get_dataset_index, TRAINING_FOLDER
+from core.auto_annotator import get_auto_annotator
+from core.file_ops import get_file_operations
+from core.fs_watcher import get_file_watcher
+from core.run_catalog import get_run_catalog
+from core.thumbnail_cache import get_thumbnail_cache
 
 # ログディレクトリ作成
 os.makedirs('logs', exist_ok=True)
@@ -86,11 +99,26 @@ with app.app_context():
 # 定期クリーンアップ
 schedule_cleanup(app, interval_hours=CLEANUP_INTERVAL_HOURS)
 
+# 前回中断した画像の一括移動・削除をジャーナルから再開（FILE_OPS_RECOVERY='rollback'の場合は元に戻す）
+for batch in get_file_operations().recover():
+    logger.info(f"一括操作 {batch['id']} を復旧しました: {batch['status']} {batch['done']}/{batch['total']}件")
+
+# データセットインデックスをディスクと同期（変更のあったファイルのみ読み直す）
+threading.Thread(target=get_dataset_index().sync, daemon=True, name='dataset-index-sync').start()
+
+# アプリ外での変更（手作業での追加・rsync・学習結果の書き込み）を監視して各キャッシュを更新
+file_watcher = get_file_watcher()
+file_watcher.watch(TRAINING_DATA_DIR, get_dataset_index().handle_changes)
+file_watcher.watch(TRAINING_DATA_DIR, get_thumbnail_cache().handle_changes)
+file_watcher.watch(YOLO_RUNS_DIR, get_run_catalog().invalidate)
+file_watcher.start()
+
 # ルートのインポートと登録
 from routes.main import main_bp
 from routes.learning import learning_bp
 from routes.camera import camera_bp
 from routes.file_manager import file_manager_bp
+from routes.thumbnails import thumbnails_bp
 
 app.register_blueprint(main_bp)
 app.register_blueprint(yolo_bp)
@@ -99,6 +127,7 @@ app.register_blueprint(training_bp)
 app.register_blueprint(annotation_editor_bp)
 app.register_blueprint(camera_bp)
 app.register_blueprint(file_manager_bp, url_prefix='/file-manager')
+app.register_blueprint(thumbnails_bp)
 
 # グローバル処理状態（タスク管理用）
 processing_status = {}
@@ -117,51 +146,60 @@ def start_worker_thread():
 
 start_worker_thread()
 
+# 前回の起動中に終わらなかった自動アノテーションをチェックポイントの続きから再開
+def resume_auto_annotation_jobs():
+    from app_utils.worker import submit_auto_annotation
+    for job in get_auto_annotator().resumable_jobs():
+        submit_auto_annotation(processing_queue, processing_status, job)
+        logger.info(f"自動アノテーションジョブ {job['id']} を再開します: {job['done']}/{job['total']}枚")
+
+resume_auto_annotation_jobs()
+
 # ファイル配信ルートの一元化
 @app.route('/uploads/<filename>')
 def get_uploaded_file(filename):
     """一時アップロードファイル配信"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_cached_file(app.config['UPLOAD_FOLDER'], filename)
 
 # 静的ファイルの設定（YOLOの結果ディレクトリ）
 @app.route('/static/runs/<path:filename>')
 def serve_runs(filename):
     """YOLOの結果ディレクトリを提供するルート"""
     runs_dir = os.path.join('yolov5', 'runs')
-    return send_from_directory(runs_dir, filename)
+    return send_cached_file(runs_dir, filename)
 
 # スナップショット画像の配信ルート
 @app.route('/uploads/snapshots/<filename>')
 def serve_snapshots(filename):
     """スナップショット画像を提供するルート"""
     snapshots_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'snapshots')
-    return send_from_directory(snapshots_dir, filename)
+    return send_cached_file(snapshots_dir, filename)
 
 # 学習データ画像の配信ルート
 @app.route('/static/training_data/images/<filename>')
 def serve_training_images(filename):
     """学習データ画像を提供するルート"""
-    return send_from_directory(TRAINING_IMAGES_DIR, filename)
+    return send_cached_file(TRAINING_IMAGES_DIR, filename)
 
 # ファイルマネージャー用の画像配信ルート（datasetsフォルダ対応）
 @app.route('/static/training_data/datasets/<path:filepath>')
 def serve_datasets_files(filepath):
     """datasetsディレクトリ内のファイルを提供するルート"""
     datasets_dir = os.path.join('static', 'training_data', 'datasets')
-    return send_from_directory(datasets_dir, filepath)
+    return send_cached_file(datasets_dir, filepath)
 
 
 # 検出結果画像の配信ルート
 @app.route('/static/detection_results/<path:filename>')
 def serve_detection_results(filename):
     """検出結果画像を提供するルート"""
-    return send_from_directory(DETECTION_RESULTS_DIR, filename)
+    return send_cached_file(DETECTION_RESULTS_DIR, filename)
 
 # 評価結果画像の配信ルート
 @app.route('/static/evaluation/<path:filename>')
 def serve_evaluation_results(filename):
     """評価結果画像を提供するルート"""
-    return send_from_directory(STATIC_EVALUATION_DIR, filename)
+    return send_cached_file(STATIC_EVALUATION_DIR, filename)
 
 # システム状態API
 @app.route('/api/system-status')
@@ -182,17 +220,15 @@ def system_status():
         female_count = 0
         unknown_count = 0
         
-        if os.path.exists(TRAINING_IMAGES_DIR):
-            for filename in os.listdir(TRAINING_IMAGES_DIR):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    image_info = metadata.get(filename, {})
-                    gender = image_info.get('gender', 'unknown')
-                    if gender == 'male':
-                        male_count += 1
-                    elif gender == 'female':
-                        female_count += 1
-                    else:
-                        unknown_count += 1
+        for entry in get_dataset_index().list_images(TRAINING_FOLDER):
+            image_info = metadata.get(entry['name'], {})
+            gender = image_info.get('gender', 'unknown')
+            if gender == 'male':
+                male_count += 1
+            elif gender == 'female':
+                female_count += 1
+            else:
+                unknown_count += 1
         
         # アクティブタスク数
         active_tasks = len([t for t in processing_status.values() 
@@ -111,6 +111,18 @@ def schedule_cleanup(app, interval_hours=12):
                 count = cleanup_temp_files(directory=temp_dir, max_age_hours=max_age)
                 if count > 0:
                     logger.info(f"定期クリーンアップ: {count}ファイルを削除しました")
+
+                # どのフォルダからも参照されなくなった画像の実体を削除
+                from core.blob_store import get_blob_store
+                get_blob_store().gc()
+
+                # どのデータセットからも参照されなくなった学習用の縮小画像を削除
+                from core.resize_cache import get_resize_cache
+                get_resize_cache().prune()
+
+                # サムネイルキャッシュを容量の上限内に収める
+                from core.thumbnail_cache import get_thumbnail_cache
+                get_thumbnail_cache().prune()
         
         # クリーンアップジョブをスケジュール
         scheduler.add_job(
@@ -57,8 +57,8 @@ def find_image_path(filename):
 
 def handle_multiple_image_upload(files, target_dir, allowed_extensions=None):
     """複数画像アップロードの共通処理"""
-    import uuid
     from werkzeug.utils import secure_filename
+    from core.blob_store import get_blob_store
     
     if allowed_extensions is None:
         allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
@@ -74,19 +74,14 @@ def handle_multiple_image_upload(files, target_dir, allowed_extensions=None):
                 try:
                     filename = secure_filename(file.filename)
                     
-                    # ユニークなファイル名生成
-                    target_path = os.path.join(target_dir, filename)
-                    if os.path.exists(target_path):
-                        name, ext = os.path.splitext(filename)
-                        unique_suffix = uuid.uuid4().hex[:8]
-                        filename = f"{name}_{unique_suffix}{ext}"
-                        target_path = os.path.join(target_dir, filename)
-                    
-                    file.save(target_path)
+                    # 画像ストアに保存（同じ画像が既にフォルダにあればそれを使う）
+                    stored = get_blob_store().store_upload(file, target_dir, filename)
+                    target_path = stored['path']
                     uploaded_files.append({
-                        'filename': filename,
+                        'filename': stored['filename'],
                         'path': target_path,
-                        'relative_path': os.path.relpath(target_path, 'static') if target_path.startswith('static') else target_path
+                        'relative_path': os.path.relpath(target_path, 'static') if target_path.startswith('static') else target_path,
+                        'duplicate': stored['duplicate']
                     })
                     
                 except Exception as e:
@@ -94,4 +89,9 @@ def handle_multiple_image_upload(files, target_dir, allowed_extensions=None):
             else:
                 errors.append(f"{file.filename}: 無効なファイル形式です")
     
+    # 一覧表示用のサムネイルをバックグラウンドで作成
+    if uploaded_files:
+        from core.thumbnail_cache import get_thumbnail_cache
+        get_thumbnail_cache().pregenerate(f['path'] for f in uploaded_files)
+    
     return uploaded_files, errors
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+ウニ生殖乳頭分析システム - HTTPキャッシュユーティリティ
+画像配信ルートで強いETag・条件付きGET（304）・Rangeリクエスト（206）・Cache-Controlを扱う
+
+ETagは画像ストア（core.blob_store）に取り込み済みのファイルならSHA-256、それ以外はinode・サイズ・更新時刻から作る
+（ファイルは一時ファイルからの置き換えで更新されるため、内容が変わればinodeか更新時刻が必ず変わる）。
+URLに内容のハッシュ（?v=<先頭16文字>）を付けた場合は内容が変わらないURLとして immutable で配信する。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request, send_file, abort
+from werkzeug.security import safe_join
+
+# 内容を変えないURL（?v=ハッシュ）のキャッシュ期間（秒）
+IMMUTABLE_MAX_AGE = 31536000
+
+# URLのハッシュと照合するために計算したSHA-256（パス -> (シグネチャ, ハッシュ)）
+_MAX_DIGESTS = 10000
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def versioned_url(url, digest):
+    """内容のハッシュを付けたURL（ハッシュが無い場合はそのまま）"""
+    if not digest:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}v={digest[:16]}"
+
+
+def _signature(st):
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def content_digest(path, st=None):
+    """
+    ファイル内容のSHA-256（画像ストアの参照ならストアの値、それ以外は計算してシグネチャ付きで記憶）
+
+    Returns:
+        str: 16進のハッシュ（読み込めない場合はNone）
+    """
+    from core.blob_store import get_blob_store, file_digest
+
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return None
+    signature = _signature(st)
+    with _digests_lock:
+        cached = _digests.get(path)
+        if cached and cached[0] == signature:
+            _digests.move_to_end(path)
+            return cached[1]
+
+    try:
+        digest = get_blob_store().digest_of(path) or file_digest(path)
+    except OSError:
+        return None
+    with _digests_lock:
+        _digests[path] = (signature, digest)
+        while len(_digests) > _MAX_DIGESTS:
+            _digests.popitem(last=False)
+    return digest
+
+
+def file_etag(path, st=None):
+    """強いETag（画像ストアの参照ならSHA-256、それ以外はinode・サイズ・更新時刻）"""
+    from core.blob_store import get_blob_store
+
+    st = st or os.stat(path)
+    digest = get_blob_store().digest_of(path)
+    if digest:
+        return digest[:32]
+    return '%x-%x-%x' % _signature(st)
+
+
+def send_cached_file(directory, filename, mimetype=None):
+    """
+    キャッシュ制御付きでファイルを配信（send_from_directoryの置き換え）
+
+    - If-None-Match / If-Modified-Since に一致すれば304
+    - Rangeヘッダがあれば206（部分応答）
+    - ?v=<ハッシュ> が内容と一致すれば Cache-Control: public, max-age=1年, immutable
+      それ以外は no-cache（毎回ETagで再検証し、変更がなければ304）
+    """
+    # send_from_directoryと同じく、相対パスはアプリのルートからのパスとして扱う
+    path = safe_join(os.path.join(current_app.root_path, os.fspath(directory)), filename)
+    if path is None:
+        abort(404)
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    version = request.args.get('v')
+    immutable = False
+    if version:
+        digest = content_digest(path, st)
+        immutable = bool(digest) and digest.startswith(version)
+
+    response = send_file(path, mimetype=mimetype, etag=file_etag(path, st), conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE if immutable else None)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
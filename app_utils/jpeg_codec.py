@@ -0,0 +1,436 @@
+"""
+ウニ生殖乳頭分析システム - JPEGコーデックユーティリティ
+libjpeg-turboバインディング（simplejpeg / PyTurboJPEG）による高速なJPEGエンコード・デコードを提供する
+バインディングがインストールされていない場合はOpenCVに自動でフォールバックする
+"""
+
+import os
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from config import JPEG_BACKEND, JPEG_QUALITY, JPEG_SUBSAMPLING
+
+logger = logging.getLogger(__name__)
+
+# オプション依存: simplejpeg
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# オプション依存: PyTurboJPEG（共有ライブラリが見つからない場合はOSError）
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY, TJSAMP_444, TJSAMP_422, TJSAMP_420, TJSAMP_GRAY
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError):
+    _turbojpeg = None
+
+# DCT領域で縮小デコードできる倍率（libjpegの仕様）
+_DCT_SCALE_FACTORS = (1, 2, 4, 8)
+
+_OPENCV_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def available_backends():
+    """利用可能なJPEGバックエンドの一覧を返す（優先順）"""
+    backends = []
+    if simplejpeg is not None:
+        backends.append('simplejpeg')
+    if _turbojpeg is not None:
+        backends.append('turbojpeg')
+    backends.append('opencv')
+    return backends
+
+
+def get_backend():
+    """使用するJPEGバックエンドを決定"""
+    backends = available_backends()
+    if JPEG_BACKEND != 'auto':
+        if JPEG_BACKEND in backends:
+            return JPEG_BACKEND
+        logger.warning(f"JPEGバックエンド {JPEG_BACKEND} が利用できないため {backends[0]} を使用します")
+    return backends[0]
+
+
+_backend = get_backend()
+logger.info(f"JPEGコーデック: {_backend} を使用")
+
+
+def is_jpeg(data):
+    """バイト列がJPEGかどうか（SOIマーカーで判定）"""
+    return len(data) > 3 and data[0] == 0xFF and data[1] == 0xD8
+
+
+def get_jpeg_size(data):
+    """
+    JPEGヘッダ（SOFマーカー）から画像サイズを取得
+
+    Returns:
+        (width, height) または取得できない場合はNone
+    """
+    if not is_jpeg(data):
+        return None
+
+    pos = 2
+    length = len(data)
+    while pos + 9 < length:
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        # パディング・スタンドアロンマーカー
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 1
+            continue
+        segment_length = (data[pos + 2] << 8) | data[pos + 3]
+        # SOF0〜SOF15（DHT/JPG/DACを除く）
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[pos + 5] << 8) | data[pos + 6]
+            width = (data[pos + 7] << 8) | data[pos + 8]
+            return width, height
+        pos += 2 + segment_length
+    return None
+
+
+def get_jpeg_orientation(data):
+    """
+    JPEGのEXIF（APP1）から向き（Orientationタグ）を取得
+
+    Returns:
+        1〜8（EXIFがない・読めない場合は1）
+    """
+    if not is_jpeg(data):
+        return 1
+
+    pos = 2
+    length = len(data)
+    while pos + 4 < length:
+        if data[pos] != 0xFF:
+            return 1
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        # SOS以降は画像データ（EXIFはその前にある）
+        if marker == 0xDA:
+            return 1
+        segment_length = (data[pos + 2] << 8) | data[pos + 3]
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return _exif_orientation(data[pos + 10:pos + 2 + segment_length])
+        pos += 2 + segment_length
+    return 1
+
+
+def _exif_orientation(tiff):
+    """TIFF形式のEXIFのIFD0からOrientationタグ（0x0112）を読む"""
+    try:
+        byteorder = {b'II': 'little', b'MM': 'big'}[bytes(tiff[:2])]
+        offset = int.from_bytes(tiff[4:8], byteorder)
+        count = int.from_bytes(tiff[offset:offset + 2], byteorder)
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            if int.from_bytes(tiff[entry:entry + 2], byteorder) == 0x0112:
+                orientation = int.from_bytes(tiff[entry + 8:entry + 10], byteorder)
+                return orientation if 1 <= orientation <= 8 else 1
+    except (KeyError, ValueError):
+        pass
+    return 1
+
+
+def apply_orientation(image, orientation):
+    """EXIFの向きを画素に適用（PIL.ImageOps.exif_transposeと同じ変換）"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def _select_scale_factor(width, height, max_size):
+    """max_size（長辺）を下回らない範囲で最大のDCT縮小倍率を選ぶ"""
+    if not max_size:
+        return 1
+    factor = 1
+    for candidate in _DCT_SCALE_FACTORS:
+        if max(width, height) / candidate >= max_size:
+            factor = candidate
+    return factor
+
+
+def _subsampling_for_opencv(subsampling):
+    """OpenCVのサンプリング係数パラメータを返す（未対応バージョンではNone）"""
+    names = {
+        '444': 'IMWRITE_JPEG_SAMPLING_FACTOR_444',
+        '422': 'IMWRITE_JPEG_SAMPLING_FACTOR_422',
+        '420': 'IMWRITE_JPEG_SAMPLING_FACTOR_420',
+        '440': 'IMWRITE_JPEG_SAMPLING_FACTOR_440',
+        '411': 'IMWRITE_JPEG_SAMPLING_FACTOR_411'
+    }
+    if not hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR') or subsampling not in names:
+        return None
+    return getattr(cv2, names[subsampling], None)
+
+
+def encode_jpeg(image, quality=None, subsampling=None, backend=None):
+    """
+    BGR画像をJPEGバイト列にエンコード
+
+    Args:
+        image: BGR（またはグレースケール）のuint8画像
+        quality: JPEG品質（Noneの場合はconfig.JPEG_QUALITY）
+        subsampling: クロマサブサンプリング（'444' / '422' / '420'、Noneの場合はconfig.JPEG_SUBSAMPLING）
+        backend: 使用するバックエンド（Noneの場合は自動選択）
+
+    Returns:
+        bytes: JPEGデータ（失敗時はNone）
+    """
+    if image is None:
+        return None
+
+    quality = int(quality or JPEG_QUALITY)
+    subsampling = subsampling or JPEG_SUBSAMPLING
+    backend = backend or _backend
+    is_gray = image.ndim == 2 or (image.ndim == 3 and image.shape[2] == 1)
+
+    try:
+        if backend == 'simplejpeg':
+            array = np.ascontiguousarray(image)
+            if is_gray:
+                array = array.reshape(array.shape[0], array.shape[1], 1)
+                return simplejpeg.encode_jpeg(array, quality=quality, colorspace='GRAY')
+            return simplejpeg.encode_jpeg(array, quality=quality, colorspace='BGR',
+                                          colorsubsampling=subsampling, fastdct=True)
+
+        if backend == 'turbojpeg':
+            samp = {'444': TJSAMP_444, '422': TJSAMP_422, '420': TJSAMP_420}.get(subsampling, TJSAMP_420)
+            if is_gray:
+                array = np.ascontiguousarray(image).reshape(image.shape[0], image.shape[1], 1)
+                return _turbojpeg.encode(array, quality=quality, pixel_format=TJPF_GRAY,
+                                         jpeg_subsample=TJSAMP_GRAY)
+            return _turbojpeg.encode(np.ascontiguousarray(image), quality=quality,
+                                     pixel_format=TJPF_BGR, jpeg_subsample=samp)
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        sampling_factor = _subsampling_for_opencv(subsampling)
+        if sampling_factor is not None:
+            params.extend([cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling_factor])
+        ret, jpeg = cv2.imencode('.jpg', image, params)
+        return jpeg.tobytes() if ret else None
+
+    except Exception as e:
+        if backend != 'opencv':
+            logger.warning(f"{backend} でのエンコードに失敗したためOpenCVで再試行: {e}")
+            return encode_jpeg(image, quality, subsampling, backend='opencv')
+        logger.error(f"JPEGエンコードエラー: {e}")
+        return None
+
+
+def decode_image(data, max_size=None, backend=None, fast=True):
+    """
+    画像バイト列をBGR画像にデコード
+
+    JPEGの場合はmax_sizeを指定するとDCT領域で1/2・1/4・1/8に縮小しながらデコードする
+    （長辺がmax_sizeを下回らない範囲で最も小さい倍率を選択）。JPEG以外はOpenCVで通常デコードする。
+    EXIFの向きはOpenCV（cv2.imdecode）と同じく画素に適用する。
+
+    Args:
+        data: 画像のバイト列（bytes / numpy配列）
+        max_size: 縮小デコード時に確保する最小の長辺ピクセル数（Noneの場合は原寸）
+        backend: 使用するバックエンド（Noneの場合は自動選択）
+        fast: 縮小デコード時に精度の低い高速なIDCT・アップサンプリングを使う（simplejpeg、学習データではFalse）
+
+    Returns:
+        numpy.ndarray: BGR画像（失敗時はNone）
+    """
+    if data is None or len(data) == 0:
+        return None
+
+    buffer = data.tobytes() if isinstance(data, np.ndarray) else bytes(data)
+
+    if not is_jpeg(buffer):
+        return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    backend = backend or _backend
+    factor = 1
+    size = get_jpeg_size(buffer) if max_size else None
+    if size:
+        factor = _select_scale_factor(size[0], size[1], max_size)
+
+    try:
+        if backend == 'simplejpeg':
+            if factor > 1:
+                # simplejpegは最小サイズを満たす最大の倍率を選ぶため、目標サイズで指定する
+                image = simplejpeg.decode_jpeg(buffer, colorspace='BGR', fastdct=fast, fastupsample=fast,
+                                               min_width=-(-size[0] // factor),
+                                               min_height=-(-size[1] // factor))
+            else:
+                image = simplejpeg.decode_jpeg(buffer, colorspace='BGR')
+            return apply_orientation(image, get_jpeg_orientation(buffer))
+
+        if backend == 'turbojpeg':
+            if factor > 1:
+                image = _turbojpeg.decode(buffer, pixel_format=TJPF_BGR, scaling_factor=(1, factor))
+            else:
+                image = _turbojpeg.decode(buffer, pixel_format=TJPF_BGR)
+            return apply_orientation(image, get_jpeg_orientation(buffer))
+
+        return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), _OPENCV_REDUCED_FLAGS[factor])
+
+    except Exception as e:
+        if backend != 'opencv':
+            logger.warning(f"{backend} でのデコードに失敗したためOpenCVで再試行: {e}")
+            return decode_image(buffer, max_size, backend='opencv', fast=fast)
+        logger.error(f"画像デコードエラー: {e}")
+        return None
+
+
+def read_image(path, max_size=None):
+    """
+    画像ファイルを読み込む（日本語パス対応）
+
+    Args:
+        path: 画像ファイルのパス
+        max_size: 縮小デコード時に確保する最小の長辺ピクセル数（Noneの場合は原寸）
+
+    Returns:
+        numpy.ndarray: BGR画像（失敗時はNone）
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.error(f"画像読み込みエラー {path}: {e}")
+        return None
+    return decode_image(data, max_size=max_size)
+
+
+def write_image(path, image, quality=None, subsampling=None):
+    """
+    画像をファイルに保存する（日本語パス対応）
+
+    拡張子が.jpg/.jpegの場合はJPEGコーデック経由で、それ以外はOpenCVでエンコードする
+
+    Returns:
+        bool: 保存に成功したかどうか
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jpg', '.jpeg'):
+        data = encode_jpeg(image, quality=quality, subsampling=subsampling)
+    else:
+        ret, encoded = cv2.imencode(ext or '.png', image)
+        data = encoded.tobytes() if ret else None
+
+    if data is None:
+        logger.error(f"画像エンコードに失敗しました: {path}")
+        return False
+
+    # 既存ファイルは画像ストアの実体とハードリンクを共有している場合があるため、
+    # 上書きせずに一時ファイルから置き換える
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        logger.error(f"画像保存エラー {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def benchmark(image=None, iterations=50, quality=None, max_size=None):
+    """
+    利用可能な各バックエンドとOpenCVのエンコード・デコード速度を比較
+
+    Args:
+        image: ベンチマークに使うBGR画像（Noneの場合は1280x720の合成画像）
+        iterations: 各計測の繰り返し回数
+        quality: JPEG品質
+        max_size: 縮小デコードの計測に使う長辺サイズ（Noneの場合は長辺の1/4）
+
+    Returns:
+        dict: バックエンドごとの平均処理時間（ミリ秒）
+    """
+    if image is None:
+        # マイクロスコープ映像に近い、なめらかなグラデーション＋ノイズの合成画像
+        h, w = 720, 1280
+        yy, xx = np.mgrid[0:h, 0:w]
+        base = ((xx / w) * 200 + (yy / h) * 55).astype(np.uint8)
+        noise = np.random.default_rng(0).integers(0, 20, (h, w), dtype=np.uint8)
+        image = cv2.merge([base, cv2.add(base, noise), 255 - base])
+
+    if max_size is None:
+        max_size = max(image.shape[:2]) // 4
+
+    results = {}
+    for backend in available_backends():
+        encoded = encode_jpeg(image, quality=quality, backend=backend)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            encode_jpeg(image, quality=quality, backend=backend)
+        encode_ms = (time.perf_counter() - start) * 1000 / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_image(encoded, backend=backend)
+        decode_ms = (time.perf_counter() - start) * 1000 / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_image(encoded, max_size=max_size, backend=backend)
+        reduced_ms = (time.perf_counter() - start) * 1000 / iterations
+
+        results[backend] = {
+            'encode_ms': encode_ms,
+            'decode_ms': decode_ms,
+            'reduced_decode_ms': reduced_ms,
+            'size_bytes': len(encoded)
+        }
+
+    return results
+
+
+# コマンドラインから直接実行可能（ベンチマーク）
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='JPEGコーデックのベンチマーク（libjpeg-turbo vs OpenCV）')
+    parser.add_argument('--image', help='ベンチマークに使う画像（省略時は1280x720の合成画像）')
+    parser.add_argument('--iterations', type=int, default=50, help='繰り返し回数')
+    parser.add_argument('--quality', type=int, default=None, help='JPEG品質')
+    parser.add_argument('--max-size', type=int, default=None, help='縮小デコードの長辺サイズ')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    source = read_image(args.image) if args.image else None
+    if args.image and source is None:
+        raise SystemExit(f"画像を読み込めませんでした: {args.image}")
+
+    bench = benchmark(source, iterations=args.iterations, quality=args.quality, max_size=args.max_size)
+
+    print(f"{'backend':<12} {'encode(ms)':>11} {'decode(ms)':>11} {'reduced(ms)':>12} {'size(KB)':>9}")
+    for name, r in bench.items():
+        print(f"{name:<12} {r['encode_ms']:>11.2f} {r['decode_ms']:>11.2f} "
+              f"{r['reduced_decode_ms']:>12.2f} {r['size_bytes'] / 1024:>9.1f}")
@@ -0,0 +1,97 @@
+"""
+ウニ生殖乳頭分析システム - 画像一覧APIの共通処理
+ページ分割（カーソル）・フィルタ・並べ替えのクエリパラメータを解釈し、DatasetIndex.query_imagesの引数に変換する
+
+クエリパラメータ:
+    limit      1ページの件数（省略時はすべて、最大MAX_PAGE_SIZE）
+    cursor     前のページのnext_cursor
+    sort       name / mtime / annotations（既定: name）
+    order      desc / asc（既定: desc）
+    annotated  true（ボックスあり） / false（ボックスなし）
+    class      このクラスのボックスを含む画像のみ（クラスIDまたはクラス名）
+    since      この日時以降に追加・更新された画像（YYYY-MM-DD または ISO 8601）
+    until      この日時までに追加・更新された画像（日付のみの場合はその日の終わりまで）
+"""
+
+from datetime import datetime, timedelta
+
+from config import YOLO_CLASS_NAMES
+
+MAX_PAGE_SIZE = 1000
+
+
+def _parse_bool(value, name):
+    value = value.lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise ValueError(f'{name}はtrueまたはfalseで指定してください')
+
+
+def _parse_time_ns(value, name, end_of_day=False):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name}の日時形式が不正です: {value}')
+    if end_of_day and len(value) == 10:
+        # 日付のみの指定はその日の終わりまでを含める
+        parsed += timedelta(days=1)
+        return int(parsed.timestamp() * 1_000_000_000) - 1
+    return int(parsed.timestamp() * 1_000_000_000)
+
+
+def parse_listing_args(args):
+    """
+    一覧APIのクエリパラメータをquery_imagesの引数に変換
+
+    Returns:
+        dict: DatasetIndex.query_imagesのキーワード引数
+
+    Raises:
+        ValueError: パラメータが不正な場合（メッセージはそのままクライアントに返せる）
+    """
+    options = {}
+
+    limit = args.get('limit')
+    if limit:
+        try:
+            options['limit'] = max(1, min(int(limit), MAX_PAGE_SIZE))
+        except ValueError:
+            raise ValueError('limitは整数で指定してください')
+    if args.get('cursor'):
+        options['cursor'] = args['cursor']
+
+    options['sort'] = args.get('sort', 'name')
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('orderはascまたはdescで指定してください')
+    options['descending'] = order == 'desc'
+
+    if args.get('annotated'):
+        options['annotated'] = _parse_bool(args['annotated'], 'annotated')
+
+    class_value = args.get('class')
+    if class_value:
+        if class_value.isdigit():
+            options['class_id'] = int(class_value)
+        elif class_value in YOLO_CLASS_NAMES:
+            options['class_id'] = YOLO_CLASS_NAMES.index(class_value)
+        else:
+            raise ValueError(f'不明なクラスです: {class_value}')
+
+    if args.get('since'):
+        options['since_ns'] = _parse_time_ns(args['since'], 'since')
+    if args.get('until'):
+        options['until_ns'] = _parse_time_ns(args['until'], 'until', end_of_day=True)
+
+    return options
+
+
+def listing_meta(result):
+    """一覧APIのレスポンスに含めるページ情報"""
+    return {
+        'total': result['total'],
+        'next_cursor': result['next_cursor'],
+        'has_more': result['next_cursor'] is not None
+    }
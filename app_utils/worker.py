@@ -5,6 +5,7 @@
 
 import os
 import json
+import uuid
 import traceback
 from datetime import datetime
 
@@ -43,6 +44,15 @@ def processing_worker(queue, status_dict, app_config):
                 if task_type == 'yolo_training':
                     # YOLO学習タスク（将来的に実装）
                     handle_yolo_training_task(task, task_id, status_dict)
+                elif task_type == 'auto_annotation':
+                    # 自動アノテーション（学習済みモデルによる候補ラベルの書き込み）
+                    handle_auto_annotation_task(task, task_id, status_dict)
+                elif task_type == 'uncertainty_scoring':
+                    # 能動学習の不確実性スコアの計算
+                    handle_uncertainty_scoring_task(task, task_id, status_dict)
+                elif task_type == 'near_duplicate_hashing':
+                    # 近似重複の検出用の知覚ハッシュの計算
+                    handle_near_duplicate_hashing_task(task, task_id, status_dict)
                 else:
                     # 未知のタスクタイプ
                     status_dict[task_id] = {
@@ -95,4 +105,153 @@ def handle_yolo_training_task(task, task_id, status_dict):
         "status": "completed",
         "message": "YOLO学習タスクは別プロセスで実行されます",
         "progress": 100
-    }
\ No newline at end of file
+    }
+
+
+def submit_auto_annotation(queue, status_dict, job):
+    """自動アノテーションのジョブを処理キューに追加（タスクIDはジョブID）"""
+    status_dict[job['id']] = {
+        "status": "queued",
+        "message": f"自動アノテーション待機中（{job['done']}/{job['total']}枚）",
+        "progress": job['progress'],
+        "job": job
+    }
+    queue.put({'id': job['id'], 'type': 'auto_annotation', 'job_id': job['id']})
+
+
+def handle_auto_annotation_task(task, task_id, status_dict):
+    """自動アノテーションの処理（バッチごとに進捗を更新し、タスクがキャンセルされたらバッチの区切りで止める）"""
+    from core.auto_annotator import get_auto_annotator
+
+    annotator = get_auto_annotator()
+
+    def progress(job):
+        if status_dict.get(task_id, {}).get('status') == 'cancelled':
+            return
+        status_dict[task_id] = {
+            "status": "running",
+            "message": f"自動アノテーション中（{job['done']}/{job['total']}枚、候補{job['labeled']}枚）",
+            "progress": job['progress'],
+            "job": job
+        }
+
+    def should_stop():
+        return status_dict.get(task_id, {}).get('status') == 'cancelled'
+
+    try:
+        job = annotator.run(task['job_id'], progress=progress, should_stop=should_stop)
+    except Exception as e:
+        annotator.mark_failed(task['job_id'], str(e))
+        raise
+
+    if job['status'] == 'completed':
+        message = f"自動アノテーション完了: 候補{job['labeled']}枚（ボックス{job['boxes']}個）"
+    else:
+        message = f"自動アノテーションを中断しました（{job['done']}/{job['total']}枚）"
+    status_dict[task_id] = {
+        "status": job['status'],
+        "message": message,
+        "progress": 100 if job['status'] == 'completed' else job['progress'],
+        "job": job
+    }
+
+
+def submit_uncertainty_scoring(queue, status_dict, prefix=None):
+    """不確実性スコアの計算を処理キューに追加（同じ範囲の計算が待機中・実行中の場合はそのタスクIDを返す）"""
+    for task_id, status in list(status_dict.items()):
+        if status.get('type') == 'uncertainty_scoring' and status.get('prefix') == prefix \
+                and status.get('status') in ('queued', 'running'):
+            return task_id
+
+    task_id = f"uncertainty_{uuid.uuid4().hex[:12]}"
+    status_dict[task_id] = {
+        "status": "queued",
+        "message": "不確実性スコアの計算待機中",
+        "progress": 0,
+        "type": "uncertainty_scoring",
+        "prefix": prefix
+    }
+    queue.put({'id': task_id, 'type': 'uncertainty_scoring', 'prefix': prefix})
+    return task_id
+
+
+def handle_uncertainty_scoring_task(task, task_id, status_dict):
+    """不確実性スコアの計算（バッチごとに進捗を更新し、タスクがキャンセルされたらバッチの区切りで止める）"""
+    from core.active_learning import get_uncertainty_scorer
+
+    # 重複して追加しないよう、種類と範囲を残したまま実行中にする
+    status_dict[task_id] = {
+        "status": "running",
+        "message": "不確実性スコアを計算中",
+        "progress": 0,
+        "type": "uncertainty_scoring",
+        "prefix": task.get('prefix')
+    }
+
+    def progress(stats):
+        if status_dict.get(task_id, {}).get('status') == 'cancelled':
+            return
+        status_dict[task_id] = {
+            "status": "running",
+            "message": f"不確実性スコアを計算中（{stats['done']}/{stats['total']}枚）",
+            "progress": int(100 * stats['done'] / stats['total']) if stats['total'] else 100,
+            "type": "uncertainty_scoring",
+            "prefix": task.get('prefix'),
+            "result": stats
+        }
+
+    def should_stop():
+        return status_dict.get(task_id, {}).get('status') == 'cancelled'
+
+    stats = get_uncertainty_scorer().score(task.get('prefix'), progress=progress, should_stop=should_stop)
+    status_dict[task_id] = {
+        "status": stats['status'],
+        "message": f"不確実性スコアの計算{'完了' if stats['status'] == 'completed' else 'を中断しました'}"
+                   f"（{stats['done']}枚）",
+        "progress": 100,
+        "type": "uncertainty_scoring",
+        "prefix": task.get('prefix'),
+        "result": stats
+    }
+
+
+def submit_near_duplicate_hashing(queue, status_dict, prefix=None):
+    """知覚ハッシュの計算を処理キューに追加（同じ範囲の計算が待機中・実行中の場合はそのタスクIDを返す）"""
+    for task_id, status in list(status_dict.items()):
+        if status.get('type') == 'near_duplicate_hashing' and status.get('prefix') == prefix \
+                and status.get('status') in ('queued', 'running'):
+            return task_id
+
+    task_id = f"near_duplicate_{uuid.uuid4().hex[:12]}"
+    status_dict[task_id] = {
+        "status": "queued",
+        "message": "知覚ハッシュの計算待機中",
+        "progress": 0,
+        "type": "near_duplicate_hashing",
+        "prefix": prefix
+    }
+    queue.put({'id': task_id, 'type': 'near_duplicate_hashing', 'prefix': prefix})
+    return task_id
+
+
+def handle_near_duplicate_hashing_task(task, task_id, status_dict):
+    """知覚ハッシュの計算（近い画像の組のグラフも作っておく）"""
+    from core.near_duplicates import get_near_duplicate_detector
+
+    # 重複して追加しないよう、種類と範囲を残したまま実行中にする
+    status_dict[task_id] = {
+        "status": "running",
+        "message": "知覚ハッシュを計算中",
+        "progress": 0,
+        "type": "near_duplicate_hashing",
+        "prefix": task.get('prefix')
+    }
+    stats = get_near_duplicate_detector().update(task.get('prefix'), warm=True)
+    status_dict[task_id] = {
+        "status": "completed",
+        "message": f"知覚ハッシュの計算完了（{stats['hashed']}枚）",
+        "progress": 100,
+        "type": "near_duplicate_hashing",
+        "prefix": task.get('prefix'),
+        "result": stats
+    }
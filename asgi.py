@@ -0,0 +1,190 @@
+"""
+ASGIエントリポイント
+カメラ配信（/camera/video_feed, /camera/detections）はasyncioで直接処理し、
+それ以外のリクエストはFlaskアプリ（WSGI）へ渡す。視聴者が何人いてもWSGIのスレッドを占有しない。
+
+起動方法（asgiref・uvicornが必要）:
+    pip install asgiref uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qs
+
+from app import app as flask_app
+from core.async_bridge import frame_bridge, detection_bridge
+from core.camera_manager import get_camera_instance, get_active_camera_index
+from core.detection_stream import get_detection_stream
+from core.inference_pool import get_inference_pool
+from core.realtime_detector import get_detector_instance
+from routes.camera import _multipart_frame, _timed_encode, _record_write
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:
+    raise ImportError("ASGIで起動するにはasgirefが必要です: pip install asgiref uvicorn") from e
+
+logger = logging.getLogger(__name__)
+
+# Flaskアプリ（スレッドプールで実行される）
+wsgi_application = WsgiToAsgi(flask_app)
+
+MJPEG_HEADERS = [
+    (b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+    (b'cache-control', b'no-cache'),
+]
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+def _query(scope) -> dict:
+    """クエリ文字列を辞書に変換（同じキーは最初の値のみ）"""
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return {key: values[0] for key, values in params.items()}
+
+def _camera_index(params: dict) -> int:
+    camera = params.get('camera')
+    return int(camera) if camera not in (None, '') else get_active_camera_index()
+
+async def _send_json(send, status: int, data: dict):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode('ascii'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _wait_disconnect(receive):
+    """クライアントの切断を待つ"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def _run_until_disconnect(receive, coroutine):
+    """配信処理をクライアントが切断するまで実行"""
+    stream_task = asyncio.ensure_future(coroutine)
+    disconnect_task = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (stream_task, disconnect_task):
+            task.cancel()
+        await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+    if stream_task.done() and not stream_task.cancelled() and stream_task.exception():
+        logger.error(f"配信エラー: {stream_task.exception()}")
+
+async def video_feed(scope, receive, send):
+    """映像ストリーミング（routes.camera.video_feedの非同期版）"""
+    params = _query(scope)
+    camera_index = _camera_index(params)
+    camera = get_camera_instance(camera_index)
+    loop = asyncio.get_running_loop()
+
+    # カメラが初期化されていない場合は初期化（ブロッキング処理はスレッドで実行）
+    if not camera.is_running and not await loop.run_in_executor(None, camera.ensure_running):
+        await _send_json(send, 500, {'error': 'カメラの初期化に失敗しました'})
+        return
+
+    detection_mode = params.get('detection', 'false').lower() == 'true'
+    if detection_mode:
+        detector = get_detector_instance()
+        detector.model.conf = float(params.get('confidence', 0.25))
+        detector.model.iou = float(params.get('iou', 0.45))
+
+    async def stream():
+        await send({'type': 'http.response.start', 'status': 200, 'headers': MJPEG_HEADERS})
+        hub = camera.frame_hub
+        pool = get_inference_pool()
+
+        with camera.viewer(), frame_bridge(hub).subscribe() as subscription:
+            while camera.is_running:
+                try:
+                    seq, frame, timestamp = await subscription.get(timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+
+                if detection_mode:
+                    # 推論はプールのスレッドで実行し、完了をイベントループで待つ
+                    # （Futureは同じフレームを待つ視聴者間で共有するため、切断時にキャンセルしない）
+                    detections = await asyncio.shield(asyncio.wrap_future(pool.submit(camera_index, seq, frame)))
+                    processed_frame, _ = await loop.run_in_executor(
+                        None, get_detector_instance().process_frame, frame, detections)
+                    jpeg = await loop.run_in_executor(None, _timed_encode, processed_frame)
+                else:
+                    # 同じフレームのエンコード結果は視聴者間で共有
+                    jpeg = await loop.run_in_executor(None, hub.encoded, seq, frame, _timed_encode)
+
+                if jpeg:
+                    write_start = time.monotonic()
+                    await send({'type': 'http.response.body',
+                                'body': _multipart_frame(jpeg, timestamp), 'more_body': True})
+                    _record_write(write_start, timestamp)
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    await _run_until_disconnect(receive, stream())
+
+async def detection_events(scope, receive, send):
+    """判定結果のServer-Sent Events配信（routes.camera.detection_eventsの非同期版）"""
+    params = _query(scope)
+    camera_index = _camera_index(params)
+    camera = get_camera_instance(camera_index)
+    detection_stream = get_detection_stream(camera_index)
+
+    detector = get_detector_instance()
+    if 'confidence' in params:
+        detector.model.conf = float(params['confidence'])
+    if 'iou' in params:
+        detector.model.iou = float(params['iou'])
+
+    async def stream():
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+
+        with camera.viewer(), detection_stream.subscribe(), \
+                detection_bridge(detection_stream).subscribe() as subscription:
+            while camera.is_running:
+                try:
+                    message = await subscription.get(timeout=15.0)
+                    chunk = f"data: {json.dumps(message)}\n\n"
+                except asyncio.TimeoutError:
+                    # 接続維持用のコメント行
+                    chunk = ': keep-alive\n\n'
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    await _run_until_disconnect(receive, stream())
+
+async def lifespan(scope, receive, send):
+    """起動・終了イベント（特別な処理はない）"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# 非同期で処理するパス
+ASYNC_ROUTES = {
+    '/camera/video_feed': video_feed,
+    '/camera/detections': detection_events,
+}
+
+async def application(scope, receive, send):
+    """ASGIアプリケーション"""
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is not None and scope.get('method', 'GET') == 'GET':
+        await handler(scope, receive, send)
+        return
+
+    await wsgi_application(scope, receive, send)
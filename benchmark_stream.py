@@ -0,0 +1,170 @@
+"""
+カメラ配信のベンチマークスクリプト
+/camera/video_feed に複数の仮想視聴者を接続し、エンドツーエンドのフレーム遅延と持続FPSを計測する
+
+マイクロスコープなし・CPUのみの環境では合成映像ソースでサーバーを起動してから実行する:
+    CAMERA_SOURCE=synthetic python app.py
+    python benchmark_stream.py --viewers 4 --duration 30 --detection
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+class Viewer(threading.Thread):
+    """MJPEGストリームを受信して各フレームの遅延を記録する仮想視聴者"""
+
+    def __init__(self, viewer_id, url, duration):
+        super().__init__(daemon=True)
+        self.viewer_id = viewer_id
+        self.url = urlparse(url)
+        self.duration = duration
+        self.latencies = []
+        self.frame_timestamps = set()
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+        self.elapsed = 0.0
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+        start = time.time()
+        try:
+            path = self.url.path + (f'?{self.url.query}' if self.url.query else '')
+            conn.request('GET', path)
+            response = conn.getresponse()
+            if response.status != 200:
+                self.error = f'HTTP {response.status}'
+                return
+
+            while time.time() - start < self.duration:
+                headers = self._read_part_headers(response)
+                if headers is None:
+                    break
+                length = int(headers.get('content-length', 0))
+                payload = response.read(length)
+                response.readline()  # パート末尾のCRLF
+                received_at = time.time()
+
+                self.frames += 1
+                self.bytes += len(payload)
+                if 'x-frame-timestamp' in headers:
+                    captured_at = float(headers['x-frame-timestamp'])
+                    self.frame_timestamps.add(captured_at)
+                    self.latencies.append(received_at - captured_at)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.elapsed = time.time() - start
+            conn.close()
+
+    @staticmethod
+    def _read_part_headers(response):
+        """境界行とパートヘッダを読み込む"""
+        line = response.readline()
+        while line and not line.startswith(b'--'):
+            line = response.readline()
+        if not line:
+            return None
+
+        headers = {}
+        while True:
+            line = response.readline()
+            if not line or line in (b'\r\n', b'\n'):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        return headers
+
+def percentile(values, q):
+    """パーセンタイルを計算（最近傍法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def summarize(viewers):
+    """全視聴者の計測結果を集計"""
+    latencies = [lat for v in viewers for lat in v.latencies]
+    per_viewer = []
+    for v in viewers:
+        per_viewer.append({
+            'viewer': v.viewer_id,
+            'frames': v.frames,
+            'unique_frames': len(v.frame_timestamps),
+            'fps': v.frames / v.elapsed if v.elapsed > 0 else 0,
+            'unique_fps': len(v.frame_timestamps) / v.elapsed if v.elapsed > 0 else 0,
+            'mbps': v.bytes * 8 / v.elapsed / 1e6 if v.elapsed > 0 else 0,
+            'error': v.error
+        })
+
+    def ms(value):
+        return value * 1000 if value is not None else None
+
+    return {
+        'viewers': len(viewers),
+        'total_frames': sum(v.frames for v in viewers),
+        'sustained_fps_per_viewer': (sum(p['unique_fps'] for p in per_viewer) / len(per_viewer)) if per_viewer else 0,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies)) if latencies else None
+        },
+        'per_viewer': per_viewer
+    }
+
+def start_camera(base_url):
+    """サーバー側のカメラを開始"""
+    url = urlparse(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    try:
+        conn.request('POST', '/camera/start', body='{}', headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        print(f"カメラ開始: HTTP {response.status} {response.read().decode('utf-8', 'ignore')}")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='カメラ配信のベンチマーク（複数視聴者の遅延・FPS計測）')
+    parser.add_argument('--url', default='http://localhost:8080', help='サーバーのURL')
+    parser.add_argument('--viewers', type=int, default=4, help='同時視聴者数')
+    parser.add_argument('--duration', type=float, default=20.0, help='計測時間（秒）')
+    parser.add_argument('--detection', action='store_true', help='判定付きストリームを計測')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    start_camera(base_url)
+
+    feed_url = f"{base_url}/camera/video_feed?detection={'true' if args.detection else 'false'}"
+    viewers = [Viewer(i, feed_url, args.duration) for i in range(args.viewers)]
+    for viewer in viewers:
+        viewer.start()
+    for viewer in viewers:
+        viewer.join(args.duration + 30)
+
+    result = summarize(viewers)
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+
+    print(f"視聴者数: {result['viewers']}  受信フレーム合計: {result['total_frames']}")
+    print(f"持続FPS（視聴者あたり・重複除く）: {result['sustained_fps_per_viewer']:.1f}")
+    latency = result['latency_ms']
+    if latency['p50'] is not None:
+        print(f"遅延(ms): p50={latency['p50']:.1f} p95={latency['p95']:.1f} "
+              f"p99={latency['p99']:.1f} max={latency['max']:.1f}")
+    for p in result['per_viewer']:
+        status = f" エラー: {p['error']}" if p['error'] else ''
+        print(f"  viewer{p['viewer']}: {p['frames']}フレーム ({p['unique_frames']}枚ユニーク) "
+              f"{p['unique_fps']:.1f}fps {p['mbps']:.1f}Mbps{status}")
+
+if __name__ == "__main__":
+    main()
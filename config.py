@@ -1,5 +1,6 @@
 import os
 import json
+import threading
 
 # アプリケーション情報
 APP_VERSION = '1.0.0'
@@ -25,6 +26,22 @@ DETECTION_RESULTS_DIR = os.path.join(STATIC_DIR, 'detection_results')
 # YOLOデータセット（自動生成）
 YOLO_DATASET_DIR = os.path.join(DATA_DIR, 'yolo_dataset')
 
+# 画像の実体ストア（SHA-256ごとに1つ保存し、各フォルダからはハードリンクで参照する）
+BLOB_STORE_DIR = os.path.join(DATA_DIR, 'blobs')
+BLOB_GC_GRACE = 3600  # 参照がなくなってからこの秒数が経った実体をGCで削除する
+
+# 学習データのインデックス（画像・ラベル・クラス別ボックス数などをSQLiteに保持）
+DATASET_INDEX_DB = os.path.join(DATA_DIR, 'dataset_index.db')
+DATASET_INDEX_REFRESH_INTERVAL = 2.0  # アプリ外での追加・削除をディレクトリの更新時刻で確認する間隔（秒）
+
+# ファイル変更監視（学習データ・学習結果の変更を検出して各キャッシュを更新する）
+WATCHER_BACKEND = os.environ.get('WATCHER_BACKEND', 'auto')  # 'auto' / 'inotify' / 'polling'
+WATCHER_DEBOUNCE = 0.5  # 最後の変更からこの秒数待ってまとめて通知する
+WATCHER_POLL_INTERVAL = 2.0  # ポーリング方式の走査間隔（秒）
+
+# YOLOv5の学習結果ディレクトリ
+YOLO_RUNS_DIR = os.path.join('yolov5', 'runs', 'train')
+
 # メタデータ
 METADATA_FILE = os.path.join(DATA_DIR, 'metadata.json')
 
@@ -50,6 +67,91 @@ YOLO_IMG_SIZE = 640
 
 # データセット分割比率
 TRAIN_VAL_SPLIT_RATIO = 0.8  # 訓練データの比率
+DATASET_SPLIT_SEED = 42  # 訓練/検証の分割に使うシード（変更すると分割をやり直す）
+DATASET_LINK_MODE = os.environ.get('DATASET_LINK_MODE', 'auto')  # 'auto' / 'hardlink' / 'symlink' / 'copy'
+
+# YOLOのクラス名（data.yamlの生成・データセット検証で使用、クラスIDの順）
+YOLO_CLASS_NAMES = ['male', 'female', 'madreporite', 'anus']
+
+# データセットのスナップショット（学習に使った画像・ラベル・分割を内容のハッシュで固定し、学習結果に記録する）
+DATASET_SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshots')
+DATASET_SNAPSHOT_ON_TRAIN = os.environ.get('DATASET_SNAPSHOT_ON_TRAIN', '1') != '0'  # 学習開始時に自動で作成する
+
+# 学習用の縮小画像キャッシュ（学習時の画像サイズに縮小したコピーを(元画像のハッシュ, サイズ)ごとに保存）
+RESIZE_CACHE_ENABLED = os.environ.get('RESIZE_CACHE_ENABLED', '1') != '0'
+RESIZE_CACHE_DIR = os.path.join(DATA_DIR, 'resize_cache')
+RESIZE_CACHE_QUALITY = 95  # 縮小画像のJPEG品質
+RESIZE_CACHE_WORKERS = None  # 縮小に使うプロセス数（Noneの場合はCPUコア数）
+RESIZE_CACHE_GRACE = 7 * 24 * 3600  # データセットから参照されなくなった縮小画像を残しておく秒数
+
+# サムネイル（/thumb/<サイズ>/<パス>、元画像のハッシュごとにディスクへキャッシュ）
+THUMBNAIL_CACHE_DIR = os.path.join(DATA_DIR, 'thumbnails')
+THUMBNAIL_SIZES = (128, 256, 512)  # 生成する長辺サイズ（それ以外の要求は近いサイズに丸める）
+THUMBNAIL_DEFAULT_SIZE = 256  # 一覧で使うサイズ（アップロード後に事前生成する）
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2  # 事前生成のスレッド数
+THUMBNAIL_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # キャッシュの上限（超えた分は古いものから削除）
+
+# 画像の一括移動・削除（計画をジャーナルに書いてから実行し、中断した場合は起動時に再開または取り消す）
+FILE_OPS_DIR = os.path.join(DATA_DIR, 'file_ops')
+FILE_OPS_WORKERS = 8  # 別デバイス間のコピーに使うスレッド数
+FILE_OPS_SYNC_LIMIT = 200  # この枚数までは完了を待って応答する（超える場合はバックグラウンドで実行）
+FILE_OPS_RECOVERY = os.environ.get('FILE_OPS_RECOVERY', 'resume')  # 中断した一括操作の扱い（'resume' / 'rollback'）
+
+# 近似重複の検出（知覚ハッシュ dHash/pHash のハミング距離で判定、core.near_duplicates）
+NEAR_DUPLICATE_THRESHOLD = 10  # dHash・pHashの両方がこの距離以下なら近似重複とみなす（0〜64）
+NEAR_DUPLICATE_WORKERS = None  # ハッシュ計算に使うプロセス数（Noneの場合はCPUコア数）
+NEAR_DUPLICATE_SYNC_LIMIT = 200  # 未計算のハッシュがこの枚数までならリクエスト内で計算する（超える分は処理キューで計算）
+DATASET_SPLIT_GROUP_DUPLICATES = os.environ.get('DATASET_SPLIT_GROUP_DUPLICATES', '1') != '0'  # 近似重複を同じ側に分割する
+
+# 自動アノテーション（学習済みモデルの検出結果を未アノテーション画像の候補ラベルとして書き込む、core.auto_annotator）
+AUTO_ANNOTATION_DIR = os.path.join(DATA_DIR, 'auto_annotation')  # ジョブの状態（バッチごとのチェックポイント）
+AUTO_ANNOTATION_BATCH_SIZE = 16  # 1回の推論で処理する画像数
+AUTO_ANNOTATION_CONF = 0.4  # 候補として書き込む検出の信頼度の下限
+
+# 能動学習（モデルが判断に迷う未アノテーション画像を優先してアノテーションする、core.active_learning）
+ACTIVE_LEARNING_BATCH_SIZE = 16  # 1回の推論で処理する画像数（左右反転した画像も同じバッチで推論する）
+ACTIVE_LEARNING_CONF = 0.1  # 不確実性の計算に使う検出の信頼度の下限（低い信頼度の検出も含める）
+ACTIVE_LEARNING_CONFLICT_CONF = 0.25  # 雄と雌の矛盾の判定に使う検出の信頼度の下限（通常の検出と同じ）
+ACTIVE_LEARNING_WEIGHTS = {  # 不確実性スコアの重み（各成分は0〜1）
+    'confidence': 0.5,    # 1 - 最も高い信頼度
+    'conflict': 0.3,      # 雄と雌の生殖乳頭が両方検出された
+    'disagreement': 0.2   # 元画像と左右反転画像でクラスごとの検出数が一致しない
+}
+ACTIVE_LEARNING_TOP_K = 20  # 一覧で返す件数の既定値
+
+# データセット検証設定
+DATASET_VALIDATION_WORKERS = None  # 検証に使うプロセス数（Noneの場合はCPUコア数）
+DATASET_MIN_IMAGE_SIZE = 32  # これより短辺が小さい画像を警告する（ピクセル）
+DATASET_DUPLICATE_IOU = 0.9  # 同じクラスでこのIoU以上重なるボックスを重複として警告する
+
+# JPEGコーデック設定
+JPEG_BACKEND = os.environ.get('JPEG_BACKEND', 'auto')  # 'auto' / 'simplejpeg' / 'turbojpeg' / 'opencv'
+JPEG_QUALITY = 95  # cv2.imwriteの既定値と同じ
+JPEG_SUBSAMPLING = '420'  # クロマサブサンプリング（'444' / '422' / '420'）
+
+# カメラ検出設定
+CAMERA_DISCOVERY_TTL = 60  # カメラ一覧キャッシュの有効期間（秒）
+CAMERA_DISCOVERY_MAX_INDEX = 5  # /dev/videoが使えない環境で試すインデックス数
+
+# 実カメラの代わりに使うフレームソース（負荷試験・CI用）
+# 'synthetic' / 'video:<パス>' / 'folder:<パス>'、未設定の場合は実カメラを使用
+CAMERA_SOURCE = os.environ.get('CAMERA_SOURCE') or None
+
+# 視聴者がいない間のカメラの省電力動作
+CAMERA_IDLE_GRACE = 10.0  # 最後の視聴者が離れてから低頻度キャプチャに切り替えるまでの秒数
+CAMERA_IDLE_FPS = 1.0  # 視聴者がいない間のキャプチャ頻度（デバイスを開いたまま維持する）
+
+# リアルタイム判定の推論プール設定（複数カメラのフレームを1回の推論にまとめる）
+INFERENCE_MAX_BATCH = 4  # 1回の推論にまとめる最大フレーム数
+INFERENCE_MAX_WAIT = 0.005  # バッチを揃えるために待つ最大時間（秒）
+LATENCY_WINDOW = 1000  # 段階ごとの所要時間を保持するサンプル数（/camera/detection/stats）
+
+# 動画解析設定
+VIDEO_ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
+VIDEO_ANALYSIS_STRIDE = 5  # 何フレームごとに解析するか
+VIDEO_ANALYSIS_BATCH_SIZE = 8  # 1回の推論にまとめるフレーム数
+VIDEO_SPECIMEN_GAP = 1.0  # この秒数以上検出が途切れたら別の個体とみなす
 
 def ensure_directories():
     """必要なディレクトリを作成"""
@@ -61,12 +163,22 @@ def ensure_directories():
         DETECTION_RESULTS_DIR,
         DATA_DIR,
         YOLO_DATASET_DIR,
+        BLOB_STORE_DIR,
+        DATASET_SNAPSHOT_DIR,
+        RESIZE_CACHE_DIR,
+        THUMBNAIL_CACHE_DIR,
+        FILE_OPS_DIR,
+        AUTO_ANNOTATION_DIR,
         'logs'
     ]
     
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
+# メタデータ（METADATA_FILE）は複数の画面・自動アノテーションから書き換えるため、
+# 読み込みから保存までをこのロックの中で行う（update_metadataを使う）
+METADATA_LOCK = threading.RLock()
+
 def load_metadata():
     """メタデータを読み込む"""
     if os.path.exists(METADATA_FILE):
@@ -78,14 +190,29 @@ def load_metadata():
     return {}
 
 def save_metadata(metadata):
-    """メタデータを保存する"""
+    """メタデータを保存する（読み込み途中のファイルが壊れて見えないよう、一時ファイルから置き換える）"""
     try:
-        with open(METADATA_FILE, 'w') as f:
+        os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
+        tmp_path = METADATA_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
             json.dump(metadata, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, METADATA_FILE)
         return True
     except:
         return False
 
+def update_metadata(update):
+    """
+    メタデータを読み込み、update(metadata)で書き換えて保存する（METADATA_LOCKの中で行う）
+    Returns:
+        updateの戻り値
+    """
+    with METADATA_LOCK:
+        metadata = load_metadata()
+        result = update(metadata)
+        save_metadata(metadata)
+        return result
+
 def get_latest_yolo_model():
     """最新のYOLOモデルパスを取得"""
     train_dir = os.path.join('yolov5', 'runs', 'train')
@@ -5,6 +5,7 @@ import cv2
 import numpy as np
 from pathlib import Path
 import logging
+from app_utils.jpeg_codec import read_image
 
 logger = logging.getLogger(__name__)
 
@@ -97,7 +98,7 @@ class YoloDetector:
             # 画像読み込み
             if isinstance(image_path, str):
                 # 日本語パス対応の読み込み
-                image = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+                image = read_image(image_path)
                 if image is None:
                     raise ValueError(f"画像の読み込みに失敗: {image_path}")
             else:
@@ -113,25 +114,8 @@ class YoloDetector:
             # 推論実行
             results = self.model(rgb_image)
             
-            # 検出結果の抽出
-            detections = []
-            count_by_class = {0: 0, 1: 0, 2: 0, 3: 0}
-            
-            for det in results.xyxy[0]:  # バッチの最初の画像の結果
-                x1, y1, x2, y2, conf, cls = det.cpu().numpy()
-                
-                if conf >= self.conf_threshold:
-                    class_id = int(cls)
-                    detections.append({
-                        'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                        'confidence': float(conf),
-                        'class_id': class_id,
-                        'class_name': self.class_info.get(class_id, {'name': '不明'})['name'],
-                        'class_name_en': self.class_info.get(class_id, {'name_en': 'Unknown'})['name_en']
-                    })
-                    
-                    if class_id in count_by_class:
-                        count_by_class[class_id] += 1
+            # 検出結果の抽出（バッチの最初の画像の結果）
+            detections, count_by_class = self._extract_detections(results.xyxy[0])
             
             # 結果の描画
             annotated_image = self._draw_detections(image, detections)
@@ -162,6 +146,67 @@ class YoloDetector:
                 'error': str(e)
             }
     
+    def detect_frames(self, frames):
+        """
+        複数フレームを1回の推論でまとめて検出（動画解析用、描画画像は生成しない）
+        
+        Args:
+            frames: BGR画像のリスト
+            
+        Returns:
+            list: 各フレームの検出結果
+                - detections / count / count_by_class / count_by_class_id / gender_result
+        """
+        if self.model is None or not frames:
+            return [self._summarize([], {0: 0, 1: 0, 2: 0, 3: 0}) for _ in frames]
+        
+        # BGR -> RGB変換してバッチ推論
+        rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        results = self.model(rgb_frames)
+        
+        summaries = []
+        for predictions in results.xyxy:
+            detections, count_by_class = self._extract_detections(predictions)
+            summaries.append(self._summarize(detections, count_by_class))
+        return summaries
+    
+    def _extract_detections(self, predictions):
+        """推論結果（[x1, y1, x2, y2, conf, cls]）を検出結果とクラスごとの検出数に変換"""
+        detections = []
+        count_by_class = {0: 0, 1: 0, 2: 0, 3: 0}
+        
+        for det in predictions:
+            x1, y1, x2, y2, conf, cls = det.cpu().numpy()
+            
+            if conf >= self.conf_threshold:
+                class_id = int(cls)
+                detections.append({
+                    'bbox': [int(x1), int(y1), int(x2), int(y2)],
+                    'confidence': float(conf),
+                    'class_id': class_id,
+                    'class_name': self.class_info.get(class_id, {'name': '不明'})['name'],
+                    'class_name_en': self.class_info.get(class_id, {'name_en': 'Unknown'})['name_en']
+                })
+                
+                if class_id in count_by_class:
+                    count_by_class[class_id] += 1
+        
+        return detections, count_by_class
+    
+    def _summarize(self, detections, count_by_class):
+        """検出結果と雌雄判定をまとめる（描画画像なし）"""
+        return {
+            'detections': detections,
+            'count': len(detections),
+            'count_by_class': {
+                'male': count_by_class[0],
+                'female': count_by_class[1],
+                'madreporite': count_by_class[2]
+            },
+            'count_by_class_id': count_by_class,
+            'gender_result': self._determine_gender(count_by_class)
+        }
+    
     def _draw_detections(self, image, detections):
         """検出結果を画像に描画"""
         annotated_image = image.copy()
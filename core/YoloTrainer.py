@@ -34,6 +34,8 @@ class YoloTrainer:
         self.current_epoch = 0
         self.total_epochs = 0
         self.training_id = None
+        self.dataset_snapshot = None  # 学習に使うデータセットのスナップショットID（core.dataset_snapshot）
+        self.run_name = None  # YOLOv5が作成した学習結果ディレクトリ名（runs/train/<実験名>）
         self.metrics = {
             'box_loss': [],
             'obj_loss': [],
@@ -45,7 +47,7 @@ class YoloTrainer:
         }
     
     def start_training(self, weights='yolov5s.pt', batch_size=4, epochs=50, img_size=640,
-                       device='', workers=4, name='exp', exist_ok=False, **kwargs):
+                       device='', workers=4, name='exp', exist_ok=False, dataset_snapshot=None, **kwargs):
 
         """
         トレーニングを開始する
@@ -59,6 +61,7 @@ class YoloTrainer:
             workers: データローダーのワーカー数
             name: 実験名
             exist_ok: 同名の実験が存在する場合に上書きするかどうか
+            dataset_snapshot: データセットのスナップショットID（学習結果ディレクトリに記録する）
             
         Returns:
             bool: トレーニングが開始されたかどうか
@@ -97,8 +100,11 @@ class YoloTrainer:
             'device': device,
             'workers': workers,
             'name': name,
-            'exist_ok': exist_ok
+            'exist_ok': exist_ok,
+            'dataset_snapshot': dataset_snapshot
         }
+        self.dataset_snapshot = dataset_snapshot
+        self.run_name = None
         
         # トレーニングスレッドを開始
         self.training_thread = threading.Thread(
@@ -142,6 +148,10 @@ class YoloTrainer:
         
         # 絶対パスを使用
         data_yaml_path = os.path.abspath(self.data_yaml)
+
+        # 学習結果ディレクトリを特定するため、開始前の一覧を記録
+        runs_dir = os.path.join(self.yolo_dir, 'runs', 'train')
+        existing_runs = set(os.listdir(runs_dir)) if os.path.isdir(runs_dir) else set()
         
         # コマンドラインの構築
         cmd = [
@@ -202,6 +212,8 @@ class YoloTrainer:
                                 self.current_epoch = int(current) + 1  # 0ベースなので+1
                                 self.total_epochs = int(total)
                                 logger.info(f"エポック進捗: {self.current_epoch}/{self.total_epochs}")
+                                if self.run_name is None:
+                                    self._record_dataset_snapshot(existing_runs)
                                 # 状態を保存
                                 self._save_training_state()
                                 
@@ -263,16 +275,44 @@ class YoloTrainer:
         finally:
             self.is_training = False
             self.training_process = None
+            if self.run_name is None:
+                self._record_dataset_snapshot(existing_runs)
             # 最終状態を保存
             self._save_training_state()
             logger.info("トレーニングプロセス終了処理完了")
     
+    def _record_dataset_snapshot(self, existing_runs):
+        """新しく作られた学習結果ディレクトリに、学習に使ったデータセットのスナップショットIDを記録"""
+        runs_dir = os.path.join(self.yolo_dir, 'runs', 'train')
+        if not os.path.isdir(runs_dir):
+            return
+        new_runs = [d for d in os.listdir(runs_dir)
+                    if d not in existing_runs and os.path.isdir(os.path.join(runs_dir, d))]
+        if new_runs:
+            self.run_name = max(new_runs, key=lambda d: os.path.getctime(os.path.join(runs_dir, d)))
+        elif self.training_config.get('exist_ok') and self.training_config['name'] in existing_runs:
+            # 同名の実験に上書きした場合
+            self.run_name = self.training_config['name']
+        else:
+            return
+
+        if not self.dataset_snapshot:
+            return
+        try:
+            from core.dataset_snapshot import record_run
+            record_run(os.path.join(runs_dir, self.run_name), self.dataset_snapshot,
+                       training_id=self.training_id, config=self.training_config)
+            logger.info(f"データセットスナップショット {self.dataset_snapshot} を {self.run_name} に記録しました")
+        except Exception as e:
+            logger.error(f"スナップショットの記録エラー: {e}")
+
     def _save_training_state(self):
         """トレーニング状態をJSONファイルに保存"""
         try:
             state = self.get_training_status()
             state['training_id'] = self.training_id
             state['config'] = self.training_config if hasattr(self, 'training_config') else {}
+            state['run_name'] = self.run_name
 
             with open(self.state_file, 'w', encoding='utf-8') as f:
                 json.dump(state, f, ensure_ascii=False, indent=2)
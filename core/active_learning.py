@@ -0,0 +1,181 @@
+"""
+能動学習モジュール
+未アノテーション画像を学習済みモデル（core.run_catalog.production_model）でバッチ推論し、
+モデルが判断に迷っている度合い（不確実性スコア、0〜1）を計算して、高い順にアノテーションの候補として返す。
+
+スコアは次の成分の重み付き和（重みは config.ACTIVE_LEARNING_WEIGHTS）:
+    confidence    1 - 検出の最も高い信頼度（何も検出されない場合は1）
+    conflict      雄と雌の生殖乳頭が両方検出された（信頼度がACTIVE_LEARNING_CONFLICT_CONF以上の検出のみで判定）
+    disagreement  元画像と左右反転画像でクラスごとの検出数が食い違う割合
+
+スコアはデータセットインデックスに (画像の内容のハッシュ, モデルのバージョン) ごとに保存するため、
+同じモデルでは再計算せず、モデルが変わると計算し直す。計算は処理キュー（app_utils.worker）で行い、
+バッチごとに保存するため、中断しても続きから計算できる。
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+import cv2
+
+from config import (ACTIVE_LEARNING_BATCH_SIZE, ACTIVE_LEARNING_CONF, ACTIVE_LEARNING_CONFLICT_CONF,
+                    ACTIVE_LEARNING_WEIGHTS, ACTIVE_LEARNING_TOP_K, YOLO_IMG_SIZE)
+
+logger = logging.getLogger(__name__)
+
+def uncertainty(result: dict, flipped: dict, weights: Dict[str, float] = ACTIVE_LEARNING_WEIGHTS,
+                conflict_conf: float = ACTIVE_LEARNING_CONFLICT_CONF) -> dict:
+    """
+    検出結果（YoloDetector.detect_framesの1枚分）と左右反転画像の検出結果から不確実性を計算
+    Args:
+        conflict_conf: 雄と雌の矛盾の判定に使う検出の信頼度の下限（低い信頼度の誤検出1つで矛盾としない）
+    Returns:
+        score, max_confidence, conflict, disagreement, box_count
+    """
+    detections = result['detections']
+    max_confidence = max((det['confidence'] for det in detections), default=0.0)
+    confident_classes = {det['class_id'] for det in detections if det['confidence'] >= conflict_conf}
+    conflict = 0 in confident_classes and 1 in confident_classes
+
+    counts = result['count_by_class_id']
+    flipped_counts = flipped['count_by_class_id']
+    total = max(sum(counts.values()), sum(flipped_counts.values()), 1)
+    mismatch = sum(abs(counts.get(class_id, 0) - flipped_counts.get(class_id, 0))
+                   for class_id in set(counts) | set(flipped_counts))
+    disagreement = min(1.0, mismatch / total)
+
+    score = (weights['confidence'] * (1.0 - max_confidence) +
+             weights['conflict'] * float(conflict) +
+             weights['disagreement'] * disagreement)
+    return {
+        'score': round(score / sum(weights.values()), 6),
+        'max_confidence': round(max_confidence, 4),
+        'conflict': int(conflict),
+        'disagreement': round(disagreement, 4),
+        'box_count': len(detections)
+    }
+
+class UncertaintyScorer:
+    """未アノテーション画像の不確実性スコアの計算と順位付け"""
+
+    def __init__(self, batch_size: int = ACTIVE_LEARNING_BATCH_SIZE, conf_threshold: float = ACTIVE_LEARNING_CONF,
+                 img_size: int = YOLO_IMG_SIZE):
+        """
+        初期化
+        Args:
+            batch_size: 1回の推論で処理する画像数（反転画像を含めると2倍になる）
+            conf_threshold: 検出の信頼度の下限
+            img_size: 推論時の画像サイズ（JPEGはこのサイズ以上に縮小しながらデコードする）
+        """
+        self.batch_size = batch_size
+        self.conf_threshold = conf_threshold
+        self.img_size = img_size
+        self._lock = threading.Lock()
+        self._detector = None
+        self._detector_path = None
+
+    @staticmethod
+    def current_model() -> Optional[dict]:
+        from core.run_catalog import get_run_catalog
+        return get_run_catalog().production_model()
+
+    def score(self, prefix: Optional[str] = None, progress: Optional[Callable[[dict], None]] = None,
+              should_stop: Optional[Callable[[], bool]] = None) -> dict:
+        """
+        スコアが未計算の画像をバッチ推論して保存（処理キューのワーカーで呼ぶ）
+        Args:
+            prefix: 対象フォルダ（インデックスのフォルダ名、子フォルダを含む。Noneの場合はすべて）
+            progress: バッチごとに呼ぶコールバック（進捗の辞書を渡す）
+            should_stop: 中断するかどうか（バッチの区切りで確認する）
+        """
+        from app_utils.jpeg_codec import read_image
+        from core.dataset_index import get_dataset_index
+
+        model = self.current_model()
+        if model is None:
+            raise ValueError('学習済みモデルがありません。先に学習を実行してください')
+
+        index = get_dataset_index()
+        # 古いモデルのスコアは使わないため削除する
+        index.prune_scores(model['version'])
+        detector = self._get_detector(model['path'])
+
+        stats = {'model_version': model['version'], 'total': index.count_without_scores(model['version'], prefix),
+                 'done': 0, 'errors': 0, 'status': 'running'}
+        while True:
+            rows = index.images_without_scores(model['version'], prefix, limit=self.batch_size)
+            if not rows:
+                break
+
+            frames = []
+            scores = []
+            for row in rows:
+                image = read_image(index.image_path(row['folder'], row['name']), max_size=self.img_size)
+                if image is None:
+                    stats['errors'] += 1
+                    scores.append({'digest': row['digest'], 'score': None})
+                else:
+                    frames.append((row, image))
+
+            if frames:
+                # 元画像と左右反転画像を1回の推論でまとめて処理する
+                images = [image for _, image in frames]
+                results = detector.detect_frames(images + [cv2.flip(image, 1) for image in images])
+                for (row, _), result, flipped in zip(frames, results[:len(frames)], results[len(frames):]):
+                    scores.append(dict(uncertainty(result, flipped), digest=row['digest']))
+
+            index.store_scores(model['version'], scores)
+            stats['done'] += len(rows)
+            if progress:
+                progress(dict(stats))
+            if should_stop and should_stop():
+                stats['status'] = 'cancelled'
+                return stats
+
+        stats['status'] = 'completed'
+        logger.info(f"不確実性スコア計算完了: {stats}")
+        return stats
+
+    def top(self, prefix: Optional[str] = None, k: int = ACTIVE_LEARNING_TOP_K) -> Optional[dict]:
+        """
+        不確実性の高い未アノテーション画像（現在のモデルで計算済みのもの）
+        Returns:
+            {'model_version', 'images', 'pending'}（学習済みモデルがない場合はNone）
+        """
+        from core.dataset_index import get_dataset_index
+
+        model = self.current_model()
+        if model is None:
+            return None
+        index = get_dataset_index()
+        return {
+            'model_version': model['version'],
+            'images': index.top_uncertain(model['version'], prefix, k),
+            'pending': index.count_without_scores(model['version'], prefix)
+        }
+
+    def _get_detector(self, model_path: str):
+        """検出器（同じモデルなら使い回す、低い信頼度の検出も含める）"""
+        from core.YoloDetector import YoloDetector
+
+        with self._lock:
+            if self._detector is None or self._detector_path != model_path:
+                self._detector = YoloDetector(model_path=model_path, conf_threshold=self.conf_threshold)
+                self._detector_path = model_path
+                if self._detector.model is None:
+                    self._detector = None
+                    raise RuntimeError(f'モデルを読み込めません: {model_path}')
+            return self._detector
+
+# シングルトンインスタンス
+_scorer_instance: Optional[UncertaintyScorer] = None
+_scorer_lock = threading.Lock()
+
+def get_uncertainty_scorer() -> UncertaintyScorer:
+    """不確実性スコアの計算器を取得（シングルトン）"""
+    global _scorer_instance
+    with _scorer_lock:
+        if _scorer_instance is None:
+            _scorer_instance = UncertaintyScorer()
+        return _scorer_instance
@@ -0,0 +1,128 @@
+"""
+非同期ブリッジモジュール
+FrameHub・DetectionStreamのブロッキングな待機を1本のスレッドに集約し、
+asyncioの購読者それぞれへ最新の要素だけを配る（ASGI配信用、asgi.py参照）
+"""
+
+import asyncio
+import threading
+import time
+import logging
+import weakref
+from typing import Any, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class AsyncSubscription:
+    """非同期の購読者（最新の1件だけを保持し、遅い購読者は古い要素を読み飛ばす）"""
+
+    def __init__(self, bridge: "AsyncHubBridge", loop: asyncio.AbstractEventLoop):
+        self._bridge = bridge
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """次の要素を待つ（タイムアウト時はasyncio.TimeoutError）"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def _offer(self, item):
+        # イベントループのスレッドで実行される
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+
+    def close(self):
+        self._bridge._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class AsyncHubBridge:
+    """ブロッキングなwait_next(last_seq, timeout)をasyncioの購読者へ中継"""
+
+    def __init__(self, wait_next: Callable[[int, float], Any], seq_of: Callable[[Any], int]):
+        """
+        初期化
+        Args:
+            wait_next: last_seqより新しい要素を待つ関数（タイムアウト時はNone）
+            seq_of: 要素から通し番号を取り出す関数
+        """
+        # 配信元をブリッジから参照し続けないように弱参照で保持
+        self._wait_next = weakref.WeakMethod(wait_next)
+        self._seq_of = seq_of
+        self._subscribers: Set[AsyncSubscription] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self) -> AsyncSubscription:
+        """現在のイベントループで購読を開始"""
+        subscription = AsyncSubscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscription
+
+    def _unsubscribe(self, subscription: AsyncSubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self):
+        """中継スレッド（購読者がいなくなると終了）"""
+        last_seq = 0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+
+            wait_next = self._wait_next()
+            if wait_next is None:
+                with self._lock:
+                    self._thread = None
+                return
+
+            try:
+                item = wait_next(last_seq, 1.0)
+            except Exception as e:
+                logger.error(f"非同期ブリッジの待機エラー: {e}")
+                item = None
+            if item is None:
+                # 配信元が停止中（close済み）の場合に空回りしないように少し待つ
+                time.sleep(0.05)
+                continue
+            last_seq = self._seq_of(item)
+
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription._offer, item)
+                except RuntimeError:
+                    # イベントループが終了している
+                    self._unsubscribe(subscription)
+
+# 配信元（FrameHub / DetectionStream）ごとのブリッジ
+_bridges: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_bridges_lock = threading.Lock()
+
+def get_async_bridge(source, seq_of: Callable[[Any], int]) -> AsyncHubBridge:
+    """配信元のwait_nextを中継するブリッジを取得（配信元ごとに1つ）"""
+    with _bridges_lock:
+        bridge = _bridges.get(source)
+        if bridge is None:
+            bridge = AsyncHubBridge(source.wait_next, seq_of)
+            _bridges[source] = bridge
+        return bridge
+
+def frame_bridge(hub) -> AsyncHubBridge:
+    """FrameHubのブリッジ（要素は(通し番号, フレーム, 取得時刻)）"""
+    return get_async_bridge(hub, lambda item: item[0])
+
+def detection_bridge(stream) -> AsyncHubBridge:
+    """DetectionStreamのブリッジ（要素は判定結果の辞書）"""
+    return get_async_bridge(stream, lambda message: message['seq'])
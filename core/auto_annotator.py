@@ -0,0 +1,376 @@
+"""
+自動アノテーション（事前ラベル付け）モジュール
+学習済みモデル（core.run_catalog.production_model、mAP@0.5が最も高い実験の重み）で
+ファイルマネージャーのフォルダ（datasets/<フォルダ>）の未アノテーション画像をバッチ推論し、
+検出結果をYOLOラベルとして書き込む。書き込んだ画像はメタデータ（data/metadata.json）に
+候補（proposal）として記録し、アノテーションエディタで修正・保存すると候補の印が外れる。
+
+ジョブは処理キュー（app.processing_queue、app_utils.worker）で実行し、進捗はタスク状態API（/task/<ジョブID>）で返す。
+対象画像の一覧と処理済みの位置は data/auto_annotation/<ジョブID>.json にバッチごとに保存するため、
+中断（キャンセル・再起動）したジョブは続きから再開できる。人がアノテーションしたラベルは上書きしない。
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from config import (AUTO_ANNOTATION_DIR, AUTO_ANNOTATION_BATCH_SIZE, AUTO_ANNOTATION_CONF, YOLO_IMG_SIZE,
+                    update_metadata)
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('completed', 'cancelled', 'failed')
+# 起動時に自動で再開する状態
+RESUMABLE_STATUSES = ('queued', 'running')
+
+def to_yolo_lines(detections: List[dict], width: int, height: int) -> List[str]:
+    """検出結果（画素のxyxy）をYOLOラベルの行（正規化したcx, cy, w, h）に変換"""
+    lines = []
+    for det in detections:
+        x1, y1, x2, y2 = det['bbox']
+        x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+        y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+        if x2 <= x1 or y2 <= y1:
+            continue
+        lines.append(f"{det['class_id']} {(x1 + x2) / 2 / width:.6f} {(y1 + y2) / 2 / height:.6f} "
+                     f"{(x2 - x1) / width:.6f} {(y2 - y1) / height:.6f}")
+    return lines
+
+class AutoAnnotator:
+    """自動アノテーションのジョブ管理"""
+
+    def __init__(self, state_dir: str = AUTO_ANNOTATION_DIR, batch_size: int = AUTO_ANNOTATION_BATCH_SIZE,
+                 conf_threshold: float = AUTO_ANNOTATION_CONF, img_size: int = YOLO_IMG_SIZE):
+        """
+        初期化
+        Args:
+            state_dir: ジョブの状態を保存するディレクトリ
+            batch_size: 1回の推論で処理する画像数の既定値
+            conf_threshold: 候補として書き込む信頼度の下限の既定値
+            img_size: 推論時の画像サイズ（JPEGはこのサイズ以上に縮小しながらデコードする）
+        """
+        self.state_dir = state_dir
+        self.batch_size = batch_size
+        self.conf_threshold = conf_threshold
+        self.img_size = img_size
+        self._lock = threading.Lock()
+        self._cancel_flags: Dict[str, threading.Event] = {}
+        self._detector = None
+        self._detector_path = None
+        os.makedirs(state_dir, exist_ok=True)
+
+    def create_job(self, folder_path: str, conf_threshold: Optional[float] = None,
+                   batch_size: Optional[int] = None) -> dict:
+        """
+        ジョブを作成（対象はフォルダ内のラベルのない画像、実行は別途run）
+        Args:
+            folder_path: ファイルマネージャーのフォルダパス（datasets以下）
+        Raises:
+            ValueError: 学習済みモデルがない、または対象の画像がない場合
+        """
+        from core.dataset_index import get_dataset_index, dataset_folder
+        from core.run_catalog import get_run_catalog
+
+        model = get_run_catalog().production_model()
+        if model is None:
+            raise ValueError('学習済みモデルがありません。先に学習を実行してください')
+
+        folder = dataset_folder(folder_path)
+        names = [row['name'] for row in
+                 get_dataset_index().query_images(folder, annotated=False, sort='name', descending=False)['images']]
+        if not names:
+            raise ValueError('未アノテーションの画像がありません')
+
+        job = {
+            'id': datetime.now().strftime('%Y%m%d_%H%M%S_') + uuid.uuid4().hex[:6],
+            'folder': folder_path,
+            'model_path': model['path'],
+            'model_version': model['version'],
+            'conf_threshold': self.conf_threshold if conf_threshold is None else conf_threshold,
+            'batch_size': batch_size or self.batch_size,
+            'status': 'queued',
+            'names': names,
+            'done': 0,
+            'labeled': 0,
+            'boxes': 0,
+            'empty': 0,
+            'skipped': 0,
+            'errors': [],
+            'created': time.time(),
+            'updated': time.time()
+        }
+        self._checkpoint(job)
+        logger.info(f"自動アノテーションジョブ作成: {job['id']} {folder_path} {len(names)}枚 ({model['version']})")
+        return self.public(job)
+
+    def run(self, job_id: str, progress: Optional[Callable[[dict], None]] = None,
+            should_stop: Optional[Callable[[], bool]] = None) -> dict:
+        """
+        ジョブを実行（チェックポイントの続きから、処理キューのワーカーで呼ぶ）
+        Args:
+            job_id: ジョブID
+            progress: バッチごとに呼ぶコールバック（公開用のジョブ情報を渡す）
+            should_stop: 中断するかどうか（タスクのキャンセルなど、バッチの区切りで確認する）
+        """
+        from core.dataset_index import get_dataset_index, dataset_folder
+
+        job = self._load(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job['status'] not in RESUMABLE_STATUSES:
+            # 完了済み、または待機中にキャンセルされたジョブ（再開する場合はreopenで戻す）
+            return self.public(job)
+
+        cancel = self._cancel_flag(job_id)
+        index = get_dataset_index()
+        folder = dataset_folder(job['folder'])
+        detector = self._get_detector(job['model_path'], job['conf_threshold'])
+
+        job['status'] = 'running'
+        self._checkpoint(job)
+        names = job['names']
+        batch_size = job['batch_size']
+        batches = [names[i:i + batch_size] for i in range(job['done'], len(names), batch_size)]
+
+        # 次のバッチの読み込みを推論と並行して行う
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='auto-annotate') as loader:
+            pending = loader.submit(self._load_batch, index, folder, batches[0]) if batches else None
+            for number, batch in enumerate(batches):
+                loaded = pending.result()
+                pending = loader.submit(self._load_batch, index, folder, batches[number + 1]) \
+                    if number + 1 < len(batches) else None
+
+                self._annotate_batch(job, index, folder, detector, loaded)
+                job['done'] += len(batch)
+                job['updated'] = time.time()
+                self._checkpoint(job)
+                if progress:
+                    progress(self.public(job))
+
+                if cancel.is_set() or (should_stop and should_stop()):
+                    job['status'] = 'cancelled'
+                    self._checkpoint(job)
+                    logger.info(f"自動アノテーションジョブを中断しました: {job_id} {job['done']}/{len(names)}枚")
+                    return self.public(job)
+
+        job['status'] = 'completed'
+        self._checkpoint(job)
+        logger.info(f"自動アノテーション完了: {job_id} 候補{job['labeled']}枚 ボックス{job['boxes']}個 "
+                    f"検出なし{job['empty']}枚 スキップ{job['skipped']}枚")
+        return self.public(job)
+
+    def mark_failed(self, job_id: str, error: str):
+        """ジョブを失敗として記録（再開は可能）"""
+        job = self._load(job_id)
+        if job is not None:
+            job['status'] = 'failed'
+            job['errors'].append(error)
+            self._checkpoint(job)
+
+    def cancel(self, job_id: str) -> bool:
+        """実行中・待機中のジョブを中断（実行中の場合は現在のバッチの後で止まる）"""
+        job = self._load(job_id)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            return False
+        self._cancel_flag(job_id).set()
+        if job['status'] == 'queued':
+            job['status'] = 'cancelled'
+            self._checkpoint(job)
+        return True
+
+    def reopen(self, job_id: str) -> Optional[dict]:
+        """中断・失敗したジョブを再開待ちに戻す（処理キューに入れ直す前に呼ぶ）"""
+        job = self._load(job_id)
+        if job is None or job['status'] not in ('cancelled', 'failed'):
+            return None
+        self._cancel_flag(job_id, reset=True)
+        job['status'] = 'queued'
+        self._checkpoint(job)
+        return self.public(job)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        job = self._load(job_id)
+        return self.public(job) if job else None
+
+    def list_jobs(self) -> List[dict]:
+        """ジョブの一覧（新しい順）"""
+        jobs = [self.public(job) for job in self._load_all()]
+        return sorted(jobs, key=lambda job: job['created'], reverse=True)
+
+    def resumable_jobs(self) -> List[dict]:
+        """前回の起動中に終わらなかったジョブ（起動時に処理キューへ入れ直す）"""
+        return [self.public(job) for job in self._load_all() if job['status'] in RESUMABLE_STATUSES]
+
+    @staticmethod
+    def public(job: dict) -> dict:
+        total = len(job['names'])
+        return {
+            'id': job['id'],
+            'folder': job['folder'],
+            'model_version': job['model_version'],
+            'conf_threshold': job['conf_threshold'],
+            'batch_size': job['batch_size'],
+            'status': job['status'],
+            'total': total,
+            'done': job['done'],
+            'labeled': job['labeled'],
+            'boxes': job['boxes'],
+            'empty': job['empty'],
+            'skipped': job['skipped'],
+            'errors': job['errors'][-20:],
+            'progress': int(100 * job['done'] / total) if total else 100,
+            'created': job['created'],
+            'updated': job['updated']
+        }
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _get_detector(self, model_path: str, conf_threshold: float):
+        """検出器（同じモデルならジョブ間で使い回す）"""
+        from core.YoloDetector import YoloDetector
+
+        with self._lock:
+            if self._detector is None or self._detector_path != model_path:
+                self._detector = YoloDetector(model_path=model_path, conf_threshold=conf_threshold)
+                self._detector_path = model_path
+                if self._detector.model is None:
+                    self._detector = None
+                    raise RuntimeError(f'モデルを読み込めません: {model_path}')
+            else:
+                self._detector.update_confidence(conf_threshold)
+            return self._detector
+
+    def _load_batch(self, index, folder: str, names: List[str]) -> List[tuple]:
+        """バッチの画像を読み込む（すでにラベルがある画像は読まない）"""
+        from app_utils.jpeg_codec import read_image
+
+        loaded = []
+        for name in names:
+            if os.path.exists(index.label_path(folder, name)):
+                loaded.append((name, None, 'labeled'))
+                continue
+            image = read_image(index.image_path(folder, name), max_size=self.img_size)
+            loaded.append((name, image, None if image is not None else '画像を読み込めません'))
+        return loaded
+
+    def _annotate_batch(self, job: dict, index, folder: str, detector, loaded: List[tuple]):
+        """1バッチを推論してラベルを書き込む"""
+        frames = [(name, image) for name, image, error in loaded if image is not None]
+        for name, _, error in loaded:
+            if error == 'labeled':
+                # 作成後に人がアノテーションした画像
+                job['skipped'] += 1
+            elif error:
+                job['errors'].append(f'{name}: {error}')
+
+        results = detector.detect_frames([image for _, image in frames]) if frames else []
+        proposals = {}
+        for (name, image), result in zip(frames, results):
+            height, width = image.shape[:2]
+            lines = to_yolo_lines(result['detections'], width, height)
+            if not lines:
+                job['empty'] += 1
+                continue
+            confidences = [det['confidence'] for det in result['detections']]
+            proposals[name] = (lines, {
+                'proposal': True,
+                'proposal_model': job['model_version'],
+                'proposal_job': job['id'],
+                'proposal_folder': job['folder'],
+                'proposal_count': len(lines),
+                'proposal_min_confidence': round(min(confidences), 4),
+                'proposal_time': datetime.now().isoformat()
+            })
+        if not proposals:
+            return
+
+        # 候補の印を先に付ける（ラベルの書き込み後に落ちても、印のない機械のラベルが人のものに見えないように）
+        def flag(metadata):
+            for name, (_, info) in proposals.items():
+                metadata.setdefault(name, {}).update(info)
+        update_metadata(flag)
+
+        written = []
+        skipped = []
+        for name, (lines, _) in proposals.items():
+            label_path = index.label_path(folder, name)
+            if os.path.exists(label_path):
+                skipped.append(name)
+                continue
+            os.makedirs(os.path.dirname(label_path), exist_ok=True)
+            tmp_path = label_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, label_path)
+            written.append(name)
+            job['labeled'] += 1
+            job['boxes'] += len(lines)
+
+        if skipped:
+            # 推論中に人がアノテーションした画像は付けた印を外す
+            def unflag(metadata):
+                for name in skipped:
+                    entry = metadata.setdefault(name, {})
+                    for key in proposals[name][1]:
+                        entry.pop(key, None)
+            update_metadata(unflag)
+            job['skipped'] += len(skipped)
+        if written:
+            index.update_labels(folder, written)
+
+    def _cancel_flag(self, job_id: str, reset: bool = False) -> threading.Event:
+        with self._lock:
+            flag = self._cancel_flags.setdefault(job_id, threading.Event())
+            if reset:
+                flag.clear()
+            return flag
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, os.path.basename(job_id) + '.json')
+
+    def _checkpoint(self, job: dict):
+        """ジョブの状態を保存（書き込み途中で壊れないように置き換え）"""
+        path = self._path(job['id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"自動アノテーションジョブを読み込めません {job_id}: {e}")
+            return None
+
+    def _load_all(self) -> List[dict]:
+        jobs = []
+        for name in sorted(os.listdir(self.state_dir)):
+            if name.endswith('.json'):
+                job = self._load(name[:-5])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+# シングルトンインスタンス
+_annotator_instance: Optional[AutoAnnotator] = None
+_annotator_lock = threading.Lock()
+
+def get_auto_annotator() -> AutoAnnotator:
+    """自動アノテーションのジョブ管理を取得（シングルトン）"""
+    global _annotator_instance
+    with _annotator_lock:
+        if _annotator_instance is None:
+            _annotator_instance = AutoAnnotator()
+        return _annotator_instance
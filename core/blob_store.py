@@ -0,0 +1,355 @@
+"""
+コンテンツアドレス型の画像ストア
+画像の実体をSHA-256ごとに1つだけ data/blobs に保存し、各フォルダ（datasets・uploads・training_data）の
+ファイルはその実体へのハードリンク（参照）として置く。同じ画像を何度アップロードしても実体は増えず、
+フォルダ間のコピーはハードリンクの作成だけで済む。どのフォルダからも参照されなくなった実体
+（リンク数が1）はガベージコレクションで削除する。
+
+ハードリンクを作れない場合（別ファイルシステムなど）は従来どおりコピーする。
+
+既存ファイルの取り込み・GCはコマンドラインからも実行できる:
+    python -m core.blob_store dedupe   # 既存の画像を取り込んで重複を解消
+    python -m core.blob_store gc       # 参照されていない実体を削除
+    python -m core.blob_store stats
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+from config import BLOB_STORE_DIR, BLOB_GC_GRACE, TRAINING_DATA_DIR, UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+# ストアで管理する画像の拡張子
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# 既存ファイルの取り込み対象（dedupe）
+DEFAULT_MANAGED_DIRS = (TRAINING_DATA_DIR, UPLOAD_DIR)
+
+CHUNK_SIZE = 1024 * 1024
+
+def file_digest(path: str) -> str:
+    """ファイルのSHA-256（16進）"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class BlobStore:
+    """SHA-256をキーとする画像の実体ストア"""
+
+    def __init__(self, root: str = BLOB_STORE_DIR, gc_grace: float = BLOB_GC_GRACE):
+        """
+        初期化
+        Args:
+            root: 実体を保存するディレクトリ
+            gc_grace: リンクの変更からこの秒数が経つまではGCの対象にしない
+        """
+        self.root = root
+        self.gc_grace = gc_grace
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        # (st_dev, st_ino) -> digest（参照ファイルから実体を引くための索引、初回アクセス時に構築）
+        self._inodes: Optional[Dict[Tuple[int, int], str]] = None
+
+    # ------------------------------------------------------------
+    # 実体
+    # ------------------------------------------------------------
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def put_stream(self, stream: BinaryIO) -> str:
+        """ストリームの内容を保存してダイジェストを返す（既にあれば破棄）"""
+        sha = hashlib.sha256()
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    f.write(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                if not self.has(digest):
+                    self._adopt(tmp_path, digest)
+            return digest
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_file(self, path: str) -> str:
+        """
+        既存ファイルを取り込む（ファイル自体を実体へのハードリンクに置き換える）
+        Returns:
+            ダイジェスト
+        """
+        digest = self.digest_of(path)
+        if digest is not None:
+            return digest
+
+        digest = file_digest(path)
+        with self._lock:
+            if self.has(digest):
+                # 同じ内容の実体があるので、このファイルを実体への参照に置き換える
+                self._replace_with_link(digest, path)
+            else:
+                # このファイル自体を実体として登録（コピーしない）
+                tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+                try:
+                    os.link(path, tmp_path)
+                    self._adopt(tmp_path, digest)
+                except OSError:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    shutil.copy2(path, tmp_path)
+                    self._adopt(tmp_path, digest)
+                    self._replace_with_link(digest, path)
+        return digest
+
+    def digest_of(self, path: str) -> Optional[str]:
+        """ファイルが参照している実体のダイジェスト（ストアに無ければNone）"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_nlink < 2:
+            return None
+        with self._lock:
+            return self._inode_index().get((st.st_dev, st.st_ino))
+
+    # ------------------------------------------------------------
+    # 参照
+    # ------------------------------------------------------------
+
+    def link(self, digest: str, dest: str) -> str:
+        """
+        実体への参照をdestに作成（既存のdestは置き換える）
+        Returns:
+            'hardlink' または 'copy'
+        """
+        with self._lock:
+            return self._replace_with_link(digest, dest)
+
+    def copy(self, src: str, dest: str) -> str:
+        """ファイルを参照としてコピー（取り込み済みならハードリンクの作成のみ）"""
+        return self.link(self.put_file(src), dest)
+
+    def store_upload(self, file_storage, target_dir: str, filename: str, unique: bool = True) -> dict:
+        """
+        アップロードされたファイルを保存
+        Args:
+            file_storage: werkzeugのFileStorage
+            target_dir: 保存先フォルダ
+            filename: 保存するファイル名（secure_filename済み）
+            unique: Trueの場合、別内容の同名ファイルがあればサフィックスを付ける（Falseなら置き換える）
+        Returns:
+            {'filename', 'path', 'digest', 'duplicate'}（duplicateは同じ画像がフォルダに既にあった場合True）
+        """
+        os.makedirs(target_dir, exist_ok=True)
+        digest = self.put_stream(file_storage.stream)
+
+        with self._lock:
+            existing = self._find_in_dir(digest, target_dir)
+            if existing is not None and (unique or existing == filename):
+                # 同じ画像が既にフォルダにある（同名でなくても再利用する）
+                return {'filename': existing, 'path': os.path.join(target_dir, existing),
+                        'digest': digest, 'duplicate': True}
+
+            target_path = os.path.join(target_dir, filename)
+            if unique and os.path.exists(target_path):
+                name, ext = os.path.splitext(filename)
+                filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
+                target_path = os.path.join(target_dir, filename)
+
+            self._replace_with_link(digest, target_path)
+        return {'filename': filename, 'path': target_path, 'digest': digest, 'duplicate': False}
+
+    # ------------------------------------------------------------
+    # 保守
+    # ------------------------------------------------------------
+
+    def dedupe(self, directories: Iterable[str] = DEFAULT_MANAGED_DIRS) -> dict:
+        """既存の画像を取り込み、同じ内容のファイルを1つの実体にまとめる"""
+        stats = {'files': 0, 'already_linked': 0, 'ingested': 0, 'errors': 0, 'bytes_saved': 0}
+        for directory in directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for name in filenames:
+                    if not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    stats['files'] += 1
+                    try:
+                        if self.digest_of(path) is not None:
+                            stats['already_linked'] += 1
+                            continue
+                        size = os.path.getsize(path)
+                        digest = self.put_file(path)
+                        stats['ingested'] += 1
+                        if os.stat(self.blob_path(digest)).st_nlink > 2:
+                            # 既存の実体への参照になった（ファイル1つ分の容量が減る）
+                            stats['bytes_saved'] += size
+                    except OSError as e:
+                        stats['errors'] += 1
+                        logger.error(f"画像の取り込みエラー {path}: {e}")
+        logger.info(f"画像ストア取り込み: {stats}")
+        return stats
+
+    def gc(self) -> dict:
+        """どこからも参照されていない実体（リンク数1）を削除"""
+        import time
+
+        stats = {'blobs': 0, 'removed': 0, 'bytes_freed': 0}
+        now = time.time()
+        with self._lock:
+            for digest, path in self._iter_blobs():
+                stats['blobs'] += 1
+                try:
+                    st = os.stat(path)
+                    # ctimeはリンクの追加・削除で更新される（直前に作られた実体を消さない）
+                    if st.st_nlink > 1 or now - st.st_ctime < self.gc_grace:
+                        continue
+                    os.remove(path)
+                    stats['removed'] += 1
+                    stats['bytes_freed'] += st.st_size
+                    if self._inodes is not None:
+                        self._inodes.pop((st.st_dev, st.st_ino), None)
+                except OSError as e:
+                    logger.error(f"画像ストアGCエラー {path}: {e}")
+
+            # 中断されたアップロードの一時ファイル
+            for name in os.listdir(self.tmp_dir):
+                path = os.path.join(self.tmp_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.gc_grace:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+        if stats['removed']:
+            logger.info(f"画像ストアGC: {stats['removed']}個の実体を削除（{stats['bytes_freed']}バイト）")
+        return stats
+
+    def stats(self) -> dict:
+        """実体の数・容量・参照数"""
+        stats = {'blobs': 0, 'bytes': 0, 'references': 0, 'unreferenced': 0}
+        for digest, path in self._iter_blobs():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats['blobs'] += 1
+            stats['bytes'] += st.st_size
+            stats['references'] += st.st_nlink - 1
+            if st.st_nlink < 2:
+                stats['unreferenced'] += 1
+        return stats
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _iter_blobs(self):
+        with os.scandir(self.root) as prefixes:
+            for prefix in prefixes:
+                if len(prefix.name) != 2 or not prefix.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(prefix.path) as blobs:
+                    for blob in blobs:
+                        yield prefix.name + blob.name, blob.path
+
+    def _inode_index(self) -> Dict[Tuple[int, int], str]:
+        if self._inodes is None:
+            inodes = {}
+            for digest, path in self._iter_blobs():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                inodes[(st.st_dev, st.st_ino)] = digest
+            self._inodes = inodes
+        return self._inodes
+
+    def _adopt(self, tmp_path: str, digest: str):
+        """一時ファイルを実体として登録"""
+        blob_path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+        st = os.stat(blob_path)
+        self._inode_index()[(st.st_dev, st.st_ino)] = digest
+
+    def _replace_with_link(self, digest: str, dest: str) -> str:
+        """destを実体へのハードリンクに置き換える（不可ならコピー）"""
+        blob_path = self.blob_path(digest)
+        if os.path.exists(dest) and os.path.samefile(blob_path, dest):
+            return 'hardlink'
+
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            try:
+                os.link(blob_path, tmp)
+                method = 'hardlink'
+            except OSError:
+                shutil.copy2(blob_path, tmp)
+                method = 'copy'
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return method
+
+    def _find_in_dir(self, digest: str, directory: str) -> Optional[str]:
+        """フォルダ内で同じ実体を参照しているファイル名"""
+        st = os.stat(self.blob_path(digest))
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.inode() == st.st_ino and entry.stat().st_dev == st.st_dev:
+                        return entry.name
+                except OSError:
+                    continue
+        return None
+
+# シングルトンインスタンス
+_store_instance: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+def get_blob_store() -> BlobStore:
+    """画像ストアを取得（シングルトン）"""
+    global _store_instance
+    with _store_lock:
+        if _store_instance is None:
+            _store_instance = BlobStore()
+        return _store_instance
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='コンテンツアドレス型画像ストアの保守')
+    parser.add_argument('command', choices=['dedupe', 'gc', 'stats'])
+    parser.add_argument('directories', nargs='*', help='dedupeの対象ディレクトリ（省略時はtraining_dataとuploads）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = get_blob_store()
+    if args.command == 'dedupe':
+        result = store.dedupe(args.directories or DEFAULT_MANAGED_DIRS)
+    elif args.command == 'gc':
+        result = store.gc()
+    else:
+        result = store.stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+カメラ検出モジュール
+使用中のカメラに触れずに、接続可能なカメラをバックグラウンドで列挙・キャッシュする
+"""
+
+import cv2
+import glob
+import os
+import re
+import sys
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import CAMERA_DISCOVERY_TTL, CAMERA_DISCOVERY_MAX_INDEX
+from core.camera_manager import get_candidate_backends, get_active_cameras
+
+logger = logging.getLogger(__name__)
+
+class CameraDiscovery:
+    """カメラ一覧のバックグラウンド検出クラス"""
+
+    def __init__(self, ttl: float = CAMERA_DISCOVERY_TTL, max_index: int = CAMERA_DISCOVERY_MAX_INDEX):
+        """
+        初期化
+        Args:
+            ttl: キャッシュの有効期間（秒）
+            max_index: /dev/videoが使えない環境で試すインデックスの上限
+        """
+        self.ttl = ttl
+        self.max_index = max_index
+        self._inventory: Dict[int, dict] = {}
+        self._updated_at = 0.0  # time.monotonic()基準
+        self._updated_wall: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def get_inventory(self, refresh: bool = False) -> dict:
+        """
+        キャッシュされたカメラ一覧を取得（ブロックしない）
+
+        キャッシュが期限切れ、またはrefresh=Trueの場合はバックグラウンドで再検出を開始する。
+        使用中のカメラは再検出せず、稼働中のCameraManagerの情報で上書きする。
+        """
+        if refresh or self.is_stale():
+            self.refresh_async()
+
+        with self._lock:
+            cameras = dict(self._inventory)
+            updated_at = self._updated_at
+            updated_wall = self._updated_wall
+
+        for index, manager in get_active_cameras().items():
+            cameras[index] = self._describe_active(index, manager)
+
+        return {
+            'cameras': [cameras[i] for i in sorted(cameras)],
+            'updated_at': updated_wall.isoformat() if updated_wall else None,
+            'age_seconds': time.monotonic() - updated_at if updated_at else None,
+            'refreshing': self.is_refreshing()
+        }
+
+    def is_stale(self) -> bool:
+        """キャッシュが期限切れかどうか"""
+        return not self._updated_at or time.monotonic() - self._updated_at > self.ttl
+
+    def is_refreshing(self) -> bool:
+        """再検出中かどうか"""
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+
+    def refresh_async(self):
+        """バックグラウンドで再検出を開始（実行中の場合は何もしない）"""
+        with self._lock:
+            if self.is_refreshing():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def refresh(self):
+        """カメラを再検出してキャッシュを更新（使用中のデバイスは開かない）"""
+        active = get_active_cameras()
+        inventory = {}
+
+        for index in self._candidate_indices():
+            if index in active:
+                continue
+            info = self._probe(index)
+            if info:
+                inventory[index] = info
+
+        with self._lock:
+            self._inventory = inventory
+            self._updated_at = time.monotonic()
+            self._updated_wall = datetime.now()
+
+        logger.info(f"カメラ検出完了: {len(inventory)}台（使用中 {len(active)}台を除く）")
+
+    def _candidate_indices(self) -> List[int]:
+        """検出対象のカメラインデックス"""
+        if sys.platform.startswith('linux'):
+            indices = []
+            for path in glob.glob('/dev/video*'):
+                match = re.match(r'/dev/video(\d+)$', path)
+                if not match:
+                    continue
+                index = int(match.group(1))
+                # メタデータ用ノード（index != 0）は映像を取得できないため除外
+                node_index = self._read_sysfs(index, 'index')
+                if node_index is not None and node_index != '0':
+                    continue
+                indices.append(index)
+            if indices:
+                return sorted(indices)
+        return list(range(self.max_index))
+
+    def _read_sysfs(self, index: int, name: str) -> Optional[str]:
+        """/sys/class/video4linux から属性を読む"""
+        path = os.path.join('/sys/class/video4linux', f'video{index}', name)
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _display_name(self, index: int) -> str:
+        """カメラの表示名"""
+        device_name = self._read_sysfs(index, 'name') if sys.platform.startswith('linux') else None
+        if device_name:
+            return f'カメラ {index} ({device_name})'
+
+        # Windows環境では逆になることが多い
+        # カメラ0がUSB、カメラ1が内蔵の場合がある
+        if index == 0:
+            return 'カメラ 0 (外部/USB)'
+        elif index == 1:
+            return 'カメラ 1 (内蔵)'
+        return f'カメラ {index}'
+
+    def _probe(self, index: int) -> Optional[dict]:
+        """カメラを一時的に開いて情報を取得"""
+        cap = cv2.VideoCapture(index, get_candidate_backends(index)[0])
+        try:
+            if not cap.isOpened():
+                return None
+
+            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+
+            # テストフレームを取得して確認
+            ret, _ = cap.read()
+            if not ret:
+                return None
+
+            logger.info(f"カメラ {index} 検出: {width}x{height} @ {fps}fps")
+            return {
+                'index': index,
+                'name': self._display_name(index),
+                'width': int(width),
+                'height': int(height),
+                'fps': int(fps) if fps > 0 else 30,
+                'available': True,
+                'in_use': False
+            }
+        except Exception as e:
+            logger.debug(f"カメラ {index} の検出エラー: {e}")
+            return None
+        finally:
+            cap.release()
+
+    def _describe_active(self, index: int, manager) -> dict:
+        """使用中のカメラの情報（デバイスを開き直さずに取得）"""
+        info = manager.get_camera_info()
+        return {
+            'index': index,
+            'name': self._display_name(index),
+            'width': info.get('width', manager.config.width),
+            'height': info.get('height', manager.config.height),
+            'fps': int(info['fps']) if info.get('fps') else manager.config.fps,
+            'available': True,
+            'in_use': True
+        }
+
+# シングルトンインスタンス
+_discovery_instance: Optional[CameraDiscovery] = None
+
+def get_camera_discovery() -> CameraDiscovery:
+    """カメラ検出インスタンスを取得（シングルトン）"""
+    global _discovery_instance
+    if _discovery_instance is None:
+        _discovery_instance = CameraDiscovery()
+    return _discovery_instance
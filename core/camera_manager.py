@@ -5,14 +5,43 @@ USBマイクロスコープとの接続・制御を管理
 
 import cv2
 import numpy as np
+import sys
 import threading
 import time
 import logging
-from typing import Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
+from app_utils.jpeg_codec import encode_jpeg, write_image
+from config import CAMERA_SOURCE, CAMERA_IDLE_GRACE, CAMERA_IDLE_FPS
+from core.frame_hub import FrameHub
+from core.pipeline_stats import get_pipeline_stats
 
 logger = logging.getLogger(__name__)
 
+# デバイスごとに接続に成功したバックエンドをキャッシュ（再初期化時の無駄な試行を省く）
+_backend_cache: Dict[int, int] = {}
+_backend_cache_lock = threading.Lock()
+
+def get_candidate_backends(camera_index: int) -> List[int]:
+    """プラットフォームに応じたバックエンド候補を優先順で返す"""
+    if sys.platform.startswith('linux'):
+        backends = [cv2.CAP_V4L2, cv2.CAP_ANY]
+    elif sys.platform == 'win32':
+        backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF, cv2.CAP_ANY]
+    elif sys.platform == 'darwin':
+        backends = [cv2.CAP_AVFOUNDATION, cv2.CAP_ANY]
+    else:
+        backends = [cv2.CAP_ANY]
+
+    # 前回成功したバックエンドを先頭に
+    with _backend_cache_lock:
+        cached = _backend_cache.get(camera_index)
+    if cached is not None:
+        backends = [cached] + [b for b in backends if b != cached]
+    return backends
+
 @dataclass
 class CameraConfig:
     """カメラ設定"""
@@ -21,6 +50,15 @@ class CameraConfig:
     height: int = 480
     fps: int = 30
     buffer_size: int = 1  # バッファサイズを小さくしてレイテンシを減らす
+    source: Optional[str] = CAMERA_SOURCE  # 代替フレームソース（core.frame_sources参照）
+
+def default_camera_config(camera_index: int) -> CameraConfig:
+    """カメラごとの既定設定（0: PC内蔵カメラ、それ以外: マイクロスコープ）"""
+    config = CameraConfig(camera_index=camera_index)
+    if camera_index != 0:
+        config.width = 1280
+        config.height = 720
+    return config
 
 class CameraManager:
     """カメラ管理クラス"""
@@ -30,10 +68,30 @@ class CameraManager:
         self.camera = None
         self.is_running = False
         self.current_frame = None
+        self.frame_timestamp = 0.0  # time.monotonic()基準の取得時刻
+        self.frame_seq = 0
         self.frame_lock = threading.Lock()
+        self.frame_hub = FrameHub()
         self.capture_thread = None
         self.current_camera_index = self.config.camera_index
         self.initialization_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+        # キャプチャ統計
+        self.frames_captured = 0
+        self.dropped_frames = 0
+        self.read_failures = 0
+        self.last_read_latency = 0.0
+        self.avg_read_latency = 0.0
+        self.max_read_latency = 0.0
+        self._frame_times = deque(maxlen=120)
+
+        # 視聴者数（映像・判定結果の配信先）。0人の間は低頻度キャプチャに落とす
+        self.viewer_count = 0
+        self.idle = False
+        self._viewer_lock = threading.Lock()
+        self._last_viewer_at = time.monotonic()
+        self._wake = threading.Event()
 
     def initialize(self) -> bool:
         """カメラを初期化"""
@@ -45,8 +103,11 @@ class CameraManager:
                     self.camera = None
                     time.sleep(0.5)
 
-                # DirectShowバックエンドを優先的に試す
-                backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF, cv2.CAP_ANY]
+                if self.config.source:
+                    return self._initialize_frame_source()
+
+                # プラットフォームに応じたバックエンドを試す（Linux: V4L2、Windows: DirectShow優先）
+                backends = get_candidate_backends(self.current_camera_index)
 
                 for backend in backends:
                     logger.info(f"バックエンド {backend} でカメラ接続を試行中...")
@@ -56,8 +117,14 @@ class CameraManager:
 
                     if self.camera.isOpened():
                         logger.info(f"バックエンド {backend} で接続成功")
+                        with _backend_cache_lock:
+                            _backend_cache[self.current_camera_index] = backend
                         break
+                    self.camera.release()
                 else:
+                    with _backend_cache_lock:
+                        _backend_cache.pop(self.current_camera_index, None)
+                    self.camera = None
                     logger.error(f"カメラ {self.current_camera_index} を開けませんでした")
                     return False
 
@@ -80,7 +147,11 @@ class CameraManager:
                 for i in range(max_retries):
                     ret, frame = self.camera.read()
                     if ret and frame is not None:
-                        self.current_frame = frame
+                        with self.frame_lock:
+                            self.current_frame = frame
+                            self.frame_timestamp = time.monotonic()
+                            self.frame_seq += 1
+                        self.frame_hub.publish(frame, self.frame_timestamp)
                         logger.info(f"テストフレーム取得成功 (試行 {i+1}/{max_retries})")
                         return True
 
@@ -98,12 +169,45 @@ class CameraManager:
                     self.camera = None
                 return False
 
+    def _initialize_frame_source(self) -> bool:
+        """実カメラの代わりに代替フレームソースを開く"""
+        from core.frame_sources import create_frame_source
+
+        self.camera = create_frame_source(self.config.source, self.config.width,
+                                          self.config.height, self.config.fps)
+        ret, frame = self.camera.read()
+        if not ret or frame is None:
+            logger.error(f"フレームソースからフレームを取得できません: {self.config.source}")
+            return False
+
+        with self.frame_lock:
+            self.current_frame = frame
+            self.frame_timestamp = time.monotonic()
+            self.frame_seq += 1
+        self.frame_hub.publish(frame, self.frame_timestamp)
+        logger.info(f"フレームソース初期化成功: {self.config.source} "
+                    f"({self.camera.width}x{self.camera.height} @ {self.camera.fps}fps)")
+        return True
+
+    def ensure_running(self) -> bool:
+        """キャプチャが停止していれば初期化して開始（同時に呼ばれても初期化は1回だけ行う）"""
+        with self._start_lock:
+            if self.is_running:
+                return True
+            if not self.initialize():
+                return False
+            self.start_capture()
+            return True
+
     def start_capture(self):
         """キャプチャスレッドを開始"""
         if self.is_running:
             return
 
         self.is_running = True
+        self.idle = False
+        self._last_viewer_at = time.monotonic()
+        self._frame_times.clear()
         self.capture_thread = threading.Thread(target=self._capture_loop)
         self.capture_thread.daemon = True
         self.capture_thread.start()
@@ -112,26 +216,148 @@ class CameraManager:
     def stop_capture(self):
         """キャプチャスレッドを停止"""
         self.is_running = False
+        self._wake.set()
         if self.capture_thread:
             self.capture_thread.join(timeout=2.0)
+        self.frame_hub.close()
         logger.info("キャプチャスレッド停止")
 
     def _capture_loop(self):
-        """キャプチャループ（別スレッドで実行）"""
+        """キャプチャループ（別スレッドで実行）
+
+        grab()はデバイスから次のフレームが届くまでブロックするため、固定の待機は行わない。
+        """
+        consecutive_failures = 0
+
         while self.is_running:
-            if self.camera and self.camera.isOpened():
-                ret, frame = self.camera.read()
-                if ret:
-                    with self.frame_lock:
-                        self.current_frame = frame
-                else:
-                    logger.warning("フレーム取得失敗")
-            else:
+            if not (self.camera and self.camera.isOpened()):
                 logger.error("カメラが開いていません")
                 break
 
-            # CPU負荷を下げるため少し待機
-            time.sleep(0.01)
+            if not self._wait_for_viewers():
+                break
+
+            read_start = time.monotonic()
+            ret = self.camera.grab()
+            frame = None
+            if ret:
+                ret, frame = self.camera.retrieve()
+            now = time.monotonic()
+
+            if ret and frame is not None:
+                with self.frame_lock:
+                    self.current_frame = frame
+                    self.frame_timestamp = now
+                    self.frame_seq += 1
+                self.frame_hub.publish(frame, now)
+                self._record_frame(now, now - read_start)
+                consecutive_failures = 0
+            else:
+                self.read_failures += 1
+                consecutive_failures += 1
+                # 連続失敗時のログは間引く
+                if consecutive_failures == 1 or consecutive_failures % 100 == 0:
+                    logger.warning(f"フレーム取得失敗（連続{consecutive_failures}回）")
+                # デバイスが応答しない間だけ待機してビジーループを防ぐ
+                time.sleep(min(0.5, 0.01 * consecutive_failures))
+
+    @contextmanager
+    def viewer(self):
+        """配信中の視聴者として登録（with文を抜けると解除）"""
+        self.add_viewer()
+        try:
+            yield self
+        finally:
+            self.remove_viewer()
+
+    def add_viewer(self):
+        """視聴者を追加（低頻度キャプチャ中なら即座に通常レートへ戻す）"""
+        with self._viewer_lock:
+            self.viewer_count += 1
+        self._wake.set()
+
+    def remove_viewer(self):
+        """視聴者を削除"""
+        with self._viewer_lock:
+            self.viewer_count = max(0, self.viewer_count - 1)
+            if self.viewer_count == 0:
+                self._last_viewer_at = time.monotonic()
+
+    def _wait_for_viewers(self) -> bool:
+        """
+        視聴者がいない状態が猶予時間を超えたら、キープアライブ間隔で待機する
+        （デバイスは開いたままなので、視聴者が戻れば再初期化なしで通常レートに復帰する）
+        Returns:
+            キャプチャを続けるかどうか
+        """
+        self._wake.clear()
+        idle_due = (self.viewer_count == 0 and
+                    time.monotonic() - self._last_viewer_at > CAMERA_IDLE_GRACE)
+
+        if idle_due:
+            if not self.idle:
+                self.idle = True
+                logger.info(f"視聴者がいないため低頻度キャプチャに切り替え ({CAMERA_IDLE_FPS}fps)")
+            self._wake.wait(1.0 / CAMERA_IDLE_FPS if CAMERA_IDLE_FPS > 0 else None)
+            return self.is_running
+
+        if self.idle:
+            self.idle = False
+            # 待機中にドライバのバッファに溜まった古いフレームを捨てる
+            for _ in range(self.config.buffer_size):
+                self.camera.grab()
+            self._frame_times.clear()
+            logger.info("視聴者が接続したため通常レートのキャプチャに復帰")
+        return True
+
+    def _record_frame(self, timestamp: float, read_latency: float):
+        """キャプチャ統計を更新"""
+        if self.idle:
+            # 低頻度キャプチャ中は取りこぼし・FPSの計算対象にしない
+            self._frame_times.clear()
+        elif self._frame_times and self.config.fps > 0:
+            # 想定フレーム間隔の1.5倍以上空いた場合は取りこぼしとみなす
+            interval = timestamp - self._frame_times[-1]
+            expected = 1.0 / self.config.fps
+            if interval > expected * 1.5:
+                self.dropped_frames += int(round(interval / expected)) - 1
+
+        self._frame_times.append(timestamp)
+        self.frames_captured += 1
+        get_pipeline_stats().record('capture', read_latency)
+        self.last_read_latency = read_latency
+        self.max_read_latency = max(self.max_read_latency, read_latency)
+        # 指数移動平均
+        if self.avg_read_latency == 0.0:
+            self.avg_read_latency = read_latency
+        else:
+            self.avg_read_latency = self.avg_read_latency * 0.9 + read_latency * 0.1
+
+    def get_capture_stats(self) -> dict:
+        """キャプチャ統計を取得"""
+        times = list(self._frame_times)
+        capture_fps = 0.0
+        if len(times) >= 2 and times[-1] > times[0]:
+            capture_fps = (len(times) - 1) / (times[-1] - times[0])
+
+        with self.frame_lock:
+            frame_timestamp = self.frame_timestamp
+        frame_age = time.monotonic() - frame_timestamp if frame_timestamp else None
+
+        return {
+            'capture_fps': capture_fps,
+            'frames_captured': self.frames_captured,
+            'dropped_frames': self.dropped_frames,
+            'read_failures': self.read_failures,
+            'viewers': self.viewer_count,
+            'idle': self.idle,
+            'read_latency_ms': {
+                'last': self.last_read_latency * 1000,
+                'avg': self.avg_read_latency * 1000,
+                'max': self.max_read_latency * 1000
+            },
+            'frame_age_ms': frame_age * 1000 if frame_age is not None else None
+        }
 
     def get_frame(self) -> Optional[np.ndarray]:
         """現在のフレームを取得"""
@@ -140,66 +366,28 @@ class CameraManager:
                 return self.current_frame.copy()
         return None
 
+    def get_frame_with_timestamp(self) -> Tuple[Optional[np.ndarray], float]:
+        """現在のフレームと取得時刻（time.monotonic()基準）を取得"""
+        with self.frame_lock:
+            if self.current_frame is not None:
+                return self.current_frame.copy(), self.frame_timestamp
+        return None, 0.0
+
     def get_frame_jpeg(self) -> Optional[bytes]:
         """現在のフレームをJPEG形式で取得"""
         frame = self.get_frame()
         if frame is not None:
-            ret, jpeg = cv2.imencode('.jpg', frame)
-            if ret:
-                return jpeg.tobytes()
+            return encode_jpeg(frame)
         return None
 
     def capture_snapshot(self, filename: str) -> bool:
         """スナップショットを保存"""
         frame = self.get_frame()
-        if frame is not None:
-            cv2.imwrite(filename, frame)
+        if frame is not None and write_image(filename, frame):
             logger.info(f"スナップショット保存: {filename}")
             return True
         return False
 
-    def switch_camera(self, camera_index: int) -> bool:
-        """カメラを切り替え"""
-        logger.info(f"カメラを {self.current_camera_index} から {camera_index} に切り替え")
-
-        # 現在のカメラを停止
-        was_running = self.is_running
-        if was_running:
-            self.stop_capture()
-
-        # カメラを完全に解放
-        if self.camera:
-            self.camera.release()
-            self.camera = None
-            # 少し待機してリソースを完全に解放
-            time.sleep(0.5)
-
-        # 新しいカメラインデックスを設定
-        self.current_camera_index = camera_index
-
-        # カメラごとの設定を適用
-        if camera_index == 0:
-            # PC内蔵カメラの設定
-            self.config.width = 640
-            self.config.height = 480
-        else:
-            # マイクロスコープの設定
-            self.config.width = 1280
-            self.config.height = 720
-
-        # 新しいカメラで初期化
-        if self.initialize():
-            if was_running:
-                self.start_capture()
-            logger.info(f"カメラ {camera_index} への切り替え成功")
-            return True
-        else:
-            logger.error(f"カメラ {camera_index} への切り替え失敗")
-            # 元のカメラに戻す試み
-            self.current_camera_index = 1 - camera_index  # 0->1, 1->0
-            self.initialize()
-            return False
-
     def get_camera_info(self) -> dict:
         """カメラ情報を取得"""
         if self.camera and self.camera.isOpened():
@@ -209,7 +397,8 @@ class CameraManager:
                 'height': int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
                 'fps': self.camera.get(cv2.CAP_PROP_FPS),
                 'backend': self.camera.getBackendName(),
-                'is_running': self.is_running
+                'is_running': self.is_running,
+                'capture': self.get_capture_stats()
             }
         return {'error': 'Camera not initialized'}
 
@@ -225,23 +414,63 @@ class CameraManager:
         """デストラクタ"""
         self.release()
 
-# シングルトンインスタンス
-_camera_instance: Optional[CameraManager] = None
-
-def get_camera_instance() -> CameraManager:
-    """カメラインスタンスを取得（シングルトン）"""
-    global _camera_instance
-    if _camera_instance is None:
-        _camera_instance = CameraManager()
-    return _camera_instance
-
-def reset_camera_instance():
-    """カメラインスタンスをリセット"""
-    global _camera_instance
-    if _camera_instance:
-        _camera_instance.release()
-        _camera_instance = None
+# カメラインデックスごとのインスタンス（複数カメラを同時に稼働させる）
+_camera_instances: Dict[int, CameraManager] = {}
+_active_camera_index = 0
+_instances_lock = threading.Lock()
+
+def get_camera_instance(camera_index: Optional[int] = None) -> CameraManager:
+    """
+    カメラインスタンスを取得
+    Args:
+        camera_index: カメラインデックス（省略時は表示中のカメラ）
+    """
+    if camera_index is None:
+        camera_index = _active_camera_index
+    with _instances_lock:
+        camera = _camera_instances.get(camera_index)
+        if camera is None:
+            camera = CameraManager(default_camera_config(camera_index))
+            _camera_instances[camera_index] = camera
+        return camera
+
+def get_active_camera_index() -> int:
+    """表示中のカメラインデックスを取得"""
+    return _active_camera_index
+
+def set_active_camera(camera_index: int) -> CameraManager:
+    """表示するカメラを切り替え（他のカメラは停止せずそのまま稼働させる）"""
+    global _active_camera_index
+    _active_camera_index = camera_index
+    return get_camera_instance(camera_index)
+
+def get_active_cameras() -> Dict[int, CameraManager]:
+    """デバイスを開いている（使用中の）カメラをインデックスごとに取得"""
+    with _instances_lock:
+        cameras = dict(_camera_instances)
+    return {
+        index: camera for index, camera in cameras.items()
+        if camera.camera is not None and camera.camera.isOpened()
+    }
+
+def reset_camera_instance(camera_index: Optional[int] = None):
+    """
+    カメラインスタンスをリセット
+    Args:
+        camera_index: リセットするカメラ（省略時はすべて）
+    """
+    with _instances_lock:
+        if camera_index is None:
+            cameras = list(_camera_instances.values())
+            _camera_instances.clear()
+        else:
+            camera = _camera_instances.pop(camera_index, None)
+            cameras = [camera] if camera else []
+
+    for camera in cameras:
+        camera.release()
+    if cameras:
         # ガベージコレクションを強制実行
         import gc
         gc.collect()
-    logger.info("カメラインスタンスをリセットしました")
\ No newline at end of file
+    logger.info("カメラインスタンスをリセットしました")
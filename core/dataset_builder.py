@@ -0,0 +1,328 @@
+"""
+YOLOデータセット構築モジュール
+前回構築時のマニフェストと比較して変更分だけを反映する。画像はハードリンク（不可ならシンボリックリンク・コピー）、
+ラベルは出力先で書き換えられても元のファイルに影響しないようにコピーする（数バイトのためコストは小さい）。
+訓練/検証の分割はマニフェストに保存して再構築後も維持し（groupを指定した画像はグループごとに同じ側にそろえる）、YOLOv5のラベルキャッシュ（labels/*.cache）は削除しない。
+img_sizeを指定した場合は、学習サイズに縮小した画像（core.resize_cache）を元画像の代わりにリンクする。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import YOLO_DATASET_DIR, TRAIN_VAL_SPLIT_RATIO, DATASET_SPLIT_SEED, DATASET_LINK_MODE
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+SPLITS = ('train', 'val')
+
+@dataclass
+class DatasetItem:
+    """データセットに含める画像1枚"""
+    key: str                      # 分割を固定するための一意なキー（例: フォルダ/ファイル名）
+    image_path: str
+    label_path: Optional[str] = None
+    name: Optional[str] = None    # 出力ファイル名（省略時は画像のファイル名）
+    split: Optional[str] = None   # 分割の指定（スナップショットからの再構築用、省略時はシード付きハッシュ）
+    group: Optional[str] = None   # 同じ側に分割するグループ（近似重複など、省略時は画像ごと）
+
+def _signature(path: Optional[str]) -> Optional[list]:
+    """ファイルの変更検出用シグネチャ（サイズ・更新時刻）"""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _same_inode(a: str, b: str) -> bool:
+    """2つのパスが同じ実体（ハードリンク）かどうか"""
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+class YoloDatasetBuilder:
+    """マニフェスト差分によるYOLOデータセットの増分構築"""
+
+    def __init__(self, dataset_dir: str = YOLO_DATASET_DIR, train_ratio: float = TRAIN_VAL_SPLIT_RATIO,
+                 seed: int = DATASET_SPLIT_SEED, link_mode: str = DATASET_LINK_MODE,
+                 img_size: Optional[int] = None):
+        """
+        初期化
+        Args:
+            dataset_dir: YOLOデータセットの出力先
+            train_ratio: 訓練データの比率（新しく追加された画像の分割に使用）
+            seed: 分割のシード
+            link_mode: 画像の配置方法 'auto'（ハードリンク→シンボリックリンク→コピー）/ 'hardlink' / 'symlink' / 'copy'
+                       （ラベルは常にコピー）
+            img_size: 学習時の画像サイズ（指定した場合は縮小画像キャッシュを使用、Noneの場合は元画像）
+        """
+        self.dataset_dir = dataset_dir
+        self.train_ratio = train_ratio
+        self.seed = seed
+        self.link_mode = link_mode
+        self.img_size = img_size
+        self.manifest_path = os.path.join(dataset_dir, MANIFEST_FILE)
+        self._link_methods_used: Dict[str, int] = {}
+
+    def load_manifest(self) -> dict:
+        """前回構築時のマニフェストを読み込む"""
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    return manifest
+            except (OSError, ValueError) as e:
+                logger.warning(f"マニフェストを読み込めないため再構築します: {e}")
+        return {'version': MANIFEST_VERSION, 'seed': self.seed, 'entries': {}}
+
+    def build(self, items: List[DatasetItem]) -> dict:
+        """
+        データセットを構築（変更分のみ反映）
+        Args:
+            items: データセットに含める画像
+        Returns:
+            構築結果の統計
+        """
+        for split in SPLITS:
+            os.makedirs(os.path.join(self.dataset_dir, 'images', split), exist_ok=True)
+            os.makedirs(os.path.join(self.dataset_dir, 'labels', split), exist_ok=True)
+
+        manifest = self.load_manifest()
+        old_entries: Dict[str, dict] = manifest.get('entries', {})
+        # シードが変わった場合は分割をやり直す
+        keep_splits = manifest.get('seed') == self.seed
+
+        targets = self._assign_names(items)
+        splits = self._assign_splits(targets, old_entries if keep_splits else {})
+        resized = self._prepare_resized(targets)
+
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        new_entries: Dict[str, dict] = {}
+        self._link_methods_used = {}
+
+        for name, item in targets.items():
+            split = splits[name]
+            entry = {
+                'key': item.key,
+                'split': split,
+                'image_src': os.path.abspath(item.image_path),
+                'label_src': os.path.abspath(item.label_path) if item.label_path else None,
+                'image_sig': _signature(item.image_path),
+                'label_sig': _signature(item.label_path),
+                'resized_src': resized.get(name)
+            }
+            old = old_entries.get(name)
+
+            if old and self._is_current(old, entry, name):
+                stats['unchanged'] += 1
+            else:
+                if old:
+                    self._remove_entry_files(name, old)
+                    stats['updated'] += 1
+                else:
+                    stats['added'] += 1
+                self._materialize(name, entry)
+            new_entries[name] = entry
+
+        # 対象外になった画像を削除
+        for name, old in old_entries.items():
+            if name not in new_entries:
+                self._remove_entry_files(name, old)
+                stats['removed'] += 1
+
+        # マニフェスト導入前のコピーなど、管理外のファイルを削除（.cacheは残す）
+        stats['untracked_removed'] = self._remove_untracked(new_entries)
+
+        self._save_manifest({'version': MANIFEST_VERSION, 'seed': self.seed,
+                             'train_ratio': self.train_ratio, 'entries': new_entries})
+        self._record_resized_references(new_entries)
+
+        train_count = sum(1 for e in new_entries.values() if e['split'] == 'train')
+        val_count = len(new_entries) - train_count
+        label_count = sum(1 for e in new_entries.values() if e['label_src'])
+
+        logger.info(f"データセット構築完了: 追加{stats['added']} 更新{stats['updated']} "
+                    f"削除{stats['removed']} 変更なし{stats['unchanged']} "
+                    f"(訓練{train_count} / 検証{val_count})")
+
+        return dict(stats,
+                    train_count=train_count,
+                    val_count=val_count,
+                    total_count=len(new_entries),
+                    label_count=label_count,
+                    link_methods=self._link_methods_used)
+
+    def _assign_names(self, items: List[DatasetItem]) -> Dict[str, DatasetItem]:
+        """出力ファイル名を決定（同名ファイルが複数ある場合はキーから一意な名前を作る）"""
+        basenames: Dict[str, int] = {}
+        for item in items:
+            name = item.name or os.path.basename(item.image_path)
+            basenames[name] = basenames.get(name, 0) + 1
+
+        targets: Dict[str, DatasetItem] = {}
+        for item in items:
+            name = item.name or os.path.basename(item.image_path)
+            if basenames[name] > 1:
+                name = item.key.replace('/', '_').replace('\\', '_')
+            targets[name] = item
+        return targets
+
+    def _prepare_resized(self, targets: Dict[str, DatasetItem]) -> Dict[str, Optional[str]]:
+        """出力名 -> 縮小画像のパス（縮小しない場合は空）"""
+        if not self.img_size:
+            return {}
+        from core.resize_cache import get_resize_cache
+
+        mapping = get_resize_cache().prepare([item.image_path for item in targets.values()], self.img_size)
+        return {name: mapping.get(item.image_path) for name, item in targets.items()}
+
+    def _record_resized_references(self, entries: Dict[str, dict]):
+        """使用中の縮小画像を縮小画像キャッシュに記録（シンボリックリンク・コピーでもpruneで消されないように）"""
+        from core.resize_cache import get_resize_cache
+
+        get_resize_cache().set_references(
+            self.dataset_dir, [entry['resized_src'] for entry in entries.values() if entry.get('resized_src')])
+
+    def _split_score(self, key: str) -> float:
+        """シード付きハッシュによる0〜1のスコア（同じキー・シードなら常に同じ値）"""
+        digest = hashlib.sha1(f"{self.seed}:{key}".encode('utf-8')).hexdigest()
+        return int(digest[:12], 16) / float(16 ** 12)
+
+    def _assign_splits(self, targets: Dict[str, DatasetItem], old_entries: Dict[str, dict]) -> Dict[str, str]:
+        """分割を決定（前回の分割を維持し、新しい画像のみシード付きハッシュで振り分ける）"""
+        splits = {}
+        for name, item in targets.items():
+            old = old_entries.get(name)
+            if item.split in SPLITS:
+                splits[name] = item.split
+            elif old and old.get('key') == item.key and old.get('split') in SPLITS:
+                splits[name] = old['split']
+            else:
+                splits[name] = 'train' if self._split_score(item.group or item.key) < self.train_ratio else 'val'
+
+        # グループ内で分割が分かれた場合（前回の分割の後に近似重複が見つかったなど）は多数派にそろえる
+        groups: Dict[str, List[str]] = {}
+        for name, item in targets.items():
+            if item.group and item.split not in SPLITS:
+                groups.setdefault(item.group, []).append(name)
+        for group, names in groups.items():
+            train = sum(1 for name in names if splits[name] == 'train')
+            if train * 2 == len(names):
+                split = 'train' if self._split_score(group) < self.train_ratio else 'val'
+            else:
+                split = 'train' if train * 2 > len(names) else 'val'
+            for name in names:
+                splits[name] = split
+
+        # 検証データが空にならないようにする（2枚以上ある場合、分割が指定されている場合はそのまま）
+        forced = any(item.split in SPLITS for item in targets.values())
+        if not forced and len(splits) >= 2 and 'val' not in splits.values():
+            name = max(splits, key=lambda n: self._split_score(targets[n].key))
+            # 同じグループの画像もまとめて移す（訓練データが空になる場合は1枚だけ）
+            moved = groups.get(targets[name].group, [name])
+            splits.update((n, 'val') for n in (moved if len(moved) < len(splits) else [name]))
+        return splits
+
+    def _dest_paths(self, name: str, split: str):
+        stem = os.path.splitext(name)[0]
+        return (os.path.join(self.dataset_dir, 'images', split, name),
+                os.path.join(self.dataset_dir, 'labels', split, stem + '.txt'))
+
+    def _is_current(self, old: dict, entry: dict, name: str) -> bool:
+        """前回の出力がそのまま使えるかどうか"""
+        for field in ('split', 'image_src', 'label_src', 'image_sig', 'label_sig', 'resized_src'):
+            if old.get(field) != entry[field]:
+                return False
+        image_dst, label_dst = self._dest_paths(name, entry['split'])
+        if not os.path.lexists(image_dst):
+            return False
+        if entry['label_src']:
+            if not os.path.lexists(label_dst):
+                return False
+            # 以前の構築でリンクしたラベルはコピーに置き換える
+            if os.path.islink(label_dst) or _same_inode(entry['label_src'], label_dst):
+                return False
+        return True
+
+    def _materialize(self, name: str, entry: dict):
+        """画像を出力先にリンクし、ラベルをコピー"""
+        image_dst, label_dst = self._dest_paths(name, entry['split'])
+        self._link(entry.get('resized_src') or entry['image_src'], image_dst)
+        if entry['label_src']:
+            self._link(entry['label_src'], label_dst, modes=['copy'])
+        elif os.path.lexists(label_dst):
+            os.remove(label_dst)
+
+    def _link(self, src: str, dst: str, modes: Optional[List[str]] = None):
+        """ハードリンク→シンボリックリンク→コピーの順で作成（一時ファイル経由で置き換える）"""
+        tmp = dst + '.tmp'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+        if modes is None:
+            modes = ['hardlink', 'symlink', 'copy'] if self.link_mode == 'auto' else [self.link_mode]
+        last_error = None
+        for mode in modes:
+            try:
+                if mode == 'hardlink':
+                    os.link(src, tmp)
+                elif mode == 'symlink':
+                    os.symlink(src, tmp)
+                else:
+                    shutil.copy2(src, tmp)
+                os.replace(tmp, dst)
+                self._link_methods_used[mode] = self._link_methods_used.get(mode, 0) + 1
+                return
+            except OSError as e:
+                last_error = e
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+        raise last_error
+
+    def _remove_entry_files(self, name: str, entry: dict):
+        """前回出力したファイルを削除"""
+        split = entry.get('split')
+        if split not in SPLITS:
+            return
+        for path in self._dest_paths(name, split):
+            if os.path.lexists(path):
+                os.remove(path)
+
+    def _remove_untracked(self, entries: Dict[str, dict]) -> int:
+        """マニフェストにないファイルを削除"""
+        expected = set()
+        for name, entry in entries.items():
+            image_dst, label_dst = self._dest_paths(name, entry['split'])
+            expected.add(os.path.normpath(image_dst))
+            if entry['label_src']:
+                expected.add(os.path.normpath(label_dst))
+
+        removed = 0
+        for data_type in ('images', 'labels'):
+            for split in SPLITS:
+                directory = os.path.join(self.dataset_dir, data_type, split)
+                with os.scandir(directory) as it:
+                    for dirent in it:
+                        if dirent.is_dir(follow_symlinks=False) or dirent.name.endswith('.cache'):
+                            continue
+                        if os.path.normpath(dirent.path) not in expected:
+                            os.remove(dirent.path)
+                            removed += 1
+        return removed
+
+    def _save_manifest(self, manifest: dict):
+        """マニフェストを保存（書き込み途中で壊れないように置き換え）"""
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
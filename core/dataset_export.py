@@ -0,0 +1,396 @@
+"""
+データセットエクスポートモジュール
+学習データのフォルダ（static/training_data/datasets 以下）をZIPまたはTARとして書き出す。
+アーカイブは一時ファイルを作らずにチャンク単位で生成するため、大きなデータセットでもすぐにダウンロードが始まり、
+メモリ使用量は画像1枚分程度で一定になる（COCOのアノテーションJSONのみボックス数に比例）。
+
+レイアウト:
+    yolo  <フォルダ>/images/<画像>, <フォルダ>/labels/<画像名>.txt, data.yaml
+    coco  images/<フォルダ>/<画像>, annotations/instances.json（YOLOラベルを一括で座標変換して生成）
+
+resizeを指定した場合は長辺をそのサイズに縮小して書き出す（core.resize_cacheと同じ縮小方法、
+YOLOラベルは正規化座標のため変わらず、COCOの座標は縮小後のサイズで計算する）。
+"""
+
+import os
+import json
+import time
+import tarfile
+import zipfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import YOLO_CLASS_NAMES
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+PAGE_SIZE = 500  # インデックスから一度に読む画像数
+RESIZE_WORKERS = 4  # 縮小に使うスレッド数（OpenCVはGILを解放する）
+
+FORMATS = {
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar')
+}
+LAYOUTS = ('yolo', 'coco')
+
+def _file_chunks(f) -> Iterator[bytes]:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        yield chunk
+
+def _prefetch(func, items: Iterable, workers: int) -> Iterator:
+    """funcをスレッドで先行実行し、入力の順に結果を返す（先行するのはworkers*2件まで）"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export') as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_yolo_label(path: str) -> np.ndarray:
+    """YOLOラベルファイルを (ボックス数, 5) の配列（class, cx, cy, w, h）として読み込む"""
+    try:
+        with open(path, 'r') as f:
+            rows = [line.split()[:5] for line in f if len(line.split()) >= 5]
+    except OSError:
+        rows = []
+    if not rows:
+        return np.empty((0, 5), dtype=np.float64)
+    try:
+        return np.asarray(rows, dtype=np.float64)
+    except ValueError:
+        # 数値でない行を除く
+        valid = []
+        for row in rows:
+            try:
+                valid.append([float(value) for value in row])
+            except ValueError:
+                continue
+        return np.asarray(valid, dtype=np.float64).reshape(-1, 5)
+
+def yolo_to_coco(labels: np.ndarray, widths: np.ndarray, heights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    YOLOの正規化座標（中心x, 中心y, 幅, 高さ）をCOCOのピクセル座標（左上x, 左上y, 幅, 高さ）に一括変換
+    Args:
+        labels: (N, 5) のYOLOラベル
+        widths, heights: 各ボックスが属する画像のサイズ（N,）
+    Returns:
+        (bbox (N, 4), area (N,))
+    """
+    cx, cy, w, h = labels[:, 1], labels[:, 2], labels[:, 3], labels[:, 4]
+    x1 = np.clip((cx - w / 2) * widths, 0, widths)
+    y1 = np.clip((cy - h / 2) * heights, 0, heights)
+    x2 = np.clip((cx + w / 2) * widths, 0, widths)
+    y2 = np.clip((cy + h / 2) * heights, 0, heights)
+    bbox = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
+    return bbox, bbox[:, 2] * bbox[:, 3]
+
+class _ChunkBuffer:
+    """書き込まれたバイト列をためておき、drainで取り出す（zipfileの出力先）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ZipStreamWriter:
+    """シークできない出力に書くZIP（各エントリの後にデータ記述子を置く）"""
+
+    def __init__(self):
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, 'w', allowZip64=True)
+
+    def add(self, arcname: str, chunks: Iterable[bytes], size: Optional[int], mtime: float,
+            compress: bool = False) -> Iterator[bytes]:
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime(mtime)[:6])
+        # 画像は圧縮済みのため無圧縮で格納し、ラベル・JSONのみ圧縮する
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        with self._zip.open(info, 'w', force_zip64=size is None or size >= zipfile.ZIP64_LIMIT) as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+                data = self._buffer.drain()
+                if data:
+                    yield data
+        yield self._buffer.drain()
+
+    def close(self) -> Iterator[bytes]:
+        self._zip.close()
+        yield self._buffer.drain()
+
+class TarStreamWriter:
+    """ヘッダ・内容・パディングを順に出力するTAR（サイズが事前に分かるエントリのみ）"""
+
+    def __init__(self):
+        self._offset = 0
+
+    def add(self, arcname: str, chunks: Iterable[bytes], size: Optional[int], mtime: float,
+            compress: bool = False) -> Iterator[bytes]:
+        if size is None:
+            # サイズが分からない内容（生成するJSON）はまとめてから書く
+            data = b''.join(chunks)
+            chunks, size = [data], len(data)
+        info = tarfile.TarInfo(arcname)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        self._offset += len(header)
+        yield header
+
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            if written > size:
+                raise IOError(f'書き出し中にファイルが変更されました: {arcname}')
+            yield chunk
+        if written != size:
+            raise IOError(f'書き出し中にファイルが変更されました: {arcname}')
+        padding = -size % tarfile.BLOCKSIZE
+        self._offset += size + padding
+        yield b'\0' * padding
+
+    def close(self) -> Iterator[bytes]:
+        # 終端の2ブロックを書き、レコードサイズの倍数に揃える
+        end = self._offset + 2 * tarfile.BLOCKSIZE
+        yield b'\0' * (2 * tarfile.BLOCKSIZE + (-end % tarfile.RECORDSIZE))
+
+class DatasetExporter:
+    """学習データのフォルダをアーカイブとしてストリーミング"""
+
+    def __init__(self, folders: List[str], layout: str = 'yolo', archive_format: str = 'zip',
+                 resize: Optional[int] = None, class_names: Optional[List[str]] = None):
+        """
+        初期化
+        Args:
+            folders: ファイルマネージャーのフォルダパス（datasets以下、例: default）
+            layout: 'yolo' / 'coco'
+            archive_format: 'zip' / 'tar'
+            resize: 長辺のサイズ（Noneの場合は元画像のまま）
+            class_names: クラス名（省略時はYOLO_CLASS_NAMES）
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f'不明なレイアウトです: {layout}')
+        if archive_format not in FORMATS:
+            raise ValueError(f'不明な形式です: {archive_format}')
+        self.folders = folders
+        self.layout = layout
+        self.archive_format = archive_format
+        self.resize = resize
+        self.class_names = list(class_names or YOLO_CLASS_NAMES)
+        self.stats = {'images': 0, 'labels': 0, 'boxes': 0, 'resized': 0, 'skipped': 0, 'bytes': 0}
+
+    @property
+    def mimetype(self) -> str:
+        return FORMATS[self.archive_format][0]
+
+    @property
+    def filename(self) -> str:
+        suffix = f'_{self.resize}px' if self.resize else ''
+        return f"dataset_{self.layout}{suffix}_{time.strftime('%Y%m%d_%H%M%S')}{FORMATS[self.archive_format][1]}"
+
+    def stream(self) -> Iterator[bytes]:
+        """アーカイブのバイト列をチャンクごとに返す"""
+        start = time.time()
+        writer = ZipStreamWriter() if self.archive_format == 'zip' else TarStreamWriter()
+        coco_images = []
+        coco_labels = []  # (画像のインデックス, ラベル配列)
+
+        if self.layout == 'yolo':
+            data = self._data_yaml().encode('utf-8')
+            yield from self._emit(writer.add('data.yaml', [data], len(data), time.time(), compress=True))
+
+        for folder, row, image in _prefetch(self._load_image, self._iter_images(), RESIZE_WORKERS):
+            if image is None:
+                self.stats['skipped'] += 1
+                continue
+            data, size, mtime, width, height, resized = image
+            self.stats['images'] += 1
+            self.stats['resized'] += resized
+            name = row['name']
+            label_path = row['label_path']
+
+            if self.layout == 'yolo':
+                yield from self._emit(writer.add(f'{folder}/images/{name}', data, size, mtime))
+                if os.path.exists(label_path):
+                    with open(label_path, 'rb') as f:
+                        label = f.read()
+                    self.stats['labels'] += 1
+                    self.stats['boxes'] += row.get('box_count') or 0
+                    yield from self._emit(writer.add(f'{folder}/labels/{os.path.splitext(name)[0]}.txt', [label],
+                                                     len(label), os.path.getmtime(label_path), compress=True))
+            else:
+                yield from self._emit(writer.add(f'images/{folder}/{name}', data, size, mtime))
+                coco_images.append({'id': len(coco_images) + 1, 'file_name': f'{folder}/{name}',
+                                    'width': width, 'height': height})
+                labels = read_yolo_label(label_path)
+                if len(labels):
+                    self.stats['labels'] += 1
+                    coco_labels.append((len(coco_images) - 1, labels))
+
+        if self.layout == 'coco':
+            yield from self._emit(writer.add('annotations/instances.json',
+                                             self._coco_json(coco_images, coco_labels), None, time.time(),
+                                             compress=True))
+        yield from self._emit(writer.close())
+        logger.info(f"データセットエクスポート完了: {self.stats} {time.time() - start:.1f}秒")
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _emit(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            if chunk:
+                self.stats['bytes'] += len(chunk)
+                yield chunk
+
+    def _iter_images(self) -> Iterator[Tuple[str, dict]]:
+        """各フォルダの画像をインデックスからページ単位で読む（名前の昇順）"""
+        from core.dataset_index import get_dataset_index, dataset_folder
+
+        index = get_dataset_index()
+        for folder in self.folders:
+            cursor = None
+            while True:
+                page = index.query_images(dataset_folder(folder), sort='name', descending=False,
+                                          limit=PAGE_SIZE, cursor=cursor)
+                for row in page['images']:
+                    row['image_path'] = index.image_path(dataset_folder(folder), row['name'])
+                    row['label_path'] = index.label_path(dataset_folder(folder), row['name'])
+                    yield folder, row
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+
+    def _load_image(self, task: Tuple[str, dict]):
+        """
+        画像の内容（縮小する場合はエンコード済みのバイト列、しない場合はファイルを読むチャンク）
+        Returns:
+            (フォルダ, 行, (チャンク, サイズ, 更新時刻, 幅, 高さ, 縮小したか))、読めない場合は画像部分がNone
+        """
+        folder, row = task
+        path = row['image_path']
+        try:
+            if self.resize:
+                resized = self._resize(path)
+                if resized is not None:
+                    data, width, height = resized
+                    return folder, row, ([data], len(data), os.path.getmtime(path), width, height, True)
+            st = os.stat(path)
+        except OSError as e:
+            logger.warning(f"エクスポートできない画像を除外します {path}: {e}")
+            return folder, row, None
+
+        # インデックスの古い行はEXIFの向きを反映していないことがあるため、ヘッダから読み直す（縮小時と同じ向き）
+        from core.dataset_index import read_image_size
+        width, height = read_image_size(path)
+        if not width or not height:
+            width, height = row.get('width'), row.get('height')
+        return folder, row, (self._read_file(path), st.st_size, st.st_mtime, width, height, False)
+
+    @staticmethod
+    def _read_file(path: str) -> Iterator[bytes]:
+        with open(path, 'rb') as f:
+            yield from _file_chunks(f)
+
+    def _resize(self, path: str):
+        """長辺をresizeに縮小してエンコード（縮小の必要がない場合はNone）"""
+        import cv2
+        from core.resize_cache import resize_image
+        from app_utils.jpeg_codec import encode_jpeg
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        image = resize_image(data, self.resize)
+        if image is None:
+            return None
+        if path.lower().endswith(('.jpg', '.jpeg')):
+            encoded = encode_jpeg(image)
+        else:
+            ok, buffer = cv2.imencode(os.path.splitext(path)[1], image)
+            if not ok:
+                return None
+            encoded = buffer.tobytes()
+        height, width = image.shape[:2]
+        return encoded, width, height
+
+    def _data_yaml(self) -> str:
+        import yaml
+
+        image_dirs = [f'{folder}/images' for folder in self.folders]
+        return yaml.dump({'path': '.', 'train': image_dirs, 'val': image_dirs,
+                          'nc': len(self.class_names), 'names': self.class_names},
+                         default_flow_style=False, allow_unicode=True)
+
+    def _coco_json(self, images: List[dict], labels: List[Tuple[int, np.ndarray]]) -> Iterator[bytes]:
+        """COCO形式のJSON（ボックスの座標変換は全画像分をまとめて行い、出力は少しずつ生成する）"""
+        categories = [{'id': class_id + 1, 'name': name, 'supercategory': 'none'}
+                      for class_id, name in enumerate(self.class_names)]
+        head = {
+            'info': {'description': 'sea urchin papilla dataset', 'date_created': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'licenses': [],
+            'categories': categories
+        }
+        yield (json.dumps(head, ensure_ascii=False)[:-1] + ', "images": [').encode('utf-8')
+        for start in range(0, len(images), 1000):
+            text = ', '.join(json.dumps(image, ensure_ascii=False) for image in images[start:start + 1000])
+            yield ((', ' if start else '') + text).encode('utf-8')
+        yield b'], "annotations": ['
+
+        if labels:
+            all_labels = np.concatenate([array for _, array in labels])
+            image_index = np.concatenate([np.full(len(array), index) for index, array in labels])
+            widths = np.array([image['width'] or 0 for image in images], dtype=np.float64)[image_index]
+            heights = np.array([image['height'] or 0 for image in images], dtype=np.float64)[image_index]
+            bbox, area = yolo_to_coco(all_labels, widths, heights)
+            class_ids = all_labels[:, 0].astype(int)
+            self.stats['boxes'] = len(all_labels)
+
+            for start in range(0, len(all_labels), 1000):
+                stop = min(start + 1000, len(all_labels))
+                text = ', '.join(
+                    f'{{"id": {i + 1}, "image_id": {int(image_index[i]) + 1}, "category_id": {class_ids[i] + 1}, '
+                    f'"bbox": [{bbox[i, 0]:.2f}, {bbox[i, 1]:.2f}, {bbox[i, 2]:.2f}, {bbox[i, 3]:.2f}], '
+                    f'"area": {area[i]:.2f}, "iscrowd": 0}}'
+                    for i in range(start, stop))
+                yield ((', ' if start else '') + text).encode('utf-8')
+        yield b']}'
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='学習データのフォルダをZIP/TARに書き出す')
+    parser.add_argument('folders', nargs='+', help='datasets以下のフォルダ')
+    parser.add_argument('-o', '--output', required=True, help='出力ファイル')
+    parser.add_argument('--layout', choices=LAYOUTS, default='yolo')
+    parser.add_argument('--resize', type=int, help='長辺のサイズ')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    archive_format = 'tar' if args.output.endswith('.tar') else 'zip'
+    exporter = DatasetExporter(args.folders, args.layout, archive_format, args.resize)
+    with open(args.output, 'wb') as f:
+        for chunk in exporter.stream():
+            f.write(chunk)
+    print(json.dumps(exporter.stats, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,793 @@
+"""
+データセットインデックスモジュール
+学習データ（static/training_data 以下の images/labels フォルダ）の画像・ラベル・クラス別ボックス数・
+画像サイズ・ハッシュ・知覚ハッシュ（近似重複の検出用、core.near_duplicates）・モデルごとの不確実性スコア
+（能動学習用、core.active_learning）・フォルダ所属をSQLiteに保持し、一覧・統計のたびにディレクトリを走査したり
+ラベルファイルを開いたりしなくて済むようにする。
+
+フォルダは TRAINING_DATA_DIR からの相対パスで表す:
+    ''                  → static/training_data/{images,labels}（従来の学習データ）
+    'datasets/default'  → static/training_data/datasets/default/{images,labels}（ファイルマネージャーのフォルダ）
+
+保存・移動・削除を行う処理はインデックスも更新する。アプリ外での変更はファイル監視（core.fs_watcher）の
+通知で、監視していない場合はディレクトリの更新時刻の変化で検出し、そのフォルダだけを差分で再同期する。
+"""
+
+import os
+import json
+import time
+import base64
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from config import TRAINING_DATA_DIR, DATASET_INDEX_DB, DATASET_INDEX_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+TRAINING_FOLDER = ''  # 従来の学習データ（static/training_data/images, labels）
+DATASETS_FOLDER = 'datasets'
+
+# フォルダ自身とその子フォルダに一致する条件（パラメータは_folder_paramsで作る）
+IN_FOLDER = '(folder = ? OR substr(folder, 1, length(?)) = ?)'
+
+# 一覧の並び順（query_imagesのsort -> 列）
+SORT_COLUMNS = {'name': 'name', 'mtime': 'mtime_ns', 'annotations': 'box_count'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    dir_mtime_ns INTEGER,
+    images_mtime_ns INTEGER,
+    labels_mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS images (
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    digest TEXT,
+    has_label INTEGER NOT NULL DEFAULT 0,
+    label_mtime_ns INTEGER,
+    box_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (folder, name)
+);
+CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+CREATE INDEX IF NOT EXISTS images_mtime ON images (folder, mtime_ns, name);
+CREATE INDEX IF NOT EXISTS images_box_count ON images (folder, box_count, name);
+CREATE TABLE IF NOT EXISTS class_counts (
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (folder, name, class_id)
+);
+CREATE TABLE IF NOT EXISTS image_hashes (
+    digest TEXT PRIMARY KEY,
+    dhash INTEGER NOT NULL,
+    phash INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uncertainty_scores (
+    digest TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    score REAL,
+    max_confidence REAL,
+    conflict INTEGER,
+    disagreement REAL,
+    box_count INTEGER,
+    scored_at REAL,
+    PRIMARY KEY (digest, model_version)
+);
+CREATE INDEX IF NOT EXISTS uncertainty_scores_rank ON uncertainty_scores (model_version, score);
+"""
+
+UINT64_MASK = (1 << 64) - 1
+
+def _to_signed64(value: int) -> int:
+    """64ビットの符号なし整数をSQLiteのINTEGER（符号付き）に収める"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def dataset_folder(folder_path: str) -> str:
+    """ファイルマネージャーのフォルダパス（datasets以下）をインデックスのフォルダ名に変換"""
+    folder_path = (folder_path or '').strip('/').replace('\\', '/')
+    return f"{DATASETS_FOLDER}/{folder_path}" if folder_path else DATASETS_FOLDER
+
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def parse_label_file(path: str) -> Dict[int, int]:
+    """YOLOラベルファイルのクラス別ボックス数"""
+    counts: Dict[int, int] = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            try:
+                class_id = int(float(parts[0]))
+            except ValueError:
+                continue
+            counts[class_id] = counts.get(class_id, 0) + 1
+    return counts
+
+# EXIFの向き（Orientation）のうち、縦横が入れ替わるもの
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def read_image_size(path: str):
+    """画像サイズ（ヘッダのみ読み込む。EXIFの向きを反映した表示上のサイズで、ラベルの座標もこのサイズに対応する）"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return width, height
+    except Exception:
+        return None, None
+
+class DatasetIndex:
+    """学習データのSQLiteインデックス"""
+
+    def __init__(self, db_path: str = DATASET_INDEX_DB, root: str = TRAINING_DATA_DIR,
+                 refresh_interval: float = DATASET_INDEX_REFRESH_INTERVAL):
+        """
+        初期化
+        Args:
+            db_path: SQLiteファイル
+            root: フォルダの基準ディレクトリ
+            refresh_interval: ディレクトリ更新時刻を確認する最小間隔（秒）
+        """
+        self.db_path = db_path
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._last_refresh = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._write_lock, self._transaction() as conn:
+            conn.executescript(SCHEMA)
+
+    # ------------------------------------------------------------
+    # 接続
+    # ------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _folder_dir(self, folder: str) -> str:
+        return os.path.join(self.root, *folder.split('/')) if folder else self.root
+
+    def image_path(self, folder: str, name: str) -> str:
+        return os.path.join(self._folder_dir(folder), 'images', name)
+
+    def label_path(self, folder: str, name: str) -> str:
+        return os.path.join(self._folder_dir(folder), 'labels', os.path.splitext(name)[0] + '.txt')
+
+    # ------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------
+
+    def update_image(self, folder: str, name: str):
+        """画像1枚（とラベル）を再インデックス。ファイルが無ければ削除する"""
+        with self._write_lock, self._transaction() as conn:
+            self._index_image(conn, folder, name)
+
+    def update_label(self, folder: str, name: str):
+        """ラベル保存後の更新（画像名またはラベルに対応する画像名）"""
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            name = self._image_name_for_label(folder, name) or name
+        self.update_image(folder, name)
+
+    def update_labels(self, folder: str, names: Iterable[str]):
+        """複数の画像のラベルを1回のトランザクションで読み直す（自動アノテーションなど）"""
+        with self._write_lock, self._transaction() as conn:
+            for name in names:
+                self._index_label(conn, folder, name)
+
+    def remove_image(self, folder: str, name: str):
+        self.remove_images(folder, [name])
+
+    def remove_images(self, folder: str, names: Iterable[str]):
+        """複数の画像を1回のトランザクションで削除（一括削除用）"""
+        with self._write_lock, self._transaction() as conn:
+            for name in names:
+                self._delete_image(conn, folder, name)
+
+    def move_image(self, src_folder: str, dst_folder: str, name: str):
+        """画像をフォルダ間で移動した後の更新（ファイル内容は変わらないため読み直さない）"""
+        self.move_images(src_folder, dst_folder, [name])
+
+    def move_images(self, src_folder: str, dst_folder: str, names: Iterable[str]):
+        """複数の画像の移動を1回のトランザクションで反映（一括移動用）"""
+        with self._write_lock, self._transaction() as conn:
+            for name in names:
+                conn.execute('DELETE FROM images WHERE folder = ? AND name = ?', (dst_folder, name))
+                conn.execute('DELETE FROM class_counts WHERE folder = ? AND name = ?', (dst_folder, name))
+                cursor = conn.execute('UPDATE images SET folder = ? WHERE folder = ? AND name = ?',
+                                      (dst_folder, src_folder, name))
+                conn.execute('UPDATE class_counts SET folder = ? WHERE folder = ? AND name = ?',
+                             (dst_folder, src_folder, name))
+                if cursor.rowcount == 0:
+                    self._index_image(conn, dst_folder, name)
+
+    def add_folder(self, folder: str):
+        with self._write_lock, self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO folders (folder) VALUES (?)', (folder,))
+            self._sync_folder(conn, folder)
+
+    def remove_folder(self, folder: str):
+        """フォルダとその子フォルダを削除"""
+        with self._write_lock, self._transaction() as conn:
+            for table in ('folders', 'images', 'class_counts'):
+                conn.execute(f'DELETE FROM {table} WHERE {IN_FOLDER}', self._folder_params(folder))
+
+    def rename_folder(self, old: str, new: str):
+        """フォルダ名の変更（子フォルダも含めて付け替える）"""
+        with self._write_lock, self._transaction() as conn:
+            for table in ('folders', 'images', 'class_counts'):
+                conn.execute(f'UPDATE {table} SET folder = ? || substr(folder, ?) WHERE {IN_FOLDER}',
+                             (new, len(old) + 1) + self._folder_params(old))
+
+    def sync(self, folders: Optional[Iterable[str]] = None) -> dict:
+        """
+        ディスクと突き合わせて差分を反映（変更のないファイルはstatのみ）
+        Args:
+            folders: 対象フォルダ（Noneの場合はすべてのフォルダを探索）
+        """
+        start = time.time()
+        stats = {'folders': 0, 'indexed': 0, 'removed': 0}
+        with self._write_lock, self._transaction() as conn:
+            if folders is None:
+                folders = self._discover(conn, '')
+            for folder in folders:
+                result = self._sync_folder(conn, folder)
+                stats['folders'] += 1
+                stats['indexed'] += result['indexed']
+                stats['removed'] += result['removed']
+        self._last_refresh = time.monotonic()
+        stats['seconds'] = round(time.time() - start, 3)
+        if stats['indexed'] or stats['removed']:
+            logger.info(f"データセットインデックス同期: {stats}")
+        return stats
+
+    def refresh(self, force: bool = False):
+        """ディレクトリの更新時刻が変わったフォルダだけを再同期（読み込み前に呼ぶ）"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+        if not force and self._rows_exist() and self._is_watched():
+            # ファイル監視が変更を通知するため確認は不要
+            return
+        with self._write_lock:
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            with self._transaction() as conn:
+                rows = conn.execute('SELECT * FROM folders').fetchall()
+                if not rows:
+                    # 初回はすべて取り込む
+                    for folder in self._discover(conn, ''):
+                        self._sync_folder(conn, folder)
+                for row in rows:
+                    self._refresh_folder(conn, row)
+            self._last_refresh = time.monotonic()
+
+    def handle_changes(self, directories: Iterable[str]):
+        """
+        ファイル監視からの通知を反映（変更のあったフォルダだけを差分で再同期）
+        Args:
+            directories: 変更のあったディレクトリ（絶対パス）
+        """
+        root = os.path.abspath(self.root)
+        folders = set()
+        for directory in directories:
+            rel = os.path.relpath(directory, root)
+            if rel.startswith('..'):
+                continue
+            parts = [] if rel == '.' else rel.split(os.sep)
+            if parts and parts[-1] in ('images', 'labels'):
+                parts = parts[:-1]
+            # 学習データ直下（''）とdatasets以下のみが対象
+            if parts and parts[0] != DATASETS_FOLDER:
+                continue
+            folders.add('/'.join(parts))
+
+        if not folders:
+            return
+        with self._write_lock, self._transaction() as conn:
+            known = {row['folder'] for row in conn.execute('SELECT folder FROM folders')}
+            for folder in sorted(folders):
+                if not os.path.isdir(self._folder_dir(folder)):
+                    # フォルダが削除された
+                    for table in ('folders', 'images', 'class_counts'):
+                        conn.execute(f'DELETE FROM {table} WHERE {IN_FOLDER}', self._folder_params(folder))
+                    continue
+                if folder in known:
+                    self._sync_folder(conn, folder)
+                # サブフォルダの追加・削除
+                discovered = self._discover(conn, folder)
+                for child in discovered:
+                    if child not in known:
+                        self._sync_folder(conn, child)
+                for child in known:
+                    if child.startswith(folder + '/' if folder else '') and child != folder \
+                            and not os.path.isdir(self._folder_dir(child)):
+                        for table in ('folders', 'images', 'class_counts'):
+                            conn.execute(f'DELETE FROM {table} WHERE {IN_FOLDER}', self._folder_params(child))
+
+    # ------------------------------------------------------------
+    # 参照
+    # ------------------------------------------------------------
+
+    def list_folders(self, prefix: Optional[str] = None) -> List[str]:
+        self.refresh()
+        conn = self._connection()
+        if prefix is None:
+            rows = conn.execute('SELECT folder FROM folders ORDER BY folder').fetchall()
+        else:
+            rows = conn.execute(f'SELECT folder FROM folders WHERE {IN_FOLDER} ORDER BY folder',
+                                self._folder_params(prefix)).fetchall()
+        return [row['folder'] for row in rows]
+
+    def list_images(self, folder: str, names: Optional[Iterable[str]] = None) -> List[dict]:
+        """フォルダ内の画像（ファイル名の降順、すべて）"""
+        return self.query_images(folder, names=names)['images']
+
+    def query_images(self, folder: str, annotated: Optional[bool] = None, class_id: Optional[int] = None,
+                     since_ns: Optional[int] = None, until_ns: Optional[int] = None,
+                     names: Optional[Iterable[str]] = None, sort: str = 'name', descending: bool = True,
+                     limit: Optional[int] = None, cursor: Optional[str] = None) -> dict:
+        """
+        フォルダ内の画像をフィルタ・並べ替えてカーソルでページ分割して取得
+        Args:
+            folder: フォルダ
+            annotated: True=ボックスのある画像のみ / False=ボックスのない画像のみ
+            class_id: このクラスのボックスを含む画像のみ
+            since_ns / until_ns: 更新時刻（アップロード日時）の範囲（ナノ秒、両端を含む）
+            names: 指定した画像名のみ
+            sort: 'name' / 'mtime' / 'annotations'（同じ値はファイル名で並べる）
+            descending: 降順
+            limit: 1ページの件数（Noneの場合はすべて）
+            cursor: 前のページのnext_cursor
+        Returns:
+            {'images': [...], 'total': 条件に一致する件数, 'next_cursor': 次ページのカーソル（最後のページはNone）}
+        Raises:
+            ValueError: sortが不正、またはカーソルが別の並び順のもの
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f'不正な並び順です: {sort}')
+        column = SORT_COLUMNS[sort]
+        self.refresh()
+        conn = self._connection()
+
+        conditions = ['folder = ?']
+        params: list = [folder]
+        if annotated is not None:
+            conditions.append('box_count > 0' if annotated else 'box_count = 0')
+        if class_id is not None:
+            conditions.append('EXISTS (SELECT 1 FROM class_counts c WHERE c.folder = images.folder '
+                              'AND c.name = images.name AND c.class_id = ? AND c.count > 0)')
+            params.append(class_id)
+        if since_ns is not None:
+            conditions.append('mtime_ns >= ?')
+            params.append(since_ns)
+        if until_ns is not None:
+            conditions.append('mtime_ns <= ?')
+            params.append(until_ns)
+        if names is not None:
+            conditions.append('name IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(names)))
+
+        where = ' AND '.join(conditions)
+        total = conn.execute(f'SELECT COUNT(*) FROM images WHERE {where}', params).fetchone()[0]
+
+        # キーセット方式（前のページの最後の行より後ろから読む。OFFSETと違い深いページでも一定時間）
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if cursor:
+            last_value, last_name = self._decode_cursor(cursor, sort, descending)
+            op = '<' if descending else '>'
+            if column == 'name':
+                page_conditions.append(f'name {op} ?')
+                page_params.append(last_name)
+            else:
+                page_conditions.append(f'({column} {op} ? OR ({column} = ? AND name {op} ?))')
+                page_params.extend([last_value, last_value, last_name])
+
+        direction = 'DESC' if descending else 'ASC'
+        order = f'name {direction}' if column == 'name' else f'{column} {direction}, name {direction}'
+        sql = f"SELECT * FROM images WHERE {' AND '.join(page_conditions)} ORDER BY {order}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            page_params.append(limit + 1)
+        rows = conn.execute(sql, page_params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = self._encode_cursor(sort, descending, last[column], last['name'])
+
+        # ページ分割時はそのページの画像分だけ読む
+        page_names = [row['name'] for row in rows] if limit is not None else None
+        class_counts = self._class_counts(conn, folder, page_names)
+        return {
+            'images': [dict(row, class_counts=class_counts.get(row['name'], {})) for row in rows],
+            'total': total,
+            'next_cursor': next_cursor
+        }
+
+    def folder_stats(self, prefix: Optional[str] = None) -> Dict[str, dict]:
+        """フォルダごとの画像数・ラベル数・ボックス数・クラス別ボックス数"""
+        self.refresh()
+        conn = self._connection()
+        where, params = ('', ()) if prefix is None else \
+            (f'WHERE {IN_FOLDER}', self._folder_params(prefix))
+
+        stats = {row['folder']: {'image_count': 0, 'label_count': 0, 'box_count': 0, 'class_counts': {}}
+                 for row in conn.execute(f'SELECT folder FROM folders {where}', params)}
+        for row in conn.execute(f'SELECT folder, COUNT(*) AS images, SUM(has_label) AS labels, '
+                                f'SUM(box_count) AS boxes FROM images {where} GROUP BY folder', params):
+            entry = stats.setdefault(row['folder'], {'class_counts': {}})
+            entry.update(image_count=row['images'], label_count=row['labels'] or 0,
+                         box_count=row['boxes'] or 0)
+        for row in conn.execute(f'SELECT folder, class_id, SUM(count) AS count FROM class_counts {where} '
+                                f'GROUP BY folder, class_id', params):
+            stats[row['folder']]['class_counts'][row['class_id']] = row['count']
+        return stats
+
+    def totals(self, prefix: Optional[str] = None) -> dict:
+        """フォルダ（prefixを指定した場合はその子フォルダを含む）の合計"""
+        total = {'image_count': 0, 'label_count': 0, 'box_count': 0, 'class_counts': {}}
+        for entry in self.folder_stats(prefix).values():
+            for key in ('image_count', 'label_count', 'box_count'):
+                total[key] += entry.get(key, 0)
+            for class_id, count in entry['class_counts'].items():
+                total['class_counts'][class_id] = total['class_counts'].get(class_id, 0) + count
+        return total
+
+    def get_image(self, folder: str, name: str) -> Optional[dict]:
+        """画像1枚の行（インデックスに無ければNone）"""
+        row = self._connection().execute('SELECT * FROM images WHERE folder = ? AND name = ?',
+                                         (folder, name)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_digest(self, digest: str) -> List[dict]:
+        """同じ内容の画像の一覧"""
+        conn = self._connection()
+        return [dict(row) for row in conn.execute('SELECT * FROM images WHERE digest = ?', (digest,))]
+
+    # ------------------------------------------------------------
+    # 知覚ハッシュ（内容のハッシュごとに保存するため、移動・名前変更では再計算しない）
+    # ------------------------------------------------------------
+
+    def images_without_hashes(self, prefix: Optional[str] = None) -> List[dict]:
+        """知覚ハッシュが未計算の画像（同じ内容の画像は1枚だけ）"""
+        self.refresh()
+        where, params = ('', ()) if prefix is None else (f'AND {IN_FOLDER}', self._folder_params(prefix))
+        # 同じ内容の画像からは実在する1行（フォルダ・名前の順で最初のもの）を選ぶ
+        rows = self._connection().execute(
+            f'SELECT digest, folder, name FROM (SELECT digest, folder, name, '
+            f'ROW_NUMBER() OVER (PARTITION BY digest ORDER BY folder, name) AS position FROM images '
+            f'WHERE digest IS NOT NULL AND digest NOT IN (SELECT digest FROM image_hashes) {where}) '
+            f'WHERE position = 1', params)
+        return [dict(row) for row in rows]
+
+    def store_hashes(self, hashes: Iterable[tuple]):
+        """知覚ハッシュを保存（(digest, dhash, phash) の組、ハッシュは符号付き64ビットに収めて保存する）"""
+        with self._write_lock, self._transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO image_hashes (digest, dhash, phash) VALUES (?, ?, ?)',
+                             [(digest, _to_signed64(dhash), _to_signed64(phash)) for digest, dhash, phash in hashes])
+
+    def image_hashes(self, prefix: Optional[str] = None) -> List[dict]:
+        """画像ごとの知覚ハッシュ（folder, name, digest, dhash, phash、未計算の画像は含まない）"""
+        where, params = ('', ()) if prefix is None else (f'WHERE {IN_FOLDER}', self._folder_params(prefix))
+        rows = self._connection().execute(
+            f'SELECT folder, name, images.digest AS digest, dhash, phash FROM images '
+            f'JOIN image_hashes ON images.digest = image_hashes.digest {where} ORDER BY folder, name', params)
+        return [dict(row, dhash=row['dhash'] & UINT64_MASK, phash=row['phash'] & UINT64_MASK) for row in rows]
+
+    def hash_table(self) -> List[tuple]:
+        """保存済みの知覚ハッシュすべて（(digest, dhash, phash) の組）"""
+        rows = self._connection().execute('SELECT digest, dhash, phash FROM image_hashes ORDER BY digest')
+        return [(row['digest'], row['dhash'] & UINT64_MASK, row['phash'] & UINT64_MASK) for row in rows]
+
+    def hash_table_state(self) -> tuple:
+        """知覚ハッシュの表が変わったかどうかの判定用（件数と最後の行番号、追加・置換・削除で変わる）"""
+        row = self._connection().execute('SELECT COUNT(*) AS count, MAX(rowid) AS last FROM image_hashes').fetchone()
+        return row['count'], row['last']
+
+    def prune_hashes(self) -> int:
+        """どの画像からも参照されなくなった知覚ハッシュを削除"""
+        with self._write_lock, self._transaction() as conn:
+            cursor = conn.execute('DELETE FROM image_hashes WHERE digest NOT IN '
+                                  '(SELECT digest FROM images WHERE digest IS NOT NULL)')
+            return cursor.rowcount
+
+    # ------------------------------------------------------------
+    # 不確実性スコア（内容のハッシュとモデルのバージョンごとに保存する）
+    # ------------------------------------------------------------
+
+    def images_without_scores(self, model_version: str, prefix: Optional[str] = None,
+                              limit: Optional[int] = None) -> List[dict]:
+        """未アノテーションでスコアが未計算の画像（同じ内容の画像は1枚だけ、名前順）"""
+        self.refresh()
+        where, params = ('', ()) if prefix is None else (f'AND {IN_FOLDER}', self._folder_params(prefix))
+        # 同じ内容の画像からは実在する1行（フォルダ・名前の順で最初のもの）を選ぶ
+        sql = (f'SELECT digest, folder, name FROM (SELECT digest, folder, name, '
+               f'ROW_NUMBER() OVER (PARTITION BY digest ORDER BY folder, name) AS position FROM images '
+               f'WHERE has_label = 0 AND digest IS NOT NULL {where} AND digest NOT IN '
+               f'(SELECT digest FROM uncertainty_scores WHERE model_version = ?)) '
+               f'WHERE position = 1 ORDER BY folder, name')
+        params = params + (model_version,)
+        if limit:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def count_without_scores(self, model_version: str, prefix: Optional[str] = None) -> int:
+        where, params = ('', ()) if prefix is None else (f'AND {IN_FOLDER}', self._folder_params(prefix))
+        row = self._connection().execute(
+            f'SELECT COUNT(DISTINCT digest) AS count FROM images WHERE has_label = 0 AND digest IS NOT NULL {where} '
+            f'AND digest NOT IN (SELECT digest FROM uncertainty_scores WHERE model_version = ?)',
+            params + (model_version,)).fetchone()
+        return row['count']
+
+    def store_scores(self, model_version: str, scores: Iterable[dict]):
+        """
+        スコアを保存
+        Args:
+            scores: digest, score, max_confidence, conflict, disagreement, box_count の辞書
+                    （読み込めなかった画像はscoreをNoneにして保存し、再計算しない）
+        """
+        now = time.time()
+        with self._write_lock, self._transaction() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO uncertainty_scores (digest, model_version, score, max_confidence, conflict, '
+                'disagreement, box_count, scored_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(entry['digest'], model_version, entry.get('score'), entry.get('max_confidence'),
+                  entry.get('conflict'), entry.get('disagreement'), entry.get('box_count'), now)
+                 for entry in scores])
+
+    def top_uncertain(self, model_version: str, prefix: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """未アノテーションの画像をスコアの高い順に取得"""
+        self.refresh()
+        where, params = ('', ()) if prefix is None else (f'AND {IN_FOLDER}', self._folder_params(prefix))
+        rows = self._connection().execute(
+            f'SELECT folder, name, images.digest AS digest, width, height, score, max_confidence, conflict, '
+            f'disagreement, uncertainty_scores.box_count AS predicted_boxes FROM images '
+            f'JOIN uncertainty_scores ON images.digest = uncertainty_scores.digest AND model_version = ? '
+            f'WHERE has_label = 0 AND score IS NOT NULL {where} ORDER BY score DESC, folder, name LIMIT ?',
+            (model_version,) + params + (limit,))
+        return [dict(row) for row in rows]
+
+    def prune_scores(self, keep_version: str) -> int:
+        """ほかのモデルのバージョンのスコアを削除"""
+        with self._write_lock, self._transaction() as conn:
+            return conn.execute('DELETE FROM uncertainty_scores WHERE model_version != ?', (keep_version,)).rowcount
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _rows_exist(self) -> bool:
+        return self._connection().execute('SELECT 1 FROM folders LIMIT 1').fetchone() is not None
+
+    def _is_watched(self) -> bool:
+        from core.fs_watcher import get_file_watcher
+        return get_file_watcher().is_watching(self.root)
+
+    @staticmethod
+    def _folder_params(folder: str) -> tuple:
+        # 子フォルダは「folder/」で始まる（''の場合はすべて）
+        prefix = folder + '/' if folder else ''
+        return folder, prefix, prefix
+
+    def _class_counts(self, conn, folder: str, names: Optional[List[str]] = None) -> Dict[str, Dict[int, int]]:
+        counts: Dict[str, Dict[int, int]] = {}
+        if names is None:
+            rows = conn.execute('SELECT name, class_id, count FROM class_counts WHERE folder = ?', (folder,))
+        else:
+            rows = conn.execute('SELECT name, class_id, count FROM class_counts WHERE folder = ? '
+                                'AND name IN (SELECT value FROM json_each(?))', (folder, json.dumps(names)))
+        for row in rows:
+            counts.setdefault(row['name'], {})[row['class_id']] = row['count']
+        return counts
+
+    @staticmethod
+    def _encode_cursor(sort: str, descending: bool, value, name: str) -> str:
+        data = json.dumps([sort, descending, value, name], ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str, descending: bool):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            cursor_sort, cursor_descending, value, name = json.loads(data.decode('utf-8'))
+        except (ValueError, TypeError):
+            raise ValueError('不正なカーソルです')
+        if cursor_sort != sort or cursor_descending != descending:
+            raise ValueError('カーソルの並び順が一致しません')
+        return value, name
+
+    def _image_name_for_label(self, folder: str, label_name: str) -> Optional[str]:
+        stem = os.path.splitext(label_name)[0]
+        row = self._connection().execute(
+            'SELECT name FROM images WHERE folder = ? AND (name = ? OR name = ? OR name = ?)',
+            (folder, stem + '.jpg', stem + '.jpeg', stem + '.png')).fetchone()
+        return row['name'] if row else None
+
+    def _discover(self, conn, folder: str) -> List[str]:
+        """フォルダ以下のサブフォルダを登録して一覧を返す（images/labelsは除く）"""
+        found = []
+        directory = self._folder_dir(folder)
+        if not os.path.isdir(directory):
+            return found
+        # 学習データ直下（''）はimagesフォルダがある場合のみ対象とする
+        if folder or os.path.isdir(os.path.join(directory, 'images')):
+            found.append(folder)
+        conn.execute('INSERT OR IGNORE INTO folders (folder) VALUES (?)', (folder,))
+
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir() and entry.name not in ('images', 'labels') and not entry.name.startswith('.'):
+                    child = f"{folder}/{entry.name}" if folder else entry.name
+                    # 学習データ直下はdatasetsフォルダのみを対象とする
+                    if folder == '' and entry.name != DATASETS_FOLDER:
+                        continue
+                    found.extend(self._discover(conn, child))
+        return found
+
+    def _refresh_folder(self, conn, row):
+        folder = row['folder']
+        directory = self._folder_dir(folder)
+        dir_mtime = _mtime_ns(directory)
+        if dir_mtime is None:
+            # フォルダが削除された
+            for table in ('folders', 'images', 'class_counts'):
+                conn.execute(f'DELETE FROM {table} WHERE {IN_FOLDER}', self._folder_params(folder))
+            return
+
+        if dir_mtime != row['dir_mtime_ns']:
+            # サブフォルダが追加された可能性がある
+            known = {r['folder'] for r in conn.execute('SELECT folder FROM folders')}
+            for child in self._discover(conn, folder):
+                if child not in known:
+                    self._sync_folder(conn, child)
+            conn.execute('UPDATE folders SET dir_mtime_ns = ? WHERE folder = ?', (dir_mtime, folder))
+
+        images_mtime = _mtime_ns(os.path.join(directory, 'images'))
+        labels_mtime = _mtime_ns(os.path.join(directory, 'labels'))
+        if images_mtime != row['images_mtime_ns'] or labels_mtime != row['labels_mtime_ns']:
+            self._sync_folder(conn, folder)
+
+    def _sync_folder(self, conn, folder: str) -> dict:
+        directory = self._folder_dir(folder)
+        images_dir = os.path.join(directory, 'images')
+        labels_dir = os.path.join(directory, 'labels')
+        result = {'indexed': 0, 'removed': 0}
+
+        # ディレクトリの更新時刻は走査前に取得する（走査中の変更は次回の確認で拾う）
+        conn.execute('INSERT OR IGNORE INTO folders (folder) VALUES (?)', (folder,))
+        conn.execute('UPDATE folders SET dir_mtime_ns = ?, images_mtime_ns = ?, labels_mtime_ns = ? '
+                     'WHERE folder = ?',
+                     (_mtime_ns(directory), _mtime_ns(images_dir), _mtime_ns(labels_dir), folder))
+
+        known = {row['name']: row for row in
+                 conn.execute('SELECT name, size, mtime_ns, label_mtime_ns FROM images WHERE folder = ?', (folder,))}
+
+        label_mtimes = {}
+        if os.path.isdir(labels_dir):
+            with os.scandir(labels_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.txt'):
+                        # 走査中に削除（移動）されたファイルは存在しないものとして扱う
+                        try:
+                            label_mtimes[entry.name[:-4]] = entry.stat().st_mtime_ns
+                        except FileNotFoundError:
+                            continue
+
+        present = set()
+        if os.path.isdir(images_dir):
+            with os.scandir(images_dir) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    present.add(entry.name)
+                    old = known.get(entry.name)
+                    label_mtime = label_mtimes.get(os.path.splitext(entry.name)[0])
+                    if old is None or old['size'] != st.st_size or old['mtime_ns'] != st.st_mtime_ns:
+                        self._index_image(conn, folder, entry.name)
+                        result['indexed'] += 1
+                    elif old['label_mtime_ns'] != label_mtime:
+                        self._index_label(conn, folder, entry.name)
+                        result['indexed'] += 1
+
+        for name in known:
+            if name not in present:
+                self._delete_image(conn, folder, name)
+                result['removed'] += 1
+        return result
+
+    def _index_image(self, conn, folder: str, name: str):
+        path = self.image_path(folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._delete_image(conn, folder, name)
+            return
+
+        from core.blob_store import get_blob_store, file_digest
+        try:
+            digest = get_blob_store().digest_of(path) or file_digest(path)
+        except FileNotFoundError:
+            self._delete_image(conn, folder, name)
+            return
+        width, height = read_image_size(path)
+
+        conn.execute('INSERT OR REPLACE INTO images (folder, name, size, mtime_ns, width, height, digest) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (folder, name, st.st_size, st.st_mtime_ns, width, height, digest))
+        self._index_label(conn, folder, name)
+
+    def _index_label(self, conn, folder: str, name: str):
+        label_path = self.label_path(folder, name)
+        conn.execute('DELETE FROM class_counts WHERE folder = ? AND name = ?', (folder, name))
+        try:
+            label_mtime = os.stat(label_path).st_mtime_ns
+            counts = parse_label_file(label_path)
+        except OSError:
+            conn.execute('UPDATE images SET has_label = 0, label_mtime_ns = NULL, box_count = 0 '
+                         'WHERE folder = ? AND name = ?', (folder, name))
+            return
+
+        conn.execute('UPDATE images SET has_label = 1, label_mtime_ns = ?, box_count = ? '
+                     'WHERE folder = ? AND name = ?',
+                     (label_mtime, sum(counts.values()), folder, name))
+        conn.executemany('INSERT INTO class_counts (folder, name, class_id, count) VALUES (?, ?, ?, ?)',
+                         [(folder, name, class_id, count) for class_id, count in counts.items()])
+
+    def _delete_image(self, conn, folder: str, name: str):
+        conn.execute('DELETE FROM images WHERE folder = ? AND name = ?', (folder, name))
+        conn.execute('DELETE FROM class_counts WHERE folder = ? AND name = ?', (folder, name))
+
+# シングルトンインスタンス
+_index_instance: Optional[DatasetIndex] = None
+_index_lock = threading.Lock()
+
+def get_dataset_index() -> DatasetIndex:
+    """データセットインデックスを取得（シングルトン）"""
+    global _index_instance
+    with _index_lock:
+        if _index_instance is None:
+            _index_instance = DatasetIndex()
+        return _index_instance
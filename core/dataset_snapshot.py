@@ -0,0 +1,416 @@
+"""
+データセットスナップショットモジュール
+学習に使ったデータセット（各画像・ラベルの内容のハッシュと訓練/検証の分割）を data/snapshots/<ID>.json に固定する。
+data/yolo_dataset は学習のたびにその場で作り直されるため、どの画像でどのモデルを学習したかをここに残す。
+
+画像とラベルの実体は画像ストア（core.blob_store）に置き、スナップショットが参照する実体には
+data/snapshots/objects/ にハードリンクを1つ作ってGCで消えないようにする（複数のスナップショットで共有）。
+前回のスナップショットから変わっていないファイルはハッシュを計算し直さず、リンクも作り直さないため、
+作成の手間は変更されたファイルの数に比例する。
+
+スナップショットIDは内容（ファイル名・分割・ハッシュ・クラス名・画像サイズ）から決まるため、同じデータセットで
+学習し直しても新しいスナップショットは増えない。学習開始時に作成したIDは学習結果
+（runs/train/<実験名>/dataset_snapshot.json）に記録され、restoreで同じデータセットをYOLOデータセットとして
+再構築できる（画像はハードリンクのみでコピーしない。ラベルはコピーするため、
+出力先のラベルを書き換えてもスナップショットの実体は変わらない）。
+
+    python -m core.dataset_snapshot create      # 現在のYOLOデータセットを固定
+    python -m core.dataset_snapshot list
+    python -m core.dataset_snapshot restore <ID> [出力先]
+    python -m core.dataset_snapshot delete <ID>
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import (DATASET_SNAPSHOT_DIR, YOLO_DATASET_DIR, YOLO_CLASS_NAMES, RESIZE_CACHE_ENABLED,
+                    TRAIN_VAL_SPLIT_RATIO, DATASET_SPLIT_SEED)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+def write_data_yaml(dataset_dir: str, class_names: List[str]):
+    """YOLOv5のdata.yamlを書く"""
+    import yaml
+
+    data_config = {
+        'path': os.path.abspath(dataset_dir),
+        'train': 'images/train',
+        'val': 'images/val',
+        'nc': len(class_names),
+        'names': list(class_names)
+    }
+    with open(os.path.join(dataset_dir, 'data.yaml'), 'w', encoding='utf-8') as f:
+        yaml.dump(data_config, f, default_flow_style=False, allow_unicode=True)
+
+def record_run(run_dir: str, snapshot_id: str, **metadata):
+    """学習結果のディレクトリにスナップショットIDを記録（RunCatalogのdataset_snapshotに反映される）"""
+    from core.run_catalog import RUN_SNAPSHOT_FILE
+
+    path = os.path.join(run_dir, RUN_SNAPSHOT_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(metadata, snapshot_id=snapshot_id, recorded=time.time()), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+class DatasetSnapshots:
+    """内容のハッシュで固定したデータセットの一覧"""
+
+    def __init__(self, root: str = DATASET_SNAPSHOT_DIR):
+        """
+        初期化
+        Args:
+            root: スナップショット（<ID>.json）と参照中の実体へのリンク（objects/）の保存先
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    # ------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------
+
+    def create_from_dataset(self, dataset_dir: str = YOLO_DATASET_DIR, folders: Optional[Iterable[str]] = None,
+                            img_size: Optional[int] = None, class_names: Optional[List[str]] = None) -> dict:
+        """
+        構築済みのYOLOデータセット（core.dataset_builderのマニフェスト）を固定
+        Args:
+            dataset_dir: YOLOデータセット
+            folders: 元にしたフォルダ（記録用、Noneの場合は従来の学習データ）
+            img_size: 学習時の画像サイズ（再構築時に縮小画像を作り直すために記録する）
+            class_names: クラス名（省略時はYOLO_CLASS_NAMES）
+        Returns:
+            スナップショットの概要（同じ内容のスナップショットがあればそれを返す）
+        """
+        from core.dataset_builder import YoloDatasetBuilder
+
+        manifest = YoloDatasetBuilder(dataset_dir).load_manifest()
+        if not manifest.get('entries'):
+            raise ValueError('データセットが空です')
+        class_names = list(class_names or YOLO_CLASS_NAMES)
+
+        with self._lock:
+            start = time.time()
+            memo = self._digest_memo()
+            stats = {'hashed': 0, 'reused': 0}
+            entries = {}
+            for name, entry in manifest['entries'].items():
+                image = self._digest(entry['image_src'], entry.get('image_sig'), memo, stats, is_label=False)
+                label = self._digest(entry.get('label_src'), entry.get('label_sig'), memo, stats, is_label=True)
+                entries[name] = {
+                    'key': entry['key'],
+                    'split': entry['split'],
+                    'image': image,
+                    'label': label,
+                    # 次回作成時に変更のないファイルのハッシュを使い回すための情報
+                    'image_src': entry['image_src'],
+                    'image_sig': entry.get('image_sig'),
+                    'label_src': entry.get('label_src'),
+                    'label_sig': entry.get('label_sig')
+                }
+
+            snapshot_id = self._snapshot_id(entries, class_names, img_size)
+            existing = self._load(snapshot_id)
+            if existing:
+                return self._summary(existing)
+
+            pinned = 0
+            for digest in self._digests(entries.values()):
+                pinned += self._pin(digest)
+
+            snapshot = {
+                'version': SNAPSHOT_VERSION,
+                'id': snapshot_id,
+                'created': time.time(),
+                'folders': list(folders) if folders is not None else None,
+                'img_size': img_size,
+                'class_names': class_names,
+                'seed': manifest.get('seed', DATASET_SPLIT_SEED),
+                'train_ratio': manifest.get('train_ratio', TRAIN_VAL_SPLIT_RATIO),
+                'counts': {
+                    'images': len(entries),
+                    'train': sum(1 for entry in entries.values() if entry['split'] == 'train'),
+                    'val': sum(1 for entry in entries.values() if entry['split'] == 'val'),
+                    'labels': sum(1 for entry in entries.values() if entry['label'])
+                },
+                'entries': entries
+            }
+            self._save(snapshot)
+
+        logger.info(f"データセットスナップショット作成: {snapshot_id} 画像{len(entries)}枚 "
+                    f"(ハッシュ計算{stats['hashed']} / 再利用{stats['reused']} / 新規リンク{pinned}) "
+                    f"{time.time() - start:.2f}秒")
+        return self._summary(snapshot)
+
+    def list_snapshots(self) -> List[dict]:
+        """スナップショットの概要（新しい順、そのデータセットで学習した実験名を含む）"""
+        runs_by_snapshot = self._runs_by_snapshot()
+        snapshots = []
+        for snapshot_id in self._snapshot_ids():
+            snapshot = self._load(snapshot_id)
+            if snapshot:
+                snapshots.append(self._summary(snapshot, runs_by_snapshot.get(snapshot_id, [])))
+        return sorted(snapshots, key=lambda s: s['created'], reverse=True)
+
+    def get(self, snapshot_id: str, include_entries: bool = False) -> Optional[dict]:
+        snapshot = self._load(snapshot_id)
+        if snapshot is None:
+            return None
+        summary = self._summary(snapshot, self._runs_by_snapshot().get(snapshot_id, []))
+        if include_entries:
+            summary['entries'] = {name: {key: entry[key] for key in ('key', 'split', 'image', 'label')}
+                                  for name, entry in snapshot['entries'].items()}
+        return summary
+
+    def restore(self, snapshot_id: str, dataset_dir: str = YOLO_DATASET_DIR, img_size: Optional[int] = None) -> dict:
+        """
+        スナップショットからYOLOデータセットを再構築（出力先の前回の内容との差分だけを反映）
+        画像は実体へのハードリンク、ラベルはコピーとして置く（出力先での書き換えが実体のハッシュと食い違わないように）。
+        Args:
+            snapshot_id: スナップショットID
+            dataset_dir: 出力先
+            img_size: 縮小画像のサイズ（省略時は作成時のサイズ、RESIZE_CACHE_ENABLEDが無効の場合は元画像）
+        Returns:
+            構築結果の統計（YoloDatasetBuilder.buildの戻り値）
+        """
+        from core.dataset_builder import YoloDatasetBuilder, DatasetItem
+
+        snapshot = self._load(snapshot_id)
+        if snapshot is None:
+            raise KeyError(snapshot_id)
+
+        items = []
+        for name, entry in snapshot['entries'].items():
+            image_path = self.object_path(entry['image'])
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f'スナップショットの画像がありません: {name} ({entry["image"]})')
+            items.append(DatasetItem(key=entry['key'], image_path=image_path,
+                                     label_path=self.object_path(entry['label']) if entry['label'] else None,
+                                     name=name, split=entry['split']))
+
+        img_size = img_size or snapshot.get('img_size')
+        builder = YoloDatasetBuilder(dataset_dir, train_ratio=snapshot['train_ratio'], seed=snapshot['seed'],
+                                     img_size=img_size if RESIZE_CACHE_ENABLED else None)
+        result = builder.build(items)
+        write_data_yaml(dataset_dir, snapshot['class_names'])
+        logger.info(f"スナップショット {snapshot_id} から再構築: {dataset_dir}")
+        return dict(result, snapshot_id=snapshot_id)
+
+    def delete(self, snapshot_id: str, force: bool = False) -> dict:
+        """
+        スナップショットを削除（他のスナップショットが参照していない実体へのリンクも削除）
+        Args:
+            force: 学習結果から参照されていても削除する
+        """
+        runs = self._runs_by_snapshot().get(snapshot_id, [])
+        if runs and not force:
+            raise ValueError(f"学習結果から参照されています: {', '.join(runs)}")
+
+        with self._lock:
+            if os.path.basename(snapshot_id) != snapshot_id or not os.path.exists(self._path(snapshot_id)):
+                raise KeyError(snapshot_id)
+            os.remove(self._path(snapshot_id))
+
+            referenced = set()
+            for other_id in self._snapshot_ids():
+                other = self._load(other_id)
+                if other:
+                    referenced.update(self._digests(other['entries'].values()))
+
+            unpinned = 0
+            for prefix in os.listdir(self.objects_dir):
+                directory = os.path.join(self.objects_dir, prefix)
+                for name in os.listdir(directory):
+                    if prefix + name not in referenced:
+                        os.remove(os.path.join(directory, name))
+                        unpinned += 1
+        logger.info(f"データセットスナップショット削除: {snapshot_id}（リンク{unpinned}個を削除）")
+        return {'id': snapshot_id, 'unpinned': unpinned}
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _path(self, snapshot_id: str) -> str:
+        return os.path.join(self.root, snapshot_id + '.json')
+
+    def _snapshot_ids(self) -> List[str]:
+        return [name[:-5] for name in os.listdir(self.root) if name.endswith('.json')]
+
+    def _load(self, snapshot_id: str) -> Optional[dict]:
+        if not snapshot_id or os.path.basename(snapshot_id) != snapshot_id:
+            return None
+        try:
+            with open(self._path(snapshot_id), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"スナップショットを読み込めません {snapshot_id}: {e}")
+            return None
+        return snapshot if snapshot.get('version') == SNAPSHOT_VERSION else None
+
+    def _save(self, snapshot: dict):
+        path = self._path(snapshot['id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _snapshot_id(entries: Dict[str, dict], class_names: List[str], img_size: Optional[int]) -> str:
+        content = [class_names, img_size, sorted((name, e['key'], e['split'], e['image'], e['label'])
+                                                 for name, e in entries.items())]
+        return hashlib.sha256(json.dumps(content).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _digests(entries: Iterable[dict]) -> set:
+        digests = set()
+        for entry in entries:
+            digests.add(entry['image'])
+            if entry['label']:
+                digests.add(entry['label'])
+        return digests
+
+    def _digest_memo(self) -> Dict[Tuple[str, tuple], str]:
+        """最新のスナップショットの (元ファイル, シグネチャ) -> ハッシュ"""
+        latest = None
+        for snapshot_id in self._snapshot_ids():
+            try:
+                mtime = os.path.getmtime(self._path(snapshot_id))
+            except OSError:
+                continue
+            if latest is None or mtime > latest[0]:
+                latest = (mtime, snapshot_id)
+        snapshot = self._load(latest[1]) if latest else None
+        memo = {}
+        for entry in (snapshot or {}).get('entries', {}).values():
+            if entry.get('image_sig'):
+                memo[(entry['image_src'], tuple(entry['image_sig']))] = entry['image']
+            if entry.get('label') and entry.get('label_sig'):
+                memo[(entry['label_src'], tuple(entry['label_sig']))] = entry['label']
+        return memo
+
+    def _digest(self, path: Optional[str], sig: Optional[list], memo: dict, stats: dict,
+                is_label: bool) -> Optional[str]:
+        """
+        ファイルの内容のハッシュ（画像ストアに実体が無ければ登録する）
+        画像はファイル自体を実体へのハードリンクにし、ラベルはエディタがその場で書き換えるため内容を複製する
+        """
+        from core.blob_store import get_blob_store
+
+        if not path:
+            return None
+        store = get_blob_store()
+        cached = memo.get((path, tuple(sig))) if sig else None
+        if cached and store.has(cached):
+            stats['reused'] += 1
+            return cached
+
+        # スナップショットから再構築したデータセットのファイル（リンク先のパスがハッシュ）
+        if os.path.dirname(os.path.dirname(os.path.abspath(path))) == os.path.abspath(self.objects_dir):
+            stats['reused'] += 1
+            return os.path.basename(os.path.dirname(path)) + os.path.basename(path)
+
+        stats['hashed'] += 1
+        try:
+            if is_label:
+                with open(path, 'rb') as f:
+                    return store.put_stream(f)
+            return store.put_file(path)
+        except FileNotFoundError:
+            if is_label:
+                return None
+            raise
+
+    def _pin(self, digest: str) -> int:
+        """実体へのリンクを作成（作成した場合は1）"""
+        from core.blob_store import get_blob_store
+
+        dest = self.object_path(digest)
+        if os.path.lexists(dest):
+            return 0
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        blob_path = get_blob_store().blob_path(digest)
+        try:
+            os.link(blob_path, dest)
+        except FileExistsError:
+            return 0
+        except OSError:
+            # 別ファイルシステムの場合はコピー（一時ファイルから置き換え）
+            tmp_path = dest + '.tmp'
+            shutil.copy2(blob_path, tmp_path)
+            os.replace(tmp_path, dest)
+        return 1
+
+    def _runs_by_snapshot(self) -> Dict[str, List[str]]:
+        from core.run_catalog import get_run_catalog
+
+        runs: Dict[str, List[str]] = {}
+        for run in get_run_catalog().list_runs():
+            if run.get('dataset_snapshot'):
+                runs.setdefault(run['dataset_snapshot'], []).append(run['name'])
+        return runs
+
+    @staticmethod
+    def _summary(snapshot: dict, runs: Optional[List[str]] = None) -> dict:
+        summary = {key: snapshot[key] for key in ('id', 'created', 'folders', 'img_size', 'class_names', 'counts')}
+        summary['runs'] = runs or []
+        return summary
+
+# シングルトンインスタンス
+_snapshots_instance: Optional[DatasetSnapshots] = None
+_snapshots_lock = threading.Lock()
+
+def get_dataset_snapshots() -> DatasetSnapshots:
+    """データセットスナップショットを取得（シングルトン）"""
+    global _snapshots_instance
+    with _snapshots_lock:
+        if _snapshots_instance is None:
+            _snapshots_instance = DatasetSnapshots()
+        return _snapshots_instance
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='データセットのスナップショット')
+    parser.add_argument('command', choices=['create', 'list', 'show', 'restore', 'delete'])
+    parser.add_argument('snapshot_id', nargs='?', help='スナップショットID（show/restore/delete）')
+    parser.add_argument('dataset_dir', nargs='?', default=YOLO_DATASET_DIR,
+                        help='YOLOデータセット（createの固定元・restoreの出力先）')
+    parser.add_argument('--img', type=int, help='学習時の画像サイズ')
+    parser.add_argument('--force', action='store_true', help='学習結果から参照されていても削除する')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    snapshots = get_dataset_snapshots()
+    if args.command == 'create':
+        # createではsnapshot_idの位置に固定元を指定できる
+        result = snapshots.create_from_dataset(args.snapshot_id or args.dataset_dir, img_size=args.img)
+    elif args.command == 'list':
+        result = snapshots.list_snapshots()
+    else:
+        if not args.snapshot_id:
+            parser.error(f'{args.command}にはスナップショットIDが必要です')
+        if args.command == 'show':
+            result = snapshots.get(args.snapshot_id)
+        elif args.command == 'restore':
+            result = snapshots.restore(args.snapshot_id, args.dataset_dir, args.img)
+        else:
+            result = snapshots.delete(args.snapshot_id, args.force)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+"""
+YOLOデータセット検証モジュール
+訓練・検証の全分割について、画像のデコード可否・サイズ、ラベルの書式・座標範囲・クラスID（data.yamlのnames）、
+対応のない画像/ラベル、重複ボックスを検査し、JSONのレポートとして保存する。
+
+画像のデコードとラベルの読み込みはプロセスプールで並列に行い、ファイルごとの結果はシグネチャ（サイズ・更新時刻・inode）を
+キーにキャッシュするため、再検証では変更のあったファイルだけを読み直す。
+クラス数やしきい値に依存する判定はキャッシュした結果から毎回計算するので、data.yamlや設定を変えても読み直しは不要。
+"""
+
+import io
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+from PIL import Image
+
+from config import (YOLO_DATASET_DIR, YOLO_CLASS_NAMES, DATASET_VALIDATION_WORKERS,
+                    DATASET_MIN_IMAGE_SIZE, DATASET_DUPLICATE_IOU)
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'validation_cache.json'
+REPORT_FILE = 'validation_report.json'
+CACHE_VERSION = 1
+SPLITS = ('train', 'val')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# これより少ないファイル数ならプロセスを起動せずに検査する
+MIN_PARALLEL_FILES = 32
+
+ERROR = 'error'
+WARNING = 'warning'
+
+def _signature(path: str) -> Optional[list]:
+    """キャッシュの照合用シグネチャ（サイズ・更新時刻・inode）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def check_image(path: str) -> dict:
+    """
+    画像1枚を検査（プロセスプールから呼ばれる）
+    Returns:
+        {'width', 'height', 'format', 'error', 'warnings'}
+    """
+    result = {'width': 0, 'height': 0, 'format': None, 'error': None, 'warnings': []}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        result['error'] = f'読み込めません: {e}'
+        return result
+    if not data:
+        result['error'] = '空のファイルです'
+        return result
+
+    try:
+        # verify()で構造を確認し、load()で実際に全体をデコードする（途中で切れたJPEGを検出）
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            result['width'], result['height'] = img.size
+            result['format'] = img.format
+    except Exception as e:
+        result['error'] = f'デコードできません: {e}'
+        return result
+
+    if result['format'] == 'JPEG' and not data.rstrip(b'\x00').endswith(b'\xff\xd9'):
+        result['warnings'].append('JPEGの終端マーカーがありません（転送途中の可能性）')
+    return result
+
+def check_label(path: str) -> dict:
+    """
+    ラベルファイル1つを読み込んで書式を検査（プロセスプールから呼ばれる）
+    Returns:
+        {'boxes': [[行番号, クラスID, x, y, w, h], ...], 'issues': [[重大度, コード, 行番号, メッセージ], ...]}
+    """
+    boxes = []
+    issues = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        return {'boxes': boxes, 'issues': [[ERROR, 'label_unreadable', None, f'読み込めません: {e}']]}
+
+    for line_no, line in enumerate(lines, start=1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 5:
+            issues.append([ERROR, 'label_format', line_no, f'列数が5ではありません（{len(parts)}列）'])
+            continue
+        try:
+            class_value = float(parts[0])
+            x, y, w, h = map(float, parts[1:5])
+        except ValueError:
+            issues.append([ERROR, 'label_parse', line_no, '数値に変換できません'])
+            continue
+        if not class_value.is_integer() or class_value < 0:
+            issues.append([ERROR, 'class_id_invalid', line_no, f'クラスIDが不正です: {parts[0]}'])
+            continue
+        if not all(0 <= v <= 1 for v in (x, y, w, h)):
+            issues.append([ERROR, 'coord_out_of_range', line_no, '座標が0〜1の範囲外です'])
+            continue
+        if w <= 0 or h <= 0:
+            issues.append([ERROR, 'box_zero_size', line_no, '幅または高さが0です'])
+            continue
+        if x - w / 2 < -1e-3 or x + w / 2 > 1 + 1e-3 or y - h / 2 < -1e-3 or y + h / 2 > 1 + 1e-3:
+            issues.append([WARNING, 'box_outside_image', line_no, 'ボックスが画像の外にはみ出しています'])
+        boxes.append([line_no, int(class_value), x, y, w, h])
+
+    return {'boxes': boxes, 'issues': issues}
+
+def _iou(a: list, b: list) -> float:
+    """YOLO形式（中心・幅・高さ）のボックス同士のIoU"""
+    ax1, ay1, ax2, ay2 = a[2] - a[4] / 2, a[3] - a[5] / 2, a[2] + a[4] / 2, a[3] + a[5] / 2
+    bx1, by1, bx2, by2 = b[2] - b[4] / 2, b[3] - b[5] / 2, b[2] + b[4] / 2, b[3] + b[5] / 2
+    inter = max(0.0, min(ax2, bx2) - max(ax1, bx1)) * max(0.0, min(ay2, by2) - max(ay1, by1))
+    union = a[4] * a[5] + b[4] * b[5] - inter
+    return inter / union if union > 0 else 0.0
+
+def read_class_names(dataset_dir: str) -> Tuple[Optional[List[str]], Optional[int]]:
+    """data.yamlのnames（IDの順）とncを読み込む（ファイルがない場合は(None, None)）"""
+    yaml_path = os.path.join(dataset_dir, 'data.yaml')
+    if not os.path.exists(yaml_path):
+        return None, None
+    with open(yaml_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    names = config.get('names') or []
+    if isinstance(names, dict):
+        names = [names[key] for key in sorted(names)]
+    return [str(name) for name in names], config.get('nc')
+
+class DatasetValidator:
+    """YOLOデータセットの増分検証"""
+
+    def __init__(self, dataset_dir: str = YOLO_DATASET_DIR, workers: Optional[int] = DATASET_VALIDATION_WORKERS,
+                 min_image_size: int = DATASET_MIN_IMAGE_SIZE, duplicate_iou: float = DATASET_DUPLICATE_IOU):
+        """
+        初期化
+        Args:
+            dataset_dir: YOLOデータセットのディレクトリ（images/{train,val}・labels/{train,val}・data.yaml）
+            workers: プロセス数（Noneの場合はCPUコア数）
+            min_image_size: これより短辺が小さい画像を警告する
+            duplicate_iou: 同じクラスでこのIoU以上重なるボックスを重複とみなす
+        """
+        self.dataset_dir = dataset_dir
+        self.workers = workers
+        self.min_image_size = min_image_size
+        self.duplicate_iou = duplicate_iou
+        self.cache_path = os.path.join(dataset_dir, CACHE_FILE)
+        self.report_path = os.path.join(dataset_dir, REPORT_FILE)
+
+    def validate(self, force: bool = False) -> dict:
+        """
+        データセットを検証してレポートを保存
+        Args:
+            force: キャッシュを使わずにすべてのファイルを検査する
+        Returns:
+            検証レポート
+        """
+        with _validate_lock:
+            return self._validate(force)
+
+    def load_report(self) -> Optional[dict]:
+        """前回保存したレポート（ない場合はNone）"""
+        try:
+            with open(self.report_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ------------------------------------------------------------
+    # 検証本体
+    # ------------------------------------------------------------
+
+    def _validate(self, force: bool) -> dict:
+        start_time = time.time()
+        issues = []
+
+        def add_issue(severity, code, message, split=None, file=None, line=None):
+            issues.append({'severity': severity, 'code': code, 'split': split, 'file': file,
+                           'line': line, 'message': message})
+
+        names, nc = None, None
+        try:
+            names, nc = read_class_names(self.dataset_dir)
+            if names is None:
+                add_issue(ERROR, 'data_yaml_missing', 'data.yamlがありません', file='data.yaml')
+        except (OSError, yaml.YAMLError) as e:
+            add_issue(ERROR, 'data_yaml_invalid', f'data.yamlを読み込めません: {e}', file='data.yaml')
+        if names is not None:
+            if nc is not None and nc != len(names):
+                add_issue(ERROR, 'class_count_mismatch',
+                          f'data.yamlのnc（{nc}）とnamesの数（{len(names)}）が一致しません', file='data.yaml')
+            if len(names) != len(YOLO_CLASS_NAMES):
+                add_issue(ERROR, 'class_count_mismatch',
+                          f'data.yamlのクラス数（{len(names)}）がアプリのクラス数（{len(YOLO_CLASS_NAMES)}）と一致しません',
+                          file='data.yaml')
+        num_classes = len(names) if names else len(YOLO_CLASS_NAMES)
+        class_names = names if names else YOLO_CLASS_NAMES
+
+        # 検査対象を列挙
+        files = {}  # 相対パス -> (種類, 分割, 絶対パス)
+        split_images: Dict[str, Dict[str, str]] = {}
+        split_labels: Dict[str, Dict[str, str]] = {}
+        for split in SPLITS:
+            split_images[split] = {}
+            split_labels[split] = {}
+            for kind, extensions, target in (('images', IMAGE_EXTENSIONS, split_images[split]),
+                                             ('labels', ('.txt',), split_labels[split])):
+                directory = os.path.join(self.dataset_dir, kind, split)
+                if not os.path.isdir(directory):
+                    if kind == 'images':
+                        add_issue(ERROR, 'split_missing', f'{kind}/{split} がありません', split=split)
+                    continue
+                for name in os.listdir(directory):
+                    if not name.lower().endswith(extensions):
+                        continue
+                    rel = f'{kind}/{split}/{name}'
+                    target[os.path.splitext(name)[0]] = rel
+                    files[rel] = (kind, split, os.path.join(directory, name))
+
+        results, checked = self._check_files(files, force)
+
+        # 集計とキャッシュ結果に対する判定
+        splits_summary = {}
+        total_boxes = 0
+        for split in SPLITS:
+            images = split_images[split]
+            labels = split_labels[split]
+            class_counts = [0] * num_classes
+            boxes_in_split = 0
+            background = 0
+
+            for stem, rel in sorted(images.items()):
+                result = results.get(rel)
+                if result is None:
+                    continue
+                if result['error']:
+                    add_issue(ERROR, 'image_corrupt', result['error'], split=split, file=rel)
+                    continue
+                for warning in result['warnings']:
+                    add_issue(WARNING, 'image_truncated', warning, split=split, file=rel)
+                if min(result['width'], result['height']) < self.min_image_size:
+                    add_issue(WARNING, 'image_too_small',
+                              f"画像が小さすぎます（{result['width']}x{result['height']}）", split=split, file=rel)
+                if stem not in labels:
+                    add_issue(WARNING, 'image_without_label', 'ラベルファイルがありません（背景画像として扱われます）',
+                              split=split, file=rel)
+                if not results.get(labels.get(stem), {}).get('boxes'):
+                    background += 1
+
+            for stem, rel in sorted(labels.items()):
+                result = results.get(rel)
+                if result is None:
+                    continue
+                if stem not in images:
+                    add_issue(WARNING, 'label_without_image', '対応する画像がありません', split=split, file=rel)
+                for severity, code, line, message in result['issues']:
+                    add_issue(severity, code, message, split=split, file=rel, line=line)
+                if not result['boxes'] and not result['issues']:
+                    add_issue(WARNING, 'label_empty', 'ボックスがありません（背景画像として扱われます）',
+                              split=split, file=rel)
+
+                boxes = result['boxes']
+                for box in boxes:
+                    if box[1] >= num_classes:
+                        add_issue(ERROR, 'class_id_out_of_range',
+                                  f'クラスID {box[1]} がクラス数（{num_classes}）を超えています',
+                                  split=split, file=rel, line=box[0])
+                    else:
+                        class_counts[box[1]] += 1
+                for i, a in enumerate(boxes):
+                    for b in boxes[i + 1:]:
+                        if a[1] == b[1] and (a[2:] == b[2:] or _iou(a, b) >= self.duplicate_iou):
+                            add_issue(WARNING, 'duplicate_box', f'{a[0]}行目と重複しています',
+                                      split=split, file=rel, line=b[0])
+                boxes_in_split += len(boxes)
+
+            total_boxes += boxes_in_split
+            splits_summary[split] = {
+                'images': len(images),
+                'labels': len(labels),
+                'background': background,
+                'boxes': boxes_in_split,
+                'class_counts': dict(zip(class_names, class_counts))
+            }
+
+        # 訓練と検証の両方に含まれる画像（検証指標が過大になる）
+        for stem in sorted(set(split_images['train']) & set(split_images['val'])):
+            add_issue(WARNING, 'split_overlap', '訓練と検証の両方に含まれています',
+                      split='val', file=split_images['val'][stem])
+
+        issue_counts: Dict[str, int] = {}
+        for issue in issues:
+            issue_counts[issue['code']] = issue_counts.get(issue['code'], 0) + 1
+        errors = sum(1 for issue in issues if issue['severity'] == ERROR)
+
+        report = {
+            'version': CACHE_VERSION,
+            'dataset_dir': os.path.abspath(self.dataset_dir),
+            'generated_at': datetime.now().isoformat(),
+            'elapsed': round(time.time() - start_time, 3),
+            'ok': errors == 0,
+            'names': class_names,
+            'nc': num_classes,
+            'summary': {
+                'images': sum(s['images'] for s in splits_summary.values()),
+                'labels': sum(s['labels'] for s in splits_summary.values()),
+                'boxes': total_boxes,
+                'errors': errors,
+                'warnings': len(issues) - errors,
+                'checked': checked,
+                'cached': len(files) - checked
+            },
+            'splits': splits_summary,
+            'issue_counts': issue_counts,
+            'issues': issues
+        }
+        self._write_json(self.report_path, report)
+        logger.info(f"データセット検証完了: エラー{errors}件, 警告{len(issues) - errors}件 "
+                    f"（検査{checked}件, キャッシュ{len(files) - checked}件, {report['elapsed']}秒）")
+        return report
+
+    def _check_files(self, files: Dict[str, tuple], force: bool) -> Tuple[Dict[str, dict], int]:
+        """変更のあったファイルだけを並列に検査し、全ファイルの結果を返す"""
+        cache = {} if force else self._load_cache()
+        results = {}
+        pending_images = []
+        pending_labels = []
+        signatures = {}
+
+        for rel, (kind, split, path) in files.items():
+            signature = _signature(path)
+            signatures[rel] = signature
+            entry = cache.get(rel)
+            if entry is not None and signature is not None and entry.get('sig') == signature:
+                results[rel] = entry['result']
+            elif kind == 'images':
+                pending_images.append(rel)
+            else:
+                pending_labels.append(rel)
+
+        checked = len(pending_images) + len(pending_labels)
+        if checked:
+            image_paths = [files[rel][2] for rel in pending_images]
+            label_paths = [files[rel][2] for rel in pending_labels]
+            if checked < MIN_PARALLEL_FILES or self.workers == 1:
+                image_results = list(map(check_image, image_paths))
+                label_results = list(map(check_label, label_paths))
+            else:
+                workers = self.workers or os.cpu_count() or 1
+                chunksize = max(1, checked // (workers * 4))
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    image_future = executor.map(check_image, image_paths, chunksize=chunksize)
+                    label_future = executor.map(check_label, label_paths, chunksize=chunksize)
+                    image_results = list(image_future)
+                    label_results = list(label_future)
+            results.update(zip(pending_images, image_results))
+            results.update(zip(pending_labels, label_results))
+
+        # 今回存在したファイルだけをキャッシュに残す
+        new_cache = {rel: {'sig': signatures[rel], 'result': results[rel]}
+                     for rel in results if signatures.get(rel) is not None}
+        if checked or len(new_cache) != len(cache):
+            self._write_json(self.cache_path, {'version': CACHE_VERSION, 'files': new_cache})
+        return results, checked
+
+    def _load_cache(self) -> Dict[str, dict]:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') == CACHE_VERSION:
+                return cache.get('files', {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        """一時ファイルに書いてから置き換える"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+# 同じデータセットの検証を同時に実行しない
+_validate_lock = threading.Lock()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='YOLOデータセットの検証')
+    parser.add_argument('dataset_dir', nargs='?', default=YOLO_DATASET_DIR)
+    parser.add_argument('--force', action='store_true', help='キャッシュを使わずにすべて検査する')
+    parser.add_argument('--workers', type=int, default=DATASET_VALIDATION_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = DatasetValidator(args.dataset_dir, workers=args.workers).validate(force=args.force)
+    print(json.dumps({key: report[key] for key in ('ok', 'summary', 'splits', 'issue_counts')},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
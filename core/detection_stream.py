@@ -0,0 +1,125 @@
+"""
+判定結果配信モジュール
+カメラごとに推論を1系統だけ回し、検出結果（JSON）を購読中のクライアントへ配る
+（枠の描画はクライアント側で行うため、サーバーは描画・再エンコードを行わない）
+"""
+
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from core.camera_manager import get_camera_instance
+from core.realtime_detector import get_detector_instance
+from core.inference_pool import get_inference_pool
+
+logger = logging.getLogger(__name__)
+
+class DetectionStream:
+    """カメラ1台分の判定結果配信"""
+
+    def __init__(self, camera_index: int):
+        self.camera_index = camera_index
+        self._condition = threading.Condition()
+        self._message: Optional[dict] = None
+        self._seq = 0
+        self._subscribers = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def subscribe(self):
+        """購読を開始（最初の購読者で推論スレッドを起動し、全員が抜けると停止する）"""
+        with self._condition:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            yield self
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+                self._condition.notify_all()
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    def wait_next(self, last_seq: int, timeout: Optional[float] = None) -> Optional[dict]:
+        """last_seqより新しい判定結果が届くまで待機（タイムアウト時はNone）"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > last_seq, timeout)
+            if self._seq <= last_seq:
+                return None
+            return self._message
+
+    def _publish(self, message: dict):
+        with self._condition:
+            self._seq += 1
+            message['seq'] = self._seq
+            self._message = message
+            self._condition.notify_all()
+
+    def _run(self):
+        """推論スレッド（フレームが届くたびに最新フレームを判定）"""
+        camera = get_camera_instance(self.camera_index)
+        detector = get_detector_instance()
+        pool = get_inference_pool()
+        last_frame_seq = 0
+
+        try:
+            while True:
+                with self._condition:
+                    if self._subscribers <= 0:
+                        self._thread = None
+                        return
+
+                item = camera.frame_hub.wait_next(last_frame_seq, timeout=1.0)
+                if item is None:
+                    continue
+                last_frame_seq, frame, timestamp = item
+
+                try:
+                    detections = pool.detect(self.camera_index, last_frame_seq, frame)
+                except Exception as e:
+                    # 1フレームの失敗で配信を止めない（購読中のクライアントには次のフレームから届く）
+                    logger.error(f"判定エラー (カメラ {self.camera_index}, フレーム {last_frame_seq}): {e}")
+                    continue
+                height, width = frame.shape[:2]
+                self._publish({
+                    'camera': self.camera_index,
+                    'frame_seq': last_frame_seq,
+                    # 映像側のX-Frame-Timestampと同じUNIX時間
+                    'frame_timestamp': time.time() - (time.monotonic() - timestamp),
+                    'width': width,
+                    'height': height,
+                    'fps': detector.fps,
+                    'process_time': detector.last_process_time,
+                    'detections': [
+                        {
+                            'bbox': d.bbox,
+                            'confidence': d.confidence,
+                            'class': d.class_name,
+                            'class_id': d.class_id
+                        }
+                        for d in detections
+                    ]
+                })
+        except Exception as e:
+            logger.error(f"判定結果配信エラー (カメラ {self.camera_index}): {e}")
+            with self._condition:
+                self._thread = None
+
+# カメラインデックスごとのインスタンス
+_streams: Dict[int, DetectionStream] = {}
+_streams_lock = threading.Lock()
+
+def get_detection_stream(camera_index: int) -> DetectionStream:
+    """カメラの判定結果配信を取得"""
+    with _streams_lock:
+        stream = _streams.get(camera_index)
+        if stream is None:
+            stream = DetectionStream(camera_index)
+            _streams[camera_index] = stream
+        return stream
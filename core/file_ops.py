@@ -0,0 +1,565 @@
+"""
+一括ファイル操作モジュール
+学習データの画像（と対応するラベル）のフォルダ間移動・削除をまとめて実行する。
+
+- 同じファイルシステム内は os.rename、別デバイス間はスレッドで並列にコピーしてから元を削除する
+- 削除はいったん data/file_ops/<バッチID>.trash に移動し、インデックスを更新してから実体を消す
+  （ジャーナルと同じデバイスでない場合のみ直接削除し、その分は取り消せない）
+- 実行前に操作の計画（各ファイルの移動元・移動先）を data/file_ops/<バッチID>.json に書く（先行書き込み）。
+  各ファイルの状態は移動元・移動先の有無から分かるため、途中で落ちても起動時に続きを実行（resume）するか、
+  移動済みのファイルを元に戻す（rollback）ことができる
+- インデックス（core.dataset_index）の更新はバッチごとに1回のトランザクションで行う
+"""
+
+import os
+import json
+import time
+import uuid
+import errno
+import shutil
+import filecmp
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from config import FILE_OPS_DIR, FILE_OPS_WORKERS, FILE_OPS_SYNC_LIMIT, FILE_OPS_RECOVERY
+
+logger = logging.getLogger(__name__)
+
+# 移動元・移動先の状態から各ファイルの進み具合を判断するため、コピー途中のファイルには接尾辞を付ける
+PARTIAL_SUFFIX = '.partial'
+
+# 完了したバッチの状態を保持する件数（進捗APIで参照する）
+MAX_FINISHED = 100
+
+FINISHED_STATUSES = ('completed', 'cancelled', 'failed')
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _existing_dir(path: str) -> str:
+    """存在する最も近い親ディレクトリ（移動先フォルダが未作成でもデバイスを判定できるように）"""
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def _same_device(a: str, b: str) -> bool:
+    try:
+        return os.stat(_existing_dir(a)).st_dev == os.stat(_existing_dir(b)).st_dev
+    except OSError:
+        return False
+
+def _transfer(src: str, dst: str, mode: str):
+    """1ファイルを移動（renameは同一デバイス、copyはコピーしてから元を削除）"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if mode == 'rename':
+        os.rename(src, dst)
+        return
+    tmp_path = dst + PARTIAL_SUFFIX
+    shutil.copy2(src, tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, dst)
+    os.unlink(src)
+
+def _place(src: str, dst: str):
+    """srcをdstに移す（dstが既にある場合は上書きせずにFileExistsError）"""
+    try:
+        # ハードリンクは移動先があると失敗するため、確認と移動の間に作られたファイルも上書きしない
+        os.link(src, dst, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError:
+        # ハードリンクを作れないファイルシステム
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+def _apply_step(src: str, dst: Optional[str], mode: str):
+    """
+    手順を実行（実行時に使う。移動先は上書きしない）
+    Raises:
+        FileExistsError: 計画の後に移動先に同名のファイルが作られた場合（移動元はそのまま残る）
+    """
+    if dst is None:
+        os.unlink(src)
+        return
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if mode == 'rename':
+        _place(src, dst)
+        return
+    tmp_path = dst + PARTIAL_SUFFIX
+    shutil.copy2(src, tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    try:
+        _place(tmp_path, dst)
+    except FileExistsError:
+        os.unlink(tmp_path)
+        raise
+    os.unlink(src)
+
+def _same_file(a: str, b: str) -> bool:
+    """同じファイル（ハードリンク）か、内容が同じか"""
+    try:
+        return os.path.samefile(a, b) or filecmp.cmp(a, b, shallow=False)
+    except OSError:
+        return False
+
+def _redo_step(src: str, dst: Optional[str], mode: str):
+    """手順を最後まで進める（復旧時に使う。何度実行しても同じ結果になる）"""
+    if dst is None:
+        # 直接削除
+        if os.path.lexists(src):
+            os.unlink(src)
+        return
+    if os.path.exists(dst + PARTIAL_SUFFIX):
+        os.unlink(dst + PARTIAL_SUFFIX)
+    if os.path.lexists(src):
+        if os.path.lexists(dst):
+            if not _same_file(src, dst):
+                # このバッチが作ったものではない（実行時に競合として除外した項目）
+                raise FileExistsError(errno.EEXIST, '同名のファイルが移動先に存在します', dst)
+            # コピーは完了していて元の削除だけが残っている
+            os.unlink(src)
+        else:
+            _transfer(src, dst, mode)
+
+def _undo_step(src: str, dst: Optional[str], mode: str):
+    """手順を取り消す（何度実行しても同じ結果になる）"""
+    if dst is None:
+        return
+    if os.path.exists(dst + PARTIAL_SUFFIX):
+        os.unlink(dst + PARTIAL_SUFFIX)
+    if os.path.lexists(dst):
+        if os.path.lexists(src):
+            if _same_file(src, dst):
+                # 元の削除前に止まった（コピーした側を消すだけでよい）
+                os.unlink(dst)
+            # 内容が違う場合は移動先のファイルはこのバッチのものではない
+        else:
+            _transfer(dst, src, mode)
+
+class FileOperations:
+    """ジャーナル付きの一括移動・削除"""
+
+    def __init__(self, journal_dir: str = FILE_OPS_DIR, workers: int = FILE_OPS_WORKERS,
+                 sync_limit: int = FILE_OPS_SYNC_LIMIT):
+        """
+        初期化
+        Args:
+            journal_dir: ジャーナルと削除待ちファイルの保存先
+            workers: 別デバイス間のコピーに使うスレッド数
+            sync_limit: この枚数までは呼び出し元で完了を待つ
+        """
+        self.journal_dir = journal_dir
+        self.workers = workers
+        self.sync_limit = sync_limit
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()  # バッチは1つずつ実行する（同じフォルダへの同時操作を避ける）
+        self._batches: Dict[str, dict] = OrderedDict()
+        self._cancel_flags: Dict[str, threading.Event] = {}
+        os.makedirs(journal_dir, exist_ok=True)
+
+    # ------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------
+
+    def move(self, src_folder: str, dst_folder: str, names: Iterable[str], wait: Optional[bool] = None) -> dict:
+        """
+        画像とラベルをフォルダ間で移動
+        Args:
+            src_folder: 移動元（インデックスのフォルダ名、例: datasets/default）
+            dst_folder: 移動先
+            names: 画像ファイル名
+            wait: 完了まで待つか（省略時は枚数がsync_limit以下なら待つ）
+        Returns:
+            バッチの状態（statusの辞書）
+        """
+        return self._submit('move', src_folder, dst_folder, list(names), wait)
+
+    def delete(self, folder: str, names: Iterable[str], wait: Optional[bool] = None) -> dict:
+        """画像とラベルを削除（引数・戻り値はmoveと同じ）"""
+        return self._submit('delete', folder, None, list(names), wait)
+
+    def status(self, batch_id: str) -> Optional[dict]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            return self._public(batch) if batch else None
+
+    def list_batches(self) -> List[dict]:
+        """実行中と最近のバッチ（新しい順）"""
+        with self._lock:
+            return [self._public(batch) for batch in reversed(self._batches.values())]
+
+    def cancel(self, batch_id: str) -> bool:
+        """実行中のバッチを中止（処理済みのファイルは元に戻す）"""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None or batch['status'] in FINISHED_STATUSES:
+                return False
+            self._cancel_flags[batch_id].set()
+            return True
+
+    def recover(self, mode: str = FILE_OPS_RECOVERY) -> List[dict]:
+        """
+        前回中断したバッチを処理（起動時に呼ぶ）
+        Args:
+            mode: 'resume'（残りを実行する）/ 'rollback'（移動済みのファイルを元に戻す）
+                  ファイルの移動がすべて終わっていたバッチ（applied）は常に完了させる
+        Returns:
+            処理したバッチの状態
+        """
+        from core.dataset_index import get_dataset_index
+
+        results = []
+        # 実行中のバッチが終わるのを待ち、このプロセスで登録済みのバッチ（実行中・実行済み）は中断したものとして扱わない
+        with self._run_lock:
+            with self._lock:
+                live = set(self._batches)
+            for journal in self._pending_journals():
+                if journal['id'] in live:
+                    continue
+                rollback = mode == 'rollback' and journal['status'] != 'applied'
+                batch = dict(journal, total=len(journal['items']), done=0, failed=0, errors=[],
+                             started=time.time(), finished=None)
+                logger.warning(f"中断した一括操作を{'取り消します' if rollback else '再開します'}: "
+                               f"{batch['id']} ({batch['op']}, {len(batch['items'])}件)")
+                try:
+                    for item in batch['items']:
+                        try:
+                            if rollback:
+                                for src, dst in reversed(item['steps']):
+                                    _undo_step(src, dst, batch['mode'])
+                            else:
+                                for src, dst in item['steps']:
+                                    _redo_step(src, dst, batch['mode'])
+                                batch['done'] += 1
+                        except OSError as e:
+                            batch['failed'] += 1
+                            batch['errors'].append(f"{item['name']}: {e}")
+                    # どこまで反映済みか分からないため、関係するフォルダをディスクと突き合わせる
+                    folders = [batch['src_folder']] + ([batch['dst_folder']] if batch['dst_folder'] else [])
+                    get_dataset_index().sync(folders)
+                    if batch['errors']:
+                        # 残りは次回起動時に再度処理する
+                        batch['status'] = 'failed'
+                    else:
+                        self._purge(batch)
+                        batch['status'] = 'cancelled' if rollback else 'completed'
+                except Exception as e:
+                    logger.error(f"一括操作の復旧エラー {batch['id']}: {e}")
+                    batch['errors'].append(str(e))
+                    batch['status'] = 'failed'
+                batch['finished'] = time.time()
+                self._remember(batch)
+                results.append(self._public(batch))
+        return results
+
+    # ------------------------------------------------------------
+    # 計画
+    # ------------------------------------------------------------
+
+    def _submit(self, op: str, src_folder: str, dst_folder: Optional[str], names: List[str],
+                wait: Optional[bool]) -> dict:
+        batch = self._plan(op, src_folder, dst_folder, names)
+        self._remember(batch)
+        if wait is None:
+            wait = len(batch['items']) <= self.sync_limit
+        if wait:
+            self._run(batch)
+        else:
+            threading.Thread(target=self._run, args=(batch,), daemon=True,
+                             name=f"file-ops-{batch['id']}").start()
+        return self.status(batch['id'])
+
+    def _plan(self, op: str, src_folder: str, dst_folder: Optional[str], names: List[str]) -> dict:
+        """各画像の移動元・移動先を決める（存在しない画像・移動先の同名ファイルはエラーにして除外）"""
+        from core.dataset_index import get_dataset_index
+
+        index = get_dataset_index()
+        batch_id = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        trash_dir = os.path.join(self.journal_dir, batch_id + '.trash')
+        src_dir = index.image_path(src_folder, '')
+
+        if op == 'move':
+            mode = 'rename' if _same_device(src_dir, index.image_path(dst_folder, '')) else 'copy'
+        else:
+            # ゴミ箱が別デバイスの場合はコピーせずに直接削除する（取り消し不可）
+            mode = 'rename' if _same_device(src_dir, self.journal_dir) else 'unlink'
+
+        items = []
+        errors = []
+        seen = set()
+        for name in names:
+            if not name or os.path.basename(name) != name or name in ('.', '..'):
+                errors.append(f'{name}: ファイル名が不正です')
+                continue
+            if name in seen:
+                continue
+            seen.add(name)
+
+            src_image = index.image_path(src_folder, name)
+            src_label = index.label_path(src_folder, name)
+            if not os.path.isfile(src_image):
+                errors.append(f'{name}: ファイルが見つかりません')
+                continue
+
+            if op == 'move':
+                dst_image = index.image_path(dst_folder, name)
+                dst_label = index.label_path(dst_folder, name)
+                if os.path.lexists(dst_image) or os.path.lexists(dst_label):
+                    errors.append(f'{name}: 同名のファイルが移動先に存在します')
+                    continue
+            elif mode == 'unlink':
+                dst_image = dst_label = None
+            else:
+                dst_image = os.path.join(trash_dir, 'images', name)
+                dst_label = os.path.join(trash_dir, 'labels', os.path.basename(src_label))
+
+            steps = [[os.path.abspath(src_image), dst_image and os.path.abspath(dst_image)]]
+            if os.path.isfile(src_label):
+                steps.append([os.path.abspath(src_label), dst_label and os.path.abspath(dst_label)])
+            items.append({'name': name, 'steps': steps})
+
+        return {
+            'id': batch_id,
+            'op': op,
+            'mode': mode,
+            'src_folder': src_folder,
+            'dst_folder': dst_folder,
+            'items': items,
+            'status': 'pending',
+            'total': len(items),
+            'done': 0,
+            'failed': len(errors),
+            'errors': errors,
+            'created': time.time(),
+            'started': None,
+            'finished': None
+        }
+
+    # ------------------------------------------------------------
+    # 実行
+    # ------------------------------------------------------------
+
+    def _run(self, batch: dict):
+        cancel = self._cancel_flags[batch['id']]
+        with self._run_lock:
+            try:
+                batch['started'] = time.time()
+                if cancel.is_set():
+                    batch['status'] = 'cancelled'
+                    return
+                # ファイルに触れる前に計画を書く
+                batch['status'] = 'running'
+                self._write_journal(batch)
+
+                done_items = self._apply(batch, cancel)
+                if cancel.is_set():
+                    if batch['mode'] == 'unlink':
+                        # 直接削除したファイルは戻せないため、削除済みの分だけ反映する
+                        self._update_index(batch, [item['name'] for item in done_items])
+                    else:
+                        self._rollback(batch, done_items)
+                    batch['status'] = 'cancelled'
+                    self._remove_journal(batch)
+                    return
+
+                # ファイルの移動は完了（中断しても復旧時は取り消さずに完了させる）
+                self._write_journal(batch, 'applied')
+                self._update_index(batch, [item['name'] for item in done_items])
+                self._purge(batch)
+                batch['status'] = 'completed'
+            except Exception as e:
+                # ジャーナルは残し、次回起動時の復旧に任せる
+                logger.error(f"一括操作エラー {batch['id']}: {e}")
+                batch['errors'].append(str(e))
+                batch['status'] = 'failed'
+            finally:
+                batch['finished'] = time.time()
+                logger.info(f"一括操作 {batch['id']} ({batch['op']}): {batch['status']} "
+                            f"{batch['done']}/{batch['total']}件 {batch['finished'] - batch['started']:.2f}秒")
+
+    def _apply(self, batch: dict, cancel: threading.Event) -> List[dict]:
+        """各画像のファイルを移動（別デバイス間のコピーはスレッドで並列に行う）"""
+        done_items = []
+
+        def apply_item(item):
+            if cancel.is_set():
+                return
+            completed = []
+            try:
+                for src, dst in item['steps']:
+                    _apply_step(src, dst, batch['mode'])
+                    completed.append((src, dst))
+            except OSError as e:
+                # 画像とラベルの片方だけが移動した状態を残さない
+                for src, dst in reversed(completed):
+                    try:
+                        _undo_step(src, dst, batch['mode'])
+                    except OSError:
+                        pass
+                message = '同名のファイルが移動先に存在します' if isinstance(e, FileExistsError) else e
+                with self._lock:
+                    batch['failed'] += 1
+                    batch['errors'].append(f"{item['name']}: {message}")
+                return
+            with self._lock:
+                batch['done'] += 1
+                done_items.append(item)
+
+        if batch['mode'] == 'copy':
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='file-ops') as executor:
+                list(executor.map(apply_item, batch['items']))
+        else:
+            for item in batch['items']:
+                apply_item(item)
+        return done_items
+
+    def _rollback(self, batch: dict, done_items: List[dict]):
+        for item in reversed(done_items):
+            for src, dst in reversed(item['steps']):
+                try:
+                    _undo_step(src, dst, batch['mode'])
+                except OSError as e:
+                    batch['errors'].append(f"{item['name']}: 元に戻せません: {e}")
+            batch['done'] -= 1
+
+    def _update_index(self, batch: dict, names: List[str]):
+        from core.dataset_index import get_dataset_index
+
+        if not names:
+            return
+        index = get_dataset_index()
+        if batch['op'] == 'move':
+            index.move_images(batch['src_folder'], batch['dst_folder'], names)
+        else:
+            index.remove_images(batch['src_folder'], names)
+
+    def _purge(self, batch: dict):
+        """削除待ちのファイルとジャーナルを消す（これ以降は取り消せない）"""
+        shutil.rmtree(os.path.join(self.journal_dir, batch['id'] + '.trash'), ignore_errors=True)
+        self._remove_journal(batch)
+
+    # ------------------------------------------------------------
+    # ジャーナル
+    # ------------------------------------------------------------
+
+    def _journal_path(self, batch_id: str) -> str:
+        return os.path.join(self.journal_dir, batch_id + '.json')
+
+    def _write_journal(self, batch: dict, status: Optional[str] = None):
+        """一時ファイルに書いてfsyncしてから置き換える"""
+        journal = {key: batch[key] for key in ('id', 'op', 'mode', 'src_folder', 'dst_folder', 'created', 'items')}
+        journal['status'] = status or batch['status']
+        path = self._journal_path(batch['id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(journal, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(self.journal_dir)
+
+    def _remove_journal(self, batch: dict):
+        try:
+            os.remove(self._journal_path(batch['id']))
+        except FileNotFoundError:
+            pass
+
+    def _pending_journals(self) -> List[dict]:
+        journals = []
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.journal_dir, name), 'r') as f:
+                    journals.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"ジャーナルを読み込めません {name}: {e}")
+        return journals
+
+    # ------------------------------------------------------------
+    # 状態
+    # ------------------------------------------------------------
+
+    def _remember(self, batch: dict):
+        with self._lock:
+            self._batches[batch['id']] = batch
+            self._cancel_flags.setdefault(batch['id'], threading.Event())
+            finished = [key for key, value in self._batches.items() if value['status'] in FINISHED_STATUSES]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED)]:
+                del self._batches[key]
+                self._cancel_flags.pop(key, None)
+
+    @staticmethod
+    def _public(batch: dict) -> dict:
+        total = batch['total']
+        return {
+            'id': batch['id'],
+            'op': batch['op'],
+            'mode': batch['mode'],
+            'src_folder': batch['src_folder'],
+            'dst_folder': batch['dst_folder'],
+            'status': batch['status'],
+            'total': total,
+            'done': batch['done'],
+            'failed': batch['failed'],
+            'errors': list(batch['errors']),
+            'progress': 100 if batch['status'] in FINISHED_STATUSES else
+                        int(100 * batch['done'] / total) if total else 0,
+            'created': batch['created'],
+            'started': batch['started'],
+            'finished': batch['finished']
+        }
+
+# シングルトンインスタンス
+_file_ops_instance: Optional[FileOperations] = None
+_file_ops_lock = threading.Lock()
+
+def get_file_operations() -> FileOperations:
+    """一括ファイル操作を取得（シングルトン）"""
+    global _file_ops_instance
+    with _file_ops_lock:
+        if _file_ops_instance is None:
+            _file_ops_instance = FileOperations()
+        return _file_ops_instance
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='一括ファイル操作のジャーナル')
+    parser.add_argument('command', choices=['list', 'recover'])
+    parser.add_argument('--rollback', action='store_true', help='中断したバッチを再開せずに取り消す')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    operations = get_file_operations()
+    if args.command == 'list':
+        result = [{key: journal[key] for key in ('id', 'op', 'status', 'src_folder', 'dst_folder')}
+                  for journal in operations._pending_journals()]
+    else:
+        result = operations.recover('rollback' if args.rollback else 'resume')
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
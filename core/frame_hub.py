@@ -0,0 +1,77 @@
+"""
+フレームハブモジュール
+キャプチャスレッドが取得した最新フレームを複数の配信先へ配る（ビジーループ・フレームコピーなし）
+"""
+
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+class FrameHub:
+    """最新フレームの配信ハブ
+
+    キャプチャスレッドがpublish()したフレームを、各配信先はwait_next()で新しいフレームが
+    届くまで待機して受け取る。フレームは共有されるため、受け取った側で書き換えてはならない。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame: Optional[np.ndarray] = None
+        self._timestamp = 0.0  # time.monotonic()基準の取得時刻
+        self._seq = 0
+        self._closed = False
+
+        # 同じフレームを複数の視聴者へ配信する際にJPEGエンコードを1回で済ませるためのキャッシュ
+        self._encoded_lock = threading.Lock()
+        self._encoded_seq = -1
+        self._encoded: Optional[bytes] = None
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def publish(self, frame: np.ndarray, timestamp: Optional[float] = None) -> int:
+        """新しいフレームを公開して待機中の配信先を起こす"""
+        with self._condition:
+            self._frame = frame
+            self._timestamp = timestamp if timestamp is not None else time.monotonic()
+            self._seq += 1
+            self._closed = False
+            self._condition.notify_all()
+            return self._seq
+
+    def latest(self) -> Tuple[int, Optional[np.ndarray], float]:
+        """最新フレームを取得（待機しない）"""
+        with self._condition:
+            return self._seq, self._frame, self._timestamp
+
+    def wait_next(self, last_seq: int, timeout: Optional[float] = 1.0) -> Optional[Tuple[int, np.ndarray, float]]:
+        """
+        last_seqより新しいフレームが届くまで待機
+        Args:
+            last_seq: 前回受け取ったフレームの通し番号（初回は0）
+            timeout: 待機の上限（秒）
+        Returns:
+            (通し番号, フレーム, 取得時刻)。タイムアウトまたはclose()時はNone
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > last_seq or self._closed, timeout)
+            if self._seq <= last_seq or self._frame is None:
+                return None
+            return self._seq, self._frame, self._timestamp
+
+    def encoded(self, seq: int, frame: np.ndarray, encoder: Callable[[np.ndarray], Optional[bytes]]) -> Optional[bytes]:
+        """フレームのエンコード結果を通し番号ごとに共有（最新フレームのみ保持）"""
+        with self._encoded_lock:
+            if self._encoded_seq != seq:
+                self._encoded = encoder(frame)
+                self._encoded_seq = seq
+            return self._encoded
+
+    def close(self):
+        """キャプチャ停止時に待機中の配信先を解放"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
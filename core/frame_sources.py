@@ -0,0 +1,238 @@
+"""
+フレームソースモジュール
+実カメラの代わりに動画ファイル・画像フォルダ・合成映像をCameraManagerに供給する
+（マイクロスコープなしでの負荷試験・回帰試験用。GPU・ディスプレイ不要）
+"""
+
+import cv2
+import numpy as np
+import os
+import time
+import logging
+from typing import Optional, Tuple
+
+from app_utils.jpeg_codec import read_image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class FrameSource:
+    """フレームソースの基底クラス（cv2.VideoCaptureと同じインターフェース）"""
+
+    backend_name = 'SOURCE'
+
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.opened = True
+        self._next_deadline = 0.0
+        self._grabbed = False
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def grab(self) -> bool:
+        """次のフレーム時刻まで待機してフレームを確保（実カメラと同様にブロックする）"""
+        if not self.opened:
+            return False
+        self._wait_next_frame()
+        self._grabbed = self._advance()
+        return self._grabbed
+
+    def retrieve(self) -> Tuple[bool, Optional[np.ndarray]]:
+        """grab()で確保したフレームを取得"""
+        if not self._grabbed:
+            return False, None
+        frame = self._render()
+        return frame is not None, frame
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop_id: int, value: float) -> bool:
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        elif prop_id == cv2.CAP_PROP_FPS and value > 0:
+            self.fps = float(value)
+        else:
+            return False
+        return True
+
+    def get(self, prop_id: int) -> float:
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        return 0.0
+
+    def getBackendName(self) -> str:
+        return self.backend_name
+
+    def release(self):
+        self.opened = False
+
+    def _wait_next_frame(self):
+        """設定FPSに合わせてペーシング"""
+        interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        now = time.monotonic()
+        if self._next_deadline > now:
+            time.sleep(self._next_deadline - now)
+            now = self._next_deadline
+        # 処理が遅れた場合は追いつこうとせず現在時刻から再開
+        self._next_deadline = max(self._next_deadline + interval, now)
+
+    def _advance(self) -> bool:
+        """次のフレームに進める（サブクラスで実装）"""
+        raise NotImplementedError
+
+    def _render(self) -> Optional[np.ndarray]:
+        """現在のフレームを生成（サブクラスで実装）"""
+        raise NotImplementedError
+
+class SyntheticSource(FrameSource):
+    """合成映像ソース（移動する円とフレーム番号を描画）"""
+
+    backend_name = 'SYNTHETIC'
+
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0, seed: int = 0):
+        super().__init__(width, height, fps)
+        self.frame_index = -1
+        self._rng = np.random.default_rng(seed)
+        self._objects = self._rng.uniform(0.1, 0.9, (4, 2))
+        self._velocities = self._rng.uniform(-0.01, 0.01, (4, 2))
+        self._background = None
+
+    def _advance(self) -> bool:
+        self.frame_index += 1
+        self._objects += self._velocities
+        # 端で反射
+        bounced = (self._objects < 0.05) | (self._objects > 0.95)
+        self._velocities[bounced] *= -1
+        self._objects = np.clip(self._objects, 0.05, 0.95)
+        return True
+
+    def _render(self) -> np.ndarray:
+        if self._background is None or self._background.shape[:2] != (self.height, self.width):
+            yy, xx = np.mgrid[0:self.height, 0:self.width]
+            base = ((xx / max(self.width, 1)) * 120 + (yy / max(self.height, 1)) * 60 + 40).astype(np.uint8)
+            self._background = cv2.merge([base, base, base])
+
+        frame = self._background.copy()
+        radius = max(8, min(self.width, self.height) // 12)
+        colors = [(255, 0, 0), (255, 0, 255), (0, 255, 0), (0, 165, 255)]
+        for (x, y), color in zip(self._objects, colors):
+            cv2.circle(frame, (int(x * self.width), int(y * self.height)), radius, color, -1)
+
+        cv2.putText(frame, f"#{self.frame_index}", (10, self.height - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        return frame
+
+class VideoFileSource(FrameSource):
+    """動画ファイルソース（終端でループ再生）"""
+
+    backend_name = 'VIDEO_FILE'
+
+    def __init__(self, path: str, fps: Optional[float] = None, loop: bool = True):
+        self.path = path
+        self.loop = loop
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise IOError(f"動画ファイルを開けません: {path}")
+
+        file_fps = self._capture.get(cv2.CAP_PROP_FPS)
+        super().__init__(
+            int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            fps or (file_fps if file_fps > 0 else 30.0)
+        )
+
+    def set(self, prop_id: int, value: float) -> bool:
+        # 動画の解像度は変更できないため、FPS（再生速度）のみ受け付ける
+        if prop_id == cv2.CAP_PROP_FPS:
+            return super().set(prop_id, value)
+        return False
+
+    def _advance(self) -> bool:
+        if self._capture.grab():
+            return True
+        if not self.loop:
+            return False
+        self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self._capture.grab()
+
+    def _render(self) -> Optional[np.ndarray]:
+        ret, frame = self._capture.retrieve()
+        return frame if ret else None
+
+    def release(self):
+        super().release()
+        self._capture.release()
+
+class ImageFolderSource(FrameSource):
+    """画像フォルダソース（ファイル名順に一定FPSで繰り返し再生）"""
+
+    backend_name = 'IMAGE_FOLDER'
+
+    def __init__(self, folder: str, fps: float = 5.0, loop: bool = True):
+        self.folder = folder
+        self.loop = loop
+        self.files = sorted(
+            os.path.join(folder, f) for f in os.listdir(folder)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise IOError(f"画像が見つかりません: {folder}")
+
+        first = read_image(self.files[0])
+        height, width = first.shape[:2] if first is not None else (480, 640)
+        super().__init__(width, height, fps)
+        self.position = -1
+
+    def set(self, prop_id: int, value: float) -> bool:
+        if prop_id == cv2.CAP_PROP_FPS:
+            return super().set(prop_id, value)
+        return False
+
+    def _advance(self) -> bool:
+        if self.position + 1 >= len(self.files):
+            if not self.loop:
+                return False
+            self.position = -1
+        self.position += 1
+        return True
+
+    def _render(self) -> Optional[np.ndarray]:
+        frame = read_image(self.files[self.position])
+        if frame is None:
+            logger.warning(f"画像を読み込めません: {self.files[self.position]}")
+        return frame
+
+def create_frame_source(spec: str, width: int = 640, height: int = 480, fps: float = 30.0) -> FrameSource:
+    """
+    指定文字列からフレームソースを作成
+    Args:
+        spec: 'synthetic' / 'video:<パス>' / 'folder:<パス>'（プレフィックスなしのパスは種類を自動判別）
+        width, height, fps: 合成映像の解像度・FPS（画像フォルダではFPSのみ使用）
+    Returns:
+        FrameSource
+    """
+    kind, _, target = spec.partition(':')
+    if kind == 'synthetic':
+        return SyntheticSource(width, height, fps)
+    if kind == 'video' and target:
+        return VideoFileSource(target)
+    if kind == 'folder' and target:
+        return ImageFolderSource(target, fps=fps)
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, fps=fps)
+    if os.path.isfile(spec):
+        return VideoFileSource(spec)
+    raise ValueError(f"不明なフレームソース指定です: {spec}")
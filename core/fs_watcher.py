@@ -0,0 +1,308 @@
+"""
+ファイル変更監視モジュール
+学習データ（手作業での追加・顕微鏡PCからのrsync）やYOLOv5の学習結果（runs/）の変更を監視し、
+まとめた変更（変更のあったディレクトリの集合）を登録されたコールバックへ通知する。
+データセットインデックス・サムネイル・学習結果一覧などの派生キャッシュは、全体を走査し直さずに
+変更のあったディレクトリだけを更新できる。
+
+inotify（オプション依存: pip install inotify_simple）が使える場合はそれを使い、
+使えない環境（macOS・Windows・NFSなど）ではos.scandirによる更新時刻のポーリングで検出する。
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import WATCHER_BACKEND, WATCHER_DEBOUNCE, WATCHER_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# オプション依存: inotify_simple（Linuxのみ）
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+    inotify_flags = None
+
+# 変更が続いている場合でも、この秒数ごとには通知する（rsync中も一覧を少しずつ反映する）
+MAX_DEBOUNCE_DELAY = 5.0
+
+ChangeCallback = Callable[[Set[str]], None]
+
+def available_backends() -> List[str]:
+    """利用可能な監視方式（優先順）"""
+    backends = []
+    if INotify is not None:
+        backends.append('inotify')
+    backends.append('polling')
+    return backends
+
+class FileWatcher:
+    """ディレクトリツリーの変更を監視してデバウンスした通知を送る"""
+
+    def __init__(self, backend: str = WATCHER_BACKEND, debounce: float = WATCHER_DEBOUNCE,
+                 poll_interval: float = WATCHER_POLL_INTERVAL):
+        """
+        初期化
+        Args:
+            backend: 'auto' / 'inotify' / 'polling'
+            debounce: 最後の変更からこの秒数だけ待ってまとめて通知する
+            poll_interval: ポーリング方式の走査間隔（秒）
+        """
+        backends = available_backends()
+        if backend == 'auto':
+            backend = backends[0]
+        elif backend not in backends:
+            logger.warning(f"ファイル監視方式 {backend} が利用できないため {backends[0]} を使用します")
+            backend = backends[0]
+        self.backend = backend
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self._callbacks: Dict[str, List[ChangeCallback]] = {}
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Set[str]] = {}
+        self._first_pending_at: Optional[float] = None
+        self._last_change_at = 0.0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        # ポーリング用: ディレクトリ -> (ディレクトリの更新時刻, {ファイル名: (更新時刻, サイズ)})
+        self._snapshots: Dict[str, Tuple[int, Dict[str, Tuple[int, int]]]] = {}
+        # inotify用
+        self._inotify = None
+        self._watch_dirs: Dict[int, str] = {}
+
+    # ------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------
+
+    def watch(self, root: str, callback: ChangeCallback):
+        """
+        ディレクトリツリーの監視を登録（存在しないディレクトリは作成されるのを待つ）
+        同じディレクトリに同じコールバックを登録済みの場合は何もしない（起動処理が重複しても通知は1回）
+        Args:
+            root: 監視するディレクトリ
+            callback: 変更のあったディレクトリ（絶対パス）の集合を受け取る関数
+        """
+        root = os.path.abspath(root)
+        with self._lock:
+            callbacks = self._callbacks.setdefault(root, [])
+            if callback in callbacks:
+                return
+            callbacks.append(callback)
+        if self.is_running:
+            self._add_root(root)
+
+    def is_watching(self, path: str) -> bool:
+        """pathが監視中のツリーに含まれるかどうか"""
+        if not self.is_running:
+            return False
+        path = os.path.abspath(path)
+        return any(path == root or path.startswith(root + os.sep) for root in self._callbacks)
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._threads) and not self._stop.is_set()
+
+    def start(self):
+        """監視を開始"""
+        if self.is_running:
+            return
+        self._stop.clear()
+        if self.backend == 'inotify':
+            self._inotify = INotify()
+            target = self._run_inotify
+        else:
+            target = self._run_polling
+        for root in list(self._callbacks):
+            self._add_root(root)
+
+        self._threads = [
+            threading.Thread(target=target, daemon=True, name='fs-watcher'),
+            threading.Thread(target=self._run_dispatcher, daemon=True, name='fs-watcher-dispatch')
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"ファイル監視を開始（{self.backend}）: {list(self._callbacks)}")
+
+    def stop(self):
+        """監視を停止"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watch_dirs.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'running': self.is_running,
+            'roots': list(self._callbacks),
+            'watched_directories': len(self._watch_dirs) if self.backend == 'inotify' else len(self._snapshots)
+        }
+
+    # ------------------------------------------------------------
+    # 通知（デバウンス）
+    # ------------------------------------------------------------
+
+    def _notify(self, directory: str):
+        """変更のあったディレクトリを記録（通知はディスパッチャが行う）"""
+        now = time.monotonic()
+        with self._lock:
+            for root in self._callbacks:
+                if directory == root or directory.startswith(root + os.sep):
+                    self._pending.setdefault(root, set()).add(directory)
+            if self._first_pending_at is None:
+                self._first_pending_at = now
+            self._last_change_at = now
+
+    def _run_dispatcher(self):
+        while not self._stop.wait(min(self.debounce, 0.1) or 0.1):
+            now = time.monotonic()
+            with self._lock:
+                if not self._pending:
+                    continue
+                quiet = now - self._last_change_at >= self.debounce
+                overdue = now - self._first_pending_at >= MAX_DEBOUNCE_DELAY
+                if not (quiet or overdue):
+                    continue
+                pending, self._pending = self._pending, {}
+                self._first_pending_at = None
+                callbacks = {root: list(self._callbacks.get(root, [])) for root in pending}
+
+            for root, directories in pending.items():
+                for callback in callbacks[root]:
+                    try:
+                        callback(directories)
+                    except Exception as e:
+                        logger.error(f"ファイル変更通知の処理エラー ({root}): {e}")
+
+    # ------------------------------------------------------------
+    # inotify
+    # ------------------------------------------------------------
+
+    def _add_root(self, root: str):
+        # ポーリング方式では監視スレッドの初回走査で基準を作る
+        if self.backend == 'inotify' and os.path.isdir(root):
+            self._add_tree(root)
+
+    def _add_tree(self, directory: str):
+        mask = (inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.CLOSE_WRITE |
+                inotify_flags.MOVED_FROM | inotify_flags.MOVED_TO | inotify_flags.DELETE_SELF |
+                inotify_flags.ATTRIB)
+        for dirpath, dirnames, filenames in os.walk(directory):
+            try:
+                wd = self._inotify.add_watch(dirpath, mask)
+                self._watch_dirs[wd] = dirpath
+            except OSError as e:
+                # 監視数の上限（fs.inotify.max_user_watches）など
+                logger.warning(f"ディレクトリを監視できません {dirpath}: {e}")
+
+    def _run_inotify(self):
+        waiting_roots = set()
+        while not self._stop.is_set():
+            # まだ存在しないルートが作成されたら監視を追加
+            for root in list(self._callbacks):
+                watched = root in self._watch_dirs.values()
+                if not watched and os.path.isdir(root):
+                    self._add_tree(root)
+                    if root in waiting_roots:
+                        self._notify(root)
+                        waiting_roots.discard(root)
+                elif not watched:
+                    waiting_roots.add(root)
+
+            try:
+                events = self._inotify.read(timeout=int(self.poll_interval * 1000))
+            except OSError as e:
+                logger.error(f"inotify読み込みエラー: {e}")
+                time.sleep(self.poll_interval)
+                continue
+
+            for event in events:
+                if event.mask & inotify_flags.Q_OVERFLOW:
+                    # イベントが溢れた場合はルート全体を変更ありとする
+                    for root in self._callbacks:
+                        self._notify(root)
+                    continue
+                directory = self._watch_dirs.get(event.wd)
+                if directory is None:
+                    continue
+                if event.mask & inotify_flags.IGNORED:
+                    self._watch_dirs.pop(event.wd, None)
+                    continue
+                self._notify(directory)
+                if event.mask & inotify_flags.ISDIR and event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    # 新しいサブディレクトリ（中身ごと移動してきた場合も含む）
+                    path = os.path.join(directory, event.name)
+                    self._add_tree(path)
+                    for dirpath, dirnames, filenames in os.walk(path):
+                        self._notify(dirpath)
+
+    # ------------------------------------------------------------
+    # ポーリング
+    # ------------------------------------------------------------
+
+    def _run_polling(self):
+        initialized = set()
+        while not self._stop.is_set():
+            for root in list(self._callbacks):
+                try:
+                    # 初回の走査結果を基準にする（既存ファイルは変更として通知しない）
+                    self._scan_tree(root, notify=root in initialized)
+                    initialized.add(root)
+                except Exception as e:
+                    logger.error(f"ファイル監視の走査エラー ({root}): {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _scan_tree(self, root: str, notify: bool):
+        """ツリーを走査し、前回から変わったディレクトリを通知"""
+        seen = set()
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime_ns
+                files = {}
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            st = entry.stat()
+                            files[entry.name] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+
+            seen.add(directory)
+            snapshot = (dir_mtime, files)
+            old = self._snapshots.get(directory)
+            if old != snapshot:
+                self._snapshots[directory] = snapshot
+                if notify:
+                    self._notify(directory)
+
+        # 削除されたディレクトリ
+        prefix = root + os.sep
+        for directory in [d for d in self._snapshots if (d == root or d.startswith(prefix)) and d not in seen]:
+            del self._snapshots[directory]
+            if notify:
+                self._notify(directory)
+
+# シングルトンインスタンス
+_watcher_instance: Optional[FileWatcher] = None
+_watcher_lock = threading.Lock()
+
+def get_file_watcher() -> FileWatcher:
+    """ファイル監視インスタンスを取得（シングルトン）"""
+    global _watcher_instance
+    with _watcher_lock:
+        if _watcher_instance is None:
+            _watcher_instance = FileWatcher()
+        return _watcher_instance
@@ -0,0 +1,182 @@
+"""
+推論プールモジュール
+複数カメラ・複数視聴者からの判定要求を1つの推論スレッドに集約し、バッチ推論する
+"""
+
+import threading
+import queue
+import time
+import logging
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT
+from core.realtime_detector import RealtimeDetector, DetectionResult, get_detector_instance
+
+logger = logging.getLogger(__name__)
+
+class InferencePool:
+    """共有バッチ推論プール
+
+    要求は(カメラインデックス, フレーム通し番号)で識別し、同じフレームに対する要求は
+    1回の推論結果を共有する。異なるカメラのフレームは同じforwardパスでまとめて処理する。
+    """
+
+    def __init__(self, detector: RealtimeDetector, max_batch: int = INFERENCE_MAX_BATCH,
+                 max_wait: float = INFERENCE_MAX_WAIT):
+        """
+        初期化
+        Args:
+            detector: 推論に使う検出器
+            max_batch: 1回の推論にまとめる最大フレーム数
+            max_wait: 最初の要求が届いてから他の要求を待つ最大時間（秒）
+        """
+        self.detector = detector
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[Tuple[int, int], np.ndarray, Future]]" = queue.Queue()
+        self._pending: Dict[Tuple[int, int], Future] = {}
+        self._latest: Dict[int, Tuple[int, Future]] = {}  # カメラごとの最新の結果
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+        # 統計
+        self.batches = 0
+        self.frames = 0
+
+    def submit(self, camera_index: int, seq: int, frame: np.ndarray) -> Future:
+        """
+        フレームの判定を要求
+        Args:
+            camera_index: カメラインデックス
+            seq: フレーム通し番号（FrameHub）
+            frame: 入力フレーム（推論中に書き換えないこと）
+        Returns:
+            検出結果のリストを返すFuture
+        """
+        key = (camera_index, seq)
+        with self._lock:
+            latest = self._latest.get(camera_index)
+            if latest and latest[0] == seq:
+                return latest[1]
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+
+            future = Future()
+            self._pending[key] = future
+            self._latest[camera_index] = (seq, future)
+            self._ensure_worker()
+        self._queue.put((key, frame, future))
+        return future
+
+    def detect(self, camera_index: int, seq: int, frame: np.ndarray,
+               timeout: Optional[float] = None) -> List[DetectionResult]:
+        """判定を要求して結果を待つ"""
+        return self.submit(camera_index, seq, frame).result(timeout)
+
+    def get_stats(self) -> dict:
+        """推論プールの統計を取得"""
+        return {
+            'batches': self.batches,
+            'frames': self.frames,
+            'avg_batch_size': self.frames / self.batches if self.batches else 0,
+            'queued': self._queue.qsize(),
+            'max_batch': self.max_batch
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _collect_batch(self) -> Tuple[List[Tuple[Tuple[int, int], np.ndarray, Future]], List[Tuple[int, int]]]:
+        """
+        最初の要求を待ち、max_waitの間に届いた要求をまとめる
+        Returns:
+            (推論する要求, 新しいフレームに置き換えた要求のキー)
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+
+        # 同じカメラの古いフレームは新しいフレームで置き換える（結果は新しいフレームのものを返す）
+        newest: Dict[int, Tuple[Tuple[int, int], np.ndarray, Future]] = {}
+        superseded: List[Tuple[Tuple[int, int], Future, Future]] = []
+        for item in batch:
+            camera_index = item[0][0]
+            previous = newest.get(camera_index)
+            if previous is None or item[0][1] > previous[0][1]:
+                if previous is not None:
+                    superseded.append((previous[0], previous[2], item[2]))
+                newest[camera_index] = item
+            else:
+                superseded.append((item[0], item[2], previous[2]))
+
+        for _, old_future, new_future in superseded:
+            new_future.add_done_callback(lambda f, old=old_future: self._copy_result(f, old))
+
+        return list(newest.values()), [key for key, _, _ in superseded]
+
+    @staticmethod
+    def _resolve(future: Future, result=None, exception: Optional[BaseException] = None):
+        """結果を設定（要求元がキャンセル済みの場合は何もしない）"""
+        if future.done():
+            return
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            # 確認の直後に別のスレッドでキャンセルされた
+            pass
+
+    @classmethod
+    def _copy_result(cls, source: Future, target: Future):
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            cls._resolve(target, exception=source.exception())
+        else:
+            cls._resolve(target, source.result())
+
+    def _run(self):
+        """推論スレッド"""
+        while True:
+            batch, superseded = self._collect_batch()
+            keys = [item[0] for item in batch] + superseded
+            try:
+                results = self.detector.detect_batch([item[1] for item in batch])
+                for (_, _, future), detections in zip(batch, results):
+                    self._resolve(future, detections)
+            except Exception as e:
+                logger.error(f"バッチ推論エラー: {e}")
+                for _, _, future in batch:
+                    self._resolve(future, exception=e)
+            finally:
+                self.batches += 1
+                self.frames += len(batch)
+                with self._lock:
+                    for key in keys:
+                        self._pending.pop(key, None)
+
+# シングルトンインスタンス
+_pool_instance: Optional[InferencePool] = None
+_pool_lock = threading.Lock()
+
+def get_inference_pool() -> InferencePool:
+    """推論プールを取得（シングルトン、検出器はget_detector_instanceと共有）"""
+    global _pool_instance
+    with _pool_lock:
+        if _pool_instance is None:
+            _pool_instance = InferencePool(get_detector_instance())
+        return _pool_instance
@@ -0,0 +1,389 @@
+"""
+近似重複の検出モジュール
+同じウニを少しずつずらして撮影した画像は、学習時間を増やすうえに訓練と検証の両方に入ると検証の精度が
+実際より高く出てしまう。画像ごとに知覚ハッシュ（dHash・pHash、各64ビット）をプロセスプールで計算して
+データセットインデックスに保存し、近い画像をクラスタにまとめる。
+
+ハッシュは画像の内容のハッシュ（SHA-256）ごとに保存するため、移動・名前変更では再計算しない。
+dHash・pHashの両方の距離が閾値以下のものを近似重複とし、距離はnumpyでまとめて計算する。
+近い画像の組（グラフ）は閾値ごとにハッシュの表が変わるまで使い回す。
+クラスタは代表の画像（近い画像の多いものから順に選ぶ）からの距離で決めるため、
+少しずつ違う画像が連鎖して1つの大きなクラスタになることはない。
+
+未計算のハッシュが多い場合はリクエスト内では計算せず、処理キュー（app_utils.worker）で計算する。
+
+コマンドラインからの実行:
+    python -m core.near_duplicates update [--folder datasets/default]
+    python -m core.near_duplicates clusters [--folder datasets/default] [--threshold 10]
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_WORKERS, NEAR_DUPLICATE_SYNC_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# これより少ない枚数ならプロセスを起動せずに計算する
+MIN_PARALLEL_FILES = 16
+
+# 一度に保存する件数（大量の画像でも途中までの結果を残す）
+STORE_BATCH_SIZE = 500
+
+def dhash(gray: np.ndarray) -> int:
+    """差分ハッシュ（9x8に縮小し、横に隣り合う画素の大小を64ビットにする）"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def phash(gray: np.ndarray) -> int:
+    """知覚ハッシュ（32x32のDCTの低周波8x8成分を、直流成分を除いた中央値と比べて64ビットにする）"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    bits = low > np.median(low.flatten()[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def _hash_one(path: str) -> dict:
+    """画像1枚のハッシュ（プロセスプールで実行、JPEGは1/4に縮小しながらデコードする）"""
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+        gray = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            return {'error': '画像を読み込めません'}
+        return {'dhash': dhash(gray), 'phash': phash(gray), 'error': None}
+    except Exception as e:
+        return {'error': str(e)}
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """uint64の配列の各要素の1のビット数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    values = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    values = (values & np.uint64(0x3333333333333333)) + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    values = (values + (values >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (values * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+class HashGraph:
+    """知覚ハッシュが近い組のグラフ（内容のハッシュごと、隣接リストはCSR形式で持つ）"""
+
+    # 一度に距離を計算する行数（行数 x ハッシュ数 の配列を作る）
+    CHUNK_ROWS = 256
+
+    def __init__(self, hashes: List[tuple], threshold: int):
+        """
+        Args:
+            hashes: (digest, dhash, phash) の組
+            threshold: dHash・pHashの両方がこの距離以下の組をつなぐ
+        """
+        self.threshold = threshold
+        self.positions = {digest: i for i, (digest, _, _) in enumerate(hashes)}
+        self.dhash = np.array([h[1] for h in hashes], dtype=np.uint64)
+        self.phash = np.array([h[2] for h in hashes], dtype=np.uint64)
+
+        sources, targets = [], []
+        for start in range(0, len(hashes), self.CHUNK_ROWS):
+            block = self.dhash[start:start + self.CHUNK_ROWS]
+            rows, cols = np.nonzero(popcount(block[:, None] ^ self.dhash[None, :]) <= threshold)
+            rows += start
+            # dHashで絞った組だけpHashを比べる
+            keep = (rows != cols) & (popcount(self.phash[rows] ^ self.phash[cols]) <= threshold)
+            sources.append(rows[keep])
+            targets.append(cols[keep])
+        sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.intp)
+        targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.intp)
+        # 行ごとに並んでいるため、そのままCSRにできる
+        self.indptr = np.searchsorted(sources, np.arange(len(hashes) + 1))
+        self.indices = targets
+
+    def neighbors(self, position: int) -> np.ndarray:
+        return self.indices[self.indptr[position]:self.indptr[position + 1]]
+
+class NearDuplicateDetector:
+    """データセットインデックスの画像の近似重複を検出"""
+
+    def __init__(self, index=None, threshold: int = NEAR_DUPLICATE_THRESHOLD,
+                 workers: Optional[int] = NEAR_DUPLICATE_WORKERS):
+        """
+        初期化
+        Args:
+            index: データセットインデックス（省略時は共有のインスタンス）
+            threshold: 近似重複とみなすハミング距離の既定値
+            workers: ハッシュ計算のプロセス数（Noneの場合はCPUコア数）
+        """
+        self._index = index
+        self.threshold = threshold
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._graph_lock = threading.Lock()
+        self._graphs: Dict[int, Tuple[tuple, HashGraph]] = {}  # 閾値 -> (ハッシュの表の状態, グラフ)
+        self._generation = 0
+
+    @property
+    def index(self):
+        if self._index is None:
+            from core.dataset_index import get_dataset_index
+            self._index = get_dataset_index()
+        return self._index
+
+    def pending(self, prefix: Optional[str] = None) -> int:
+        """知覚ハッシュが未計算の画像の数"""
+        return len(self.index.images_without_hashes(prefix))
+
+    def ensure_hashes(self, prefixes: Iterable[Optional[str]], submit: Callable[[Optional[str]], str],
+                      sync_limit: int = NEAR_DUPLICATE_SYNC_LIMIT) -> List[str]:
+        """
+        リクエストの処理中に呼ぶ。未計算のハッシュが合わせてsync_limit枚以下ならその場で計算し、
+        多い場合はsubmit（処理キューに追加してタスクIDを返す関数）に任せる
+        Returns:
+            追加したタスクのID（その場で計算した場合は空）
+        """
+        prefixes = list(prefixes)
+        pending = {prefix: self.pending(prefix) for prefix in prefixes}
+        if sum(pending.values()) <= sync_limit:
+            for prefix, count in pending.items():
+                if count:
+                    self.update(prefix)
+            return []
+        return [submit(prefix) for prefix, count in pending.items() if count]
+
+    def update(self, prefix: Optional[str] = None, warm: bool = False) -> dict:
+        """
+        ハッシュが未計算の画像だけを計算して保存
+        Args:
+            prefix: 対象フォルダ（インデックスのフォルダ名、子フォルダを含む。Noneの場合はすべて）
+            warm: 既定の閾値のグラフも作っておく（処理キューで実行する場合）
+        """
+        with self._lock:
+            start = time.time()
+            pending = self.index.images_without_hashes(prefix)
+            stats = {'hashed': 0, 'errors': 0}
+            if pending:
+                paths = [self.index.image_path(row['folder'], row['name']) for row in pending]
+                if len(paths) < MIN_PARALLEL_FILES or self.workers == 1:
+                    results = map(_hash_one, paths)
+                    self._store(pending, paths, results, stats)
+                else:
+                    workers = self.workers or os.cpu_count() or 1
+                    with ProcessPoolExecutor(max_workers=workers) as executor:
+                        results = executor.map(_hash_one, paths, chunksize=max(1, len(paths) // (workers * 4)))
+                        self._store(pending, paths, results, stats)
+                self.index.prune_hashes()
+                self._generation += 1
+            stats['seconds'] = round(time.time() - start, 3)
+            if pending:
+                logger.info(f"知覚ハッシュ計算: {stats}")
+        if warm:
+            self._graph(self.threshold)
+        return stats
+
+    def neighbors(self, folder: str, name: str, threshold: Optional[int] = None,
+                  prefix: Optional[str] = None) -> List[dict]:
+        """
+        画像1枚に近い画像（距離の近い順、自分自身は除く、ハッシュが未計算の画像は含まない）
+        Args:
+            folder: インデックスのフォルダ名
+            name: 画像ファイル名
+            threshold: ハミング距離の閾値（省略時は既定値）
+            prefix: 探す範囲（Noneの場合はすべて）
+        """
+        threshold = self.threshold if threshold is None else threshold
+        rows = self.index.image_hashes(prefix)
+        target = next((row for row in rows if row['folder'] == folder and row['name'] == name), None)
+        if target is None and prefix is not None:
+            # 探す範囲の外の画像を基準にする場合
+            target = next((row for row in self.index.image_hashes(folder)
+                           if row['folder'] == folder and row['name'] == name), None)
+        if target is None:
+            if self.index.get_image(folder, name) is None:
+                raise KeyError(f'{folder}/{name}')
+            # ハッシュが未計算の画像1枚だけなら計算する
+            self.update(folder)
+            target = next((row for row in self.index.image_hashes(folder)
+                           if row['folder'] == folder and row['name'] == name), None)
+            if target is None:
+                raise KeyError(f'{folder}/{name}')
+
+        if not rows:
+            return []
+        distances = popcount(np.array([row['dhash'] for row in rows], dtype=np.uint64) ^ np.uint64(target['dhash']))
+        phash_distances = popcount(np.array([row['phash'] for row in rows], dtype=np.uint64) ^
+                                   np.uint64(target['phash']))
+        results = []
+        for i in np.nonzero((distances <= threshold) & (phash_distances <= threshold))[0]:
+            row = rows[i]
+            if row['folder'] == folder and row['name'] == name:
+                continue
+            results.append(self._public(row, distance=int(distances[i]), phash_distance=int(phash_distances[i])))
+        results.sort(key=lambda r: (r['distance'] + r['phash_distance'], r['folder'], r['name']))
+        return results
+
+    def clusters(self, prefix: Optional[str] = None, threshold: Optional[int] = None) -> List[dict]:
+        """
+        近似重複のクラスタ（2枚以上のもの、大きい順、ハッシュが未計算の画像は含まない）
+        Returns:
+            [{'id', 'size', 'images': [{'folder', 'name', 'digest', 'distance', 'phash_distance'}, ...]}]
+            先頭の画像がクラスタの代表で、distanceは代表からの距離
+        """
+        threshold = self.threshold if threshold is None else threshold
+        rows = self.index.image_hashes(prefix)
+        groups = self._cluster(rows, threshold)
+
+        clusters = []
+        for members in groups:
+            first = rows[members[0]]
+            clusters.append({
+                'size': len(members),
+                'images': [self._public(rows[i], distance=hamming(rows[i]['dhash'], first['dhash']),
+                                        phash_distance=hamming(rows[i]['phash'], first['phash']))
+                           for i in members]
+            })
+        clusters.sort(key=lambda c: (-c['size'], c['images'][0]['folder'], c['images'][0]['name']))
+        for number, cluster in enumerate(clusters, 1):
+            cluster['id'] = number
+        return clusters
+
+    def split_groups(self, folders: Iterable[str], threshold: Optional[int] = None) -> Dict[Tuple[str, str], str]:
+        """
+        データセットの分割で同じ側にまとめるグループ（ハッシュが未計算の画像は含まない）
+        Args:
+            folders: 対象フォルダ（インデックスのフォルダ名、子フォルダは含まない）
+        Returns:
+            (フォルダ, 画像名) -> グループ名（クラスタ内で最小の「フォルダ/画像名」）、重複のない画像は含まない
+        """
+        threshold = self.threshold if threshold is None else threshold
+        folders = set(folders)
+        rows = []
+        for folder in sorted(folders):
+            rows.extend(row for row in self.index.image_hashes(folder) if row['folder'] in folders)
+
+        groups = {}
+        for members in self._cluster(rows, threshold):
+            keys = [(rows[i]['folder'], rows[i]['name']) for i in members]
+            group = min(f'{folder}/{name}' for folder, name in keys)
+            for key in keys:
+                groups[key] = group
+        return groups
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _store(self, pending: List[dict], paths: List[str], results: Iterable[dict], stats: dict):
+        batch = []
+        for row, path, result in zip(pending, paths, results):
+            if result['error']:
+                stats['errors'] += 1
+                logger.warning(f"知覚ハッシュを計算できません {path}: {result['error']}")
+                continue
+            batch.append((row['digest'], result['dhash'], result['phash']))
+            if len(batch) >= STORE_BATCH_SIZE:
+                self.index.store_hashes(batch)
+                stats['hashed'] += len(batch)
+                batch = []
+        if batch:
+            self.index.store_hashes(batch)
+            stats['hashed'] += len(batch)
+
+    def _graph(self, threshold: int) -> HashGraph:
+        """閾値のグラフ（ハッシュの表が変わっていなければ前回のものを使う）"""
+        with self._graph_lock:
+            state = (self._generation,) + tuple(self.index.hash_table_state())
+            cached = self._graphs.get(threshold)
+            if cached is not None and cached[0] == state:
+                return cached[1]
+            start = time.time()
+            graph = HashGraph(self.index.hash_table(), threshold)
+            # 古い状態のグラフは捨てる
+            self._graphs = {key: value for key, value in self._graphs.items() if value[0] == state}
+            self._graphs[threshold] = (state, graph)
+            logger.info(f"近似重複のグラフ作成: {len(graph.positions)}件 {len(graph.indices) // 2}組 "
+                        f"{time.time() - start:.2f}秒")
+            return graph
+
+    def _cluster(self, rows: List[dict], threshold: int) -> List[List[int]]:
+        """
+        代表の画像と近い画像をクラスタにする（行番号のリスト、先頭が代表、2枚以上のみ）
+        近い画像の多いものから代表にし、代表とdHash・pHashの両方が近いまだ割り当てていない画像をまとめる。
+        """
+        if not rows:
+            return []
+        graph = self._graph(threshold)
+        by_position: Dict[int, List[int]] = {}
+        for i, row in enumerate(rows):
+            position = graph.positions.get(row['digest'])
+            if position is not None:
+                by_position.setdefault(position, []).append(i)
+
+        def candidates(position):
+            # 同じ内容の画像と近い画像（対象の行に含まれるもの）
+            members = list(by_position[position])
+            for neighbor in graph.neighbors(position):
+                members.extend(by_position.get(int(neighbor), ()))
+            return members
+
+        degree = {position: len(candidates(position)) for position in by_position}
+        order = sorted(range(len(rows)), key=lambda i: (-degree.get(graph.positions.get(rows[i]['digest']), 0), i))
+
+        assigned = [False] * len(rows)
+        groups = []
+        for i in order:
+            position = graph.positions.get(rows[i]['digest'])
+            if assigned[i] or position is None:
+                continue
+            members = [i] + sorted(j for j in set(candidates(position)) if j != i and not assigned[j])
+            for j in members:
+                assigned[j] = True
+            if len(members) > 1:
+                groups.append(members)
+        return groups
+
+    @staticmethod
+    def _public(row: dict, **extra) -> dict:
+        return dict({'folder': row['folder'], 'name': row['name'], 'digest': row['digest'],
+                     'dhash': f"{row['dhash']:016x}", 'phash': f"{row['phash']:016x}"}, **extra)
+
+# シングルトンインスタンス
+_detector_instance: Optional[NearDuplicateDetector] = None
+_detector_lock = threading.Lock()
+
+def get_near_duplicate_detector() -> NearDuplicateDetector:
+    """近似重複の検出器を取得（シングルトン）"""
+    global _detector_instance
+    with _detector_lock:
+        if _detector_instance is None:
+            _detector_instance = NearDuplicateDetector()
+        return _detector_instance
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='知覚ハッシュによる近似重複の検出')
+    parser.add_argument('command', choices=['update', 'clusters'])
+    parser.add_argument('--folder', help='対象フォルダ（インデックスのフォルダ名、例: datasets/default）')
+    parser.add_argument('--threshold', type=int, default=NEAR_DUPLICATE_THRESHOLD, help='ハミング距離の閾値')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    detector = get_near_duplicate_detector()
+    if args.command == 'update':
+        result = detector.update(args.folder)
+    else:
+        detector.update(args.folder)
+        clusters = detector.clusters(args.folder, args.threshold)
+        result = {'clusters': len(clusters), 'images': sum(c['size'] for c in clusters), 'items': clusters}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
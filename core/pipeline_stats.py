@@ -0,0 +1,117 @@
+"""
+パイプライン計測モジュール
+ライブカメラ処理の各段階（キャプチャ〜ソケット書き込み）の所要時間をローリングウィンドウで集計する
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+from config import LATENCY_WINDOW
+
+# 計測する段階（表示順）
+STAGES = (
+    'capture',       # デバイスからのフレーム取得（grab + retrieve）
+    'copy',          # フレームのコピー
+    'preprocess',    # 推論前処理（リサイズ・正規化）
+    'forward',       # モデルのforward
+    'nms',           # NMS
+    'draw',          # 検出枠の描画
+    'encode',        # JPEGエンコード
+    'socket_write',  # クライアントへの書き込み
+    'frame_age'      # 送信完了時点でのフレームの経過時間（キャプチャからの遅延）
+)
+
+# ヒストグラムの区切り（ミリ秒）
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class PipelineStats:
+    """段階ごとの所要時間のローリングヒストグラム"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """
+        初期化
+        Args:
+            window: 段階ごとに保持するサンプル数
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._totals: Dict[str, int] = {}
+        self._started_at = time.monotonic()
+
+    def record(self, stage: str, seconds: float):
+        """所要時間（秒）を記録"""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds * 1000)
+            self._totals[stage] = self._totals.get(stage, 0) + 1
+
+    @contextmanager
+    def measure(self, stage: str):
+        """with文で囲んだ区間の所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """段階ごとのパーセンタイル・ヒストグラムを取得"""
+        with self._lock:
+            snapshot = {stage: np.fromiter(samples, dtype=np.float64, count=len(samples))
+                        for stage, samples in self._samples.items()}
+            totals = dict(self._totals)
+
+        stages = {}
+        ordered = [s for s in STAGES if s in snapshot] + sorted(s for s in snapshot if s not in STAGES)
+        for stage in ordered:
+            values = snapshot[stage]
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            counts = np.histogram(values, bins=(0,) + HISTOGRAM_BUCKETS_MS + (np.inf,))[0]
+            stages[stage] = {
+                'count': totals.get(stage, 0),
+                'window': len(values),
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(values.max()),
+                'histogram': {
+                    'upper_ms': list(HISTOGRAM_BUCKETS_MS) + ['inf'],
+                    'counts': counts.tolist()
+                }
+            }
+
+        return {
+            'stages': stages,
+            'window': self.window,
+            'since_seconds': time.monotonic() - self._started_at
+        }
+
+    def reset(self):
+        """統計をリセット"""
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._started_at = time.monotonic()
+
+# シングルトンインスタンス
+_stats_instance: Optional[PipelineStats] = None
+_stats_lock = threading.Lock()
+
+def get_pipeline_stats() -> PipelineStats:
+    """パイプライン計測インスタンスを取得（シングルトン）"""
+    global _stats_instance
+    with _stats_lock:
+        if _stats_instance is None:
+            _stats_instance = PipelineStats()
+        return _stats_instance
@@ -15,6 +15,8 @@ from dataclasses import dataclass
 import threading
 import time
 
+from core.pipeline_stats import get_pipeline_stats
+
 # YOLOv5のパスを追加
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'yolov5'))
 
@@ -48,6 +50,7 @@ class RealtimeDetector:
         self.fps = 0
         self.last_process_time = 0
         self.detection_count = 0
+        get_pipeline_stats().reset()
 
         # クラス名（学習済みモデルに対応）
         self.class_names = {
@@ -132,41 +135,16 @@ class RealtimeDetector:
 
                 # 結果を解析
                 detections = []
-
-                # 結果の処理方法を修正
                 if hasattr(results, 'xyxy') and len(results.xyxy) > 0:
-                    # tensor形式の結果を処理
-                    predictions = results.xyxy[0]  # 最初の画像の結果
-
-                    if predictions is not None and len(predictions) > 0:
-                        for pred in predictions:
-                            # pred: [x1, y1, x2, y2, conf, class]
-                            if len(pred) >= 6:
-                                conf = float(pred[4])
-                                if conf >= confidence_threshold:
-                                    class_id = int(pred[5])
-
-                                    # クラス名を取得
-                                    if hasattr(results, 'names') and class_id < len(results.names):
-                                        class_name = results.names[class_id]
-                                    else:
-                                        class_name = f"class_{class_id}"
-
-                                    detection = DetectionResult(
-                                        bbox=[int(pred[0]), int(pred[1]),
-                                              int(pred[2]), int(pred[3])],
-                                        confidence=conf,
-                                        class_name=class_name,
-                                        class_id=class_id
-                                    )
-                                    detections.append(detection)
-                                    self.detection_count += 1
+                    # tensor形式の結果を処理（最初の画像の結果）
+                    detections = self._parse_predictions(results.xyxy[0], results, confidence_threshold)
 
                 # FPS計算
                 process_time = time.time() - start_time
                 if process_time > 0:
                     self.fps = 1.0 / process_time
                 self.last_process_time = process_time
+                self._record_stage_times(results, process_time, 1)
 
                 return detections
 
@@ -176,6 +154,92 @@ class RealtimeDetector:
                 logger.error(traceback.format_exc())
                 return []
 
+    def detect_batch(self, frames: List[np.ndarray],
+                     confidence_threshold: Optional[float] = None) -> List[List[DetectionResult]]:
+        """
+        複数フレームを1回の推論でまとめて検出
+        Args:
+            frames: 入力画像のリスト（異なるカメラのフレームを混在可）
+            confidence_threshold: 信頼度の閾値（省略時は判定パラメータで設定したmodel.conf）
+        Returns:
+            フレームごとの検出結果のリスト
+        """
+        if not self.is_initialized:
+            logger.warning("モデルが初期化されていません")
+            return [[] for _ in frames]
+        if not frames:
+            return []
+
+        if confidence_threshold is None:
+            confidence_threshold = self.model.conf
+
+        with self.processing_lock:
+            try:
+                start_time = time.time()
+
+                # AutoShapeはリストを受け取るとバッチとして1回のforwardで処理する
+                results = self.model(list(frames), size=640)
+
+                batch_detections = []
+                for i in range(len(frames)):
+                    predictions = results.xyxy[i] if i < len(results.xyxy) else None
+                    batch_detections.append(
+                        self._parse_predictions(predictions, results, confidence_threshold))
+
+                # FPS計算（1フレームあたりの処理時間に換算）
+                process_time = time.time() - start_time
+                if process_time > 0:
+                    self.fps = len(frames) / process_time
+                self.last_process_time = process_time / len(frames)
+                self._record_stage_times(results, process_time, len(frames))
+
+                return batch_detections
+
+            except Exception as e:
+                logger.error(f"バッチ検出エラー: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+                return [[] for _ in frames]
+
+    def _record_stage_times(self, results, process_time: float, batch_size: int):
+        """推論の段階別時間を記録（YOLOv5のresults.tは1枚あたりの前処理・推論・NMS時間[ms]）"""
+        stats = get_pipeline_stats()
+        stage_times = getattr(results, 't', None)
+        if stage_times and len(stage_times) >= 3:
+            for stage, ms in zip(('preprocess', 'forward', 'nms'), stage_times):
+                stats.record(stage, float(ms) * batch_size / 1000)
+        else:
+            stats.record('forward', process_time)
+
+    def _parse_predictions(self, predictions, results, confidence_threshold: float) -> List[DetectionResult]:
+        """推論結果のテンソル（[x1, y1, x2, y2, conf, class]）をDetectionResultに変換"""
+        detections = []
+        if predictions is None or len(predictions) == 0:
+            return detections
+
+        for pred in predictions:
+            if len(pred) < 6:
+                continue
+            conf = float(pred[4])
+            if conf < confidence_threshold:
+                continue
+            class_id = int(pred[5])
+
+            # クラス名を取得
+            if hasattr(results, 'names') and class_id < len(results.names):
+                class_name = results.names[class_id]
+            else:
+                class_name = f"class_{class_id}"
+
+            detections.append(DetectionResult(
+                bbox=[int(pred[0]), int(pred[1]), int(pred[2]), int(pred[3])],
+                confidence=conf,
+                class_name=class_name,
+                class_id=class_id
+            ))
+            self.detection_count += 1
+        return detections
+
     def draw_detections(self, frame: np.ndarray, detections: List[DetectionResult]) -> np.ndarray:
         """
         検出結果を画像に描画
@@ -185,7 +249,11 @@ class RealtimeDetector:
         Returns:
             描画済み画像
         """
+        stats = get_pipeline_stats()
+        copy_start = time.perf_counter()
         output = frame.copy()
+        draw_start = time.perf_counter()
+        stats.record('copy', draw_start - copy_start)
 
         for detection in detections:
             x1, y1, x2, y2 = detection.bbox
@@ -223,18 +291,22 @@ class RealtimeDetector:
         cv2.putText(output, count_text, (10, 60),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
+        stats.record('draw', time.perf_counter() - draw_start)
         return output
 
-    def process_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, Dict]:
+    def process_frame(self, frame: np.ndarray,
+                      detections: Optional[List[DetectionResult]] = None) -> Tuple[np.ndarray, Dict]:
         """
         フレームを処理して結果を返す
         Args:
             frame: 入力フレーム
+            detections: 推論プールなどで検出済みの結果（省略時はここで検出）
         Returns:
             (描画済みフレーム, 検出情報の辞書)
         """
         # 検出実行
-        detections = self.detect(frame)
+        if detections is None:
+            detections = self.detect(frame)
 
         # 結果を描画
         output_frame = self.draw_detections(frame, detections)
@@ -265,7 +337,8 @@ class RealtimeDetector:
             'last_process_time': self.last_process_time,
             'is_initialized': self.is_initialized,
             'model_path': self.model_path,
-            'device': self.device
+            'device': self.device,
+            'latency': get_pipeline_stats().summary()
         }
 
     def reset_stats(self):
@@ -273,6 +346,7 @@ class RealtimeDetector:
         self.fps = 0
         self.last_process_time = 0
         self.detection_count = 0
+        get_pipeline_stats().reset()
 
 # シングルトンインスタンス
 _detector_instance: Optional[RealtimeDetector] = None
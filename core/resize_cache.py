@@ -0,0 +1,430 @@
+"""
+学習用の縮小画像キャッシュ
+顕微鏡画像は学習サイズ（640px）の数倍の大きさがあり、YOLOv5のデータローダーはエポックごとに
+JPEGのデコードと縮小にCPU時間の大半を使う。データセット準備の段階で、長辺を学習サイズに合わせた
+コピーをプロセスプールで作成し、(元画像のSHA-256, 画像サイズ) をキーに data/resize_cache に保存する。
+
+縦横比を保ったまま縮小し、パディング（レターボックス）はYOLOv5側に任せるため、正規化座標のラベルは
+書き換えずにそのまま使える。EXIFの回転情報は縮小時に画素へ適用する（ブラウザで見た向きでアノテーション
+されているため、回転後の画像に対する座標がそのまま一致する）。
+学習サイズ以下の画像は縮小せず、元画像をそのまま使う。
+
+コマンドラインからの実行:
+    python -m core.resize_cache prepare <画像ディレクトリ> --img 640
+    python -m core.resize_cache benchmark [画像ディレクトリ] --img 640   # 省略時は合成画像で計測
+    python -m core.resize_cache prune
+    python -m core.resize_cache stats
+"""
+
+import io
+import os
+import json
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import (RESIZE_CACHE_DIR, RESIZE_CACHE_QUALITY, RESIZE_CACHE_WORKERS, RESIZE_CACHE_GRACE,
+                    YOLO_IMG_SIZE)
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+
+# これより少ない枚数ならプロセスを起動せずに縮小する
+MIN_PARALLEL_FILES = 8
+
+# EXIFのOrientationタグ
+EXIF_ORIENTATION = 0x0112
+
+def _signature(path: str) -> Optional[list]:
+    """ハッシュの再計算が必要かどうかの判定用シグネチャ（サイズ・更新時刻・inode）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def _target_size(width: int, height: int, img_size: int):
+    """YOLOv5のload_imageと同じ縮小後サイズ（長辺をimg_sizeに合わせる）"""
+    r = img_size / max(width, height)
+    return math.ceil(width * r), math.ceil(height * r)
+
+def resize_image(data: bytes, img_size: int) -> Optional[np.ndarray]:
+    """
+    画像バイト列をデコードして長辺img_sizeに縮小（EXIFの回転を適用）
+    Returns:
+        BGR画像（元画像が学習サイズ以下の場合やデコードできない場合はNone）
+    """
+    from app_utils.jpeg_codec import decode_image
+
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        width, height = img.size
+        if max(width, height) <= img_size:
+            return None
+        if orientation not in (None, 1):
+            # 回転・反転が必要な画像はPILで向きを揃えてから縮小
+            image = cv2.cvtColor(np.asarray(ImageOps.exif_transpose(img).convert('RGB')), cv2.COLOR_RGB2BGR)
+        else:
+            image = None
+
+    if image is None:
+        # JPEGはDCT領域で縮小しながらデコードする（長辺がimg_sizeを下回らない範囲、学習データのため高速モードは使わない）
+        image = decode_image(data, max_size=img_size, fast=False)
+        if image is None:
+            return None
+
+    h, w = image.shape[:2]
+    target = _target_size(w, h, img_size)
+    if (w, h) != target:
+        image = cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+    return image
+
+def _prepare_one(task: tuple) -> dict:
+    """
+    1枚の縮小画像を作成（プロセスプールから呼ばれる）
+    Args:
+        task: (元画像のパス, 既知のダイジェストまたはNone, 画像サイズ, キャッシュディレクトリ, JPEG品質)
+    """
+    from core.blob_store import file_digest
+    from app_utils.jpeg_codec import write_image
+
+    src, digest, img_size, root, quality = task
+    result = {'digest': digest, 'width': 0, 'height': 0, 'path': None, 'error': None}
+    try:
+        with open(src, 'rb') as f:
+            data = f.read()
+        if digest is None:
+            digest = file_digest(src)
+            result['digest'] = digest
+        with Image.open(io.BytesIO(data)) as img:
+            result['width'], result['height'] = img.size
+
+        if max(result['width'], result['height']) <= img_size:
+            return result
+
+        dst = ResizeCache.path_in(root, digest, img_size)
+        if not os.path.exists(dst):
+            image = resize_image(data, img_size)
+            if image is None:
+                result['error'] = 'デコードできません'
+                return result
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if not write_image(dst, image, quality=quality, subsampling='444'):
+                result['error'] = '保存できません'
+                return result
+        result['path'] = dst
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+class ResizeCache:
+    """(元画像のハッシュ, 画像サイズ) をキーとする縮小画像キャッシュ"""
+
+    def __init__(self, root: str = RESIZE_CACHE_DIR, quality: int = RESIZE_CACHE_QUALITY,
+                 workers: Optional[int] = RESIZE_CACHE_WORKERS, grace: float = RESIZE_CACHE_GRACE):
+        """
+        初期化
+        Args:
+            root: キャッシュディレクトリ
+            quality: 縮小画像のJPEG品質
+            workers: プロセス数（Noneの場合はCPUコア数）
+            grace: データセットから参照されなくなった縮小画像をpruneで削除するまでの秒数
+        """
+        self.root = root
+        self.quality = quality
+        self.workers = workers
+        self.grace = grace
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.Lock()
+        # 元画像の絶対パス -> {'sig', 'digest', 'width', 'height'}（ハッシュの再計算を避ける）
+        self._index: Optional[Dict[str, dict]] = None
+        # データセットのディレクトリ -> 使用中の縮小画像のパス（リンクの方式によらずpruneで残す）
+        self._references: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def path_in(root: str, digest: str, img_size: int) -> str:
+        return os.path.join(root, str(img_size), digest[:2], f'{digest}.jpg')
+
+    def path_for(self, digest: str, img_size: int) -> str:
+        """縮小画像の保存先"""
+        return self.path_in(self.root, digest, img_size)
+
+    def prepare(self, paths: Iterable[str], img_size: int = YOLO_IMG_SIZE) -> Dict[str, Optional[str]]:
+        """
+        縮小画像を用意（キャッシュにないものだけをプロセスプールで作成）
+        Args:
+            paths: 元画像のパス
+            img_size: 学習時の画像サイズ
+        Returns:
+            元画像のパス -> 縮小画像のパス（縮小不要・失敗の場合はNone）
+        """
+        with self._lock:
+            index = self._load_index()
+            mapping: Dict[str, Optional[str]] = {}
+            pending = []
+            signatures = {}
+            hits = 0
+
+            for path in paths:
+                key = os.path.abspath(path)
+                signature = _signature(path)
+                signatures[key] = signature
+                entry = index.get(key)
+                if entry is None or signature is None or entry.get('sig') != signature:
+                    pending.append((path, None))
+                    continue
+                if max(entry['width'], entry['height']) <= img_size:
+                    mapping[path] = None
+                    continue
+                dst = self.path_for(entry['digest'], img_size)
+                if os.path.exists(dst):
+                    mapping[path] = dst
+                    hits += 1
+                else:
+                    pending.append((path, entry['digest']))
+
+            tasks = [(path, digest, img_size, self.root, self.quality) for path, digest in pending]
+            if len(tasks) < MIN_PARALLEL_FILES or self.workers == 1:
+                results = list(map(_prepare_one, tasks))
+            else:
+                workers = self.workers or os.cpu_count() or 1
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(_prepare_one, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+            errors = 0
+            for (path, _), result in zip(pending, results):
+                if result['error']:
+                    errors += 1
+                    logger.warning(f"縮小画像を作成できないため元画像を使用します {path}: {result['error']}")
+                mapping[path] = result['path']
+                key = os.path.abspath(path)
+                if result['digest'] and signatures.get(key) is not None:
+                    index[key] = {'sig': signatures[key], 'digest': result['digest'],
+                                  'width': result['width'], 'height': result['height']}
+
+            if pending:
+                self._save_index()
+            resized = sum(1 for path in mapping.values() if path)
+            logger.info(f"縮小画像キャッシュ（{img_size}px）: 縮小{resized}枚（うち作成{resized - hits}枚）, "
+                        f"縮小不要{len(mapping) - resized}枚, エラー{errors}枚")
+            return mapping
+
+    def set_references(self, dataset_dir: str, paths: Iterable[str]):
+        """
+        データセットが使用している縮小画像を記録（core.dataset_builderが構築のたびに呼ぶ）
+        シンボリックリンク・コピーで構築したデータセットはリンク数から参照を判断できないため、pruneはこの記録で判断する
+        """
+        key = os.path.abspath(dataset_dir)
+        paths = sorted({os.path.abspath(path) for path in paths if path})
+        with self._lock:
+            self._load_index()
+            if self._references.get(key, []) == paths:
+                return
+            if paths:
+                self._references[key] = paths
+            else:
+                self._references.pop(key, None)
+            self._save_index()
+
+    def prune(self) -> dict:
+        """
+        どのデータセットからも参照されていない古い縮小画像と、消えた元画像の索引を削除
+        （set_referencesで記録されたもの、ハードリンクでリンク数が2以上のものは参照中とみなす）
+        """
+        removed = 0
+        freed = 0
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            # 削除されたデータセットの記録は捨てる
+            for dataset_dir in [key for key in self._references if not os.path.isdir(key)]:
+                del self._references[dataset_dir]
+            referenced = {path for paths in self._references.values() for path in paths}
+
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                for name in filenames:
+                    if not name.endswith('.jpg'):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    if os.path.abspath(path) in referenced:
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if st.st_nlink == 1 and now - st.st_mtime > self.grace:
+                        os.remove(path)
+                        removed += 1
+                        freed += st.st_size
+
+            stale = [key for key in index if not os.path.exists(key)]
+            for key in stale:
+                del index[key]
+            self._save_index()
+
+        if removed:
+            logger.info(f"縮小画像キャッシュ: {removed}枚を削除（{freed / 1024 / 1024:.1f}MB）")
+        return {'removed': removed, 'freed_bytes': freed, 'stale_sources': len(stale)}
+
+    def stats(self) -> dict:
+        """画像サイズごとの枚数と容量"""
+        sizes = {}
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or not entry.name.isdigit():
+                    continue
+                count = 0
+                total = 0
+                for dirpath, dirnames, filenames in os.walk(entry.path):
+                    for name in filenames:
+                        if name.endswith('.jpg'):
+                            count += 1
+                            total += os.path.getsize(os.path.join(dirpath, name))
+                sizes[int(entry.name)] = {'files': count, 'bytes': total}
+        with self._lock:
+            sources = len(self._load_index())
+        return {'root': self.root, 'sources': sources, 'sizes': sizes}
+
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            self._index = {}
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self._index = data.get('sources', {})
+                    self._references = data.get('references', {})
+            except (OSError, ValueError):
+                pass
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'sources': self._index, 'references': self._references}, f)
+        os.replace(tmp_path, self.index_path)
+
+def _synthetic_images(directory: str, count: int, width: int = 2592, height: int = 1944) -> List[str]:
+    """顕微鏡画像に近い大きさの合成画像を作成（ベンチマーク用）"""
+    from app_utils.jpeg_codec import write_image
+
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = ((xx / width) * 200 + (yy / height) * 55).astype(np.uint8)
+    paths = []
+    for i in range(count):
+        noise = rng.integers(0, 20, (height, width), dtype=np.uint8)
+        image = cv2.merge([base, cv2.add(base, noise), 255 - base])
+        path = os.path.join(directory, f'synthetic_{i:03d}.jpg')
+        write_image(path, image, quality=90)
+        paths.append(path)
+    return paths
+
+def benchmark(paths: List[str], img_size: int = YOLO_IMG_SIZE, cache: Optional[ResizeCache] = None) -> dict:
+    """
+    YOLOv5のデータローダーが1エポックに行う読み込み（cv2.imread＋長辺img_sizeへの縮小）の時間を、
+    元画像と縮小画像キャッシュで比較
+    Returns:
+        1枚あたりの時間（ミリ秒）・1エポックあたりの推定時間（秒）・キャッシュ作成時間
+    """
+    cache = cache or get_resize_cache()
+
+    def load_epoch(files):
+        start = time.perf_counter()
+        for path in files:
+            image = cv2.imread(path)
+            h0, w0 = image.shape[:2]
+            r = img_size / max(h0, w0)
+            if r != 1:
+                interp = cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA
+                image = cv2.resize(image, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    mapping = cache.prepare(paths, img_size)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache.prepare(paths, img_size)
+    cached_prepare_seconds = time.perf_counter() - start
+
+    cached_paths = [mapping.get(path) or path for path in paths]
+    original_seconds = load_epoch(paths)
+    cached_seconds = load_epoch(cached_paths)
+
+    return {
+        'images': len(paths),
+        'img_size': img_size,
+        'original_ms_per_image': original_seconds * 1000 / max(len(paths), 1),
+        'cached_ms_per_image': cached_seconds * 1000 / max(len(paths), 1),
+        'original_epoch_seconds': original_seconds,
+        'cached_epoch_seconds': cached_seconds,
+        'speedup': original_seconds / cached_seconds if cached_seconds > 0 else 0,
+        'build_seconds': build_seconds,
+        'cached_prepare_seconds': cached_prepare_seconds
+    }
+
+# シングルトンインスタンス
+_cache_instance: Optional[ResizeCache] = None
+_cache_lock = threading.Lock()
+
+def get_resize_cache() -> ResizeCache:
+    """縮小画像キャッシュを取得（シングルトン）"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResizeCache()
+        return _cache_instance
+
+def main():
+    import argparse
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='学習用の縮小画像キャッシュ')
+    parser.add_argument('command', choices=['prepare', 'benchmark', 'prune', 'stats'])
+    parser.add_argument('directory', nargs='?', help='元画像のディレクトリ（benchmarkで省略時は合成画像）')
+    parser.add_argument('--img', type=int, default=YOLO_IMG_SIZE, help='学習時の画像サイズ')
+    parser.add_argument('--count', type=int, default=32, help='benchmarkで作成する合成画像の枚数')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def list_images(directory):
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+
+    if args.command == 'prepare':
+        if not args.directory:
+            parser.error('prepareには元画像のディレクトリが必要です')
+        mapping = get_resize_cache().prepare(list_images(args.directory), args.img)
+        result = {'images': len(mapping), 'resized': sum(1 for path in mapping.values() if path)}
+    elif args.command == 'benchmark':
+        if args.directory:
+            result = benchmark(list_images(args.directory), args.img)
+        else:
+            # 合成画像と一時キャッシュで計測（実際のキャッシュは汚さない）
+            work_dir = tempfile.mkdtemp(prefix='resize_cache_bench_')
+            try:
+                paths = _synthetic_images(work_dir, args.count)
+                result = benchmark(paths, args.img, ResizeCache(os.path.join(work_dir, 'cache')))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    elif args.command == 'prune':
+        result = get_resize_cache().prune()
+    else:
+        result = get_resize_cache().stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
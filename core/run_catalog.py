@@ -0,0 +1,170 @@
+"""
+学習結果カタログモジュール
+YOLOv5の学習結果（yolov5/runs/train/<実験名>）の一覧と最終エポックの指標をキャッシュする。
+ファイル監視（core.fs_watcher）で変更が通知された実験だけを読み直し、監視していない場合は毎回走査する。
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from config import YOLO_RUNS_DIR
+
+logger = logging.getLogger(__name__)
+
+# 学習に使ったデータセットのスナップショット（core.dataset_snapshot）を記録するファイル
+RUN_SNAPSHOT_FILE = 'dataset_snapshot.json'
+
+def _read_final_map50(results_csv: str) -> float:
+    """results.csvの最終行からmAP@0.5を取得（7列目）"""
+    try:
+        with open(results_csv, 'r') as f:
+            lines = f.readlines()
+        if len(lines) > 1:
+            last_line = lines[-1].strip()
+            if last_line:
+                parts = last_line.split(',')
+                return float(parts[6]) if len(parts) > 6 else 0
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def _read_snapshot_id(run_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(run_dir, RUN_SNAPSHOT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('snapshot_id')
+    except (OSError, ValueError):
+        return None
+
+class RunCatalog:
+    """学習結果の一覧（実験ディレクトリごとにキャッシュ）"""
+
+    def __init__(self, runs_dir: str = YOLO_RUNS_DIR):
+        self.runs_dir = runs_dir
+        self._lock = threading.Lock()
+        self._runs: Optional[Dict[str, dict]] = None  # None: 未走査（全体を読み直す）
+        self._weights_digests: Dict[tuple, str] = {}  # (パス, サイズ, 更新時刻) -> 重みのハッシュ
+
+    def list_runs(self) -> List[dict]:
+        """実験の一覧（作成時刻の降順）"""
+        from core.fs_watcher import get_file_watcher
+
+        with self._lock:
+            if self._runs is None or not get_file_watcher().is_watching(self.runs_dir):
+                self._runs = self._scan()
+            runs = list(self._runs.values())
+        return sorted(runs, key=lambda run: run['created'], reverse=True)
+
+    def get_run(self, name: str) -> Optional[dict]:
+        for run in self.list_runs():
+            if run['name'] == name:
+                return run
+        return None
+
+    def latest(self, prefix: Optional[str] = None) -> Optional[dict]:
+        """最新の実験（prefixを指定した場合は名前がprefixで始まるもののみ）"""
+        for run in self.list_runs():
+            if prefix is None or run['name'].startswith(prefix):
+                return run
+        return None
+
+    def best(self) -> Optional[dict]:
+        """学習済みの重み（best.pt）がある実験のうち、最終エポックのmAP@0.5が最も高いもの"""
+        runs = [run for run in self.list_runs() if run['best_weights']]
+        return max(runs, key=lambda run: (run['final_map50'], run['created'])) if runs else None
+
+    def production_model(self) -> Optional[dict]:
+        """
+        自動アノテーション・能動学習に使うモデル（mAP@0.5が最も高い実験の重み）
+        Returns:
+            {'path', 'run', 'version'}（学習済みモデルがない場合はNone）
+            versionは実験名と重みの内容のハッシュから作る（同じ名前で再学習した場合も区別する）
+        """
+        run = self.best()
+        if run is None:
+            return None
+        path = run['best_weights']
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._weights_digests.get(key)
+        if digest is None:
+            from core.blob_store import file_digest
+            digest = file_digest(path)
+            with self._lock:
+                self._weights_digests[key] = digest
+        return {'path': path, 'run': run['name'], 'version': f"{run['name']}-{digest[:12]}"}
+
+    def invalidate(self, directories: Optional[Iterable[str]] = None):
+        """
+        キャッシュを無効化（ファイル監視のコールバック）
+        Args:
+            directories: 変更のあったディレクトリ（Noneの場合はすべて）
+        """
+        with self._lock:
+            if self._runs is None:
+                return
+            if directories is None:
+                self._runs = None
+                return
+
+            root = os.path.abspath(self.runs_dir)
+            for directory in directories:
+                rel = os.path.relpath(directory, root)
+                if rel == '.' or rel.startswith('..'):
+                    # 実験の追加・削除
+                    self._runs = None
+                    return
+                name = rel.split(os.sep)[0]
+                run = self._load_run(name)
+                if run is None:
+                    self._runs.pop(name, None)
+                else:
+                    self._runs[name] = run
+
+    def _scan(self) -> Dict[str, dict]:
+        runs = {}
+        if not os.path.isdir(self.runs_dir):
+            return runs
+        for name in os.listdir(self.runs_dir):
+            run = self._load_run(name)
+            if run is not None:
+                runs[name] = run
+        return runs
+
+    def _load_run(self, name: str) -> Optional[dict]:
+        path = os.path.join(self.runs_dir, name)
+        if not os.path.isdir(path):
+            return None
+
+        results_csv = os.path.join(path, 'results.csv')
+        best_path = os.path.join(path, 'weights', 'best.pt')
+        has_results = os.path.exists(results_csv)
+        created = os.path.getctime(path)
+        return {
+            'name': name,
+            'path': path,
+            'created': created,
+            'updated': os.path.getmtime(results_csv) if has_results else created,
+            'has_results': has_results,
+            'final_map50': _read_final_map50(results_csv) if has_results else 0,
+            'best_weights': best_path if os.path.exists(best_path) else None,
+            'dataset_snapshot': _read_snapshot_id(path)
+        }
+
+# シングルトンインスタンス
+_catalog_instance: Optional[RunCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_run_catalog() -> RunCatalog:
+    """学習結果カタログを取得（シングルトン）"""
+    global _catalog_instance
+    with _catalog_lock:
+        if _catalog_instance is None:
+            _catalog_instance = RunCatalog()
+        return _catalog_instance
@@ -0,0 +1,322 @@
+"""
+サムネイルキャッシュモジュール
+学習データ（static/training_data 以下）の画像から一覧表示用のサムネイル（WebP、非対応ブラウザにはJPEG）を作成し、
+data/thumbnails/<サイズ>/<元画像のSHA-256>.<形式> に保存する。キーが内容のハッシュなので、フォルダ間の
+移動・コピーでは作り直さず、画像が書き換えられた場合は自動的に別のサムネイルになる。
+
+元画像のハッシュはデータセットインデックス（core.dataset_index）に記録済みのものを使い、無い場合のみ計算する。
+アップロード後とファイル監視で新しい画像を検出したときは、一覧で使うサイズをバックグラウンドで事前生成する。
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import quote
+
+from PIL import Image, ImageOps, features
+
+from config import (TRAINING_DATA_DIR, THUMBNAIL_CACHE_DIR, THUMBNAIL_SIZES, THUMBNAIL_DEFAULT_SIZE,
+                    THUMBNAIL_QUALITY, THUMBNAIL_WORKERS, THUMBNAIL_CACHE_MAX_BYTES)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+# 生成方法を変えた場合に上げる（ETagに含める）
+THUMBNAIL_VERSION = 1
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg')
+}
+
+# キャッシュヒット時に更新時刻を更新する間隔（古い順に削除する際の目安）
+TOUCH_INTERVAL = 24 * 3600
+
+# ファイル監視の通知で変更を判定する際の余裕（ファイルのタイムスタンプは時計より粗い）
+CHANGE_SLACK_NS = 1_000_000_000
+
+def preferred_format(accept: str) -> str:
+    """Acceptヘッダから返す形式を決める"""
+    if 'image/webp' in (accept or '') and features.check('webp'):
+        return 'webp'
+    return 'jpeg'
+
+def thumbnail_url(rel_path: str, digest: Optional[str] = None, size: int = THUMBNAIL_DEFAULT_SIZE) -> str:
+    """
+    サムネイルのURL
+    Args:
+        rel_path: 学習データディレクトリからの相対パス（例: datasets/default/images/a.jpg）
+        digest: 元画像のハッシュ（指定するとURLに含め、内容が変わるとURLも変わる）
+        size: 長辺サイズ
+    """
+    url = f"/thumb/{size}/{quote(rel_path.replace(os.sep, '/'))}"
+    if digest:
+        url += f'?v={digest[:16]}'
+    return url
+
+def _signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+class ThumbnailCache:
+    """元画像のハッシュをキーとするサムネイルのディスクキャッシュ"""
+
+    def __init__(self, root: str = THUMBNAIL_CACHE_DIR, source_root: str = TRAINING_DATA_DIR,
+                 sizes=THUMBNAIL_SIZES, quality: int = THUMBNAIL_QUALITY, workers: int = THUMBNAIL_WORKERS,
+                 max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES):
+        """
+        初期化
+        Args:
+            root: サムネイルの保存先
+            source_root: 元画像のディレクトリ（これより外のファイルは扱わない）
+            sizes: 生成する長辺サイズ
+            quality: WebP/JPEGの品質
+            workers: 事前生成のスレッド数
+            max_bytes: キャッシュ容量の上限（pruneで古いものから削除）
+        """
+        self.root = root
+        self.source_root = os.path.abspath(source_root)
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._lock = threading.Lock()
+        self._digests: Dict[str, Tuple[tuple, str]] = {}  # 元画像の絶対パス -> (シグネチャ, ハッシュ)
+        self._in_flight = set()
+        # ディレクトリごとの前回の走査時刻（ns、ファイル監視の通知で変更のあったファイルだけを選ぶ）
+        self._scanned_at: Dict[str, int] = {}
+        self._created_ns = time.time_ns()
+        self._stats = {'hits': 0, 'generated': 0, 'pregenerated': 0, 'errors': 0}
+
+    # ------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------
+
+    def normalize_size(self, size: int) -> int:
+        """要求サイズ以上で最小の生成サイズ（最大を超える場合は最大）"""
+        for candidate in self.sizes:
+            if size <= candidate:
+                return candidate
+        return self.sizes[-1]
+
+    def resolve(self, rel_path: str) -> Optional[str]:
+        """URLのパスを元画像の絶対パスに変換（学習データディレクトリの外や画像以外はNone）"""
+        path = os.path.abspath(os.path.join(self.source_root, rel_path))
+        if not path.startswith(self.source_root + os.sep):
+            return None
+        if not path.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+            return None
+        return path
+
+    def get(self, rel_path: str, size: int, fmt: str = 'jpeg') -> Optional[Tuple[str, str, str]]:
+        """
+        サムネイルを取得（無ければ作成）
+        Returns:
+            (サムネイルのパス, 元画像のハッシュ, ETag)、元画像が無い・デコードできない場合はNone
+        """
+        source = self.resolve(rel_path)
+        if source is None:
+            return None
+        size = self.normalize_size(size)
+        digest = self.digest_for(source)
+        if digest is None:
+            return None
+
+        path = self.path_for(digest, size, fmt)
+        try:
+            st = os.stat(path)
+            with self._lock:
+                self._stats['hits'] += 1
+            if time.time() - st.st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            if not self._render(source, path, size, fmt):
+                return None
+            with self._lock:
+                self._stats['generated'] += 1
+        return path, digest, f'{digest[:32]}-{size}-{fmt}-v{THUMBNAIL_VERSION}'
+
+    def path_for(self, digest: str, size: int, fmt: str) -> str:
+        return os.path.join(self.root, str(size), digest[:2], digest + FORMATS[fmt][2])
+
+    def digest_for(self, path: str) -> Optional[str]:
+        """元画像のハッシュ（インデックスの値が現在のファイルと一致すればそれを使う）"""
+        signature = _signature(path)
+        if signature is None:
+            return None
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        digest = self._digest_from_index(path, signature)
+        if digest is None:
+            from core.blob_store import get_blob_store, file_digest
+            try:
+                digest = get_blob_store().digest_of(path) or file_digest(path)
+            except OSError:
+                return None
+        with self._lock:
+            self._digests[path] = (signature, digest)
+        return digest
+
+    def pregenerate(self, paths: Iterable[str], sizes: Optional[Iterable[int]] = None, fmt: Optional[str] = None):
+        """
+        サムネイルをバックグラウンドで作成（アップロード後など）
+        Args:
+            paths: 元画像のパス（学習データディレクトリ内のもののみ対象）
+            sizes: 作成するサイズ（省略時は一覧で使うサイズ）
+            fmt: 形式（省略時はWebPが使えればWebP）
+        """
+        sizes = tuple(sizes or (THUMBNAIL_DEFAULT_SIZE,))
+        fmt = fmt or ('webp' if features.check('webp') else 'jpeg')
+        for path in paths:
+            rel_path = os.path.relpath(os.path.abspath(path), self.source_root)
+            for size in sizes:
+                key = (rel_path, size, fmt)
+                with self._lock:
+                    if key in self._in_flight:
+                        continue
+                    self._in_flight.add(key)
+                self._executor.submit(self._pregenerate_one, key)
+
+    def handle_changes(self, directories: Iterable[str]):
+        """
+        ファイル監視からの通知（images ディレクトリに追加・変更された画像のサムネイルを事前生成）
+        前回の走査以降にctime（作成・移動・書き換えで更新される）が変わった画像だけを対象にする。
+        """
+        paths = []
+        for directory in directories:
+            if os.path.basename(directory) != 'images' or not os.path.isdir(directory):
+                continue
+            # タイムスタンプの粒度の分だけ前から拾う（重複しても生成済みなら何もしない）
+            scanned_at = time.time_ns()
+            with self._lock:
+                since = self._scanned_at.get(directory, self._created_ns) - CHANGE_SLACK_NS
+                self._scanned_at[directory] = scanned_at
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                            continue
+                        try:
+                            if entry.stat().st_ctime_ns >= since:
+                                paths.append(entry.path)
+                        except FileNotFoundError:
+                            continue
+            except OSError:
+                continue
+        if paths:
+            self.pregenerate(paths)
+
+    def prune(self) -> dict:
+        """容量の上限を超えた分を、最後に使われた時刻が古いものから削除"""
+        files = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        freed = 0
+        if total > self.max_bytes:
+            # 上限の9割まで減らす（毎回少しずつ削除し続けないように）
+            target = self.max_bytes * 0.9
+            for mtime, size, path in sorted(files):
+                if total - freed <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+                freed += size
+            logger.info(f"サムネイルキャッシュ: {removed}件を削除（{freed / 1024 / 1024:.1f}MB）")
+        return {'files': len(files) - removed, 'bytes': total - freed, 'removed': removed, 'freed_bytes': freed}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._in_flight), known_sources=len(self._digests))
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+
+    def _digest_from_index(self, path: str, signature: tuple) -> Optional[str]:
+        """データセットインデックスに記録されたハッシュ（サイズ・更新時刻が一致する場合のみ）"""
+        from core.dataset_index import get_dataset_index
+
+        parts = os.path.relpath(path, self.source_root).split(os.sep)
+        if len(parts) < 2 or parts[-2] != 'images':
+            return None
+        try:
+            row = get_dataset_index().get_image('/'.join(parts[:-2]), parts[-1])
+        except Exception:
+            return None
+        if row and row['digest'] and row['size'] == signature[0] and row['mtime_ns'] == signature[1]:
+            return row['digest']
+        return None
+
+    def _pregenerate_one(self, key: tuple):
+        rel_path, size, fmt = key
+        try:
+            source = self.resolve(rel_path)
+            digest = self.digest_for(source) if source else None
+            if digest and not os.path.exists(self.path_for(digest, size, fmt)):
+                if self._render(source, self.path_for(digest, size, fmt), size, fmt):
+                    with self._lock:
+                        self._stats['pregenerated'] += 1
+        except Exception as e:
+            logger.error(f"サムネイル事前生成エラー {rel_path}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _render(self, source: str, dest: str, size: int, fmt: str) -> bool:
+        """サムネイルを作成（一時ファイルに書いてから置き換える）"""
+        pil_format = FORMATS[fmt][0]
+        tmp_path = f'{dest}.{threading.get_ident()}.tmp'
+        try:
+            with Image.open(source) as img:
+                # JPEGはDCT領域で縮小しながらデコードする
+                img.draft('RGB', (size, size))
+                image = ImageOps.exif_transpose(img)
+                image.thumbnail((size, size))
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                image.save(tmp_path, pil_format, quality=self.quality)
+            os.replace(tmp_path, dest)
+            return True
+        except Exception as e:
+            logger.warning(f"サムネイルを作成できません {source}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+# シングルトンインスタンス
+_thumbnail_instance: Optional[ThumbnailCache] = None
+_thumbnail_lock = threading.Lock()
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """サムネイルキャッシュを取得（シングルトン）"""
+    global _thumbnail_instance
+    with _thumbnail_lock:
+        if _thumbnail_instance is None:
+            _thumbnail_instance = ThumbnailCache()
+        return _thumbnail_instance
@@ -0,0 +1,289 @@
+"""
+動画解析モジュール
+顕微鏡動画をバックグラウンドでデコードし、一定間隔のフレームをバッチ推論して
+フレームごとの結果と個体ごとの雌雄判定を逐次返す（動画全体をメモリに載せない）
+
+コマンドラインからの実行:
+    python -m core.video_analyzer video.mp4 --stride 5 --batch-size 8
+"""
+
+import cv2
+import json
+import queue
+import threading
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import VIDEO_ANALYSIS_STRIDE, VIDEO_ANALYSIS_BATCH_SIZE, VIDEO_SPECIMEN_GAP
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class FrameReader:
+    """動画をバックグラウンドスレッドでデコードし、stride間隔のフレームを供給する"""
+
+    def __init__(self, video_path: str, stride: int = VIDEO_ANALYSIS_STRIDE, max_queue: int = 16):
+        """
+        初期化
+        Args:
+            video_path: 動画ファイルのパス
+            stride: 何フレームごとに取り出すか
+            max_queue: デコード済みフレームの最大保持数（メモリ使用量の上限）
+        """
+        self.video_path = video_path
+        self.stride = max(1, int(stride))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.error: Optional[str] = None
+
+        self._capture = cv2.VideoCapture(video_path)
+        if not self._capture.isOpened():
+            self._capture.release()
+            raise IOError(f"動画ファイルを開けません: {video_path}")
+
+        fps = self._capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.0
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """デコードスレッド（間引くフレームはgrab()のみで色変換を省く）"""
+        index = 0
+        try:
+            while not self._stop.is_set():
+                if not self._capture.grab():
+                    break
+                if index % self.stride == 0:
+                    ret, frame = self._capture.retrieve()
+                    if ret and frame is not None:
+                        self._put((index, frame))
+                index += 1
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"動画デコードエラー: {e}")
+        finally:
+            self._capture.release()
+            self._put(_END)
+
+    def _put(self, item):
+        # 読み手が停止した場合に備えてタイムアウト付きで投入
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            yield item
+
+    def stop(self):
+        """デコードを中断（スレッドを開始する前なら動画をここで閉じる）"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+        else:
+            self._capture.release()
+
+class SpecimenTracker:
+    """連続して検出があるフレーム区間を1個体としてまとめる"""
+
+    def __init__(self, detector, gap_seconds: float = VIDEO_SPECIMEN_GAP):
+        self.detector = detector
+        self.gap_seconds = gap_seconds
+        self.specimens: List[dict] = []
+        self._current: Optional[dict] = None
+
+    def update(self, frame_index: int, time_sec: float, result: dict) -> Optional[dict]:
+        """
+        フレームの結果を追加
+        Returns:
+            区切りが確定した個体の結果（なければNone）
+        """
+        finished = None
+        if self._current and time_sec - self._current['last_detected_sec'] > self.gap_seconds:
+            finished = self.close()
+
+        if result['count'] > 0:
+            if self._current is None:
+                self._current = {
+                    'start_frame': frame_index,
+                    'start_sec': time_sec,
+                    'frames': 0,
+                    'sums': {0: 0, 1: 0, 2: 0, 3: 0},
+                    'frame_votes': {}
+                }
+            current = self._current
+            current['end_frame'] = frame_index
+            current['last_detected_sec'] = time_sec
+            current['frames'] += 1
+            for class_id, count in result['count_by_class_id'].items():
+                current['sums'][class_id] = current['sums'].get(class_id, 0) + count
+            gender = result['gender_result']['gender']
+            current['frame_votes'][gender] = current['frame_votes'].get(gender, 0) + 1
+
+        return finished
+
+    def close(self) -> Optional[dict]:
+        """現在の区間を確定して個体の判定結果を返す"""
+        current = self._current
+        self._current = None
+        if current is None:
+            return None
+
+        # 区間内の平均検出数を個体の検出数とする（一部フレームの誤検出に引きずられないように）
+        count_by_class = {
+            class_id: int(round(total / current['frames']))
+            for class_id, total in current['sums'].items()
+        }
+        specimen = {
+            'specimen': len(self.specimens) + 1,
+            'start_frame': current['start_frame'],
+            'end_frame': current['end_frame'],
+            'start_sec': round(current['start_sec'], 3),
+            'end_sec': round(current['last_detected_sec'], 3),
+            'frames': current['frames'],
+            'count_by_class': {
+                'male': count_by_class[0],
+                'female': count_by_class[1],
+                'madreporite': count_by_class[2]
+            },
+            'frame_votes': current['frame_votes'],
+            'gender_result': self.detector._determine_gender(count_by_class)
+        }
+        self.specimens.append(specimen)
+        return specimen
+
+class VideoAnalyzer:
+    """動画解析クラス"""
+
+    def __init__(self, detector, stride: int = VIDEO_ANALYSIS_STRIDE,
+                 batch_size: int = VIDEO_ANALYSIS_BATCH_SIZE, specimen_gap: float = VIDEO_SPECIMEN_GAP):
+        """
+        初期化
+        Args:
+            detector: YoloDetector
+            stride: 何フレームごとに解析するか
+            batch_size: 1回の推論にまとめるフレーム数
+            specimen_gap: この秒数以上検出が途切れたら別の個体とみなす
+        """
+        self.detector = detector
+        self.stride = max(1, int(stride))
+        self.batch_size = max(1, int(batch_size))
+        self.specimen_gap = specimen_gap
+
+    def analyze(self, video_path: str) -> Iterator[dict]:
+        """
+        動画を解析して結果を逐次返す
+        Yields:
+            {'type': 'start'}       : 動画情報
+            {'type': 'frame'}       : 解析したフレームごとの検出結果
+            {'type': 'specimen'}    : 個体ごとの雌雄判定（区間が確定した時点）
+            {'type': 'summary'}     : 全体の集計
+        """
+        reader = FrameReader(video_path, self.stride, max_queue=self.batch_size * 2)
+        tracker = SpecimenTracker(self.detector, self.specimen_gap)
+        analyzed = 0
+
+        # 'start'を返した直後に接続が切れても（ジェネレータが閉じられても）動画を閉じる
+        try:
+            yield {
+                'type': 'start',
+                'video': video_path,
+                'fps': reader.fps,
+                'frame_count': reader.frame_count,
+                'width': reader.width,
+                'height': reader.height,
+                'stride': self.stride,
+                'batch_size': self.batch_size
+            }
+
+            reader.start()
+            batch: List[Tuple[int, np.ndarray]] = []
+            for item in reader:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    yield from self._process_batch(batch, reader.fps, tracker)
+                    analyzed += len(batch)
+                    batch = []
+            if batch:
+                yield from self._process_batch(batch, reader.fps, tracker)
+                analyzed += len(batch)
+
+            specimen = tracker.close()
+            if specimen:
+                yield dict(specimen, type='specimen')
+
+            gender_totals: Dict[str, int] = {}
+            for s in tracker.specimens:
+                gender = s['gender_result']['gender']
+                gender_totals[gender] = gender_totals.get(gender, 0) + 1
+
+            yield {
+                'type': 'summary',
+                'analyzed_frames': analyzed,
+                'specimen_count': len(tracker.specimens),
+                'gender_totals': gender_totals,
+                'specimens': tracker.specimens,
+                'error': reader.error
+            }
+        finally:
+            reader.stop()
+
+    def _process_batch(self, batch, fps: float, tracker: SpecimenTracker) -> Iterator[dict]:
+        """バッチ推論してフレーム結果と確定した個体結果を返す"""
+        results = self.detector.detect_frames([frame for _, frame in batch])
+        for (frame_index, _), result in zip(batch, results):
+            time_sec = frame_index / fps
+            specimen = tracker.update(frame_index, time_sec, result)
+            if specimen:
+                yield dict(specimen, type='specimen')
+            yield {
+                'type': 'frame',
+                'frame_index': frame_index,
+                'time_sec': round(time_sec, 3),
+                'count': result['count'],
+                'count_by_class': result['count_by_class'],
+                'detections': result['detections'],
+                'gender': result['gender_result']['gender']
+            }
+
+def main():
+    import argparse
+    from core.YoloDetector import YoloDetector
+
+    parser = argparse.ArgumentParser(description='顕微鏡動画の雌雄判定（フレームを間引いてバッチ推論）')
+    parser.add_argument('video', help='動画ファイルのパス')
+    parser.add_argument('--model', default=None, help='YOLOモデルのパス（省略時は最新の学習済みモデル）')
+    parser.add_argument('--confidence', type=float, default=0.25, help='信頼度閾値')
+    parser.add_argument('--stride', type=int, default=VIDEO_ANALYSIS_STRIDE, help='何フレームごとに解析するか')
+    parser.add_argument('--batch-size', type=int, default=VIDEO_ANALYSIS_BATCH_SIZE, help='バッチサイズ')
+    parser.add_argument('--specimen-gap', type=float, default=VIDEO_SPECIMEN_GAP, help='個体の区切りとみなす検出の途切れ（秒）')
+    parser.add_argument('--frames', action='store_true', help='フレームごとの結果も出力')
+
+    args = parser.parse_args()
+
+    detector = YoloDetector(model_path=args.model, conf_threshold=args.confidence)
+    analyzer = VideoAnalyzer(detector, args.stride, args.batch_size, args.specimen_gap)
+
+    # 1行1件のJSONで出力
+    for event in analyzer.analyze(args.video):
+        if event['type'] == 'frame' and not args.frames:
+            continue
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+
+if __name__ == "__main__":
+    main()
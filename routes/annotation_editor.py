@@ -2,7 +2,13 @@ from flask import Blueprint, request, jsonify, render_template, current_app
 import os
 import json
 from datetime import datetime
-from config import METADATA_FILE
+from config import METADATA_FILE, ACTIVE_LEARNING_TOP_K, update_metadata
+from core.dataset_index import get_dataset_index, dataset_folder, DATASETS_FOLDER
+from core.file_ops import get_file_operations
+from core.active_learning import get_uncertainty_scorer
+from core.thumbnail_cache import thumbnail_url
+from app_utils.http_cache import versioned_url
+from app_utils.listing import parse_listing_args, listing_meta
 
 annotation_editor_bp = Blueprint('annotation_editor', __name__, url_prefix='/annotation')
 
@@ -44,13 +50,20 @@ def load_annotation(image_id):
         # メタデータの取得
         metadata = load_annotation_metadata()
         image_info = metadata.get(image_id, {})
+
+        # 内容のハッシュをURLに含め、再表示時はブラウザのキャッシュから読み込ませる
+        entry = get_dataset_index().get_image(dataset_folder(folder), image_id)
         
         return jsonify({
             'id': image_id,
             'original_name': image_info.get('original_name', image_id),
             'annotations': annotations,
             'annotation_count': len([line for line in annotations.split('\n') if line.strip()]),
-            'image_url': f'/static/training_data/datasets/{folder}/images/{image_id}',
+            # 自動アノテーション（core.auto_annotator）の候補で、まだ人が確認していないラベル
+            'proposal': bool(image_info.get('proposal')),
+            'proposal_model': image_info.get('proposal_model'),
+            'image_url': versioned_url(f'/static/training_data/datasets/{folder}/images/{image_id}',
+                                       entry['digest'] if entry else None),
             'redirect_url': f'/annotation/editor/?image={image_id}&folder={folder}',
             'folder': folder
         })
@@ -78,6 +91,7 @@ def save_annotation(image_id):
         
         with open(label_path, 'w') as f:
             f.write(yolo_annotations)
+        get_dataset_index().update_label(dataset_folder(folder), image_id)
         
         # クラス別カウント
         male_count = 0
@@ -98,8 +112,9 @@ def save_annotation(image_id):
                     elif class_id == 3:
                         anus_count += 1
 
-        # メタデータを更新
+        # メタデータを更新（保存したラベルは確認済みのため、自動アノテーションの候補の印を外す）
         update_annotation_metadata(image_id, {
+            'proposal': False,
             'annotated': annotation_count > 0,
             'annotation_count': annotation_count,
             'annotation_time': datetime.now().isoformat(),
@@ -132,58 +147,29 @@ def delete_images():
     if not image_ids:
         return jsonify({'error': 'パラメータが不足しています'}), 400
 
-    # フォルダごとのパスを構築
     base_dir = os.path.join('static', 'training_data', 'datasets', folder)
-    images_dir = os.path.join(base_dir, 'images')
-    labels_dir = os.path.join(base_dir, 'labels')
-
-    current_app.logger.info(f'削除対象ディレクトリ: images_dir={images_dir}, labels_dir={labels_dir}')
-
     if not os.path.exists(base_dir):
         current_app.logger.error(f'フォルダが見つかりません: {base_dir}')
         return jsonify({'error': 'フォルダが見つかりません'}), 404
 
-    deleted_count = 0
-    errors = []
-
-    for image_id in image_ids:
-        try:
-            # 画像ファイルを削除
-            image_path = os.path.join(images_dir, image_id)
-            current_app.logger.info(f'削除対象画像: {image_path}, 存在: {os.path.exists(image_path)}')
-
-            if os.path.exists(image_path):
-                os.remove(image_path)
-                current_app.logger.info(f'画像削除成功: {image_path}')
-
-                # 対応するラベルファイルも削除
-                label_name = os.path.splitext(image_id)[0] + '.txt'
-                label_path = os.path.join(labels_dir, label_name)
-                if os.path.exists(label_path):
-                    os.remove(label_path)
-                    current_app.logger.info(f'ラベル削除成功: {label_path}')
-
-                deleted_count += 1
-            else:
-                error_msg = f'{image_id}: ファイルが見つかりません'
-                errors.append(error_msg)
-                current_app.logger.warning(error_msg)
-
-        except Exception as e:
-            errors.append(f'{image_id}: {str(e)}')
-            current_app.logger.error(f'画像削除エラー: {image_id} - {str(e)}')
-
-    current_app.logger.info(f'削除結果: deleted_count={deleted_count}, errors={errors}')
+    # 画像とラベルの削除・インデックスの更新はcore.file_opsでまとめて行う（エディタからは完了を待つ）
+    batch = get_file_operations().delete(dataset_folder(folder), image_ids, wait=True)
+    current_app.logger.info(f'削除結果: deleted_count={batch["done"]}, errors={batch["errors"]}')
 
     return jsonify({
-        'success': deleted_count > 0,
-        'deleted_count': deleted_count,
-        'errors': errors
+        'success': batch['done'] > 0,
+        'deleted_count': batch['done'],
+        'errors': batch['errors']
     })
 
 @annotation_editor_bp.route('/editor/list-for-edit')
 def list_for_edit():
-    """エディタ用の画像リストを取得（選択された画像のみ）"""
+    """エディタ用の画像リストを取得（選択された画像のみ、limit/cursorでページ分割）"""
+    try:
+        options = parse_listing_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     # URLパラメータから選択された画像IDリストとフォルダを取得
     selected_ids = request.args.get('selected', '')
     folder = request.args.get('folder', 'default')
@@ -196,49 +182,91 @@ def list_for_edit():
 
     metadata = load_annotation_metadata()
     images = []
+    page = {'total': 0, 'next_cursor': None, 'has_more': False}
 
     # フォルダごとのパスを構築
     base_dir = os.path.join('static', 'training_data', 'datasets', folder)
     images_dir = os.path.join(base_dir, 'images')
-    labels_dir = os.path.join(base_dir, 'labels')
 
     if os.path.exists(images_dir):
-        all_image_files = []
-        for image_file in os.listdir(images_dir):
-            if image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                # 選択されたIDリストがある場合はフィルタリング
-                if selected_image_ids is None or image_file in selected_image_ids:
-                    all_image_files.append(image_file)
-
-        # ファイル名でソート（新しい順）
-        all_image_files.sort(reverse=True)
+        # インデックスから取得（既定はファイル名の降順、ラベルファイルは開かない）
+        try:
+            result = get_dataset_index().query_images(dataset_folder(folder), names=selected_image_ids, **options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        entries = result['images']
+        page = listing_meta(result)
 
         # 各画像の情報を構築
-        for image_file in all_image_files:
+        for entry in entries:
+            image_file = entry['name']
             image_info = metadata.get(image_file, {})
+            annotation_count = entry['box_count']
 
-            # アノテーション数を確認
-            label_path = os.path.join(labels_dir,
-                                     os.path.splitext(image_file)[0] + '.txt')
-            annotation_count = 0
-            if os.path.exists(label_path):
-                with open(label_path, 'r') as f:
-                    annotation_count = len([line for line in f.readlines() if line.strip()])
-            
             images.append({
                 'id': image_file,
                 'original_name': image_info.get('original_name', image_file),
                 'annotated': annotation_count > 0,
                 'annotation_count': annotation_count,
-                'thumbnail_url': f'/static/training_data/datasets/{folder}/images/{image_file}',
+                'proposal': bool(image_info.get('proposal')),
+                'thumbnail_url': thumbnail_url(f'datasets/{folder}/images/{image_file}', entry['digest']),
                 'upload_time': image_info.get('upload_time', '')
             })
     
+    return jsonify(dict(page,
+        images=images,
+        selected_mode=selected_image_ids is not None,
+        folder=folder
+    ))
+
+@annotation_editor_bp.route('/active-learning/queue')
+def active_learning_queue():
+    """
+    モデルが判断に迷っている未アノテーション画像（不確実性スコアの高い順）
+    クエリ: folder=フォルダ（省略時はすべて）, k=件数, score=false（未計算の画像があっても計算を始めない）
+    スコアが未計算の画像がある場合は計算を処理キューに追加し、そのタスクIDを返す（/task/<task_id>で進捗を取得）
+    """
+    from app import processing_queue, processing_status
+    from app_utils.worker import submit_uncertainty_scoring
+
+    folder = request.args.get('folder', '').strip('/')
+    if folder and not os.path.isdir(os.path.join('static', 'training_data', 'datasets', folder)):
+        return jsonify({'error': 'フォルダが見つかりません'}), 404
+    k = request.args.get('k', str(ACTIVE_LEARNING_TOP_K))
+    if not k.isdigit() or not 1 <= int(k) <= 500:
+        return jsonify({'error': 'kは1〜500の整数で指定してください'}), 400
+
+    prefix = dataset_folder(folder)
+    queue = get_uncertainty_scorer().top(prefix, int(k))
+    if queue is None:
+        return jsonify({'error': '学習済みモデルがありません。先に学習を実行してください'}), 404
+
+    task_id = None
+    if queue['pending'] and request.args.get('score', 'true').lower() != 'false':
+        task_id = submit_uncertainty_scoring(processing_queue, processing_status, prefix)
+
+    images = []
+    for entry in queue['images']:
+        folder_path = entry['folder'][len(DATASETS_FOLDER) + 1:]
+        name = entry['name']
+        images.append({
+            'id': name,
+            'folder': folder_path,
+            'score': entry['score'],
+            'max_confidence': entry['max_confidence'],
+            'conflict': bool(entry['conflict']),
+            'disagreement': entry['disagreement'],
+            'predicted_boxes': entry['predicted_boxes'],
+            'thumbnail_url': thumbnail_url(f'datasets/{folder_path}/images/{name}', entry['digest']),
+            'editor_url': f'/annotation/editor/?image={name}&folder={folder_path}'
+        })
+
     return jsonify({
+        'model_version': queue['model_version'],
         'images': images,
-        'total': len(images),
-        'selected_mode': selected_image_ids is not None,
-        'folder': folder
+        'count': len(images),
+        'pending': queue['pending'],
+        'scoring_task_id': task_id
     })
 
 # ヘルパー関数
@@ -252,13 +280,4 @@ def load_annotation_metadata():
     return {}
 
 def update_annotation_metadata(image_id, info):
-    metadata = load_annotation_metadata()
-    if image_id not in metadata:
-        metadata[image_id] = {}
-    metadata[image_id].update(info)
-    save_annotation_metadata(metadata)
-
-def save_annotation_metadata(metadata):
-    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
\ No newline at end of file
+    update_metadata(lambda metadata: metadata.setdefault(image_id, {}).update(info))
\ No newline at end of file
@@ -4,45 +4,103 @@
 """
 
 from flask import Blueprint, render_template, Response, jsonify, request
-import cv2
 import logging
 import os
 import base64
 import json
-from core.camera_manager import get_camera_instance, reset_camera_instance
+import time
+from core.camera_manager import get_camera_instance, get_active_camera_index, set_active_camera
+from core.camera_discovery import get_camera_discovery
 from core.realtime_detector import get_detector_instance
+from core.inference_pool import get_inference_pool
+from core.detection_stream import get_detection_stream
+from core.pipeline_stats import get_pipeline_stats
+from app_utils.jpeg_codec import encode_jpeg
 from config import UPLOAD_DIR
 
 logger = logging.getLogger(__name__)
 
 camera_bp = Blueprint('camera', __name__, url_prefix='/camera')
 
-def generate_frames():
-    """映像フレームをストリーミング"""
-    camera = get_camera_instance()
-
-    while True:
-        frame_jpeg = camera.get_frame_jpeg()
-        if frame_jpeg:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_jpeg + b'\r\n')
-
-def generate_frames_with_detection():
+@camera_bp.record_once
+def start_camera_discovery(state):
+    """アプリ登録時にカメラ一覧の初回検出をバックグラウンドで開始"""
+    get_camera_discovery().refresh_async()
+
+def _multipart_frame(jpeg, timestamp):
+    """MJPEGストリームの1パートを生成
+
+    X-Frame-Timestampにはキャプチャ時刻（UNIX時間）を入れ、クライアント側でエンドツーエンドの遅延を計測できるようにする
+    """
+    captured_at = time.time() - (time.monotonic() - timestamp)
+    headers = (f'Content-Type: image/jpeg\r\n'
+               f'Content-Length: {len(jpeg)}\r\n'
+               f'X-Frame-Timestamp: {captured_at:.6f}\r\n\r\n')
+    return b'--frame\r\n' + headers.encode('ascii') + jpeg + b'\r\n'
+
+def _requested_camera_index():
+    """リクエストで指定されたカメラインデックス（未指定の場合は表示中のカメラ）"""
+    camera_index = request.args.get('camera', type=int)
+    if camera_index is None and request.is_json:
+        camera_index = (request.get_json(silent=True) or {}).get('camera_index')
+    return int(camera_index) if camera_index is not None else get_active_camera_index()
+
+def _timed_encode(frame):
+    """JPEGエンコード（所要時間を記録）"""
+    with get_pipeline_stats().measure('encode'):
+        return encode_jpeg(frame)
+
+def _record_write(write_start, timestamp):
+    """yieldから再開するまでの時間（サーバーのソケット書き込み）とフレームの経過時間を記録"""
+    stats = get_pipeline_stats()
+    now = time.monotonic()
+    stats.record('socket_write', now - write_start)
+    stats.record('frame_age', now - timestamp)
+
+def generate_frames(camera):
+    """映像フレームをストリーミング（新しいフレームが届くまで待機）"""
+    hub = camera.frame_hub
+    last_seq = 0
+
+    with camera.viewer():
+        while camera.is_running:
+            item = hub.wait_next(last_seq, timeout=1.0)
+            if item is None:
+                continue
+            last_seq, frame, timestamp = item
+            # 同じフレームのエンコード結果は視聴者間で共有
+            frame_jpeg = hub.encoded(last_seq, frame, _timed_encode)
+            if frame_jpeg:
+                write_start = time.monotonic()
+                yield _multipart_frame(frame_jpeg, timestamp)
+                _record_write(write_start, timestamp)
+
+def generate_frames_with_detection(camera, camera_index):
     """判定結果付き映像フレームをストリーミング"""
-    camera = get_camera_instance()
+    hub = camera.frame_hub
     detector = get_detector_instance()
-
-    while True:
-        frame = camera.get_frame()
-        if frame is not None:
-            # YOLO判定を実行
-            processed_frame, info = detector.process_frame(frame)
+    pool = get_inference_pool()
+    last_seq = 0
+
+    # 推論は視聴者のジェネレータ内でのみ行うため、接続が切れると同時に止まる
+    with camera.viewer():
+        while camera.is_running:
+            # 推論中に届いたフレームは読み飛ばし、常に最新のフレームを判定する
+            item = hub.wait_next(last_seq, timeout=1.0)
+            if item is None:
+                continue
+            last_seq, frame, timestamp = item
+
+            # YOLO判定を実行（他のカメラ・視聴者の要求とまとめてバッチ推論）
+            detections = pool.detect(camera_index, last_seq, frame)
+            processed_frame, info = detector.process_frame(frame, detections)
 
             # フレームをJPEGに変換
-            ret, jpeg = cv2.imencode('.jpg', processed_frame)
-            if ret:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
+            jpeg = _timed_encode(processed_frame)
+            if jpeg:
+                write_start = time.monotonic()
+                yield _multipart_frame(jpeg, timestamp)
+                _record_write(write_start, timestamp)
 
 @camera_bp.route('/')
 @camera_bp.route('/<int:camera_index>')
@@ -52,39 +110,20 @@ def camera_page(camera_index=None):
     if camera_index is None:
         camera_index = 0
 
-    # カメラを切り替え
-    camera = get_camera_instance()
-    if camera.current_camera_index != camera_index:
-        reset_camera_instance()
-
-        from core.camera_manager import CameraConfig
-        config = CameraConfig()
-        config.camera_index = camera_index
-
-        # カメラごとの設定
-        if camera_index == 0:
-            config.width = 640
-            config.height = 480
-        else:
-            config.width = 1280
-            config.height = 720
-
-        # 新しいインスタンスを作成
-        import core.camera_manager as cm
-        cm._camera_instance = cm.CameraManager(config)
+    # 表示するカメラを切り替え（他のカメラは稼働したまま）
+    set_active_camera(camera_index)
 
     return render_template('camera.html', camera_index=camera_index)
 
 @camera_bp.route('/video_feed')
 def video_feed():
     """映像ストリーミングエンドポイント"""
-    camera = get_camera_instance()
+    camera_index = _requested_camera_index()
+    camera = get_camera_instance(camera_index)
 
     # カメラが初期化されていない場合は初期化
-    if not camera.is_running:
-        if not camera.initialize():
-            return jsonify({'error': 'カメラの初期化に失敗しました'}), 500
-        camera.start_capture()
+    if not camera.ensure_running():
+        return jsonify({'error': 'カメラの初期化に失敗しました'}), 500
 
     # 判定モードの確認とパラメータの取得
     detection_mode = request.args.get('detection', 'false').lower() == 'true'
@@ -107,24 +146,54 @@ def video_feed():
         logger.info(f"検出パラメータ更新: confidence={confidence}, iou={iou}, size={size}")
 
         # 判定付きストリーミング
-        return Response(generate_frames_with_detection(),
+        return Response(generate_frames_with_detection(camera, camera_index),
                         mimetype='multipart/x-mixed-replace; boundary=frame')
     else:
         # 通常のストリーミング
-        return Response(generate_frames(),
+        return Response(generate_frames(camera),
                         mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@camera_bp.route('/detections')
+def detection_events():
+    """
+    判定結果のみをServer-Sent Eventsで配信（映像はdetection=falseの生フレームを使い、枠はクライアントで描画）
+    confidence・iouを指定した場合は判定付きの映像配信と同じく検出器に設定する
+    """
+    camera_index = _requested_camera_index()
+    camera = get_camera_instance(camera_index)
+    stream = get_detection_stream(camera_index)
+
+    detector = get_detector_instance()
+    if 'confidence' in request.args:
+        detector.model.conf = float(request.args['confidence'])
+    if 'iou' in request.args:
+        detector.model.iou = float(request.args['iou'])
+
+    def generate():
+        with camera.viewer(), stream.subscribe():
+            last_seq = 0
+            while camera.is_running:
+                message = stream.wait_next(last_seq, timeout=15.0)
+                if message is None:
+                    # 接続維持用のコメント行
+                    yield ': keep-alive\n\n'
+                    continue
+                last_seq = message['seq']
+                yield f"data: {json.dumps(message)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @camera_bp.route('/start', methods=['POST'])
 def start_camera():
     """カメラを開始"""
-    camera = get_camera_instance()
+    camera = get_camera_instance(_requested_camera_index())
 
     if camera.is_running:
         return jsonify({'status': 'already_running', 'message': 'カメラは既に起動しています'})
 
-
-    if camera.initialize():
-        camera.start_capture()
+    # 映像配信の開始と同時に呼ばれてもデバイスの初期化は1回だけ行う
+    if camera.ensure_running():
         return jsonify({'status': 'success', 'message': 'カメラを開始しました'})
     else:
         return jsonify({'status': 'error', 'message': 'カメラの開始に失敗しました'}), 500
@@ -132,14 +201,14 @@ def start_camera():
 @camera_bp.route('/stop', methods=['POST'])
 def stop_camera():
     """カメラを停止"""
-    camera = get_camera_instance()
+    camera = get_camera_instance(_requested_camera_index())
     camera.stop_capture()
     return jsonify({'status': 'success', 'message': 'カメラを停止しました'})
 
 @camera_bp.route('/snapshot', methods=['POST'])
 def capture_snapshot():
     """スナップショットを撮影"""
-    camera = get_camera_instance()
+    camera = get_camera_instance(_requested_camera_index())
 
     if not camera.is_running:
         return jsonify({'status': 'error', 'message': 'カメラが起動していません'}), 400
@@ -167,7 +236,7 @@ def capture_snapshot():
 @camera_bp.route('/info', methods=['GET'])
 def camera_info():
     """カメラ情報を取得"""
-    camera = get_camera_instance()
+    camera = get_camera_instance(_requested_camera_index())
     info = camera.get_camera_info()
     return jsonify(info)
 
@@ -187,6 +256,7 @@ def detection_stats():
     """判定統計を取得"""
     detector = get_detector_instance()
     stats = detector.get_stats()
+    stats['inference_pool'] = get_inference_pool().get_stats()
     return jsonify(stats)
 
 @camera_bp.route('/update_detection_params', methods=['POST'])
@@ -218,116 +288,44 @@ def update_detection_params():
 
 @camera_bp.route('/detection/reset', methods=['POST'])
 def reset_detection_stats():
-    """判定統計をリセット"""
+    """判定統計・段階別の所要時間をリセット"""
     detector = get_detector_instance()
     detector.reset_stats()
     return jsonify({'status': 'success', 'message': '統計をリセットしました'})
 
 @camera_bp.route('/detect', methods=['GET'])
 def detect_cameras():
-    """利用可能なカメラを検出"""
-    import time
-
-    # 現在のカメラインスタンスを一時停止
-    camera = get_camera_instance()
-    was_running = camera.is_running
-    if was_running:
-        camera.stop_capture()
-        time.sleep(0.5)  # リソースの解放を待つ
-
-    available_cameras = []
-
-    # 最大5つまでカメラを検出
-    for i in range(5):
-        logger.info(f"カメラ {i} を検出中...")
-        cap = cv2.VideoCapture(i)
-
-        if cap.isOpened():
-            # カメラ情報を取得
-            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-
-            # テストフレームを取得して確認
-            ret, frame = cap.read()
-            if ret:
-                camera_info = {
-                    'index': i,
-                    'name': f'カメラ {i}',
-                    'width': int(width),
-                    'height': int(height),
-                    'fps': int(fps) if fps > 0 else 30,
-                    'available': True
-                }
-
-                # Windows環境では逆になることが多い
-                # カメラ0がUSB、カメラ1が内蔵の場合がある
-                if i == 0:
-                    camera_info['name'] = 'カメラ 0 (外部/USB)'
-                elif i == 1:
-                    camera_info['name'] = 'カメラ 1 (内蔵)'
-
-                available_cameras.append(camera_info)
-                logger.info(f"カメラ {i} 検出: {width}x{height} @ {fps}fps")
-
-            cap.release()
-
-        # 少し待機してからリソースを解放
-        time.sleep(0.1)
-
-    # 元の状態に戻す
-    if was_running:
-        camera.initialize()
-        camera.start_capture()
+    """利用可能なカメラを取得（キャッシュから即時に返す）"""
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
+    inventory = get_camera_discovery().get_inventory(refresh=refresh)
 
     return jsonify({
         'status': 'success',
-        'cameras': available_cameras,
-        'current_camera': camera.current_camera_index
+        'cameras': inventory['cameras'],
+        'current_camera': get_active_camera_index(),
+        'updated_at': inventory['updated_at'],
+        'refreshing': inventory['refreshing']
     })
 
 @camera_bp.route('/switch', methods=['POST'])
 def switch_camera():
-    """カメラを切り替え"""
-    data = request.get_json()
-    camera_index = data.get('camera_index', 0)
-
-    # より長い待機時間でリソースを確実に解放
-    import time
-
-    # 現在のインスタンスを完全にリセット
-    reset_camera_instance()
+    """カメラを切り替え（切り替え前のカメラは解放せず稼働を続けるため即座に切り替わる）"""
+    data = request.get_json() or {}
+    camera_index = int(data.get('camera_index', 0))
 
-    # OpenCVのバッファをクリアするために少し長めに待機
-    time.sleep(1.0)
+    previous_index = get_active_camera_index()
+    camera = set_active_camera(camera_index)
 
-    # 新しいインスタンスを作成
-    from core.camera_manager import CameraConfig
-    config = CameraConfig()
-    config.camera_index = camera_index
-
-    # カメラごとの設定
-    if camera_index == 0:
-        config.width = 640
-        config.height = 480
-    else:
-        config.width = 1280
-        config.height = 720
-
-    # 新しいインスタンスを作成
-    import core.camera_manager as cm
-    cm._camera_instance = cm.CameraManager(config)
-
-    # 新しいカメラを取得して初期化
-    camera = get_camera_instance()
-    if camera.initialize():
-        return jsonify({
-            'status': 'success',
-            'message': f'カメラ {camera_index} に切り替えました',
-            'camera_info': camera.get_camera_info()
-        })
-    else:
+    # 初めて使うカメラのみ初期化
+    if not camera.ensure_running():
+        set_active_camera(previous_index)
         return jsonify({
             'status': 'error',
             'message': f'カメラ {camera_index} への切り替えに失敗しました'
-        }), 500
\ No newline at end of file
+        }), 500
+
+    return jsonify({
+        'status': 'success',
+        'message': f'カメラ {camera_index} に切り替えました',
+        'camera_info': camera.get_camera_info()
+    })
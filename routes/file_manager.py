@@ -4,13 +4,22 @@
 フォルダ構造での画像・ラベル管理を提供
 """
 
-from flask import Blueprint, request, jsonify, render_template, current_app
+from flask import Blueprint, request, jsonify, render_template, current_app, Response
 import os
 import shutil
 from datetime import datetime
 import json
 from pathlib import Path
 
+from core.blob_store import get_blob_store
+from core.dataset_index import get_dataset_index, dataset_folder, DATASETS_FOLDER
+from core.file_ops import get_file_operations
+from core.dataset_export import DatasetExporter
+from core.near_duplicates import get_near_duplicate_detector
+from core.thumbnail_cache import thumbnail_url
+from app_utils.http_cache import versioned_url
+from app_utils.listing import parse_listing_args, listing_meta
+
 file_manager_bp = Blueprint('file_manager', __name__)
 
 # ベースディレクトリ
@@ -37,7 +46,8 @@ def ensure_base_directory():
                     src = os.path.join(old_images, file)
                     dst = os.path.join(default_dir, 'images', file)
                     if not os.path.exists(dst):
-                        shutil.copy2(src, dst)
+                        # 画像ストアへの参照として作成（実体は共有）
+                        get_blob_store().copy(src, dst)
 
         if os.path.exists(old_labels):
             for file in os.listdir(old_labels):
@@ -58,58 +68,46 @@ def get_folder_structure():
     """フォルダ構造を取得"""
     ensure_base_directory()
 
-    def build_tree(path, name):
+    # フォルダごとの件数はインデックスから取得（ディレクトリを走査しない）
+    stats = get_dataset_index().folder_stats(DATASETS_FOLDER)
+    children = {}
+    for folder in stats:
+        if folder != DATASETS_FOLDER:
+            children.setdefault(folder.rsplit('/', 1)[0], []).append(folder)
+
+    def build_tree(folder, name):
         """再帰的にフォルダツリーを構築"""
+        folder_stats = stats.get(folder, {})
         node = {
             'name': name,
-            'path': os.path.relpath(path, BASE_DIR).replace('\\', '/'),
+            'path': os.path.relpath(folder, DATASETS_FOLDER).replace('\\', '/'),
             'type': 'folder',
             'children': [],
-            'image_count': 0,
-            'label_count': 0,
-            'annotation_count': 0  # アノテーション数を追加
+            'image_count': folder_stats.get('image_count', 0),
+            'label_count': folder_stats.get('label_count', 0),
+            'annotation_count': folder_stats.get('label_count', 0)  # annotation_countも同じ値を設定
         }
 
-        try:
-            # images/labelsサブフォルダのファイル数をカウント
-            images_dir = os.path.join(path, 'images')
-            labels_dir = os.path.join(path, 'labels')
-
-            if os.path.exists(images_dir):
-                node['image_count'] = len([f for f in os.listdir(images_dir)
-                                          if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
-
-            if os.path.exists(labels_dir):
-                label_count = len([f for f in os.listdir(labels_dir)
-                                  if f.endswith('.txt')])
-                node['label_count'] = label_count
-                node['annotation_count'] = label_count  # annotation_countも同じ値を設定
-
-            # サブフォルダを探索（images/labels以外）
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                if os.path.isdir(item_path) and item not in ['images', 'labels']:
-                    child_node = build_tree(item_path, item)
-                    node['children'].append(child_node)
-
-                    # datasetsフォルダの場合、子フォルダの画像数を合計
-                    if name == 'datasets':
-                        node['image_count'] += child_node['image_count']
-                        node['label_count'] += child_node['label_count']
-                        node['annotation_count'] += child_node.get('annotation_count', 0)
-                        # 子フォルダの子フォルダも含める（再帰的集計）
-                        if child_node['children']:
-                            for grandchild in child_node['children']:
-                                node['image_count'] += grandchild.get('image_count', 0)
-                                node['label_count'] += grandchild.get('label_count', 0)
-                                node['annotation_count'] += grandchild.get('annotation_count', 0)
-
-        except PermissionError:
-            pass
+        # サブフォルダ（images/labels以外）
+        for child in sorted(children.get(folder, [])):
+            child_node = build_tree(child, child.rsplit('/', 1)[1])
+            node['children'].append(child_node)
+
+            # datasetsフォルダの場合、子フォルダの画像数を合計
+            if name == 'datasets':
+                node['image_count'] += child_node['image_count']
+                node['label_count'] += child_node['label_count']
+                node['annotation_count'] += child_node.get('annotation_count', 0)
+                # 子フォルダの子フォルダも含める（再帰的集計）
+                if child_node['children']:
+                    for grandchild in child_node['children']:
+                        node['image_count'] += grandchild.get('image_count', 0)
+                        node['label_count'] += grandchild.get('label_count', 0)
+                        node['annotation_count'] += grandchild.get('annotation_count', 0)
 
         return node
 
-    tree = build_tree(BASE_DIR, 'datasets')
+    tree = build_tree(DATASETS_FOLDER, 'datasets')
     return jsonify(tree)
 
 @file_manager_bp.route('/api/folder/create', methods=['POST'])
@@ -141,6 +139,7 @@ def create_folder():
         # フォルダとサブフォルダを作成
         os.makedirs(os.path.join(folder_path, 'images'))
         os.makedirs(os.path.join(folder_path, 'labels'))
+        get_dataset_index().add_folder(dataset_folder(os.path.relpath(folder_path, BASE_DIR)))
 
         return jsonify({
             'success': True,
@@ -180,6 +179,8 @@ def rename_folder():
 
     try:
         os.rename(old_path, new_path)
+        get_dataset_index().rename_folder(dataset_folder(folder_path),
+                                          dataset_folder(os.path.relpath(new_path, BASE_DIR)))
         return jsonify({
             'success': True,
             'new_name': safe_name
@@ -217,14 +218,34 @@ def delete_folder():
 
         # フォルダを削除
         shutil.rmtree(full_path)
+        get_dataset_index().remove_folder(dataset_folder(folder_path))
         return jsonify({'success': True})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _batch_response(batch, count_key):
+    """一括操作の結果（バックグラウンドで実行中の場合は進捗確認用のbatch_idを202で返す）"""
+    if batch['status'] in ('pending', 'running'):
+        return jsonify({
+            'success': True,
+            'batch_id': batch['id'],
+            'status': batch['status'],
+            'total': batch['total'],
+            'errors': batch['errors']
+        }), 202
+
+    return jsonify({
+        'success': batch['done'] > 0,
+        count_key: batch['done'],
+        'errors': batch['errors'],
+        'batch_id': batch['id'],
+        'status': batch['status']
+    })
+
 @file_manager_bp.route('/api/images/move', methods=['POST'])
 def move_images():
-    """画像を別のフォルダに移動"""
+    """画像を別のフォルダに移動（core.file_opsで一括実行、枚数が多い場合はバックグラウンド）"""
     data = request.json
     source_folder = data.get('source_folder')
     target_folder = data.get('target_folder')
@@ -239,42 +260,68 @@ def move_images():
     if not os.path.exists(source_path) or not os.path.exists(target_path):
         return jsonify({'error': 'フォルダが見つかりません'}), 404
 
-    moved_count = 0
+    batch = get_file_operations().move(dataset_folder(source_folder), dataset_folder(target_folder), image_ids)
+    return _batch_response(batch, 'moved_count')
+
+@file_manager_bp.route('/api/images/copy', methods=['POST'])
+def copy_images():
+    """画像を別のフォルダにコピー（画像は実体を共有するハードリンク、ラベルは複製）"""
+    data = request.json
+    source_folder = data.get('source_folder')
+    target_folder = data.get('target_folder')
+    image_ids = data.get('image_ids', [])
+
+    if not all([source_folder, target_folder, image_ids]):
+        return jsonify({'error': 'パラメータが不足しています'}), 400
+
+    source_path = os.path.join(BASE_DIR, source_folder)
+    target_path = os.path.join(BASE_DIR, target_folder)
+
+    if not os.path.exists(source_path) or not os.path.exists(target_path):
+        return jsonify({'error': 'フォルダが見つかりません'}), 404
+
+    store = get_blob_store()
+    copied_count = 0
     errors = []
 
     for image_id in image_ids:
         try:
-            # 画像ファイルを移動
             src_image = os.path.join(source_path, 'images', image_id)
             dst_image = os.path.join(target_path, 'images', image_id)
 
-            if os.path.exists(src_image):
-                shutil.move(src_image, dst_image)
+            if not os.path.exists(src_image):
+                errors.append(f'{image_id}: ファイルが見つかりません')
+                continue
+            if os.path.exists(dst_image):
+                errors.append(f'{image_id}: 同名のファイルがコピー先に存在します')
+                continue
 
-                # 対応するラベルファイルも移動
-                label_name = os.path.splitext(image_id)[0] + '.txt'
-                src_label = os.path.join(source_path, 'labels', label_name)
-                dst_label = os.path.join(target_path, 'labels', label_name)
+            store.copy(src_image, dst_image)
 
-                if os.path.exists(src_label):
-                    shutil.move(src_label, dst_label)
+            # ラベルはフォルダごとに編集されるため実体を共有しない
+            label_name = os.path.splitext(image_id)[0] + '.txt'
+            src_label = os.path.join(source_path, 'labels', label_name)
+            dst_label = os.path.join(target_path, 'labels', label_name)
 
-                moved_count += 1
-            else:
-                errors.append(f'{image_id}: ファイルが見つかりません')
+            if os.path.exists(src_label):
+                os.makedirs(os.path.dirname(dst_label), exist_ok=True)
+                shutil.copy2(src_label, dst_label)
+
+            get_dataset_index().update_image(dataset_folder(target_folder), image_id)
+            copied_count += 1
 
         except Exception as e:
             errors.append(f'{image_id}: {str(e)}')
 
     return jsonify({
-        'success': moved_count > 0,
-        'moved_count': moved_count,
+        'success': copied_count > 0,
+        'copied_count': copied_count,
         'errors': errors
     })
 
 @file_manager_bp.route('/api/images/delete', methods=['POST'])
 def delete_images():
-    """選択された画像を削除"""
+    """選択された画像を削除（core.file_opsで一括実行、枚数が多い場合はバックグラウンド）"""
     data = request.json
     folder_path = data.get('folder_path')
     image_ids = data.get('image_ids', [])
@@ -287,39 +334,148 @@ def delete_images():
     if not os.path.exists(full_path):
         return jsonify({'error': 'フォルダが見つかりません'}), 404
 
-    deleted_count = 0
-    errors = []
-
-    for image_id in image_ids:
-        try:
-            # 画像ファイルを削除
-            image_path = os.path.join(full_path, 'images', image_id)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-
-                # 対応するラベルファイルも削除
-                label_name = os.path.splitext(image_id)[0] + '.txt'
-                label_path = os.path.join(full_path, 'labels', label_name)
-                if os.path.exists(label_path):
-                    os.remove(label_path)
-
-                deleted_count += 1
-            else:
-                errors.append(f'{image_id}: ファイルが見つかりません')
+    batch = get_file_operations().delete(dataset_folder(folder_path), image_ids)
+    return _batch_response(batch, 'deleted_count')
+
+@file_manager_bp.route('/api/operations')
+def list_operations():
+    """実行中と最近の一括操作"""
+    return jsonify({'operations': get_file_operations().list_batches()})
+
+@file_manager_bp.route('/api/operations/<batch_id>')
+def get_operation(batch_id):
+    """一括操作の進捗（total・done・failed・progress・status）"""
+    batch = get_file_operations().status(batch_id)
+    if batch is None:
+        return jsonify({'error': '操作が見つかりません'}), 404
+    return jsonify(batch)
+
+@file_manager_bp.route('/api/operations/<batch_id>/cancel', methods=['POST'])
+def cancel_operation(batch_id):
+    """実行中の一括操作を中止（処理済みのファイルは元に戻す）"""
+    if not get_file_operations().cancel(batch_id):
+        return jsonify({'error': '実行中の操作が見つかりません'}), 404
+    return jsonify({'success': True})
+
+@file_manager_bp.route('/api/export')
+def export_folders():
+    """
+    フォルダをZIP/TARとしてストリーミングでダウンロード（一時ファイルを作らず、すぐに送信を始める）
+    クエリ: folders=a,b（カンマ区切り）, format=zip|tar, layout=yolo|coco, resize=長辺のピクセル数
+    """
+    folders = [folder.strip('/') for folder in request.args.get('folders', '').split(',') if folder.strip('/')]
+    if not folders:
+        return jsonify({'error': 'フォルダを指定してください'}), 400
+    for folder in folders:
+        full_path = os.path.abspath(os.path.join(BASE_DIR, folder))
+        if not full_path.startswith(os.path.abspath(BASE_DIR) + os.sep) or not os.path.isdir(full_path):
+            return jsonify({'error': f'フォルダが見つかりません: {folder}'}), 404
+
+    resize = request.args.get('resize')
+    try:
+        if resize and (not resize.isdigit() or not 32 <= int(resize) <= 8192):
+            raise ValueError('resizeは32〜8192の整数で指定してください')
+        resize = int(resize) if resize else None
+        exporter = DatasetExporter(folders, layout=request.args.get('layout', 'yolo'),
+                                   archive_format=request.args.get('format', 'zip'), resize=resize)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 長さが分からないためチャンク転送で送る（プロキシでのバッファリングも無効にする）
+    return Response(exporter.stream(), mimetype=exporter.mimetype, direct_passthrough=True, headers={
+        'Content-Disposition': f'attachment; filename="{exporter.filename}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
 
-        except Exception as e:
-            errors.append(f'{image_id}: {str(e)}')
+def _duplicate_entry(entry):
+    """近似重複の検出結果の画像に、ファイルマネージャーのフォルダパスとURLを付ける"""
+    folder_path = entry['folder'][len(DATASETS_FOLDER) + 1:]
+    path = f"datasets/{folder_path}/images/{entry['name']}"
+    return dict(entry, folder=folder_path,
+                url=versioned_url(f'/static/training_data/{path}', entry['digest']),
+                thumbnail_url=thumbnail_url(path, entry['digest']))
+
+def _duplicate_threshold():
+    threshold = request.args.get('threshold', '')
+    if not threshold:
+        return None
+    if not threshold.isdigit() or int(threshold) > 64:
+        raise ValueError('thresholdは0〜64の整数で指定してください')
+    return int(threshold)
+
+@file_manager_bp.route('/api/duplicates')
+def list_duplicates():
+    """
+    近似重複のクラスタ一覧
+    クエリ: folder=フォルダ（省略時はすべてのフォルダ、子フォルダを含む）, threshold=ハミング距離
+    知覚ハッシュが未計算の画像が多い場合は計算を処理キューに追加し、そのタスクIDを返す（/task/<task_id>で進捗を取得）。
+    計算が終わるまでの結果には未計算の画像は含まれない
+    """
+    folder_path = request.args.get('folder', '').strip('/')
+    if folder_path and not os.path.isdir(os.path.join(BASE_DIR, folder_path)):
+        return jsonify({'error': 'フォルダが見つかりません'}), 404
+    detector = get_near_duplicate_detector()
+    prefix = dataset_folder(folder_path)
+    try:
+        threshold = _duplicate_threshold()
+        task_ids = detector.ensure_hashes([prefix], _submit_hashing)
+        clusters = detector.clusters(prefix, threshold)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"近似重複の検出エラー: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
+    for cluster in clusters:
+        cluster['images'] = [_duplicate_entry(entry) for entry in cluster['images']]
     return jsonify({
-        'success': deleted_count > 0,
-        'deleted_count': deleted_count,
-        'errors': errors
+        'clusters': clusters,
+        'cluster_count': len(clusters),
+        'image_count': sum(cluster['size'] for cluster in clusters),
+        'pending': detector.pending(prefix) if task_ids else 0,
+        'task_id': task_ids[0] if task_ids else None
     })
 
+@file_manager_bp.route('/api/duplicates/neighbors')
+def list_duplicate_neighbors():
+    """
+    画像1枚に近い画像の一覧（知覚ハッシュが未計算の画像は含まない）
+    クエリ: folder=画像のフォルダ, name=画像名, threshold=ハミング距離, scope=探すフォルダ（省略時はすべてのフォルダ）
+    """
+    folder_path = request.args.get('folder', '').strip('/')
+    name = request.args.get('name', '')
+    scope = request.args.get('scope', '').strip('/')
+    if not folder_path or not name:
+        return jsonify({'error': 'folderとnameを指定してください'}), 400
+    detector = get_near_duplicate_detector()
+    prefix = dataset_folder(scope)
+    try:
+        threshold = _duplicate_threshold()
+        task_ids = detector.ensure_hashes([prefix], _submit_hashing)
+        neighbors = detector.neighbors(dataset_folder(folder_path), name, threshold, prefix)
+    except KeyError:
+        return jsonify({'error': '画像が見つかりません'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'images': [_duplicate_entry(entry) for entry in neighbors], 'count': len(neighbors),
+                    'task_id': task_ids[0] if task_ids else None})
+
+def _submit_hashing(prefix):
+    from app import processing_queue, processing_status
+    from app_utils.worker import submit_near_duplicate_hashing
+    return submit_near_duplicate_hashing(processing_queue, processing_status, prefix)
+
 @file_manager_bp.route('/api/folder/images/')
 @file_manager_bp.route('/api/folder/images/<path:folder_path>')
 def get_folder_images(folder_path=''):
-    """指定フォルダ内の画像一覧を取得"""
+    """指定フォルダ内の画像一覧を取得（limit/cursorでページ分割、フィルタ・並べ替えはapp_utils.listingを参照）"""
+    try:
+        options = parse_listing_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     # 空のパスまたはdatasetsの場合はデフォルトフォルダへ
     if not folder_path or folder_path == '.' or folder_path == 'datasets':
         # デフォルトフォルダがあればそれを使用
@@ -345,21 +501,22 @@ def get_folder_images(folder_path=''):
 
     images = []
     try:
-        for file in os.listdir(full_path):
-            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                # ラベルファイルの存在確認
-                label_path = os.path.join(BASE_DIR, folder_path, 'labels',
-                                         os.path.splitext(file)[0] + '.txt')
-                has_label = os.path.exists(label_path)
-
-                images.append({
-                    'id': file,
-                    'name': file,
-                    'has_label': has_label,
-                    'url': f'/static/training_data/datasets/{folder_path}/images/{file}'
-                })
+        result = get_dataset_index().query_images(dataset_folder(folder_path), **options)
+        for entry in result['images']:
+            file = entry['name']
+            images.append({
+                'id': file,
+                'name': file,
+                'has_label': bool(entry['has_label']),
+                'annotation_count': entry['box_count'],
+                'mtime': entry['mtime_ns'] / 1e9 if entry['mtime_ns'] else None,
+                'url': versioned_url(f'/static/training_data/datasets/{folder_path}/images/{file}', entry['digest']),
+                'thumbnail_url': thumbnail_url(f'datasets/{folder_path}/images/{file}', entry['digest'])
+            })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"画像リスト取得エラー: {str(e)}")
         return jsonify({'images': [], 'count': 0, 'error': str(e)})
 
-    return jsonify({'images': images, 'count': len(images)})
\ No newline at end of file
+    return jsonify(dict(listing_meta(result), images=images, count=len(images), folder=folder_path))
\ No newline at end of file
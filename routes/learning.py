@@ -15,7 +15,12 @@ import uuid
 import traceback
 import base64
 from datetime import datetime
+from config import METADATA_LOCK, save_metadata, update_metadata
 from app_utils.file_handlers import handle_multiple_image_upload
+from core.dataset_index import get_dataset_index, TRAINING_FOLDER, DATASETS_FOLDER
+from core.run_catalog import get_run_catalog
+from core.thumbnail_cache import thumbnail_url
+from app_utils.http_cache import versioned_url
 
 learning_bp = Blueprint('learning', __name__, url_prefix='/learning')
 
@@ -36,7 +41,7 @@ def manage_learning_data():
 def upload_learning_data():
     """学習データ用の画像をアップロード（POST処理）"""
     from app import app
-    from config import TRAINING_IMAGES_DIR, METADATA_FILE
+    from config import TRAINING_IMAGES_DIR
     
     if 'images' not in request.files:
         return jsonify({"error": "画像ファイルがありません"}), 400
@@ -56,26 +61,19 @@ def upload_learning_data():
     )
     
     # メタデータに性別情報を保存
-    metadata = {}
-    if os.path.exists(METADATA_FILE):
-        try:
-            with open(METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-        except:
-            metadata = {}
-    
+    entries = {}
+    index = get_dataset_index()
     for file_info in uploaded_files:
         filename = file_info['filename']
-        metadata[filename] = {
+        index.update_image(TRAINING_FOLDER, filename)
+        entries[filename] = {
             'gender': gender,
             'upload_time': datetime.now().isoformat(),
             'original_name': file_info.get('original_name', filename)
         }
         file_info['url'] = f'/static/training_data/images/{filename}'
     
-    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    update_metadata(lambda metadata: metadata.update(entries))
     
     result = {
         "success": len(uploaded_files) > 0,
@@ -97,7 +95,7 @@ def upload_learning_data():
 
 def get_learning_data():
     """学習データ一覧を取得（GET処理）"""
-    from config import TRAINING_IMAGES_DIR, TRAINING_LABELS_DIR, METADATA_FILE
+    from config import TRAINING_IMAGES_DIR, METADATA_FILE
     
     try:
         gender_filter = request.args.get('gender', 'all')
@@ -117,30 +115,30 @@ def get_learning_data():
         }
         
         if os.path.exists(TRAINING_IMAGES_DIR):
-            for filename in os.listdir(TRAINING_IMAGES_DIR):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    image_info = metadata.get(filename, {'gender': 'unknown'})
-                    gender = image_info.get('gender', 'unknown')
-                    
-                    if gender_filter != 'all' and gender_filter != gender:
-                        continue
-                    
-                    label_file = os.path.splitext(filename)[0] + '.txt'
-                    has_annotation = os.path.exists(os.path.join(TRAINING_LABELS_DIR, label_file))
-                    
-                    sample_info = {
-                        'filename': filename,
-                        'path': os.path.join(TRAINING_IMAGES_DIR, filename),
-                        'url': f"/static/training_data/images/{filename}",
-                        'has_annotation': has_annotation,
-                        'category': gender,
-                        'metadata': image_info
-                    }
-                    
-                    if gender in result:
-                        result[gender].append(sample_info)
-                    else:
-                        result['unknown'].append(sample_info)
+            for entry in get_dataset_index().list_images(TRAINING_FOLDER):
+                filename = entry['name']
+                image_info = metadata.get(filename, {'gender': 'unknown'})
+                gender = image_info.get('gender', 'unknown')
+                
+                if gender_filter != 'all' and gender_filter != gender:
+                    continue
+                
+                has_annotation = bool(entry['has_label'])
+                
+                sample_info = {
+                    'filename': filename,
+                    'path': os.path.join(TRAINING_IMAGES_DIR, filename),
+                    'url': versioned_url(f"/static/training_data/images/{filename}", entry['digest']),
+                    'thumbnail_url': thumbnail_url(f'images/{filename}', entry['digest']),
+                    'has_annotation': has_annotation,
+                    'category': gender,
+                    'metadata': image_info
+                }
+                
+                if gender in result:
+                    result[gender].append(sample_info)
+                else:
+                    result['unknown'].append(sample_info)
         
         result['counts'] = {
             'male': len(result['male']),
@@ -158,7 +156,7 @@ def get_learning_data():
 
 def delete_learning_data():
     """学習データを削除（DELETE処理）"""
-    from config import TRAINING_IMAGES_DIR, TRAINING_LABELS_DIR, METADATA_FILE, YOLO_DATASET_DIR
+    from config import TRAINING_IMAGES_DIR, TRAINING_LABELS_DIR, YOLO_DATASET_DIR
     
     try:
         data = request.json
@@ -189,6 +187,7 @@ def delete_learning_data():
         label_path = os.path.join(TRAINING_LABELS_DIR, f'{base_name}.txt')
         if os.path.exists(label_path):
             os.remove(label_path)
+        get_dataset_index().remove_image(TRAINING_FOLDER, filename)
         
         yolo_paths = [
             os.path.join(YOLO_DATASET_DIR, 'images/train', filename),
@@ -204,18 +203,7 @@ def delete_learning_data():
                 except Exception as e:
                     current_app.logger.warning(f"YOLOファイル削除エラー: {yolo_path} - {str(e)}")
         
-        metadata = {}
-        if os.path.exists(METADATA_FILE):
-            try:
-                with open(METADATA_FILE, 'r') as f:
-                    metadata = json.load(f)
-            except:
-                pass
-        
-        if filename in metadata:
-            del metadata[filename]
-            with open(METADATA_FILE, 'w') as f:
-                json.dump(metadata, f, indent=2)
+        update_metadata(lambda metadata: metadata.pop(filename, None))
         
         return jsonify({
             "success": True,
@@ -270,8 +258,10 @@ def delete_all_learning_data_internal():
                     current_app.logger.warning(f"YOLOファイル削除エラー: {file_path} - {str(e)}")
     
     if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'w') as f:
-            json.dump({}, f)
+        with METADATA_LOCK:
+            save_metadata({})
+    
+    get_dataset_index().sync([TRAINING_FOLDER])
     
     return jsonify({
         "success": True,
@@ -283,7 +273,7 @@ def delete_all_learning_data_internal():
 @learning_bp.route('/dataset-stats')
 def get_dataset_stats():
     """学習データセットの統計情報を取得"""
-    from config import TRAINING_IMAGES_DIR, TRAINING_LABELS_DIR, METADATA_FILE
+    from config import METADATA_FILE
     
     try:
         metadata = {}
@@ -300,23 +290,20 @@ def get_dataset_stats():
         female_count = 0
         unknown_count = 0
         
-        if os.path.exists(TRAINING_IMAGES_DIR):
-            for filename in os.listdir(TRAINING_IMAGES_DIR):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    total_images += 1
-                    
-                    image_info = metadata.get(filename, {})
-                    gender = image_info.get('gender', 'unknown')
-                    
-                    if gender == 'male':
-                        male_count += 1
-                    elif gender == 'female':
-                        female_count += 1
-                    else:
-                        unknown_count += 1
-        
-        if os.path.exists(TRAINING_LABELS_DIR):
-            total_labels = len([f for f in os.listdir(TRAINING_LABELS_DIR) if f.endswith('.txt')])
+        for entry in get_dataset_index().list_images(TRAINING_FOLDER):
+            total_images += 1
+            if entry['has_label']:
+                total_labels += 1
+            
+            image_info = metadata.get(entry['name'], {})
+            gender = image_info.get('gender', 'unknown')
+            
+            if gender == 'male':
+                male_count += 1
+            elif gender == 'female':
+                female_count += 1
+            else:
+                unknown_count += 1
         
         annotation_ratio = (total_labels / total_images * 100) if total_images > 0 else 0
         
@@ -893,53 +880,30 @@ def learning_dashboard():
 def get_learning_history():
     """YOLO学習履歴を取得"""
     try:
-        train_dir = 'yolov5/runs/train'
         history = []
         
-        if os.path.exists(train_dir):
-            for exp_dir in os.listdir(train_dir):
-                exp_path = os.path.join(train_dir, exp_dir)
-
-                # ディレクトリでない場合はスキップ
-                if not os.path.isdir(exp_path):
-                    continue
-                results_csv = os.path.join(exp_path, 'results.csv')
-                
-                if os.path.exists(results_csv):
-                    created_time = os.path.getctime(exp_path)
-                    modified_time = os.path.getmtime(results_csv)
-                    
-                    try:
-                        with open(results_csv, 'r') as f:
-                            lines = f.readlines()
-                            if len(lines) > 1:
-                                last_line = lines[-1].strip()
-                                if last_line:
-                                    parts = last_line.split(',')
-                                    map50 = float(parts[6]) if len(parts) > 6 else 0
-                                else:
-                                    map50 = 0
-                            else:
-                                map50 = 0
-                    except:
-                        map50 = 0
-                    
-                    # ディレクトリ名から実験名を生成
-                    if exp_dir.startswith('exp'):
-                        display_name = f'実験 {exp_dir}'
-                    else:
-                        # 日付形式のディレクトリ名（例：2025-09-19_07-10）
-                        display_name = f'学習 {exp_dir}'
-
-                    history.append({
-                        'id': exp_dir,
-                        'name': display_name,
-                        'created_at': datetime.fromtimestamp(created_time).isoformat(),
-                        'updated_at': datetime.fromtimestamp(modified_time).isoformat(),
-                        'status': 'completed',
-                        'accuracy': map50,
-                        'model_path': os.path.join(exp_path, 'weights/best.pt')
-                    })
+        # 学習結果の一覧（ファイル監視で更新されるキャッシュ）
+        for run in get_run_catalog().list_runs():
+            if not run['has_results']:
+                continue
+            exp_dir = run['name']
+            
+            # ディレクトリ名から実験名を生成
+            if exp_dir.startswith('exp'):
+                display_name = f'実験 {exp_dir}'
+            else:
+                # 日付形式のディレクトリ名（例：2025-09-19_07-10）
+                display_name = f'学習 {exp_dir}'
+
+            history.append({
+                'id': exp_dir,
+                'name': display_name,
+                'created_at': datetime.fromtimestamp(run['created']).isoformat(),
+                'updated_at': datetime.fromtimestamp(run['updated']).isoformat(),
+                'status': 'completed',
+                'accuracy': run['final_map50'],
+                'model_path': os.path.join(run['path'], 'weights/best.pt')
+            })
         
         history.sort(key=lambda x: x['updated_at'], reverse=True)
         
@@ -962,7 +926,7 @@ def get_learning_history():
 
 def get_dataset_info():
     """データセット情報を取得"""
-    from config import TRAINING_IMAGES_DIR, METADATA_FILE
+    from config import METADATA_FILE
     import os
     
     metadata = {}
@@ -978,20 +942,18 @@ def get_dataset_info():
     unknown_count = 0
     total_count = 0
     
-    if os.path.exists(TRAINING_IMAGES_DIR):
-        for filename in os.listdir(TRAINING_IMAGES_DIR):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                total_count += 1
-                
-                image_info = metadata.get(filename, {})
-                gender = image_info.get('gender', 'unknown')
-                
-                if gender == 'male':
-                    male_count += 1
-                elif gender == 'female':
-                    female_count += 1
-                else:
-                    unknown_count += 1
+    for entry in get_dataset_index().list_images(TRAINING_FOLDER):
+        total_count += 1
+        
+        image_info = metadata.get(entry['name'], {})
+        gender = image_info.get('gender', 'unknown')
+        
+        if gender == 'male':
+            male_count += 1
+        elif gender == 'female':
+            female_count += 1
+        else:
+            unknown_count += 1
     
     return {
         'male': male_count,
@@ -1002,42 +964,9 @@ def get_dataset_info():
 
 def get_total_annotations():
     """総アノテーション数を取得"""
-    from config import TRAINING_LABELS_DIR, YOLO_DATASET_DIR
-    import os
-    
-    total_annotations = 0
-    
-    if os.path.exists(TRAINING_LABELS_DIR):
-        for txt_file in os.listdir(TRAINING_LABELS_DIR):
-            if txt_file.endswith('.txt'):
-                file_path = os.path.join(TRAINING_LABELS_DIR, txt_file)
-                try:
-                    with open(file_path, 'r') as f:
-                        content = f.read().strip()
-                        if content:
-                            lines = content.split('\n')
-                            total_annotations += len([line for line in lines if line.strip()])
-                except:
-                    pass
-    
-    yolo_label_dirs = [
-        os.path.join(YOLO_DATASET_DIR, 'labels/train'),
-        os.path.join(YOLO_DATASET_DIR, 'labels/val')
-    ]
-    
-    yolo_annotations = 0
-    for label_dir in yolo_label_dirs:
-        if os.path.exists(label_dir):
-            for txt_file in os.listdir(label_dir):
-                if txt_file.endswith('.txt'):
-                    file_path = os.path.join(label_dir, txt_file)
-                    try:
-                        with open(file_path, 'r') as f:
-                            content = f.read().strip()
-                            if content:
-                                lines = content.split('\n')
-                                yolo_annotations += len([line for line in lines if line.strip()])
-                    except:
-                        pass
+    # インデックスのボックス数（学習データと、YOLOデータセットの元になるdatasets以下のフォルダ）
+    index = get_dataset_index()
+    total_annotations = index.folder_stats(TRAINING_FOLDER).get(TRAINING_FOLDER, {}).get('box_count', 0)
+    dataset_annotations = index.totals(DATASETS_FOLDER)['box_count']
     
-    return max(total_annotations, yolo_annotations)
+    return max(total_annotations, dataset_annotations)
@@ -3,7 +3,8 @@ routes/main.py - 統合メインルート
 雌雄判定、画像管理、システム情報の統合
 """
 
-from flask import Blueprint, render_template, jsonify, request, url_for, send_from_directory, current_app
+from flask import Blueprint, render_template, jsonify, request, url_for, current_app
+from app_utils.http_cache import send_cached_file
 from werkzeug.utils import secure_filename
 import os
 import uuid
@@ -11,7 +12,6 @@ import traceback
 import cv2
 from datetime import datetime
 import json
-import shutil
 
 main_bp = Blueprint('main', __name__)
 
@@ -38,6 +38,8 @@ def classify_image():
     from app_utils.file_handlers import allowed_file, is_image_file
     from core.analyzer import UnifiedAnalyzer
     from core.YoloDetector import YoloDetector
+    from core.blob_store import get_blob_store
+    from app_utils.jpeg_codec import write_image
     
     if 'image' not in request.files:
         return jsonify({"error": "画像ファイルがありません"}), 400
@@ -51,16 +53,10 @@ def classify_image():
         # 安全なファイル名に変換
         filename = secure_filename(file.filename)
         
-        # 同名ファイルが既に存在する場合はユニークな名前に変更
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            name, ext = os.path.splitext(filename)
-            unique_suffix = uuid.uuid4().hex[:8]
-            filename = f"{name}_{unique_suffix}{ext}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # ファイルを保存
-        file.save(file_path)
+        # 画像ストアに保存（同じ画像が既にあればそれを使い、別内容の同名ファイルはユニークな名前に変更）
+        stored = get_blob_store().store_upload(file, app.config['UPLOAD_FOLDER'], filename)
+        filename = stored['filename']
+        file_path = stored['path']
         current_app.logger.info(f"画像をアップロード: {filename}")
         
         try:
@@ -93,7 +89,7 @@ def classify_image():
                 # 検出結果画像を保存
                 marked_filename = f"marked_{filename}"
                 marked_path = os.path.join(app.config['UPLOAD_FOLDER'], marked_filename)
-                cv2.imwrite(marked_path, detection_result["annotated_image"])
+                write_image(marked_path, detection_result["annotated_image"])
                 
                 result["marked_image_url"] = url_for('main.get_uploaded_file', filename=marked_filename, _external=True)
                 result["papillae_count"] = detection_result["count"]
@@ -140,7 +136,7 @@ def upload_image():
 def get_uploaded_file(filename):
     """アップロードファイルを配信"""
     from app import app
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_cached_file(app.config['UPLOAD_FOLDER'], filename)
 
 @main_bp.route('/image', methods=['POST', 'DELETE'])
 def manage_image():
@@ -188,6 +184,7 @@ def delete_image():
 def save_to_dataset():
     """画像をデータセットに保存（内部処理）"""
     from app import app
+    from core.blob_store import get_blob_store
     
     data = request.json
     
@@ -235,8 +232,8 @@ def save_to_dataset():
             filename = f"{name}_{unique_suffix}{ext}"
             target_path = os.path.join(target_dir, filename)
         
-        # 画像のコピー
-        shutil.copy(image_path, target_path)
+        # 画像のコピー（画像ストアへの参照として作成）
+        get_blob_store().copy(image_path, target_path)
         current_app.logger.info(f"画像をデータセットに保存: {gender}/{filename}")
         
         return jsonify({
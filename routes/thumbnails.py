@@ -0,0 +1,33 @@
+# routes/thumbnails.py
+
+from flask import Blueprint, request, jsonify, send_file, abort
+
+from core.thumbnail_cache import get_thumbnail_cache, preferred_format, FORMATS
+
+thumbnails_bp = Blueprint('thumbnails', __name__)
+
+@thumbnails_bp.route('/thumb/<int:size>/<path:path>')
+def get_thumbnail(size, path):
+    """学習データ画像のサムネイル（pathは static/training_data からの相対パス）"""
+    fmt = preferred_format(request.headers.get('Accept', ''))
+    result = get_thumbnail_cache().get(path, size, fmt)
+    if result is None:
+        abort(404)
+    thumb_path, digest, etag = result
+
+    # URLに内容のハッシュを含む場合は変更されないため、再検証なしでキャッシュさせる
+    version = request.args.get('v')
+    immutable = bool(version) and digest.startswith(version)
+
+    # ETagが一致すれば304を返す（send_fileが条件付きリクエストを処理する、max_ageがNoneならno-cache）
+    response = send_file(thumb_path, mimetype=FORMATS[fmt][1], etag=etag, conditional=True,
+                         max_age=31536000 if immutable else None)
+    response.vary.add('Accept')
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+@thumbnails_bp.route('/thumb/stats')
+def thumbnail_stats():
+    """サムネイルキャッシュの状態"""
+    return jsonify(get_thumbnail_cache().get_stats())
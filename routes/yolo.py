@@ -1,14 +1,12 @@
 # routes/yolo.py
 
 # ファイル先頭のインポートを整理
-from flask import Blueprint, request, jsonify, render_template, current_app
+from flask import Blueprint, request, jsonify, render_template, current_app, Response, stream_with_context
 import os
 import json
 import csv
-import shutil
 import yaml
 from werkzeug.utils import secure_filename
-import cv2
 import numpy as np
 from PIL import Image
 import uuid
@@ -18,7 +16,21 @@ from datetime import datetime
 from core.YoloDetector import YoloDetector
 from core.YoloTrainer import YoloTrainer
 from core.dataset_manager import DatasetManager
+from core.dataset_builder import YoloDatasetBuilder, DatasetItem
+from core.dataset_validator import DatasetValidator
+from core.blob_store import get_blob_store
+from core.dataset_index import get_dataset_index, dataset_folder, TRAINING_FOLDER
+from core.near_duplicates import get_near_duplicate_detector
+from core.run_catalog import get_run_catalog
+from core.dataset_snapshot import get_dataset_snapshots
+from core.auto_annotator import get_auto_annotator
+from core.video_analyzer import VideoAnalyzer
 from app_utils.file_handlers import find_image_path, handle_multiple_image_upload
+from app_utils.jpeg_codec import write_image
+from app_utils.listing import parse_listing_args, listing_meta
+from config import (VIDEO_ALLOWED_EXTENSIONS, VIDEO_ANALYSIS_STRIDE, VIDEO_ANALYSIS_BATCH_SIZE, YOLO_CLASS_NAMES,
+                    YOLO_IMG_SIZE, RESIZE_CACHE_ENABLED, YOLO_DATASET_DIR, DATASET_SNAPSHOT_ON_TRAIN,
+                    DATASET_SPLIT_GROUP_DUPLICATES)
 
 # Blueprintの作成
 yolo_bp = Blueprint('yolo', __name__, url_prefix='/yolo')
@@ -26,26 +38,17 @@ yolo_bp = Blueprint('yolo', __name__, url_prefix='/yolo')
 # YOLOトレーナーのインスタンス
 trainer = YoloTrainer()
 
-def prepare_dataset_from_folders(folders):
-    """選択されたフォルダからYOLOデータセットを準備"""
+def prepare_dataset_from_folders(folders, img_size=YOLO_IMG_SIZE, group_duplicates=DATASET_SPLIT_GROUP_DUPLICATES):
+    """
+    選択されたフォルダからYOLOデータセットを準備（img_sizeは縮小画像キャッシュに使う学習時の画像サイズ）
+    group_duplicatesを指定した場合は、近似重複の画像を訓練・検証の同じ側にまとめる
+    """
     try:
         # YOLOデータセットディレクトリ
         dataset_dir = os.path.join('data', 'yolo_dataset')
-        images_train_dir = os.path.join(dataset_dir, 'images', 'train')
-        images_val_dir = os.path.join(dataset_dir, 'images', 'val')
-        labels_train_dir = os.path.join(dataset_dir, 'labels', 'train')
-        labels_val_dir = os.path.join(dataset_dir, 'labels', 'val')
-
-        # ディレクトリをクリーンアップして作成
-        for dir_path in [images_train_dir, images_val_dir, labels_train_dir, labels_val_dir]:
-            if os.path.exists(dir_path):
-                shutil.rmtree(dir_path)
-            os.makedirs(dir_path, exist_ok=True)
-
-        # 各フォルダからデータをコピー
-        total_images = 0
-        total_labels = 0
 
+        # 各フォルダから画像とラベルを収集
+        items = []
         for folder_path in folders:
             # フォルダパス構築
             base_folder = os.path.join('static', 'training_data', 'datasets', folder_path)
@@ -55,44 +58,41 @@ def prepare_dataset_from_folders(folders):
             if not os.path.exists(images_dir):
                 continue
 
-            # 画像とラベルをコピー
             image_files = [f for f in os.listdir(images_dir)
                           if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
 
-            # 8:2で訓練と検証に分割
-            split_index = int(len(image_files) * 0.8)
-            train_files = image_files[:split_index]
-            val_files = image_files[split_index:]
-
-            # 訓練データをコピー
-            for img_file in train_files:
-                src_img = os.path.join(images_dir, img_file)
-                dst_img = os.path.join(images_train_dir, img_file)
-                shutil.copy2(src_img, dst_img)
-                total_images += 1
-
+            for img_file in image_files:
                 # 対応するラベルファイル
                 label_file = os.path.splitext(img_file)[0] + '.txt'
                 src_label = os.path.join(labels_dir, label_file)
-                if os.path.exists(src_label):
-                    dst_label = os.path.join(labels_train_dir, label_file)
-                    shutil.copy2(src_label, dst_label)
-                    total_labels += 1
-
-            # 検証データをコピー
-            for img_file in val_files:
-                src_img = os.path.join(images_dir, img_file)
-                dst_img = os.path.join(images_val_dir, img_file)
-                shutil.copy2(src_img, dst_img)
-                total_images += 1
-
-                # 対応するラベルファイル
-                label_file = os.path.splitext(img_file)[0] + '.txt'
-                src_label = os.path.join(labels_dir, label_file)
-                if os.path.exists(src_label):
-                    dst_label = os.path.join(labels_val_dir, label_file)
-                    shutil.copy2(src_label, dst_label)
-                    total_labels += 1
+                items.append(DatasetItem(
+                    key=f'{folder_path}/{img_file}',
+                    image_path=os.path.join(images_dir, img_file),
+                    label_path=src_label if os.path.exists(src_label) else None
+                ))
+
+        # 近似重複（同じ個体を続けて撮影した画像など）が訓練と検証に分かれないようにグループを付ける
+        duplicate_groups = 0
+        if group_duplicates and items:
+            try:
+                detector = get_near_duplicate_detector()
+                task_ids = detector.ensure_hashes([dataset_folder(f) for f in folders], _submit_hashing)
+                if task_ids:
+                    current_app.logger.warning('知覚ハッシュが未計算の画像が多いため、計算済みの画像だけを'
+                                               f'近似重複としてまとめます（計算タスク: {", ".join(task_ids)}）')
+                groups = detector.split_groups(dataset_folder(f) for f in folders)
+                for item in items:
+                    folder_path, img_file = item.key.rsplit('/', 1)
+                    item.group = groups.get((dataset_folder(folder_path), img_file))
+                duplicate_groups = len(set(groups.values()))
+            except Exception as e:
+                current_app.logger.warning(f'近似重複の検出に失敗したため画像ごとに分割します: {str(e)}')
+
+        # 前回から変更のあった画像だけをリンクで反映（訓練/検証の分割は前回のものを維持）
+        builder = YoloDatasetBuilder(dataset_dir, img_size=img_size if RESIZE_CACHE_ENABLED else None)
+        build_result = builder.build(items)
+        total_images = build_result['total_count']
+        total_labels = build_result['label_count']
 
         # data.yamlファイルを生成
         data_yaml_path = os.path.join(dataset_dir, 'data.yaml')
@@ -100,8 +100,8 @@ def prepare_dataset_from_folders(folders):
             'path': os.path.abspath(dataset_dir),
             'train': 'images/train',
             'val': 'images/val',
-            'nc': 4,  # クラス数
-            'names': ['male', 'female', 'madreporite', 'anus']
+            'nc': len(YOLO_CLASS_NAMES),  # クラス数
+            'names': YOLO_CLASS_NAMES
         }
 
         with open(data_yaml_path, 'w', encoding='utf-8') as f:
@@ -113,6 +113,10 @@ def prepare_dataset_from_folders(folders):
             'success': True,
             'total_images': total_images,
             'total_labels': total_labels,
+            'train_count': build_result['train_count'],
+            'val_count': build_result['val_count'],
+            'duplicate_groups': duplicate_groups,
+            'changes': {key: build_result[key] for key in ('added', 'updated', 'removed', 'unchanged')},
             'message': f'データセット準備完了: 画像{total_images}枚'
         }
 
@@ -124,35 +128,74 @@ def prepare_dataset_from_folders(folders):
         }
 
 
+def _submit_hashing(prefix):
+    from app import processing_queue, processing_status
+    from app_utils.worker import submit_near_duplicate_hashing
+    return submit_near_duplicate_hashing(processing_queue, processing_status, prefix)
+
+def prepare_training_dataset(folders, img_size, group_duplicates=DATASET_SPLIT_GROUP_DUPLICATES):
+    """選択フォルダ（空の場合は従来の学習データ）からYOLOデータセットを準備（失敗時はエラーメッセージを返す）"""
+    if folders:
+        prepare_result = prepare_dataset_from_folders(folders, img_size, group_duplicates)
+        if not prepare_result['success']:
+            return prepare_result.get('message', 'データセット準備に失敗しました')
+    else:
+        prepare_result = DatasetManager.prepare_yolo_dataset(img_size)
+        if prepare_result['status'] != 'success':
+            return 'データセット準備に失敗しました'
+    return None
+
+def snapshot_training_dataset(folders, img_size):
+    """準備したYOLOデータセットのスナップショットを作成（失敗しても学習は止めない）"""
+    try:
+        return get_dataset_snapshots().create_from_dataset(YOLO_DATASET_DIR, folders=folders or None,
+                                                           img_size=img_size)
+    except Exception as e:
+        current_app.logger.error(f'データセットスナップショットの作成エラー: {str(e)}')
+        return None
+
 @yolo_bp.route('/training/start', methods=['POST'])
 def start_training():
-    """YOLOのトレーニングを開始"""
+    """YOLOのトレーニングを開始（snapshotを指定した場合はそのスナップショットのデータセットで学習）"""
     data = request.json or {}
+    img_size = int(data.get('img_size', 640))
 
-    # フォルダ選択がある場合は、そのデータをYOLO形式に準備
+    if trainer.is_training:
+        return jsonify({
+            'status': 'error',
+            'message': 'トレーニングが実行中です'
+        }), 400
+
+    # スナップショットを指定した場合は、そのときのデータセットをそのまま再構築
+    snapshot_id = data.get('snapshot')
     folders = data.get('folders', [])
-    if folders:
-        # 選択フォルダのデータをYOLOデータセットに準備
-        prepare_result = prepare_dataset_from_folders(folders)
-        if not prepare_result['success']:
-            return jsonify({
-                'status': 'error',
-                'message': prepare_result.get('message', 'データセット準備に失敗しました')
-            }), 400
+    if snapshot_id:
+        try:
+            get_dataset_snapshots().restore(snapshot_id, YOLO_DATASET_DIR, img_size)
+        except KeyError:
+            return jsonify({'status': 'error', 'message': 'スナップショットが見つかりません'}), 404
+        except Exception as e:
+            current_app.logger.error(f'スナップショットからの再構築エラー: {str(e)}')
+            return jsonify({'status': 'error', 'message': f'データセット準備エラー: {str(e)}'}), 400
     else:
-        # フォルダ指定がない場合は既存の全データを使用
-        prepare_result = DatasetManager.prepare_yolo_dataset()
-        if prepare_result['status'] != 'success':
+        # 選択フォルダ（指定がない場合は既存の全データ）をYOLOデータセットに準備
+        error = prepare_training_dataset(folders, img_size,
+                                         bool(data.get('group_duplicates', DATASET_SPLIT_GROUP_DUPLICATES)))
+        if error:
             return jsonify({
                 'status': 'error',
-                'message': 'データセット準備に失敗しました'
+                'message': error
             }), 400
 
+    # 学習に使うデータセットを固定し、学習結果に記録する
+    if not snapshot_id and DATASET_SNAPSHOT_ON_TRAIN:
+        snapshot = snapshot_training_dataset(folders, img_size)
+        snapshot_id = snapshot['id'] if snapshot else None
+
     # トレーニングパラメータの取得
     weights = data.get('weights', 'yolov5s.pt')
     batch_size = int(data.get('batch_size', 16))
     epochs = int(data.get('epochs', 100))
-    img_size = int(data.get('img_size', 640))
     device = data.get('device', '')
     workers = int(data.get('workers', 4))
     name = data.get('name', 'exp')
@@ -167,13 +210,15 @@ def start_training():
         device=device,
         workers=workers,
         name=name,
-        exist_ok=exist_ok
+        exist_ok=exist_ok,
+        dataset_snapshot=snapshot_id
     )
     
     if success:
         return jsonify({
             'status': 'success',
-            'message': 'トレーニングを開始しました'
+            'message': 'トレーニングを開始しました',
+            'dataset_snapshot': snapshot_id
         })
     else:
         return jsonify({
@@ -181,6 +226,130 @@ def start_training():
             'message': 'トレーニングの開始に失敗しました。すでにトレーニングが実行中の可能性があります。'
         }), 400
 
+@yolo_bp.route('/snapshots', methods=['GET'])
+def list_snapshots():
+    """データセットスナップショットの一覧（そのデータセットで学習した実験名を含む）"""
+    return jsonify({'snapshots': get_dataset_snapshots().list_snapshots()})
+
+@yolo_bp.route('/snapshots', methods=['POST'])
+def create_snapshot():
+    """選択フォルダ（指定がない場合は従来の学習データ）からデータセットを準備してスナップショットを作成"""
+    data = request.json or {}
+    folders = data.get('folders', [])
+    img_size = int(data.get('img_size', YOLO_IMG_SIZE))
+
+    # 学習中のデータセットは作り直さない
+    if trainer.is_training:
+        return jsonify({'error': 'トレーニングが実行中です'}), 409
+
+    error = prepare_training_dataset(folders, img_size,
+                                     bool(data.get('group_duplicates', DATASET_SPLIT_GROUP_DUPLICATES)))
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        snapshot = get_dataset_snapshots().create_from_dataset(YOLO_DATASET_DIR, folders=folders or None,
+                                                               img_size=img_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(snapshot)
+
+@yolo_bp.route('/snapshots/<snapshot_id>', methods=['GET'])
+def get_snapshot(snapshot_id):
+    """スナップショットの詳細（?entries=trueで画像ごとの分割・ハッシュを含める）"""
+    include_entries = request.args.get('entries', 'false').lower() == 'true'
+    snapshot = get_dataset_snapshots().get(snapshot_id, include_entries)
+    if snapshot is None:
+        return jsonify({'error': 'スナップショットが見つかりません'}), 404
+    return jsonify(snapshot)
+
+@yolo_bp.route('/snapshots/<snapshot_id>/restore', methods=['POST'])
+def restore_snapshot(snapshot_id):
+    """スナップショットからYOLOデータセットを再構築（変更のあった画像だけをリンクし直す）"""
+    data = request.json or {}
+    if trainer.is_training:
+        return jsonify({'error': 'トレーニングが実行中です'}), 409
+    try:
+        img_size = int(data['img_size']) if data.get('img_size') else None
+        result = get_dataset_snapshots().restore(snapshot_id, YOLO_DATASET_DIR, img_size)
+    except KeyError:
+        return jsonify({'error': 'スナップショットが見つかりません'}), 404
+    except (OSError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@yolo_bp.route('/snapshots/<snapshot_id>', methods=['DELETE'])
+def delete_snapshot(snapshot_id):
+    """スナップショットを削除（学習結果から参照されている場合は?force=trueが必要）"""
+    force = request.args.get('force', 'false').lower() == 'true'
+    try:
+        result = get_dataset_snapshots().delete(snapshot_id, force)
+    except KeyError:
+        return jsonify({'error': 'スナップショットが見つかりません'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(result)
+
+@yolo_bp.route('/auto-annotate', methods=['POST'])
+def start_auto_annotation():
+    """
+    学習済みモデルでフォルダの未アノテーション画像に候補ラベルを付けるジョブを開始
+    進捗は /task/<task_id> で取得する（ジョブはバッチごとに保存され、中断しても再開できる）
+    """
+    from app import processing_queue, processing_status
+    from app_utils.worker import submit_auto_annotation
+
+    data = request.json or {}
+    folder = (data.get('folder') or '').strip('/')
+    if not folder or not os.path.isdir(os.path.join('static', 'training_data', 'datasets', folder, 'images')):
+        return jsonify({'error': 'フォルダが見つかりません'}), 404
+    try:
+        conf = float(data['conf']) if data.get('conf') is not None else None
+        batch_size = int(data['batch_size']) if data.get('batch_size') else None
+        if (conf is not None and not 0 < conf < 1) or (batch_size is not None and not 1 <= batch_size <= 256):
+            raise ValueError('confは0〜1、batch_sizeは1〜256で指定してください')
+        job = get_auto_annotator().create_job(folder, conf_threshold=conf, batch_size=batch_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    submit_auto_annotation(processing_queue, processing_status, job)
+    return jsonify({'task_id': job['id'], 'status_url': f"/task/{job['id']}", 'job': job}), 202
+
+@yolo_bp.route('/auto-annotate/jobs', methods=['GET'])
+def list_auto_annotation_jobs():
+    """自動アノテーションのジョブ一覧（新しい順）"""
+    return jsonify({'jobs': get_auto_annotator().list_jobs()})
+
+@yolo_bp.route('/auto-annotate/jobs/<job_id>', methods=['GET'])
+def get_auto_annotation_job(job_id):
+    job = get_auto_annotator().get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job)
+
+@yolo_bp.route('/auto-annotate/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_auto_annotation_job(job_id):
+    """ジョブを中断（実行中の場合は現在のバッチの後で止まる）"""
+    from app import processing_status
+
+    if not get_auto_annotator().cancel(job_id):
+        return jsonify({'error': '実行中のジョブが見つかりません'}), 404
+    if job_id in processing_status:
+        processing_status[job_id] = dict(processing_status[job_id], status='cancelled',
+                                         message='ユーザーによってキャンセルされました')
+    return jsonify({'success': True, 'job': get_auto_annotator().get_job(job_id)})
+
+@yolo_bp.route('/auto-annotate/jobs/<job_id>/resume', methods=['POST'])
+def resume_auto_annotation_job(job_id):
+    """中断・失敗したジョブをチェックポイントの続きから再開"""
+    from app import processing_queue, processing_status
+    from app_utils.worker import submit_auto_annotation
+
+    job = get_auto_annotator().reopen(job_id)
+    if job is None:
+        return jsonify({'error': '再開できるジョブが見つかりません'}), 404
+    submit_auto_annotation(processing_queue, processing_status, job)
+    return jsonify({'task_id': job['id'], 'status_url': f"/task/{job['id']}", 'job': job}), 202
+
 @yolo_bp.route('/training/stop', methods=['POST'])
 def stop_training():
     """YOLOのトレーニングを停止"""
@@ -242,9 +411,7 @@ def detect_objects():
     # 画像の保存
     filename = secure_filename(file.filename)
     upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'yolo_detect')
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, filename)
-    file.save(file_path)
+    file_path = get_blob_store().store_upload(file, upload_dir, filename, unique=False)['path']
     
     try:
         # YoloDetectorを使用して検出
@@ -257,7 +424,7 @@ def detect_objects():
             os.makedirs(result_dir, exist_ok=True)
             result_filename = f"result_{os.path.splitext(filename)[0]}.jpg"
             result_path = os.path.join(result_dir, result_filename)
-            cv2.imwrite(result_path, result['annotated_image'])
+            write_image(result_path, result['annotated_image'])
             
             return jsonify({
                 'status': 'success',
@@ -302,14 +469,11 @@ def batch_detect():
     
     # 画像の保存
     upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'yolo_batch')
-    os.makedirs(upload_dir, exist_ok=True)
     
     file_paths = []
     for file in files:
         filename = secure_filename(file.filename)
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
-        file_paths.append(file_path)
+        file_paths.append(get_blob_store().store_upload(file, upload_dir, filename, unique=False)['path'])
     
     try:
         # YoloDetectorを使用して一括検出
@@ -336,7 +500,7 @@ def batch_detect():
             if result.get('annotated_image') is not None:
                 result_filename = f"result_{os.path.splitext(base_name)[0]}.jpg"
                 result_path = os.path.join(result_dir, result_filename)
-                cv2.imwrite(result_path, result['annotated_image'])
+                write_image(result_path, result['annotated_image'])
                 
                 results.append({
                     'path': result['image_path'],
@@ -358,12 +522,83 @@ def batch_detect():
             'message': f'一括検出処理中にエラーが発生しました: {str(e)}'
         }), 500
 
+@yolo_bp.route('/analyze_video', methods=['POST'])
+def analyze_video():
+    """動画ファイルを解析し、フレームごと・個体ごとの結果をNDJSONで逐次返す"""
+    if 'video' not in request.files:
+        return jsonify({
+            'status': 'error',
+            'message': '動画がアップロードされていません'
+        }), 400
+    
+    file = request.files['video']
+    if file.filename == '':
+        return jsonify({
+            'status': 'error',
+            'message': '動画が選択されていません'
+        }), 400
+    
+    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if ext not in VIDEO_ALLOWED_EXTENSIONS:
+        return jsonify({
+            'status': 'error',
+            'message': f'対応していない動画形式です: {ext}'
+        }), 400
+    
+    # パラメータの取得
+    conf_threshold = float(request.form.get('confidence', 0.25))
+    stride = int(request.form.get('stride', VIDEO_ANALYSIS_STRIDE))
+    batch_size = int(request.form.get('batch_size', VIDEO_ANALYSIS_BATCH_SIZE))
+    include_frames = request.form.get('frames', 'true').lower() == 'true'
+    
+    detector = YoloDetector(conf_threshold=conf_threshold)
+    analyzer = VideoAnalyzer(detector, stride=stride, batch_size=batch_size)
+    logger = current_app.logger
+    
+    # 動画の保存（ファイル名の衝突を避ける、解析が終わるか接続が切れたら削除する）
+    filename = f"{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}"
+    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'yolo_video')
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, filename)
+    file.save(file_path)
+    
+    def remove_video():
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f'動画の削除に失敗しました: {file_path} - {str(e)}')
+    
+    def generate():
+        try:
+            for event in analyzer.analyze(file_path):
+                if event['type'] == 'frame' and not include_frames:
+                    continue
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f'動画解析エラー: {str(e)}')
+            yield json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False) + '\n'
+        finally:
+            remove_video()
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # 最初の出力の前に接続が切れた場合はgenerateのfinallyが実行されないため、応答の終了時にも削除する
+    response.call_on_close(remove_video)
+    return response
+
 @yolo_bp.route('/api/images', methods=['GET'])
 def get_images():
-    """アノテーション用の画像リストを取得"""
-    from config import TRAINING_IMAGES_DIR, TRAINING_LABELS_DIR, METADATA_FILE
-    
+    """アノテーション用の画像リストを取得（limit/cursorでページ分割、フィルタ・並べ替えはapp_utils.listingを参照）"""
+    from config import TRAINING_IMAGES_DIR, METADATA_FILE
+
+    try:
+        options = parse_listing_args(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
     images = []
+    page = {'total': 0, 'next_cursor': None, 'has_more': False}
     
     # メタデータを読み込み
     metadata = {}
@@ -375,31 +610,35 @@ def get_images():
             pass
     
     if os.path.exists(TRAINING_IMAGES_DIR):
-        for filename in os.listdir(TRAINING_IMAGES_DIR):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                image_path = os.path.join(TRAINING_IMAGES_DIR, filename)
-                
-                # メタデータから情報を取得
-                image_info = metadata.get(filename, {})
-                
-                # ラベルファイルの存在確認
-                label_file = os.path.splitext(filename)[0] + '.txt'
-                label_path = os.path.join(TRAINING_LABELS_DIR, label_file)
-                has_label = os.path.exists(label_path)
-                
-                images.append({
-                    'id': filename,
-                    'filename': filename,
-                    'path': image_path,
-                    'url': f'/annotation/images/image/{filename}',
-                    'has_annotation': has_label,
-                    'metadata': image_info
-                })
+        # インデックスから取得（ラベルの有無もインデックスに保持）
+        try:
+            result = get_dataset_index().query_images(TRAINING_FOLDER, **options)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        page = listing_meta(result)
+        for entry in result['images']:
+            filename = entry['name']
+            image_path = os.path.join(TRAINING_IMAGES_DIR, filename)
+            
+            # メタデータから情報を取得
+            image_info = metadata.get(filename, {})
+            
+            has_label = bool(entry['has_label'])
+            
+            images.append({
+                'id': filename,
+                'filename': filename,
+                'path': image_path,
+                'url': f'/annotation/images/image/{filename}',
+                'has_annotation': has_label,
+                'annotation_count': entry['box_count'],
+                'metadata': image_info
+            })
     
-    return jsonify({
-        'status': 'success',
-        'images': images
-    })
+    return jsonify(dict(page,
+        status='success',
+        images=images
+    ))
 
 
 
@@ -501,8 +740,11 @@ def save_yolo_annotation():
         os.makedirs(label_dir, exist_ok=True)
         label_path = os.path.join(label_dir, label_name)
         
-        with open(label_path, 'w') as f:
+        # 一時ファイルから置き換える（出力先がリンクでも元のファイルを書き換えない）
+        tmp_path = label_path + '.tmp'
+        with open(tmp_path, 'w') as f:
             f.write(yolo_data)
+        os.replace(tmp_path, label_path)
         
         # アノテーションが空でないか確認
         if not yolo_data.strip():
@@ -602,32 +844,27 @@ def get_training_results():
 
 @yolo_bp.route('/dataset-check', methods=['GET'])
 def check_dataset():
-    """データセットの詳細チェック"""
+    """データセットの詳細チェック（全分割の画像・ラベルを検証し、変更のあったファイルだけを検査する）"""
     dataset_dir = 'data/yolo_dataset'
-    
-    # 画像とラベルの対応チェック
-    train_images = os.listdir(os.path.join(dataset_dir, 'images/train'))
-    train_labels = os.listdir(os.path.join(dataset_dir, 'labels/train'))
-    
-    # ラベルファイルの内容確認
-    empty_labels = []
-    valid_labels = []
-    
-    for label_file in train_labels:
-        label_path = os.path.join(dataset_dir, 'labels/train', label_file)
-        with open(label_path, 'r') as f:
-            content = f.read().strip()
-            if not content:
-                empty_labels.append(label_file)
-            else:
-                valid_labels.append(label_file)
-    
+    force = request.args.get('force', 'false').lower() == 'true'
+
+    try:
+        report = DatasetValidator(dataset_dir).validate(force=force)
+    except Exception as e:
+        current_app.logger.error(f'データセット検証エラー: {str(e)}')
+        return jsonify({'error': f'データセット検証エラー: {str(e)}'}), 500
+
+    empty_labels = [os.path.basename(issue['file']) for issue in report['issues']
+                    if issue['code'] == 'label_empty' and issue['split'] == 'train']
+    train = report['splits']['train']
+
     return jsonify({
-        'train_images': len(train_images),
-        'train_labels': len(train_labels),
+        'train_images': train['images'],
+        'train_labels': train['labels'],
         'empty_labels': len(empty_labels),
-        'valid_labels': len(valid_labels),
-        'empty_label_files': empty_labels
+        'valid_labels': train['labels'] - len(empty_labels),
+        'empty_label_files': empty_labels,
+        'report': report
     })
 
 # トレーニングセッション管理
@@ -672,28 +909,12 @@ def get_latest_experiment():
         if not os.path.exists(runs_dir):
             return jsonify({'error': '学習結果が見つかりません'}), 404
         
-        # 実験ディレクトリを取得（作成時刻でソート）
-        exp_dirs = []
-        for d in os.listdir(runs_dir):
-            if d.startswith('exp'):
-                exp_path = os.path.join(runs_dir, d)
-                if os.path.isdir(exp_path):
-                    exp_dirs.append({
-                        'name': d,
-                        'path': exp_path,
-                        'created': os.path.getctime(exp_path)
-                    })
-        
-        if not exp_dirs:
+        # 最新の実験（作成時刻の降順、一覧はファイル監視で更新されるキャッシュ）
+        latest = get_run_catalog().latest(prefix='exp')
+        if latest is None:
             return jsonify({'error': '実験が見つかりません'}), 404
         
-        # 作成時刻で降順ソート（最新が最初）
-        exp_dirs.sort(key=lambda x: x['created'], reverse=True)
-        latest = exp_dirs[0]
-        
-        # 結果ファイルの存在確認
-        results_csv = os.path.join(latest['path'], 'results.csv')
-        has_results = os.path.exists(results_csv)
+        has_results = latest['has_results']
         
         return jsonify({
             'experiment': latest['name'],
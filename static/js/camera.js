@@ -6,6 +6,9 @@ class CameraController {
     constructor() {
         this.isRunning = false;
         this.detectionEnabled = false;
+        // 判定枠をブラウザ側で描画する（サーバーは生フレームと判定結果JSONのみ送る）
+        this.clientOverlay = true;
+        this.detectionSource = null;
         this.initializeElements();
         this.attachEventListeners();
     }
@@ -91,7 +94,8 @@ class CameraController {
 
             const response = await fetch('/camera/start', {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'}
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ camera_index: this.currentCameraIndex })
             });
 
             const data = await response.json();
@@ -101,14 +105,15 @@ class CameraController {
                 this.setStatus('active', '配信中');
 
                 // ビデオフィードを開始（判定モードに応じて）
-                const detectionParam = this.detectionEnabled ? '?detection=true' : '';
-                this.videoFeed.src = '/camera/video_feed' + detectionParam;
+                this.videoFeed.src = this.videoFeedUrl();
+                if (this.detectionEnabled) {
+                    this.startOverlay();
+                }
 
                 // ボタンの状態を更新
                 this.startBtn.disabled = true;
                 this.stopBtn.disabled = false;
                 this.snapshotBtn.disabled = false;
-                this.detectCamerasBtn.disabled = true;  // カメラ検出ボタンを無効化
 
                 // カメラ情報を取得
                 this.updateCameraInfo();
@@ -129,7 +134,8 @@ class CameraController {
         try {
             const response = await fetch('/camera/stop', {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'}
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ camera_index: this.currentCameraIndex })
             });
 
             const data = await response.json();
@@ -145,7 +151,6 @@ class CameraController {
                 this.startBtn.disabled = false;
                 this.stopBtn.disabled = true;
                 this.snapshotBtn.disabled = true;
-                this.detectCamerasBtn.disabled = false;  // カメラ検出ボタンを有効化
 
                 // 判定を無効化
                 if (this.detectionEnabled) {
@@ -164,7 +169,8 @@ class CameraController {
         try {
             const response = await fetch('/camera/snapshot', {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'}
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ camera_index: this.currentCameraIndex })
             });
 
             const data = await response.json();
@@ -192,7 +198,7 @@ class CameraController {
 
     async updateCameraInfo() {
         try {
-            const response = await fetch('/camera/info');
+            const response = await fetch(`/camera/info?camera=${this.currentCameraIndex}`);
             const info = await response.json();
 
             if (!info.error) {
@@ -213,10 +219,9 @@ class CameraController {
             // 判定付きビデオフィードに切り替え
             if (this.isRunning) {
                 // 現在のパラメータを含めてURLを構築
-                const params = this.getDetectionParams();
-                const queryString = new URLSearchParams(params).toString();
-                this.videoFeed.src = `/camera/video_feed?${queryString}`;
-                console.log('判定機能を有効化:', params);
+                this.videoFeed.src = this.videoFeedUrl();
+                this.startOverlay();
+                console.log('判定機能を有効化:', this.getDetectionParams());
 
                 // 統計情報の定期更新を開始
                 this.startStatsUpdate();
@@ -227,7 +232,7 @@ class CameraController {
 
             // 通常のビデオフィードに戻す
             if (this.isRunning) {
-                this.videoFeed.src = '/camera/video_feed?detection=false';
+                this.videoFeed.src = this.videoFeedUrl();
                 console.log('判定機能を無効化');
 
                 // 統計情報の更新を停止
@@ -235,8 +240,97 @@ class CameraController {
             }
 
             // オーバーレイをクリア
-            const ctx = this.detectionOverlay.getContext('2d');
-            ctx.clearRect(0, 0, this.detectionOverlay.width, this.detectionOverlay.height);
+            this.stopOverlay();
+        }
+    }
+
+    startOverlay() {
+        // 判定結果をServer-Sent Eventsで受信して枠を描画（推論のたびに更新）
+        this.stopOverlay();
+        if (!this.clientOverlay) {
+            return;
+        }
+
+        // 判定パラメータも渡す（枠をサーバーで描画する場合と同じ閾値で判定する）
+        const detectionParams = this.getDetectionParams();
+        const params = new URLSearchParams({
+            camera: this.currentCameraIndex,
+            confidence: detectionParams.confidence,
+            iou: detectionParams.iou
+        });
+        this.detectionSource = new EventSource(`/camera/detections?${params.toString()}`);
+        this.detectionSource.onmessage = (event) => {
+            const result = JSON.parse(event.data);
+            if (result.camera !== this.currentCameraIndex) {
+                return;
+            }
+            this.drawOverlay(result);
+            this.fpsValue.textContent = result.fps.toFixed(1);
+        };
+        this.detectionSource.onerror = () => {
+            console.warn('判定結果の受信が中断されました（自動で再接続します）');
+        };
+    }
+
+    stopOverlay() {
+        if (this.detectionSource) {
+            this.detectionSource.close();
+            this.detectionSource = null;
+        }
+        const ctx = this.detectionOverlay.getContext('2d');
+        ctx.clearRect(0, 0, this.detectionOverlay.width, this.detectionOverlay.height);
+    }
+
+    drawOverlay(result) {
+        // 表示サイズに合わせてキャンバスを調整し、フレーム座標から拡大縮小して描画
+        const canvas = this.detectionOverlay;
+        const width = this.videoFeed.clientWidth;
+        const height = this.videoFeed.clientHeight;
+        if (canvas.width !== width || canvas.height !== height) {
+            canvas.width = width;
+            canvas.height = height;
+        }
+
+        const ctx = canvas.getContext('2d');
+        ctx.clearRect(0, 0, width, height);
+        if (!result.width || !result.height) {
+            return;
+        }
+        const scaleX = width / result.width;
+        const scaleY = height / result.height;
+
+        // 他の視聴者が別の閾値で判定している場合もあるため、表示中の閾値で絞り込む
+        const minConfidence = this.confidenceThreshold ? parseFloat(this.confidenceThreshold.value) : 0;
+
+        ctx.lineWidth = 2;
+        ctx.font = '12px sans-serif';
+        for (const detection of result.detections) {
+            if (detection.confidence < minConfidence) {
+                continue;
+            }
+            const [x1, y1, x2, y2] = detection.bbox;
+            const className = detection.class.toLowerCase();
+
+            // 色を決定（サーバー側の描画と同じ配色）
+            let color = '#00ff00';  // 緑（その他）
+            if (className.includes('female')) {
+                color = '#ff00ff';  // マゼンタ（メス）
+            } else if (className.includes('male')) {
+                color = '#0000ff';  // 青（オス）
+            }
+
+            const x = x1 * scaleX;
+            const y = y1 * scaleY;
+            ctx.strokeStyle = color;
+            ctx.strokeRect(x, y, (x2 - x1) * scaleX, (y2 - y1) * scaleY);
+
+            // ラベル
+            const label = `${detection.class}: ${detection.confidence.toFixed(2)}`;
+            const labelWidth = ctx.measureText(label).width + 6;
+            ctx.fillStyle = color;
+            ctx.fillRect(x, Math.max(0, y - 16), labelWidth, 16);
+            ctx.fillStyle = '#ffffff';
+            ctx.fillText(label, x + 3, Math.max(12, y - 4));
         }
     }
 
@@ -291,33 +385,15 @@ class CameraController {
             this.detectionMessage.textContent = 'カメラを検出中...';
             this.detectCamerasBtn.disabled = true;
 
-            const response = await fetch('/camera/detect');
-            const data = await response.json();
+            // キャッシュを即時表示し、バックグラウンドの再検出が終わるまで待つ
+            let data = await this.fetchCameraList(true);
+            this.renderCameraList(data, true);
 
-            if (response.ok && data.cameras.length > 0) {
-                // カメラリストを表示
-                this.cameraListContainer.style.display = 'block';
-                this.cameraSelect.innerHTML = '';
-
-                data.cameras.forEach(camera => {
-                    const option = document.createElement('option');
-                    option.value = camera.index;
-                    option.textContent = `${camera.name} (${camera.width}x${camera.height})`;
-                    if (camera.index === this.currentCameraIndex) {
-                        option.selected = true;
-                        // 現在接続中のカメラを表示
-                        this.updateCurrentCameraDisplay(camera.name, camera.width, camera.height);
-                    }
-                    this.cameraSelect.appendChild(option);
-                });
-
-                this.detectionMessage.textContent = `${data.cameras.length}台のカメラを検出しました`;
-                this.detectionMessage.className = 'text-success small mt-2';
-            } else {
-                this.detectionMessage.textContent = 'カメラが検出されませんでした';
-                this.detectionMessage.className = 'text-warning small mt-2';
-                this.cameraListContainer.style.display = 'none';
+            for (let i = 0; i < 20 && data.refreshing; i++) {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                data = await this.fetchCameraList(false);
             }
+            this.renderCameraList(data, false);
         } catch (error) {
             console.error('カメラ検出エラー:', error);
             this.detectionMessage.textContent = 'カメラ検出に失敗しました';
@@ -327,6 +403,50 @@ class CameraController {
         }
     }
 
+    async fetchCameraList(refresh) {
+        const response = await fetch(`/camera/detect${refresh ? '?refresh=true' : ''}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+    }
+
+    renderCameraList(data, pending) {
+        if (data.cameras.length > 0) {
+            // カメラリストを表示
+            this.cameraListContainer.style.display = 'block';
+            const previousValue = this.cameraSelect.value;
+            this.cameraSelect.innerHTML = '';
+
+            data.cameras.forEach(camera => {
+                const option = document.createElement('option');
+                option.value = camera.index;
+                option.textContent = `${camera.name} (${camera.width}x${camera.height})`;
+                if (camera.index === this.currentCameraIndex) {
+                    option.selected = !previousValue;
+                    // 現在接続中のカメラを表示
+                    this.updateCurrentCameraDisplay(camera.name, camera.width, camera.height);
+                }
+                this.cameraSelect.appendChild(option);
+            });
+            if (previousValue) {
+                this.cameraSelect.value = previousValue;
+            }
+
+            this.detectionMessage.textContent = pending
+                ? `${data.cameras.length}台のカメラを検出しました（更新中...）`
+                : `${data.cameras.length}台のカメラを検出しました`;
+            this.detectionMessage.className = 'text-success small mt-2';
+        } else if (pending) {
+            this.detectionMessage.textContent = 'カメラを検出中...';
+            this.detectionMessage.className = 'text-info small mt-2';
+        } else {
+            this.detectionMessage.textContent = 'カメラが検出されませんでした';
+            this.detectionMessage.className = 'text-warning small mt-2';
+            this.cameraListContainer.style.display = 'none';
+        }
+    }
+
     async connectToSelectedCamera() {
         const selectedIndex = parseInt(this.cameraSelect.value);
 
@@ -341,12 +461,7 @@ class CameraController {
             this.detectionMessage.textContent = 'カメラに接続中...';
             this.detectionMessage.className = 'text-info small mt-2';
 
-            // カメラを停止
-            if (this.isRunning) {
-                await this.stopCamera();
-            }
-
-            // カメラを切り替え
+            // カメラを切り替え（切り替え前のカメラは停止せずサーバー側で稼働を続ける）
             const response = await fetch('/camera/switch', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
@@ -356,8 +471,23 @@ class CameraController {
             const data = await response.json();
 
             if (response.ok) {
-                // ページをリロードして新しいカメラに切り替え
-                window.location.href = `/camera/${selectedIndex}`;
+                // ページを再読み込みせずに表示するカメラを切り替え
+                this.currentCameraIndex = selectedIndex;
+                window.history.replaceState(null, '', `/camera/${selectedIndex}`);
+
+                this.isRunning = true;
+                this.setStatus('active', '配信中');
+                this.videoFeed.src = this.videoFeedUrl();
+                if (this.detectionEnabled) {
+                    this.startOverlay();
+                }
+                this.startBtn.disabled = true;
+                this.stopBtn.disabled = false;
+                this.snapshotBtn.disabled = false;
+                this.updateCameraInfo();
+
+                this.detectionMessage.textContent = data.message;
+                this.detectionMessage.className = 'text-success small mt-2';
             } else {
                 this.detectionMessage.textContent = `接続失敗: ${data.message}`;
                 this.detectionMessage.className = 'text-danger small mt-2';
@@ -377,6 +507,14 @@ class CameraController {
         this.currentCameraName.textContent = `${name} (${width}x${height})`;
     }
 
+    videoFeedUrl() {
+        // 表示中のカメラと判定モードに応じた配信URL
+        const serverDraw = this.detectionEnabled && !this.clientOverlay;
+        const params = serverDraw ? this.getDetectionParams() : { detection: 'false' };
+        params.camera = this.currentCameraIndex;
+        return `/camera/video_feed?${new URLSearchParams(params).toString()}`;
+    }
+
     getDetectionParams() {
         return {
             detection: 'true',
@@ -400,10 +538,10 @@ class CameraController {
             const data = await response.json();
 
             if (response.ok) {
-                // ビデオフィードを再起動して新しいパラメータを適用
+                // ビデオフィード・判定結果の受信を再起動して新しいパラメータを適用
                 if (this.isRunning && this.detectionEnabled) {
-                    const queryString = new URLSearchParams(params).toString();
-                    this.videoFeed.src = `/camera/video_feed?${queryString}`;
+                    this.videoFeed.src = this.videoFeedUrl();
+                    this.startOverlay();
                 }
                 this.showNotification('パラメータを更新しました', 'success');
             } else {